@@ -0,0 +1,208 @@
+import sys
+import json
+import time
+import signal
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+
+# The servers compared, started on a free port each: Flask's development server of app.py, and uvicorn with the
+# ASGI app of async_app.py
+SERVERS = {
+    'flask': [sys.executable, 'app.py'],
+    'async': [sys.executable, 'async_app.py']
+}
+
+# Endpoints of the load, as (path, whether it takes a date)
+ENDPOINTS = [
+    ('/metrics/total_ships', False),
+    ('/metrics/avg_speed', True),
+    ('/metrics/wind_speed', True),
+    ('/metrics/weather_conditions', True)
+]
+
+# Seconds a server gets to answer /status after it was started, it loads its data first
+STARTUP_TIMEOUT_SECONDS = 300
+
+
+# Function to send one GET request on a new connection and return the status code of the response.
+# A connection per request works the same against both servers, Flask's development server closes every connection.
+async def http_get(host, port, target):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode('ascii'))
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+# Function to draw the request targets of a run: random endpoints, ships and dates. Uncached, every request has a
+# range of its own (a day from a random second of the date), so every one misses the response cache and is computed.
+def request_targets(count, device_ids, dates, cached, seed=0):
+    rng = random.Random(seed)
+    targets = []
+    for _ in range(count):
+        path, dated = rng.choice(ENDPOINTS)
+        if not dated:
+            targets.append(path)
+            continue
+        device_id, date = rng.choice(device_ids), rng.choice(dates)
+        if cached:
+            targets.append(f"{path}?device_id={device_id}&date={date}")
+        else:
+            start = pd.Timestamp(date) + pd.Timedelta(seconds=rng.randrange(3600))
+            end = start + pd.Timedelta(days=1)
+            targets.append(f"{path}?device_id={device_id}&start={start:%Y-%m-%dT%H:%M:%S}&end={end:%Y-%m-%dT%H:%M:%S}")
+    return targets
+
+
+# Function to send the targets to a server from concurrency clients at once, each sending its next request as soon
+# as the previous one was answered, and to summarize throughput, latency and status codes
+async def run_load(host, port, targets, concurrency):
+    queue = list(reversed(targets))
+    latencies, statuses = {}, Counter()
+
+    async def client():
+        while queue:
+            target = queue.pop()
+            start = time.perf_counter()
+            try:
+                status = await http_get(host, port, target)
+            except OSError:
+                status = 'connection_error'
+            latencies.setdefault(target.split('?')[0], []).append(time.perf_counter() - start)
+            statuses[str(status)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(targets),
+        'seconds': seconds,
+        'requests_per_second': len(targets) / seconds,
+        **latency_summary([latency for path_latencies in latencies.values() for latency in path_latencies]),
+        'endpoints': {path: latency_summary(path_latencies) for path, path_latencies in sorted(latencies.items())},
+        'statuses': dict(statuses)
+    }
+
+
+def latency_summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p95_ms': float(np.percentile(milliseconds, 95)),
+        'p99_ms': float(np.percentile(milliseconds, 99))
+    }
+
+
+# Function to start a server and wait until it answers, returns the process and its startup time
+def start_server(name, port, pushdown):
+    command = SERVERS[name] + ['--port', str(port)] + (['--pushdown'] if pushdown else [])
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.perf_counter()
+    while time.perf_counter() - start < STARTUP_TIMEOUT_SECONDS:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} server exited with {process.returncode} while starting")
+        try:
+            if asyncio.run(http_get('127.0.0.1', port, '/status')) == 200:
+                return process, time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{name} server did not answer within {STARTUP_TIMEOUT_SECONDS} seconds")
+
+
+# Function to stop a server with SIGTERM like a process manager would, returns how long it took to exit
+def stop_server(process, timeout=60):
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return time.perf_counter() - start
+
+
+# Function to start every server in turn, load it at every concurrency and stop it again
+def run_benchmark(servers, concurrencies, requests, device_ids, dates, cached=False, pushdown=False, port=8765,
+                  url=None):
+    results = {}
+    for name in servers:
+        if url is None:
+            process, startup_seconds = start_server(name, port, pushdown)
+            host, server_port = '127.0.0.1', port
+        else:
+            process, startup_seconds = None, None
+            parsed = urlparse(url)
+            host, server_port = parsed.hostname, parsed.port or 80
+        try:
+            # A round of warm-up requests first, e.g. to open the database connections
+            warm_up = request_targets(min(requests, 50), device_ids, dates, cached, seed=1)
+            asyncio.run(run_load(host, server_port, warm_up, 1))
+            runs = [
+                asyncio.run(run_load(host, server_port,
+                                     request_targets(requests, device_ids, dates, cached, seed=concurrency),
+                                     concurrency))
+                for concurrency in concurrencies
+            ]
+        finally:
+            shutdown_seconds = stop_server(process) if process is not None else None
+        results[name] = {'startup_seconds': startup_seconds, 'shutdown_seconds': shutdown_seconds, 'runs': runs}
+    return results
+
+
+def print_results(results):
+    print(f"{'server':>8} {'clients':>8} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}  statuses, "
+          f"then per endpoint")
+    for name, result in results.items():
+        for run in result['runs']:
+            print(f"{name:>8} {run['concurrency']:>8} {run['requests_per_second']:>9.1f} {run['p50_ms']:>9.1f} "
+                  f"{run['p95_ms']:>9.1f} {run['p99_ms']:>9.1f}  {run['statuses']}")
+            for path, summary in run['endpoints'].items():
+                print(f"{'':>18} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f}  {path}")
+    for name, result in results.items():
+        if result['startup_seconds'] is not None:
+            print(f"{name}: started in {result['startup_seconds']:.1f} s, "
+                  f"stopped in {result['shutdown_seconds']:.1f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load the metrics API with concurrent clients, served by Flask's development server and by uvicorn."
+    )
+    parser.add_argument("--servers", nargs='+', choices=sorted(SERVERS), default=['flask', 'async'])
+    parser.add_argument("--url", help="Load an already running server at this URL instead of starting the servers")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 8, 32, 128],
+                        help="Clients sending requests at once, one run per value")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per run")
+    parser.add_argument("--device-ids", nargs='+', default=['st-1a2090', '0001'])
+    parser.add_argument("--dates", nargs='+', default=['2019-02-12', '2019-02-13', '2019-02-14'])
+    parser.add_argument("--cached", action="store_true",
+                        help="Repeat the same few requests, so they are answered from the response cache")
+    parser.add_argument("--pushdown", action="store_true", help="Start the servers in pushdown mode")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    servers = args.servers[:1] if args.url else args.servers
+    results = run_benchmark(servers, args.concurrency, args.requests, args.device_ids, args.dates, args.cached,
+                            args.pushdown, args.port, args.url)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,350 @@
-import os
-import psycopg2
+import time
+import argparse
+from datetime import datetime, timezone
 import pandas as pd
-from flask import Flask, jsonify
-from urllib.parse import urlparse
-from dotenv import load_dotenv
-from exploratory_data_analysis import fetch_data_from_db
+from pandas.errors import OutOfBoundsDatetime
+from flask import Flask, jsonify, request, g
+from snapshot import WEATHER_COLUMNS, load_snapshot, SnapshotRefresher
+from query_pushdown import load_database_view, PushdownRefresher
+from response_cache import ResponseCache, cached_response
+from instrumentation import LatencyHistogram, render_metric, render_histogram
+from trajectory import ROUTE_COLUMNS
 
 app = Flask(__name__)
 
+# Rendered metric responses per endpoint, query parameters and data version
+response_cache = ResponseCache()
+
+# Latency of every request per route and status code, exposed on /metrics/internal
+request_latency = LatencyHistogram()
+
+# Ship and date the metrics are about when the request does not name them
+DEFAULT_DEVICE_ID = 'st-1a2090'
+DEFAULT_DATE = '2019-02-13'
+
+# Content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Raised for query parameters that cannot be used, answered with a 400
+class InvalidQueryParameter(ValueError):
+    pass
+
+
+# Parse a date or timestamp query parameter. An empty value gives NaT instead of an error, it is no timestamp either.
+def parse_timestamp(name, value):
+    try:
+        timestamp = pd.Timestamp(value)
+    except ValueError:
+        timestamp = pd.NaT
+    if pd.isna(timestamp):
+        raise InvalidQueryParameter(f"Query parameter '{name}' is not a valid date or timestamp: {value}")
+    return check_timestamp_range(name, value, timestamp)
+
+
+# Reject a timestamp the indexes cannot compare. They count in nanoseconds, so a query can ask for pd.Timestamp.min
+# (1677-09-21) to pd.Timestamp.max (2262-04-11) and no further.
+def check_timestamp_range(name, value, timestamp):
+    try:
+        timestamp.as_unit('ns')
+    except (OutOfBoundsDatetime, OverflowError):
+        raise InvalidQueryParameter(f"Query parameter '{name}' is outside {pd.Timestamp.min} to {pd.Timestamp.max}: "
+                                    f"{value}") from None
+    return timestamp
+
+
+# Read the ship and time range of a request: ?device_id=...&date=YYYY-MM-DD, or &start=...&end=... for any range.
+# start and end are timestamps and the range includes start but not end. args defaults to the Flask request's.
+def requested_range(default_date=DEFAULT_DATE, args=None):
+    args = request.args if args is None else args
+    device_id = args.get('device_id', DEFAULT_DEVICE_ID)
+    start, end = args.get('start'), args.get('end')
+    if start is None and end is None:
+        date = args.get('date', default_date)
+        if date is None:
+            return device_id, None, None
+        start = parse_timestamp('date', date).normalize()
+        return device_id, start, check_timestamp_range('date', date, start + pd.Timedelta(days=1))
+    start = None if start is None else parse_timestamp('start', start)
+    end = None if end is None else parse_timestamp('end', end)
+    return device_id, start, end
+
+
+# Read the resolution of a request on a route: ?resolution=track (the default) for the compressed track, or
+# ?resolution=full for every message
+def requested_resolution(args=None):
+    args = request.args if args is None else args
+    resolution = args.get('resolution', 'track')
+    if resolution not in ('track', 'full'):
+        raise InvalidQueryParameter(f"Query parameter 'resolution' must be 'track' or 'full', not {resolution}")
+    return resolution
+
+
+# Read the box and time range of an area request: ?bbox=west,south,east,north in degrees, east and north positive, and
+# &from=...&to=... timestamps, the range includes from but not to and either may be left out. A box with west > east
+# crosses the antimeridian.
+def requested_area(args=None):
+    args = request.args if args is None else args
+    bbox = args.get('bbox')
+    if bbox is None:
+        raise InvalidQueryParameter("Query parameter 'bbox' is required: west,south,east,north")
+    try:
+        west, south, east, north = (float(value) for value in bbox.split(','))
+    except ValueError:
+        raise InvalidQueryParameter(f"Query parameter 'bbox' must be four numbers west,south,east,north: {bbox}")
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+        raise InvalidQueryParameter(f"Query parameter 'bbox' is not a box of longitudes and latitudes: {bbox}")
+    start, end = args.get('from'), args.get('to')
+    start = None if start is None else parse_timestamp('from', start)
+    end = None if end is None else parse_timestamp('to', end)
+    return (west, south, east, north), start, end
+
+
+# Function to find the parts of start <= datetime < end where a ship has messages (on the days of days_df) but no
+# compressed track, like days loaded before the tracks were kept. Days next to each other without a track point in
+# between become one range, clipped to start and end.
+def track_gaps(days_df, track_df, start, end):
+    message_days = set(pd.DatetimeIndex(days_df['day']))
+    track_days = set(pd.DatetimeIndex(track_df['datetime']).floor('D'))
+    gaps = []
+    extend = False
+    for day in sorted(message_days | track_days):
+        if day in track_days:
+            extend = False
+        elif extend:
+            gaps[-1][1] = day + pd.Timedelta(days=1)
+        else:
+            gaps.append([day, day + pd.Timedelta(days=1)])
+            extend = True
+    return [(gap_start if start is None else max(gap_start, start), gap_end if end is None else min(gap_end, end))
+            for gap_start, gap_end in gaps]
+
+
+# Function to put the rows of the messages of the track gaps between the track points, in time order. The track
+# points keep only the columns of the message rows.
+def fill_track_gaps(track_df, gap_dfs):
+    if not gap_dfs:
+        return track_df
+    frames = [df for df in [track_df[gap_dfs[0].columns], *gap_dfs] if not df.empty]
+    if len(frames) <= 1:
+        return frames[0] if frames else gap_dfs[0]
+    return pd.concat(frames, ignore_index=True).sort_values('datetime', kind='stable', ignore_index=True)
+
+
+# Function to read the points of a ship's compressed track over a range, or the rows of the messages (from the
+# snapshot's full_name method) at full resolution. The days of the range without a track are read from the messages,
+# wherever they fall in the range.
+def track_or_messages(snapshot, full_name, device_id, start, end, resolution):
+    read_messages = getattr(snapshot, full_name)
+    if resolution != 'track':
+        return read_messages(device_id, start, end)
+    track_df = snapshot.track_rows(device_id, start, end)
+    gaps = track_gaps(snapshot.message_days(device_id, start, end), track_df, start, end)
+    return fill_track_gaps(track_df, [read_messages(device_id, gap_start, gap_end) for gap_start, gap_end in gaps])
+
+
+# Function to shape the hourly average speeds of a ship into the avg_speed response
+def avg_speed_records(filtered_df):
+    hourly_avg_speed = pd.DataFrame({
+        'date': filtered_df['hour'].dt.strftime('%Y-%m-%d'),
+        'datetime': filtered_df['hour'].dt.hour,
+        'speed_over_ground_d': filtered_df['avg_speed']
+    })
+    return hourly_avg_speed.to_dict(orient='records')
+
+
+# Function to shape the daily wind speeds of a ship into the wind_speed response
+def wind_speed_records(filtered_df):
+    wind_speed_stats = filtered_df.rename(
+        columns={'day': 'datetime', 'max_wind_spd': 'max', 'min_wind_spd': 'min'}
+    )
+    return wind_speed_stats.to_dict(orient='records')
+
+
+# Function to shape the ships found in an area into the in_area response
+def area_records(ships_df):
+    return ships_df.assign(first_seen=ships_df['first_seen'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+                           last_seen=ships_df['last_seen'].dt.strftime('%Y-%m-%dT%H:%M:%S')).to_dict(orient='records')
+
+
+# Function to render the weather rows of a ship as the text table of the weather_conditions response
+def weather_table(weather_df):
+    return f"<pre>{weather_df.drop_duplicates().to_string(index=False)}</pre>"
+
+
+# Function to shape the positions of a ship into the route response, missing values become null. Without rows the
+# datetime column may not be typed, like that of an empty result read from the database.
+def route_records(route_df):
+    if route_df.empty:
+        return []
+    route_df = route_df[ROUTE_COLUMNS].assign(datetime=route_df['datetime'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+    return route_df.astype(object).where(route_df.notna(), None).to_dict(orient='records')
+
+
+# Every request reads from one snapshot, also when a refresh swaps in a new one halfway
+@app.before_request
+def pin_snapshot():
+    g.request_start = time.perf_counter()
+    g.snapshot = snapshots.current()
+
+
+# Record the latency of every answered request, under its route so query parameters do not add series
+@app.after_request
+def record_latency(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_latency.observe((route, str(response.status_code)), time.perf_counter() - g.request_start)
+    return response
+
+
+# Version of the data a request is answered from, part of the cache key and the ETag
+def snapshot_version():
+    return g.snapshot.version
+
+
+@app.errorhandler(InvalidQueryParameter)
+def invalid_query_parameter(error):
+    return jsonify({"error": str(error)}), 400
+
+# The available metrics, listed on the welcome page
+API_INDEX = {
+    "message": "Welcome to the Ship Metrics API",
+    "available_metrics": [
+        {"metric": "Total Ships", "description": "Total number of ships", "endpoint": "/metrics/total_ships"},
+        {"metric": "Average Speed", "description": "Average speed of a ship for every hour of a date (default ship 'st-1a2090' on 2019-02-13)", "endpoint": "/metrics/avg_speed?device_id=st-1a2090&date=2019-02-13"},
+        {"metric": "Max/Min Wind Speed", "description": "Maximum and minimum wind speeds for each day for a ship (default ship 'st-1a2090', all days)", "endpoint": "/metrics/wind_speed?device_id=st-1a2090"},
+        {"metric": "Weather Conditions", "description": "Weather conditions along the compressed track of a ship on a date (default ship 'st-1a2090' on 2019-02-13), resolution=full for every message", "endpoint": "/metrics/weather_conditions?device_id=st-1a2090&date=2019-02-13"},
+        {"metric": "Route", "description": "Positions of the compressed track of a ship on a date (default ship 'st-1a2090' on 2019-02-13), resolution=full for every message", "endpoint": "/metrics/route?device_id=st-1a2090&date=2019-02-13"},
+        {"metric": "Ships In Area", "description": "Ships with messages inside a box (west,south,east,north) between two times, when each was first and last seen there", "endpoint": "/ships/in_area?bbox=4.0,51.3,4.5,51.5&from=2019-02-13&to=2019-02-14"},
+        {"metric": "Status", "description": "Version and lag of the served data, response cache counters", "endpoint": "/status"},
+        {"metric": "Internal Metrics", "description": "Request latencies and snapshot size and age in Prometheus format", "endpoint": "/metrics/internal"}
+    ]
+}
+
+
+# Function to render the telemetry of a server in the Prometheus text format: request latency histograms, the size and
+# age of the served snapshot and the response cache counters
+def render_internal_metrics(snapshot, status, cache, latency):
+    age_seconds = (datetime.now(timezone.utc) - snapshot.built_at).total_seconds()
+    families = [
+        render_histogram('ships_api_request_duration_seconds', 'Latency of the API requests.',
+                         latency, ('route', 'status')),
+        # In pushdown mode no messages are held, the gauge has no sample
+        render_metric('ships_snapshot_rows', 'gauge', 'Messages in the served snapshot.',
+                      [({}, status['snapshot_rows'])] if status['snapshot_rows'] is not None else []),
+        render_metric('ships_snapshot_memory_bytes', 'gauge', 'Memory of the served snapshot\'s tables.',
+                      [({}, snapshot.memory_bytes)]),
+        render_metric('ships_snapshot_age_seconds', 'gauge', 'Seconds since the served snapshot was built.',
+                      [({}, age_seconds)]),
+        render_metric('ships_snapshot_version', 'gauge', 'Last etl_changes.change_id in the served snapshot.',
+                      [({}, snapshot.version)]),
+        render_metric('ships_data_lag_seconds', 'gauge', 'Seconds production has had changes the snapshot lacks.',
+                      [({}, status['data_lag_seconds'])]),
+        render_metric('ships_response_cache_requests_total', 'counter', 'Response cache lookups and answers.',
+                      [({'result': key}, cache[key]) for key in ('hits', 'misses', 'not_modified')]),
+        render_metric('ships_response_cache_evictions_total', 'counter', 'Responses evicted from the cache.',
+                      [({}, cache['evictions'])]),
+        render_metric('ships_response_cache_bytes', 'gauge', 'Size of the cached response bodies.',
+                      [({}, cache['bytes'])])
+    ]
+    return '\n'.join(families) + '\n'
+
 # Welcome Page with a list of available metrics as JSON
 @app.route('/')
 def welcome():
-    return jsonify({
-        "message": "Welcome to the Ship Metrics API",
-        "available_metrics": [
-            {"metric": "Total Ships", "description": "Total number of ships", "endpoint": "/metrics/total_ships"},
-            {"metric": "Average Speed for st-1a2090", "description": "Average speed for ship 'st-1a2090' for a specific hour on 2019-02-13", "endpoint": "/metrics/avg_speed"},
-            {"metric": "Max/Min Wind Speed for st-1a2090", "description": "Maximum and minimum wind speeds for each day for ship 'st-1a2090'", "endpoint": "/metrics/wind_speed"},
-            {"metric": "Weather Conditions for st-1a2090 on 2019-02-13", "description": "Weather conditions for ship 'st-1a2090' on 2019-02-13", "endpoint": "/metrics/weather_conditions"}
-        ]
-    })
+    return jsonify(API_INDEX)
 
 # Endpoint 1: Total number of ships
 @app.route('/metrics/total_ships', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
 def total_ships():
-    total_ships_count = raw_messages_cleaned_weather_df['device_id'].nunique()
+    # One row per ship in the devices rollup, or a count in the database in pushdown mode
+    total_ships_count = g.snapshot.ship_count()
     return jsonify({"total_ships": total_ships_count})
 
-# Endpoint 2: Average speed for the ship "st-1a2090" for all hours on 2019-02-13
+# Endpoint 2: Average speed of a ship for every hour of a date (default: "st-1a2090" on 2019-02-13)
 @app.route('/metrics/avg_speed', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
 def avg_speed():
-    # Filter for the specific ship and date 2019-02-13
-    filtered_df = raw_messages_cleaned_weather_df[
-        (raw_messages_cleaned_weather_df['device_id'] == 'st-1a2090') &
-        (raw_messages_cleaned_weather_df['datetime'].dt.date == pd.to_datetime('2019-02-13').date())
-    ]
-    
-    # Group by each hour and calculate the average speed for each hour
-    hourly_avg_speed = filtered_df.groupby(filtered_df['datetime'].dt.hour)['speed_over_ground_d'].mean().reset_index()
+    # Look up the ship's hours in the hourly rollup
+    device_id, start, end = requested_range()
+    filtered_df = g.snapshot.hourly_speed(device_id, start, end)
 
-    # Convert the result to a dictionary format
-    hourly_avg_speed_dict = hourly_avg_speed.to_dict(orient='records')
-    
-    return jsonify(hourly_avg_speed_dict)
+    # The rollup (or the database in pushdown mode) already gives the average speed of each hour
+    return jsonify(avg_speed_records(filtered_df))
 
-# Endpoint 3: Maximum and minimum wind speeds for each day for ship "st-1a2090"
+# Endpoint 3: Maximum and minimum wind speeds for each day for a ship (default: "st-1a2090", every day)
 @app.route('/metrics/wind_speed', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
 def wind_speed():
-    # Filter for ship "st-1a2090" and non-null wind speed values
-    filtered_df = raw_messages_cleaned_weather_df[
-        (raw_messages_cleaned_weather_df['device_id'] == 'st-1a2090') & 
-        (~raw_messages_cleaned_weather_df['wind_spd'].isnull())
-    ]
-    
-    # Group by the date and calculate max and min wind speeds for each day
-    wind_speed_stats = filtered_df.groupby(filtered_df['datetime'].dt.date)['wind_spd'].agg(['max', 'min']).reset_index()
+    # Look up the ship's days in the daily rollup, it only has days with wind speed values
+    device_id, start, end = requested_range(default_date=None)
+    filtered_df = g.snapshot.daily_wind(device_id, start, end)
 
-    # Convert the result to a dictionary format
-    wind_speed_stats_dict = wind_speed_stats.to_dict(orient='records')
-    
-    return jsonify(wind_speed_stats_dict)
+    # The rollup (or the database in pushdown mode) already gives the max and min wind speeds of each day
+    return jsonify(wind_speed_records(filtered_df))
 
 
-# Endpoint 4: Weather conditions for ship "st-1a2090" on 2019-02-13
+# Endpoint 4: Weather conditions of a ship on a date (default: "st-1a2090" on 2019-02-13)
 @app.route('/metrics/weather_conditions', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
 def weather_conditions():
-    # Filter for ship "st-1a2090" and date 2019-02-13
-    requested_date = pd.to_datetime('2019-02-13').date()
-    filtered_df = raw_messages_cleaned_weather_df[
-        (raw_messages_cleaned_weather_df['device_id'] == 'st-1a2090') &
-        (raw_messages_cleaned_weather_df['datetime'].dt.date == requested_date) &
-        (~raw_messages_cleaned_weather_df['datetime'].isnull())
-    ]
-
-     # Select relevant weather-related columns
-    weather_info = filtered_df[[
-        'datetime', 'temp', 'wind_spd', 'rh', 'weather_description', 'city_name', 'timezone'
-    ]].drop_duplicates()
-
-    # Convert the DataFrame to a string format (text table)
-    weather_table = weather_info.to_string(index=False)
+    # Look up the weather-related columns of the ship's track (or messages) of the requested date. The track keeps
+    # every change of the weather, so only repeated rows are left out.
+    device_id, start, end = requested_range()
+    weather_info = track_or_messages(g.snapshot, 'weather_rows', device_id, start, end, requested_resolution())
 
     # Return the text-based table as plain text
-    return f"<pre>{weather_table}</pre>", 200, {'Content-Type': 'text/plain'}
-
-if __name__ == '__main__':
+    return weather_table(weather_info[WEATHER_COLUMNS]), 200, {'Content-Type': 'text/plain'}
 
-    load_dotenv()
+# Endpoint 5: Route of a ship on a date (default: "st-1a2090" on 2019-02-13)
+@app.route('/metrics/route', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
+def route():
+    device_id, start, end = requested_range()
+    route_df = track_or_messages(g.snapshot, 'route_rows', device_id, start, end, requested_resolution())
+    return jsonify(route_records(route_df))
 
-    # Fetch the database URL from the .env file
-    PRODUCTION_URL = os.getenv("PRODUCTION_KEY")
+# Endpoint 6: Ships inside a box during a time window
+@app.route('/ships/in_area', methods=['GET'])
+@cached_response(response_cache, snapshot_version)
+def in_area():
+    # The snapshot looks up the grid cells the box covers over the hours of the range, not every message
+    bbox, start, end = requested_area()
+    return jsonify(area_records(g.snapshot.in_area(bbox, start, end)))
 
-    # Parse the URL to extract connection parameters
-    url = urlparse(PRODUCTION_URL)
+# Status of the served data: which load it includes and how far it lags behind production
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify({**snapshots.status(), "response_cache": response_cache.snapshot()})
 
-    conn_params = {
-        'dbname': url.path[1:],    # Extracts the database name after '/'
-        'user': url.username,       # Extracts the username
-        'password': url.password,   # Extracts the password
-        'host': url.hostname,       # Extracts the host
-        'port': url.port            # Extracts the port
-    }
+# Telemetry for monitoring in the Prometheus text format
+@app.route('/metrics/internal', methods=['GET'])
+def internal_metrics():
+    body = render_internal_metrics(g.snapshot, snapshots.status(), response_cache.snapshot(), request_latency)
+    return body, 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
 
-    # Establish a connection to the database
-    conn = psycopg2.connect(**conn_params)
+# Command line of the development server, also run by `ships serve`
+def main(argv=None):
+    global snapshots
+    parser = argparse.ArgumentParser(description="Serve the ship metrics API.")
+    parser.add_argument("--pushdown", action="store_true",
+                        help="Hold no data in memory, answer every request with a query on production")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args(argv)
 
-    # Load the data into raw_messages_cleaned_weather_df
-    raw_messages_cleaned_weather_df = fetch_data_from_db(query="SELECT * FROM raw_messages_cleaned_weather;", environment="PRODUCTION")
+    if args.pushdown:
+        # Every endpoint runs a prepared statement over the ship and range it asks for on a pooled connection.
+        # New loads only invalidate the cached responses.
+        snapshots = PushdownRefresher(load_database_view())
+    else:
+        # Load production and index every table by ship and time, so requests only touch the rows they ask for.
+        # New loads are picked up in the background and swapped in without restarting.
+        snapshots = SnapshotRefresher(load_snapshot())
+    snapshots.start()
 
     # Run the Flask app
-    app.run(debug=True)
+    app.run(port=args.port, debug=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
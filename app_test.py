@@ -0,0 +1,133 @@
+import datetime
+import itertools
+import unittest
+import pandas as pd
+import app
+from snapshot import DataSnapshot, SnapshotRefresher
+from trajectory import message_track_points
+
+# Every test serves a new data version, so no test is answered from another's cached responses
+versions = itertools.count(1000)
+
+# A snapshot of one ship with two positioned messages on 2019-02-13
+def make_snapshot():
+    messages_df = pd.DataFrame({
+        'device_id': ['0001', '0001'],
+        'datetime': pd.to_datetime(['2019-02-13 14:10', '2019-02-13 15:10']),
+        'lat': [51.2, 51.4], 'latitude_direction': ['N', 'N'], 'lon': [4.3, 4.6], 'longitude_direction': ['E', 'E'],
+        'speed_over_ground_d': [10.0, 11.0], 'true_course': [90.0, 91.0],
+        'temp': [1.0, 2.0], 'wind_spd': [3.0, 4.0], 'rh': [80.0, 81.0],
+        'weather_description': ['Overcast clouds'] * 2, 'city_name': ['Antwerp'] * 2,
+        'timezone': ['Europe/Brussels'] * 2
+    })
+    devices_df = pd.DataFrame({'device_id': ['0001', 'st-1a2090']})
+    hourly_speed_df = pd.DataFrame({'device_id': ['0001'], 'hour': pd.to_datetime(['2019-02-13 14:00']),
+                                    'avg_speed': [1.5]})
+    daily_wind_df = pd.DataFrame({'device_id': ['0001'], 'day': [datetime.date(2019, 2, 13)],
+                                  'max_wind_spd': [4.0], 'min_wind_spd': [3.0]})
+    return DataSnapshot(next(versions), messages_df, devices_df, hourly_speed_df, daily_wind_df)
+
+class AppTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Serve a snapshot without running main, which would load production
+        app.snapshots = SnapshotRefresher(make_snapshot())
+        self.client = app.app.test_client()
+
+    def test_welcome(self):
+        # Test that the welcome page lists the metrics
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), app.API_INDEX)
+
+    def test_endpoints_answer_from_the_snapshot(self):
+        # Test that the ship, date and range query parameters select the rows of the answers
+        response = self.client.get('/metrics/total_ships')
+        self.assertEqual(response.get_json(), {"total_ships": 2})
+
+        response = self.client.get('/metrics/avg_speed?device_id=0001&date=2019-02-13')
+        self.assertEqual(response.get_json(), [{"date": "2019-02-13", "datetime": 14, "speed_over_ground_d": 1.5}])
+        self.assertEqual(self.client.get('/metrics/avg_speed?device_id=0001&date=2019-02-14').get_json(), [])
+
+        response = self.client.get('/metrics/wind_speed?device_id=0001')
+        self.assertEqual(response.get_json(), [{"datetime": "Wed, 13 Feb 2019 00:00:00 GMT", "max": 4.0, "min": 3.0}])
+
+        response = self.client.get('/metrics/weather_conditions?device_id=0001&start=2019-02-13T15:00')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'15:10', response.data)
+        self.assertNotIn(b'14:10', response.data)
+
+        response = self.client.get('/metrics/route?device_id=0001&end=2019-02-13T15:00&resolution=full')
+        self.assertEqual([point['datetime'] for point in response.get_json()], ["2019-02-13T14:10:00"])
+
+        response = self.client.get('/ships/in_area?bbox=4.0,51.0,4.5,51.3&from=2019-02-13&to=2019-02-14')
+        self.assertEqual([ship['device_id'] for ship in response.get_json()], ['0001'])
+
+    def test_days_without_a_track_are_read_from_the_messages(self):
+        # Test that a range over a day with a track and a day loaded before the tracks mixes track points and messages
+        snapshot = make_snapshot()
+        messages_df = pd.concat([snapshot.messages_by_device.df, snapshot.messages_by_device.df.iloc[[1]].assign(
+            datetime=pd.Timestamp('2019-02-14 09:00'))], ignore_index=True)
+        tracks_df = message_track_points(messages_df.iloc[[0]])
+        app.snapshots = SnapshotRefresher(DataSnapshot(next(versions), messages_df, snapshot.devices_df,
+                                                       snapshot.hourly_speed_by_device.df,
+                                                       snapshot.daily_wind_by_device.df, tracks_df))
+
+        response = self.client.get('/metrics/route?device_id=0001&start=2019-02-13&end=2019-02-15')
+        self.assertEqual([point['datetime'] for point in response.get_json()],
+                         ["2019-02-13T14:10:00", "2019-02-14T09:00:00"])
+        response = self.client.get('/metrics/route?device_id=0001&start=2019-02-13&end=2019-02-15&resolution=full')
+        self.assertEqual(len(response.get_json()), 3)
+
+    def test_ranges_without_messages(self):
+        # Test that an unknown ship and a day without messages are answered with no rows, with and without tracks
+        snapshot = make_snapshot()
+        tracks_df = message_track_points(snapshot.messages_by_device.df).iloc[:0]
+        with_empty_tracks = DataSnapshot(next(versions), snapshot.messages_by_device.df, snapshot.devices_df,
+                                         snapshot.hourly_speed_by_device.df, snapshot.daily_wind_by_device.df,
+                                         tracks_df.astype({'datetime': object}))
+        for served in (snapshot, with_empty_tracks):
+            app.snapshots = SnapshotRefresher(served)
+            for query in ('device_id=unknown', 'device_id=0001&date=2019-02-20'):
+                for resolution in ('track', 'full'):
+                    response = self.client.get(f'/metrics/route?{query}&resolution={resolution}')
+                    self.assertEqual((response.status_code, response.get_json()), (200, []), query)
+                response = self.client.get(f'/metrics/weather_conditions?{query}')
+                self.assertEqual(response.status_code, 200, query)
+
+    def test_track_gaps(self):
+        # Test that days without a track next to each other become one range, clipped to the requested range
+        days_df = pd.DataFrame({'day': pd.to_datetime(['2019-02-11', '2019-02-12', '2019-02-13', '2019-02-15'])})
+        track_df = pd.DataFrame({'datetime': pd.to_datetime(['2019-02-13 10:00', '2019-02-14 10:00'])})
+        self.assertEqual(app.track_gaps(days_df, track_df, pd.Timestamp('2019-02-11 12:00'), None), [
+            (pd.Timestamp('2019-02-11 12:00'), pd.Timestamp('2019-02-13')),
+            (pd.Timestamp('2019-02-15'), pd.Timestamp('2019-02-16'))
+        ])
+        self.assertEqual(app.track_gaps(days_df.iloc[:0], track_df, None, None), [])
+
+    def test_invalid_query_parameters(self):
+        # Test that empty or malformed parameters are answered with a 400 naming the parameter, not a 500 or an
+        # open range
+        requests = {
+            '/metrics/avg_speed?date=': 'date',
+            '/metrics/avg_speed?date=not-a-date': 'date',
+            '/metrics/avg_speed?device_id=0001&start=': 'start',
+            '/metrics/wind_speed?device_id=0001&end=': 'end',
+            '/metrics/avg_speed?device_id=0001&start=0001-01-01': 'start',
+            '/metrics/avg_speed?device_id=0001&end=9999-01-01': 'end',
+            '/metrics/avg_speed?device_id=0001&date=2262-04-12': 'date',
+            '/metrics/avg_speed?device_id=0001&date=2262-04-11': 'date',
+            '/metrics/route?resolution=coarse': 'resolution',
+            '/ships/in_area?bbox=4,51,5,52&from=': 'from',
+            '/ships/in_area?bbox=4,51,5,52&to=': 'to',
+            '/ships/in_area?bbox=4,51,5,52&from=0001-01-01': 'from',
+            '/ships/in_area?bbox=4,51,5,52&to=9999-01-01': 'to',
+            '/ships/in_area?bbox=4,51,5': 'bbox'
+        }
+        for path, name in requests.items():
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertIn(f"'{name}'", response.get_json()['error'])
+
+if __name__ == '__main__':
+    unittest.main()
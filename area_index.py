@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# Side in degrees of the cells of the grid, about 11 km north to south and 7 km east to west in the North Sea
+AREA_CELL_DEGREES = 0.1
+
+# Columns of the ships found in an area: when each was first and last seen there and with how many messages
+AREA_COLUMNS = ['device_id', 'first_seen', 'last_seen', 'messages']
+
+NS_PER_HOUR = 3600 * 10 ** 9
+
+
+def _ns(value):
+    return pd.Timestamp(value).as_unit('ns').value
+
+
+# Rows of a DataFrame with signed lat and lon columns grouped per grid cell and hour, built once so that finding the
+# rows inside a box over a time range takes one binary search per cell the box covers instead of a scan over every
+# row. Within a (cell, hour) bucket the rows are in time order. Rows without a time or position are left out.
+class AreaTimeIndex:
+
+    def __init__(self, df, time_column='datetime', cell_degrees=AREA_CELL_DEGREES):
+        times = pd.to_datetime(df[time_column])
+        known = (times.notna() & df['lat'].notna() & df['lon'].notna()).to_numpy()
+        if not known.all():
+            df, times = df[known], times[known]
+        self.cell_degrees = cell_degrees
+        self._grid_rows = int(np.ceil(180 / cell_degrees))
+        self._grid_columns = int(np.ceil(360 / cell_degrees))
+
+        times = times.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        hours = times // NS_PER_HOUR
+        self._first_hour = int(hours.min()) if len(hours) else 0
+        self._hours = int(hours.max()) - self._first_hour + 1 if len(hours) else 0
+        grid_rows, grid_columns = self._grid_row(df['lat'].to_numpy()), self._grid_column(df['lon'].to_numpy())
+        cells = grid_rows * self._grid_columns + grid_columns
+        # Cells outside the rows and columns that hold positions are never looked up, a box over the whole world
+        # only covers the waters the ships were seen in
+        self._row_range = (int(grid_rows.min()), int(grid_rows.max())) if len(grid_rows) else (0, -1)
+        self._column_range = (int(grid_columns.min()), int(grid_columns.max())) if len(grid_columns) else (0, -1)
+        keys = cells * self._hours + (hours - self._first_hour)
+
+        # One sort makes every (cell, hour) bucket contiguous, with the hours of a cell one after the other
+        order = np.lexsort((times, keys))
+        self.df = df.iloc[order].reset_index(drop=True)
+        self._keys = keys[order]
+        self._times = times[order]
+
+    # Bytes of the bucket keys and times held next to df
+    @property
+    def index_bytes(self):
+        return self._keys.nbytes + self._times.nbytes
+
+    def _grid_row(self, lats):
+        return np.clip(np.floor((np.asarray(lats, dtype=np.float64) + 90) / self.cell_degrees),
+                       0, self._grid_rows - 1).astype(np.int64)
+
+    def _grid_column(self, lons):
+        return np.clip(np.floor((np.asarray(lons, dtype=np.float64) + 180) / self.cell_degrees),
+                       0, self._grid_columns - 1).astype(np.int64)
+
+    # Cells covering the box (west, south, east, north) that may hold positions, a box with west > east crosses the
+    # antimeridian
+    def cells(self, bbox):
+        west, south, east, north = bbox
+        (first_row, last_row), (first_column, last_column) = self._row_range, self._column_range
+        grid_rows = np.arange(max(self._grid_row(south), first_row), min(self._grid_row(north), last_row) + 1)
+        if west <= east:
+            spans = [(self._grid_column(west), self._grid_column(east))]
+        else:
+            spans = [(self._grid_column(west), self._grid_columns - 1), (0, self._grid_column(east))]
+        grid_columns = np.concatenate([np.arange(max(low, first_column), min(high, last_column) + 1)
+                                       for low, high in spans])
+        return (grid_rows[:, None] * self._grid_columns + grid_columns[None, :]).ravel()
+
+    # Positions in df of the rows of the buckets the box and the hours of start <= time < end cover, either bound
+    # may be None to leave that side open. Rows near the edges of the box or range may lie outside it.
+    def positions(self, bbox, start=None, end=None):
+        first = 0 if start is None else max(_ns(start) // NS_PER_HOUR - self._first_hour, 0)
+        last = self._hours if end is None else min((_ns(end) - 1) // NS_PER_HOUR + 1 - self._first_hour, self._hours)
+        if first >= last:
+            return np.empty(0, dtype=np.int64)
+
+        # The hours of a cell are contiguous, so one binary search per cell finds the rows of the whole range
+        cell_keys = self.cells(bbox) * self._hours
+        lower = np.searchsorted(self._keys, cell_keys + first)
+        upper = np.searchsorted(self._keys, cell_keys + last)
+        lengths = upper - lower
+        offsets = np.repeat(lower - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    # Rows inside the box (west, south, east, north), edges included, with start <= time < end
+    def rows(self, bbox, start=None, end=None):
+        west, south, east, north = bbox
+        positions = self.positions(bbox, start, end)
+        lats = self.df['lat'].to_numpy()[positions]
+        lons = self.df['lon'].to_numpy()[positions]
+        inside = (lats >= south) & (lats <= north)
+        inside &= ((lons >= west) & (lons <= east)) if west <= east else ((lons >= west) | (lons <= east))
+        if start is not None:
+            inside &= self._times[positions] >= _ns(start)
+        if end is not None:
+            inside &= self._times[positions] < _ns(end)
+        return self.df.iloc[positions[inside]]
+
+
+# Function to give every ship with rows in area_df once, with when it was first and last seen and its number of
+# rows, ordered by ship. One pass of unbuffered minimum and maximum over the rows found, a groupby has a fixed cost of
+# milliseconds per call that would dominate a small area.
+def ships_in_area(area_df):
+    codes, devices = pd.factorize(area_df['device_id'], sort=True)
+    times = area_df['datetime'].to_numpy()
+    first_seen = np.full(len(devices), np.iinfo(np.int64).max)
+    last_seen = np.full(len(devices), np.iinfo(np.int64).min)
+    np.minimum.at(first_seen, codes, times.view(np.int64))
+    np.maximum.at(last_seen, codes, times.view(np.int64))
+    return pd.DataFrame({
+        'device_id': pd.Series(np.asarray(devices, dtype=object), dtype=object),
+        'first_seen': first_seen.view(times.dtype),
+        'last_seen': last_seen.view(times.dtype),
+        'messages': np.bincount(codes, minlength=len(devices)).astype(np.int64)
+    })
@@ -0,0 +1,115 @@
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from fleet_generator import AREA, DEFAULT_START, simulate_tracks
+from area_index import AREA_CELL_DEGREES, AreaTimeIndex, ships_in_area
+
+# Number of area queries timed per approach, size and kind of query
+QUERIES = 20
+
+# Kinds of query: side of the box in degrees and length of the time window
+QUERY_KINDS = {'harbour, 1 hour': (0.05, pd.Timedelta(hours=1)),
+               'coast, 6 hours': (0.25, pd.Timedelta(hours=6)),
+               'sea, 1 day': (1.0, pd.Timedelta(days=1))}
+
+
+# Function to simulate the positions of a fleet, one message per ship every interval_seconds
+def make_positions(n_ships, days, interval_seconds, rng):
+    n_steps = days * 86400 // interval_seconds
+    lats, lons, _, _ = simulate_tracks(n_ships, n_steps, interval_seconds, rng)
+    times = pd.Timestamp(DEFAULT_START) + pd.to_timedelta(np.arange(n_steps) * interval_seconds, unit='s')
+    return pd.DataFrame({
+        'device_id': pd.Categorical(np.tile([f"ship-{i}" for i in range(n_ships)], n_steps)),
+        'datetime': np.repeat(times, n_ships),
+        'lat': lats.ravel(), 'lon': lons.ravel()
+    })
+
+
+# The scan the endpoint would need without the index: boolean masks over every row
+def ships_with_masks(positions_df, bbox, start, end):
+    west, south, east, north = bbox
+    lats, lons, times = positions_df['lat'], positions_df['lon'], positions_df['datetime']
+    inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east) & (times >= start) & (times < end)
+    return ships_in_area(positions_df[inside])
+
+
+# Function to draw boxes and windows of one kind inside the fleet's area and time span
+def make_queries(kind, days, rng):
+    side, window = QUERY_KINDS[kind]
+    queries = []
+    for _ in range(QUERIES):
+        west = rng.uniform(AREA['lon_min'], AREA['lon_max'] - side)
+        south = rng.uniform(AREA['lat_min'], max(AREA['lat_max'] - side, AREA['lat_min']))
+        seconds = int(rng.integers(0, days * 86400 - window.total_seconds()))
+        start = pd.Timestamp(DEFAULT_START) + pd.Timedelta(seconds=seconds)
+        queries.append(((west, south, west + side, south + side), start, start + window))
+    return queries
+
+
+def time_queries(run, queries):
+    start = time.perf_counter()
+    results = [run(*query) for query in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def run_benchmark(ships, days, interval_seconds, cell_degrees, seed=0):
+    rng = np.random.default_rng(seed)
+    results = {'cell_degrees': cell_degrees, 'sizes': []}
+    for n_ships in ships:
+        positions_df = make_positions(n_ships, days, interval_seconds, rng)
+        start = time.perf_counter()
+        index = AreaTimeIndex(positions_df, cell_degrees=cell_degrees)
+        build_seconds = time.perf_counter() - start
+
+        size = {'ships': n_ships, 'rows': len(positions_df), 'build_seconds': build_seconds,
+                'index_bytes': int(index.df.memory_usage(deep=True).sum()) + index.index_bytes, 'queries': {}}
+        for kind in QUERY_KINDS:
+            queries = make_queries(kind, days, rng)
+            scan_ms, expected = time_queries(lambda *query: ships_with_masks(positions_df, *query), queries)
+            index_ms, found = time_queries(lambda *query: ships_in_area(index.rows(*query)), queries)
+            for expected_df, found_df in zip(expected, found):
+                pd.testing.assert_frame_equal(found_df, expected_df)
+            size['queries'][kind] = {
+                'scan_ms': scan_ms, 'index_ms': index_ms,
+                'cells': float(np.mean([len(index.cells(bbox)) for bbox, _, _ in queries])),
+                'rows_read': float(np.mean([len(index.positions(*query)) for query in queries])),
+                'ships_found': float(np.mean([len(found_df) for found_df in found]))
+            }
+        results['sizes'].append(size)
+    return results
+
+
+def print_results(results):
+    print(f"cells of {results['cell_degrees']} degrees")
+    print(f"{'rows':>10} {'build (s)':>10} {'query':>16} {'cells':>7} {'rows read':>10} {'ships':>6} "
+          f"{'scan (ms)':>10} {'index (ms)':>11} {'speedup':>8}")
+    for size in results['sizes']:
+        for kind, query in size['queries'].items():
+            print(f"{size['rows']:>10} {size['build_seconds']:>10.2f} {kind:>16} {query['cells']:>7.0f} "
+                  f"{query['rows_read']:>10.0f} {query['ships_found']:>6.1f} {query['scan_ms']:>10.2f} "
+                  f"{query['index_ms']:>11.3f} {query['scan_ms'] / query['index_ms']:>7.0f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare finding the ships in an area with the grid index against scanning every message."
+    )
+    parser.add_argument("--ships", type=int, nargs='+', default=[100, 1000],
+                        help="Fleet sizes, one index per size")
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--interval-seconds", type=int, default=60, help="Seconds between the messages of a ship")
+    parser.add_argument("--cell-degrees", type=float, default=AREA_CELL_DEGREES)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.ships, args.days, args.interval_seconds, args.cell_degrees)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
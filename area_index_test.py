@@ -0,0 +1,101 @@
+import unittest
+import numpy as np
+import pandas as pd
+from area_index import AreaTimeIndex, ships_in_area
+
+# Function to select the rows inside a box and time range with boolean masks over every row
+def rows_with_masks(points_df, bbox, start=None, end=None):
+    west, south, east, north = bbox
+    inside = (points_df['lat'] >= south) & (points_df['lat'] <= north)
+    if west <= east:
+        inside &= (points_df['lon'] >= west) & (points_df['lon'] <= east)
+    else:
+        inside &= (points_df['lon'] >= west) | (points_df['lon'] <= east)
+    if start is not None:
+        inside &= points_df['datetime'] >= start
+    if end is not None:
+        inside &= points_df['datetime'] < end
+    return points_df[inside]
+
+class AreaTimeIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Positions of three ships around the North Sea and one near the antimeridian, one without a datetime
+        self.points_df = pd.DataFrame({
+            'device_id': ['0001', '0001', 'st-1a2090', 'st-1a2090', '0002', '0003', '0001'],
+            'datetime': pd.to_datetime([
+                '2019-02-13 14:10', '2019-02-13 16:40', '2019-02-13 14:20', '2019-02-14 09:00', '2019-02-13 14:30',
+                '2019-02-13 15:00', None
+            ]),
+            'lat': [51.30, 51.45, 51.35, 53.00, 51.40, -16.50, 51.32],
+            'lon': [4.30, 4.05, 4.50, 4.30, 4.10, 179.90, 4.30]
+        })
+        self.index = AreaTimeIndex(self.points_df)
+
+    def test_rows_in_box_and_range(self):
+        # Test that the box includes its edges, and the range its start but not its end
+        rows_df = self.index.rows((4.0, 51.3, 4.5, 51.5))
+        self.assertEqual(sorted(rows_df['device_id']), ['0001', '0001', '0002', 'st-1a2090'])
+
+        rows_df = self.index.rows((4.0, 51.3, 4.5, 51.5), pd.Timestamp('2019-02-13 14:20'),
+                                  pd.Timestamp('2019-02-13 16:40'))
+        self.assertEqual(sorted(rows_df['device_id']), ['0002', 'st-1a2090'])
+
+        rows_df = self.index.rows((4.0, 51.3, 4.5, 51.5), end=pd.Timestamp('2019-02-13 14:15'))
+        self.assertEqual(rows_df['datetime'].tolist(), [pd.Timestamp('2019-02-13 14:10')])
+
+    def test_box_across_the_antimeridian(self):
+        # Test that a box with west > east wraps around from 180 to -180
+        rows_df = self.index.rows((179.5, -17.0, -179.5, -16.0))
+        self.assertEqual(rows_df['device_id'].tolist(), ['0003'])
+        # Only the cell west of the antimeridian is within the columns that hold positions
+        self.assertEqual(len(self.index.cells((179.85, -16.5, -179.95, -16.5))), 1)
+
+    def test_rows_match_masks(self):
+        # Test against filtering the whole frame with boolean masks, for boxes smaller and larger than a cell
+        rng = np.random.default_rng(0)
+        points_df = pd.DataFrame({
+            'device_id': rng.choice(['0001', '0002', '0003', 'st-1a2090'], 5000),
+            'datetime': pd.Timestamp('2019-02-13') + pd.to_timedelta(rng.integers(0, 3 * 86400, 5000), unit='s'),
+            'lat': rng.uniform(51.0, 52.0, 5000),
+            'lon': rng.uniform(3.5, 6.5, 5000)
+        })
+        index = AreaTimeIndex(points_df, cell_degrees=0.25)
+        queries = [
+            ((4.0, 51.3, 4.5, 51.5), None, None),
+            ((4.01, 51.31, 4.02, 51.32), pd.Timestamp('2019-02-14 10:30'), None),
+            ((-180, -90, 180, 90), pd.Timestamp('2019-02-13 23:59:59'), pd.Timestamp('2019-02-14 00:00:01')),
+            ((5.2, 51.0, 6.5, 51.9), pd.Timestamp('2019-02-14'), pd.Timestamp('2019-02-15 12:00'))
+        ]
+        for bbox, start, end in queries:
+            expected_df = rows_with_masks(points_df, bbox, start, end)
+            pd.testing.assert_frame_equal(ships_in_area(index.rows(bbox, start, end)), ships_in_area(expected_df))
+
+    def test_positions_only_read_the_cells_hit(self):
+        # Test that a box within one cell over one hour reads only that bucket's rows
+        index = AreaTimeIndex(self.points_df, cell_degrees=1.0)
+        candidates = index.positions((4.01, 51.31, 4.02, 51.32), pd.Timestamp('2019-02-13 14:00'),
+                                     pd.Timestamp('2019-02-13 15:00'))
+        self.assertEqual(sorted(index.df['device_id'].iloc[candidates]), ['0001', '0002', 'st-1a2090'])
+        self.assertEqual(len(self.index.positions((4.0, 51.3, 4.5, 51.5), pd.Timestamp('2019-03-01'))), 0)
+        # A box over the whole world only covers the rows and columns of cells that hold positions
+        self.assertEqual(len(index.cells((-180, -90, 180, 90))), (143 - 73 + 1) * (359 - 184 + 1))
+
+    def test_ships_in_area(self):
+        # Test that every ship is listed once with when it was first and last seen, also for an empty area
+        ships_df = ships_in_area(self.index.rows((4.0, 51.3, 4.5, 51.5)))
+        self.assertEqual(ships_df.to_dict(orient='records')[0], {
+            'device_id': '0001', 'first_seen': pd.Timestamp('2019-02-13 14:10'),
+            'last_seen': pd.Timestamp('2019-02-13 16:40'), 'messages': 2
+        })
+        self.assertEqual(ships_df['device_id'].tolist(), ['0001', '0002', 'st-1a2090'])
+        self.assertEqual(list(ships_in_area(self.index.rows((0, 0, 1, 1))).columns),
+                         ['device_id', 'first_seen', 'last_seen', 'messages'])
+
+    def test_empty_frame(self):
+        # Test that an index without rows answers every query with no rows
+        index = AreaTimeIndex(self.points_df.iloc[:0])
+        self.assertEqual(len(index.rows((-180, -90, 180, 90))), 0)
+
+if __name__ == '__main__':
+    unittest.main()
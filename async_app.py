@@ -0,0 +1,300 @@
+import os
+import time
+import asyncio
+import multiprocessing
+import argparse
+from functools import partial
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncpg
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from db_connection import async_connection_params
+from snapshot import WEATHER_COLUMNS, load_snapshot, SnapshotRefresher
+from query_pushdown import (PUSHDOWN_STATEMENTS, DatabaseView, PushdownRefresher, load_database_view, statement_params,
+                            area_params, result_frame)
+from response_cache import ResponseCache, cache_key, make_etag, etag_matches
+from instrumentation import LatencyHistogram
+from app import (app as flask_app, API_INDEX, PROMETHEUS_CONTENT_TYPE, InvalidQueryParameter, requested_range,
+                 requested_resolution, requested_area, avg_speed_records, wind_speed_records, weather_table,
+                 route_records, area_records, render_internal_metrics, track_gaps, fill_track_gaps)
+
+# Requests handled at once. More wait up to QUEUE_TIMEOUT_SECONDS for a slot and are then answered with a 503, so a
+# burst queues for a moment instead of piling up work the server cannot finish.
+MAX_CONCURRENT_REQUESTS = 128
+QUEUE_TIMEOUT_SECONDS = 5
+
+# Threads that run the pandas work of the requests: lookups in the snapshot, building and rendering the frames
+EXECUTOR_WORKERS = 4
+
+# Processes that render the weather tables. DataFrame.to_string formats every cell in Python while holding the GIL
+# (over a second for a busy ship's day), in threads these renders would only take turns on one core.
+RENDER_PROCESSES = os.cpu_count() or 1
+
+# Connections of the asyncpg pool the endpoints query in pushdown mode
+ASYNC_POOL_MIN_SIZE = 2
+ASYNC_POOL_MAX_SIZE = 10
+
+# Seconds requests in progress get to finish on shutdown, and the pool to get its connections back
+GRACEFUL_SHUTDOWN_SECONDS = 30
+
+# Rendered metric responses per endpoint, query parameters and data version
+response_cache = ResponseCache()
+
+# Latency of every request per route and status code, exposed on /metrics/internal
+request_latency = LatencyHistogram()
+
+# Set up by the lifespan of the app: the refresher of the served data, the executors and, in pushdown mode, the pool
+snapshots = None
+executor = None
+render_executor = None
+db_pool = None
+
+
+# Function to run blocking (pandas) work on the bounded thread executor without blocking the event loop
+async def offload(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(function, *args))
+
+
+# Function to run CPU-heavy work on the render processes, the arguments and result are pickled across.
+# Without render processes it runs on the thread executor.
+async def offload_render(function, *args):
+    if render_executor is None:
+        return await offload(function, *args)
+    return await asyncio.get_running_loop().run_in_executor(render_executor, partial(function, *args))
+
+
+# Function to give the DataFrame of one of the ship statements of query_pushdown.py (hourly_speed, daily_wind,
+# weather_rows, route_rows, track_rows, message_days): from the snapshot on the executor, or in pushdown mode from the database through the async pool.
+# asyncpg prepares every statement on the server once per connection and reuses it after that.
+async def fetch_frame(snapshot, name, device_id, start, end):
+    if isinstance(snapshot, DatabaseView):
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(PUSHDOWN_STATEMENTS[name][1], *statement_params(name, device_id, start, end))
+        return await offload(result_frame, name, [tuple(row) for row in rows])
+    return await offload(getattr(snapshot, name), device_id, start, end)
+
+
+# Function to read a ship's compressed track over a range, or its messages (the full_name statement), like
+# track_or_messages of app.py
+async def fetch_track_or_messages(snapshot, full_name, device_id, start, end, resolution):
+    if resolution != 'track':
+        return await fetch_frame(snapshot, full_name, device_id, start, end)
+    track_df, days_df = await asyncio.gather(
+        fetch_frame(snapshot, 'track_rows', device_id, start, end),
+        fetch_frame(snapshot, 'message_days', device_id, start, end)
+    )
+    gaps = track_gaps(days_df, track_df, start, end)
+    gap_dfs = await asyncio.gather(*(fetch_frame(snapshot, full_name, device_id, gap_start, gap_end)
+                                     for gap_start, gap_end in gaps))
+    return await offload(fill_track_gaps, track_df, list(gap_dfs))
+
+
+def json_body(value):
+    return flask_app.json.dumps(value).encode('utf-8')
+
+
+# Caps the requests in progress of an ASGI app, see MAX_CONCURRENT_REQUESTS
+class ConcurrencyLimit:
+
+    def __init__(self, app, max_requests=MAX_CONCURRENT_REQUESTS, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.app = app
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_requests)
+        self.stats = {'rejected': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats['rejected'] += 1
+            response = Response(json_body({"error": "Too many requests in progress"}), 503,
+                                {'Retry-After': '1'}, media_type='application/json')
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._slots.release()
+
+
+# Function to make the route of an endpoint. view(request, snapshot) returns the body and content type of a 200.
+# Every request reads one snapshot, the one current when it started, and its latency is recorded under the route.
+# Cached endpoints answer like the cached_response decorator of the Flask app: a matching If-None-Match with 304,
+# a response rendered before for the same data version from the cache.
+def endpoint(path, view, cached=True):
+    async def handle(request):
+        start = time.perf_counter()
+        snapshot = snapshots.current()
+        try:
+            response = await (respond_cached(request, view, snapshot) if cached else respond(request, view, snapshot))
+        except InvalidQueryParameter as error:
+            response = Response(json_body({"error": str(error)}), 400, media_type='application/json')
+        request_latency.observe((path, str(response.status_code)), time.perf_counter() - start)
+        return response
+    return Route(path, handle, methods=['GET'])
+
+
+async def respond(request, view, snapshot):
+    body, content_type = await view(request, snapshot)
+    return Response(body, 200, media_type=content_type)
+
+
+async def respond_cached(request, view, snapshot):
+    key = cache_key(request.url.path, request.query_params.multi_items())
+    etag = make_etag(key, snapshot.version)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        response_cache.count_not_modified()
+        return Response(status_code=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+
+    entry = response_cache.get(key, snapshot.version)
+    if entry is None:
+        body, content_type = await view(request, snapshot)
+        headers = {'Content-Type': content_type, 'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        response_cache.put(key, snapshot.version, body, headers)
+        return Response(body, 200, headers)
+    body, headers = entry
+    return Response(body, 200, headers)
+
+
+async def welcome(request, snapshot):
+    return json_body(API_INDEX), 'application/json'
+
+
+async def total_ships(request, snapshot):
+    if isinstance(snapshot, DatabaseView):
+        async with db_pool.acquire() as conn:
+            total_ships_count = await conn.fetchval(PUSHDOWN_STATEMENTS['ship_count'][1])
+    else:
+        total_ships_count = snapshot.ship_count()
+    return json_body({"total_ships": total_ships_count}), 'application/json'
+
+
+async def avg_speed(request, snapshot):
+    device_id, start, end = requested_range(args=request.query_params)
+    filtered_df = await fetch_frame(snapshot, 'hourly_speed', device_id, start, end)
+    return await offload(lambda: json_body(avg_speed_records(filtered_df))), 'application/json'
+
+
+async def wind_speed(request, snapshot):
+    device_id, start, end = requested_range(default_date=None, args=request.query_params)
+    filtered_df = await fetch_frame(snapshot, 'daily_wind', device_id, start, end)
+    return await offload(lambda: json_body(wind_speed_records(filtered_df))), 'application/json'
+
+
+async def weather_conditions(request, snapshot):
+    device_id, start, end = requested_range(args=request.query_params)
+    resolution = requested_resolution(args=request.query_params)
+    weather_info = await fetch_track_or_messages(snapshot, 'weather_rows', device_id, start, end, resolution)
+    return (await offload_render(weather_table, weather_info[WEATHER_COLUMNS])).encode('utf-8'), 'text/plain'
+
+
+async def route(request, snapshot):
+    device_id, start, end = requested_range(args=request.query_params)
+    resolution = requested_resolution(args=request.query_params)
+    route_df = await fetch_track_or_messages(snapshot, 'route_rows', device_id, start, end, resolution)
+    return await offload(lambda: json_body(route_records(route_df))), 'application/json'
+
+
+async def in_area(request, snapshot):
+    bbox, start, end = requested_area(args=request.query_params)
+    if isinstance(snapshot, DatabaseView):
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(PUSHDOWN_STATEMENTS['ships_in_area'][1], *area_params(bbox, start, end))
+        ships_df = await offload(result_frame, 'ships_in_area', [tuple(row) for row in rows])
+    else:
+        ships_df = await offload(snapshot.in_area, bbox, start, end)
+    return await offload(lambda: json_body(area_records(ships_df))), 'application/json'
+
+
+async def status(request, snapshot):
+    return json_body({**snapshots.status(), "response_cache": response_cache.snapshot()}), 'application/json'
+
+
+async def internal_metrics(request, snapshot):
+    body = render_internal_metrics(snapshot, snapshots.status(), response_cache.snapshot(), request_latency)
+    return body.encode('utf-8'), PROMETHEUS_CONTENT_TYPE
+
+
+ROUTES = [
+    endpoint('/', welcome, cached=False),
+    endpoint('/metrics/total_ships', total_ships),
+    endpoint('/metrics/avg_speed', avg_speed),
+    endpoint('/metrics/wind_speed', wind_speed),
+    endpoint('/metrics/weather_conditions', weather_conditions),
+    endpoint('/metrics/route', route),
+    endpoint('/ships/in_area', in_area),
+    endpoint('/status', status, cached=False),
+    endpoint('/metrics/internal', internal_metrics, cached=False)
+]
+
+
+# Function to make the lifespan of the app: load the served data (or, in pushdown mode, open the async pool) before
+# the first request, and release everything once the server stopped taking requests and the ones in progress ended
+def make_lifespan(pushdown, executor_workers, render_processes, pool_max_size):
+    @asynccontextmanager
+    async def lifespan(app):
+        global snapshots, executor, render_executor, db_pool
+        executor = ThreadPoolExecutor(executor_workers, thread_name_prefix='metrics')
+        if render_processes:
+            # Spawned, not forked: the server process already runs threads and holds connections
+            render_executor = ProcessPoolExecutor(render_processes, mp_context=multiprocessing.get_context('spawn'))
+        if pushdown:
+            db_pool = await asyncpg.create_pool(**async_connection_params("PRODUCTION"),
+                                                min_size=min(ASYNC_POOL_MIN_SIZE, pool_max_size),
+                                                max_size=pool_max_size)
+            snapshots = PushdownRefresher(await offload(load_database_view))
+        else:
+            snapshots = SnapshotRefresher(await offload(load_snapshot))
+        snapshots.start()
+        try:
+            yield
+        finally:
+            # The refresher thread is a daemon, it is not waited for when it sleeps until its next check
+            snapshots.stop(timeout=1)
+            if db_pool is not None:
+                try:
+                    await asyncio.wait_for(db_pool.close(), GRACEFUL_SHUTDOWN_SECONDS)
+                except asyncio.TimeoutError:
+                    db_pool.terminate()
+            executor.shutdown(wait=True)
+            if render_executor is not None:
+                render_executor.shutdown(wait=True)
+    return lifespan
+
+
+# Function to create the ASGI app with the routes of app.py, behind the concurrency limit
+def create_app(pushdown=False, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, executor_workers=EXECUTOR_WORKERS,
+               render_processes=RENDER_PROCESSES, pool_max_size=ASYNC_POOL_MAX_SIZE):
+    app = Starlette(routes=ROUTES, lifespan=make_lifespan(pushdown, executor_workers, render_processes, pool_max_size))
+    return ConcurrencyLimit(app, max_concurrent_requests)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the ship metrics API asynchronously with uvicorn.")
+    parser.add_argument("--pushdown", action="store_true",
+                        help="Hold no data in memory, answer every request with a query on production")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrent-requests", type=int, default=MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--executor-workers", type=int, default=EXECUTOR_WORKERS,
+                        help="Threads for the pandas work of the requests")
+    parser.add_argument("--render-processes", type=int, default=RENDER_PROCESSES,
+                        help="Processes rendering the weather tables, 0 renders them on the threads")
+    parser.add_argument("--pool-size", type=int, default=ASYNC_POOL_MAX_SIZE,
+                        help="Database connections of the async pool in pushdown mode")
+    args = parser.parse_args(argv)
+
+    app = create_app(args.pushdown, args.max_concurrent_requests, args.executor_workers, args.render_processes,
+                     args.pool_size)
+    # On SIGINT or SIGTERM uvicorn stops accepting connections, lets the requests in progress finish and then runs
+    # the shutdown of the lifespan. The access log is off, every request is in the latency histogram.
+    uvicorn.run(app, host=args.host, port=args.port, access_log=False,
+                timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS)
+
+
+if __name__ == '__main__':
+    main()
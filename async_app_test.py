@@ -0,0 +1,181 @@
+import json
+import asyncio
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import async_app
+from async_app import ConcurrencyLimit, create_app
+from snapshot import DataSnapshot, SnapshotRefresher
+from query_pushdown import DatabaseView
+
+# Function to send one GET request to an ASGI app, returns the status, headers and body of the response
+async def get(app, path, query_string='', headers=()):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(name.encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 8000)
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return start['status'], {name.decode(): value.decode() for name, value in start['headers']}, body
+
+# A snapshot of one ship with two messages on 2019-02-13
+def make_snapshot():
+    messages_df = pd.DataFrame({
+        'device_id': ['0001', '0001'],
+        'datetime': pd.to_datetime(['2019-02-13 14:10', '2019-02-13 15:10']),
+        'temp': [1.0, 2.0], 'wind_spd': [3.0, 4.0], 'rh': [80.0, 81.0],
+        'weather_description': ['Overcast clouds'] * 2, 'city_name': ['Antwerp'] * 2,
+        'timezone': ['Europe/Brussels'] * 2
+    })
+    devices_df = pd.DataFrame({'device_id': ['0001', 'st-1a2090']})
+    hourly_speed_df = pd.DataFrame({'device_id': ['0001'], 'hour': pd.to_datetime(['2019-02-13 14:00']),
+                                    'avg_speed': [1.5]})
+    daily_wind_df = pd.DataFrame({'device_id': ['0001'], 'day': [datetime.date(2019, 2, 13)],
+                                  'max_wind_spd': [4.0], 'min_wind_spd': [3.0]})
+    return DataSnapshot(3, messages_df, devices_df, hourly_speed_df, daily_wind_df)
+
+class AsyncAppTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Serve a snapshot without running the lifespan, which would load production
+        async_app.snapshots = SnapshotRefresher(make_snapshot())
+        async_app.executor = ThreadPoolExecutor(2)
+        async_app.response_cache = async_app.ResponseCache()
+        self.app = create_app()
+
+    def tearDown(self):
+        async_app.executor.shutdown()
+
+    def test_endpoints_answer_from_the_snapshot(self):
+        # Test that the routes of app.py answer the same metrics
+        status, _, body = asyncio.run(get(self.app, '/metrics/total_ships'))
+        self.assertEqual((status, json.loads(body)), (200, {"total_ships": 2}))
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/avg_speed', 'device_id=0001&date=2019-02-13'))
+        self.assertEqual(json.loads(body), [{"date": "2019-02-13", "datetime": 14, "speed_over_ground_d": 1.5}])
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/wind_speed', 'device_id=0001'))
+        self.assertEqual(json.loads(body), [{"datetime": "Wed, 13 Feb 2019 00:00:00 GMT", "max": 4.0, "min": 3.0}])
+
+        status, headers, body = asyncio.run(get(self.app, '/metrics/weather_conditions',
+                                                'device_id=0001&start=2019-02-13T15:00'))
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/plain'))
+        self.assertIn(b'15:10', body)
+        self.assertNotIn(b'14:10', body)
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/avg_speed', 'date=not-a-date'))
+        self.assertEqual(status, 400)
+        self.assertIn('not a valid date', json.loads(body)['error'])
+
+    def test_conditional_get_and_cache(self):
+        # Test that a repeated request is answered from the cache and a matching If-None-Match with a 304
+        _, headers, body = asyncio.run(get(self.app, '/metrics/avg_speed', 'device_id=0001'))
+        _, _, cached_body = asyncio.run(get(self.app, '/metrics/avg_speed', 'device_id=0001'))
+        self.assertEqual(cached_body, body)
+        self.assertEqual(async_app.response_cache.snapshot()['hits'], 1)
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/avg_speed', 'device_id=0001',
+                                          headers=[('if-none-match', headers['etag'])]))
+        self.assertEqual((status, body), (304, b''))
+
+    def test_route_reads_the_track(self):
+        # Test that the route comes from the compressed track, every message with resolution=full, and from the
+        # messages when the snapshot has no track
+        messages_df = make_snapshot().messages_by_device.df.assign(
+            lat=[51.0, 51.1], latitude_direction=['N', 'N'], lon=[4.0, 4.1], longitude_direction=['W', 'W'],
+            speed_over_ground_d=[10.0, 11.0], true_course=[90.0, 91.0]
+        )
+        snapshot = make_snapshot()
+        tracks_df = messages_df.iloc[:1].assign(lon=-4.0)
+        async_app.snapshots = SnapshotRefresher(DataSnapshot(3, messages_df, snapshot.devices_df,
+                                                             snapshot.hourly_speed_by_device.df,
+                                                             snapshot.daily_wind_by_device.df, tracks_df))
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/route', 'device_id=0001&date=2019-02-13'))
+        self.assertEqual((status, json.loads(body)), (200, [{"datetime": "2019-02-13T14:10:00", "lat": 51.0,
+                                                              "lon": -4.0, "speed_over_ground_d": 10.0,
+                                                              "true_course": 90.0}]))
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/route', 'device_id=0001&resolution=full'))
+        self.assertEqual([point['lon'] for point in json.loads(body)], [-4.0, -4.1])
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/route', 'device_id=0001&start=2019-02-13T15:00'))
+        self.assertEqual([point['datetime'] for point in json.loads(body)], ["2019-02-13T15:10:00"])
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/route', 'resolution=coarse'))
+        self.assertEqual(status, 400)
+
+    def test_in_area_finds_the_ships_in_the_box(self):
+        # Test that the ships with messages in the box and time window are listed once, and a bad box is a 400
+        messages_df = make_snapshot().messages_by_device.df.assign(
+            lat=[51.2, 51.4], latitude_direction=['N', 'N'], lon=[4.3, 4.6], longitude_direction=['E', 'E']
+        )
+        snapshot = make_snapshot()
+        async_app.snapshots = SnapshotRefresher(DataSnapshot(3, messages_df, snapshot.devices_df,
+                                                             snapshot.hourly_speed_by_device.df,
+                                                             snapshot.daily_wind_by_device.df))
+
+        status, _, body = asyncio.run(get(self.app, '/ships/in_area', 'bbox=4.0,51.0,5.0,52.0'))
+        self.assertEqual((status, json.loads(body)), (200, [{"device_id": "0001", "first_seen": "2019-02-13T14:10:00",
+                                                              "last_seen": "2019-02-13T15:10:00", "messages": 2}]))
+
+        status, _, body = asyncio.run(get(self.app, '/ships/in_area', 'bbox=4.0,51.0,4.5,51.3&from=2019-02-13T15:00'))
+        self.assertEqual(json.loads(body), [])
+
+        for query_string in ['', 'bbox=4.0,51.0,5.0', 'bbox=4.0,52.0,5.0,51.0', 'bbox=4,51,5,52&to=never']:
+            status, _, body = asyncio.run(get(self.app, '/ships/in_area', query_string))
+            self.assertEqual(status, 400)
+
+    @patch('async_app.PUSHDOWN_STATEMENTS', {'hourly_speed': ((), 'hourly speed query')})
+    def test_pushdown_queries_the_async_pool(self):
+        # Test that in pushdown mode the statement is run on a pooled connection with the rounded range
+        conn = MagicMock()
+        async def fetch(query, *params):
+            return [(datetime.datetime(2019, 2, 13, 14), 1.5)]
+        conn.fetch = MagicMock(side_effect=fetch)
+        acquire = MagicMock()
+        acquire.return_value.__aenter__.return_value = conn
+        async_app.db_pool = MagicMock(acquire=acquire)
+        async_app.snapshots = SnapshotRefresher(DatabaseView(3))
+
+        status, _, body = asyncio.run(get(self.app, '/metrics/avg_speed', 'device_id=0001&start=2019-02-13T13:30'))
+        self.assertEqual(json.loads(body), [{"date": "2019-02-13", "datetime": 14, "speed_over_ground_d": 1.5}])
+        conn.fetch.assert_called_once_with('hourly speed query', '0001', datetime.datetime(2019, 2, 13, 14),
+                                           datetime.datetime.max)
+
+    def test_concurrency_limit(self):
+        # Test that requests beyond the limit wait for a slot and get a 503 when none frees up in time
+        release = None
+
+        async def slow_app(scope, receive, send):
+            await release.wait()
+            await async_app.Response(b'done')(scope, receive, send)
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            limited = ConcurrencyLimit(slow_app, max_requests=1, queue_timeout=0.05)
+            first = asyncio.create_task(get(limited, '/'))
+            await asyncio.sleep(0.01)
+            rejected = await get(limited, '/')
+            release.set()
+            return (await first)[0], rejected[0], limited.stats
+
+        self.assertEqual(asyncio.run(run()), (200, 503, {'rejected': 1}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,22 @@
-import re
-import os
-import psycopg2
+import argparse
 import pandas as pd
 import json
-from urllib.parse import urlparse
-from dotenv import load_dotenv
-from raw_data_db_insert import create_cursor_and_insert_data, copy_from_csv
-from exploratory_data_analysis import fetch_data_from_db, robust_clean_raw_message
+from contextlib import nullcontext
+from db_connection import connection, close_pools
+from copy_writer import upsert_from_dataframe, insert_new_from_dataframe
+from watermarks import fetch_watermarks, build_incremental_query, compute_watermarks, update_watermarks
+from exploratory_data_analysis import fetch_data_from_db, fetch_data_in_batches
+from message_parser import vectorized_clean_raw_messages
+from parallel_cleaning import ParallelCleaner
+from weather_join import WeatherIndex
+from weather_loader import load_weather_frame
+from rollups import refresh_rollups
+from data_changes import record_changes, notify_changes
+from columnar_snapshot import SNAPSHOT_PATH, write_columnar_snapshot
+from instrumentation import RUN_REPORT_DIR, RunReport, stage
+from message_dedup import KEPT_PAYLOADS_SQL, DuplicateFilter, fetch_recently_kept
+from partitions import days_of, ensure_partitions
+from trajectory import TRACK_TOLERANCE_M, TRACK_MAX_INTERVAL_SECONDS, refresh_tracks
 
 # Function to save the DataFrame to a CSV file temporarily
 def save_df_to_csv(df, file_path):
@@ -26,101 +36,282 @@ def filter_weather_data(weather_df):
     # Convert datetime fields in both DataFrames to ensure they are in the same format
     # Clean the 'datetime' column by replacing ":" with a space and appending ":00" where needed
     weather_df['datetime'] = weather_df['datetime'].str.replace(':', ' ', regex=False) + ':00'
-    weather_df['datetime'] = pd.to_datetime(weather_df['datetime'], errors='coerce')
+    weather_df['datetime'] = pd.to_datetime(weather_df['datetime'], errors='coerce').astype('datetime64[ns]')
 
     # Filter weather_df
-    weather_df['lat'] = weather_df['lat'].astype(int)
-    weather_df['lon'] = weather_df['lon'].astype(int)
     weather_df = weather_df.sort_values('datetime')
 
     return weather_df
 
-def filter_raw_messages_clean_df(raw_messages_df):
-    # Convert Unix timestamps to a readable datetime format
-    raw_messages_df['datetime'] = pd.to_datetime(raw_messages_df['datetime'], unit='s')
+# With a ParallelCleaner the raw messages are parsed in its worker processes, the result is the same.
+# With a RunReport the parse, normalize and sort steps are timed as stages of it.
+def filter_raw_messages_clean_df(raw_messages_df, cleaner=None, report=None):
+    # Parse the whole raw_message column at once into typed RMC columns
+    with stage(report, 'parse', len(raw_messages_df)) as record:
+        if cleaner is None:
+            cleaned_columns_df = vectorized_clean_raw_messages(raw_messages_df['raw_message'])
+        else:
+            cleaned_columns_df = cleaner.clean(raw_messages_df['raw_message'])
+        valid = cleaned_columns_df['data_status'].notna()
+        record['rows_out'] = int(valid.sum())
+        record['rejected'] = len(raw_messages_df) - record['rows_out']
 
-    # Apply the robust cleaning function
-    raw_messages_df['cleaned_message'] = raw_messages_df['raw_message'].apply(robust_clean_raw_message)
+    with stage(report, 'normalize', len(raw_messages_df)) as record:
+        # Convert Unix timestamps (stored as text in the staging table) to a readable datetime format
+        raw_messages_df['datetime'] = pd.to_datetime(pd.to_numeric(raw_messages_df['datetime']), unit='s')
 
-    # Normalize the cleaned data into separate columns
-    cleaned_columns_df = pd.json_normalize(raw_messages_df['cleaned_message'])
+        # Concatenate the cleaned columns back to the original dataframe
+        raw_messages_clean_df = pd.concat([raw_messages_df, cleaned_columns_df], axis=1)
 
-    # Concatenate the cleaned columns back to the original dataframe
-    raw_messages_clean_df = pd.concat([raw_messages_df, cleaned_columns_df], axis=1)
+        # Remove the 'raw_message' column and the messages that could not be parsed
+        raw_messages_clean_df = raw_messages_clean_df.drop(columns=['raw_message'])
+        raw_messages_clean_df = raw_messages_clean_df[valid]
 
-    # Remove the 'raw_message' and 'cleaned_message' columns
-    raw_messages_clean_df = raw_messages_clean_df.drop(columns=['raw_message', 'cleaned_message'])
+        # Filter raw_messages_clean_df
+        raw_messages_clean_df = raw_messages_clean_df.rename(columns={"latitude": "lat", "longitude": "lon"})
+        # Both sides of the weather merge need the same datetime resolution
+        raw_messages_clean_df['datetime'] = pd.to_datetime(raw_messages_clean_df['datetime'], errors='coerce').astype('datetime64[ns]')
+        record['rows_out'] = len(raw_messages_clean_df)
 
-    # Filter raw_messages_clean_df
-    raw_messages_clean_df = raw_messages_clean_df.rename(columns={"latitude": "lat", "longitude": "lon"})
-    raw_messages_clean_df['datetime'] = pd.to_datetime(raw_messages_clean_df['datetime'], errors='coerce')
-    raw_messages_clean_df['lat'] = raw_messages_clean_df['lat'].astype(int)
-    raw_messages_clean_df['lon'] = raw_messages_clean_df['lon'].astype(int)
-    raw_messages_clean_df = raw_messages_clean_df.sort_values('datetime')
+    with stage(report, 'sort', len(raw_messages_clean_df)) as record:
+        raw_messages_clean_df = raw_messages_clean_df.sort_values('datetime')
+        record['rows_out'] = len(raw_messages_clean_df)
 
     return raw_messages_clean_df
 
 
+# Key of the production tables, see partitioning_sql in partitions.py. datetime is part of it because the tables are
+# partitioned on it.
+PRODUCTION_KEY_COLUMNS = ['device_id', 'original_message_id', 'datetime']
 
-def main():
 
-    load_dotenv()
+# Function to recompute the rollups and the compressed tracks of everything a batch touched and log the changed hours
+# for the API, in the transaction of the batch. track_options are the tolerances of refresh_tracks.
+def refresh_derived_tables(cursor, combined_df, report=None, track_options=None):
+    with stage(report, 'rollups', len(combined_df)):
+        refresh_rollups(cursor, combined_df)
+    with stage(report, 'tracks') as record:
+        stats = refresh_tracks(cursor, combined_df, **(track_options or {}))
+        record.update(rows_in=stats['points_in'], rows_out=stats['points_out'],
+                      rejected=stats['points_in'] - stats['points_out'])
+    # Last, it locks the change log until the batch commits
+    record_changes(cursor, combined_df)
+    if report is not None:
+        report.record_max('track_max_error_m', stats['max_error_m'])
 
-    # Fetch the database URL from the .env file
-    PRODUCTION_URL = os.getenv("PRODUCTION_KEY")
 
-    # Parse the URL to extract connection parameters
-    url = urlparse(PRODUCTION_URL)
+# Function to clean one batch of staging rows, combine it with the weather data and load both into production.
+# With a DuplicateFilter repeated deliveries of a message are dropped before they are parsed.
+# With a RunReport every step is timed as a stage of it.
+def process_raw_messages_batch(conn, raw_messages_df, weather_index, binary_copy=False, incremental=False,
+                               cleaner=None, report=None, duplicate_filter=None, track_options=None):
+    if raw_messages_df.empty:
+        return
 
-    conn_params = {
-        'dbname': url.path[1:],    # Extracts the database name after '/'
-        'user': url.username,       # Extracts the username
-        'password': url.password,   # Extracts the password
-        'host': url.hostname,       # Extracts the host
-        'port': url.port            # Extracts the port
-    }
+    if incremental:
+        # Taken before cleaning, so messages that fail to parse still move the watermark past them
+        with stage(report, 'watermarks', len(raw_messages_df)) as record:
+            batch_watermarks_df = compute_watermarks(raw_messages_df)
+            record['rows_out'] = len(batch_watermarks_df)
 
-    # Establish a connection to the database
-    conn = psycopg2.connect(**conn_params)
+    if duplicate_filter is not None:
+        # Also before cleaning, the same payload from another collector is never parsed, joined or stored again
+        with stage(report, 'dedup', len(raw_messages_df)) as record:
+            raw_messages_df = raw_messages_df[duplicate_filter.keep_mask(raw_messages_df)]
+            record['rows_out'] = len(raw_messages_df)
+            record['rejected'] = record['rows_in'] - len(raw_messages_df)
 
+    raw_messages_clean_df = filter_raw_messages_clean_df(raw_messages_df, cleaner, report)
+
+    # Combine every message with the weather of its nearest station, nearest in time
+    with stage(report, 'weather_join', len(raw_messages_clean_df)) as record:
+        combined_df = weather_index.join(raw_messages_clean_df)
+        record['rows_out'] = len(combined_df)
+
+    # The daily partitions the batch goes into, in the transaction of the copy
+    cursor = conn.cursor()
+    with stage(report, 'partitions') as record:
+        days = days_of(raw_messages_clean_df['datetime'])
+        created = [name for table_name in ('raw_messages_cleaned', 'raw_messages_cleaned_weather', 'device_tracks')
+                   for name in ensure_partitions(cursor, table_name, days)]
+        record.update(rows_in=len(days), rows_out=len(created))
+
+    copied_rows = len(raw_messages_clean_df) + len(combined_df)
+    if incremental:
+        # Upsert both tables and move the watermarks in one transaction, so a failed run can simply be repeated
+        with stage(report, 'copy', copied_rows) as record:
+            upsert_from_dataframe(cursor, raw_messages_clean_df, 'raw_messages_cleaned', PRODUCTION_KEY_COLUMNS, binary_copy)
+            upsert_from_dataframe(cursor, combined_df, 'raw_messages_cleaned_weather', PRODUCTION_KEY_COLUMNS, binary_copy)
+            record['rows_out'] = copied_rows
+        with stage(report, 'watermarks', len(batch_watermarks_df)) as record:
+            update_watermarks(cursor, batch_watermarks_df)
+            record['rows_out'] = len(batch_watermarks_df)
+        refresh_derived_tables(cursor, combined_df, report, track_options)
+        with stage(report, 'commit'):
+            conn.commit()
+        cursor.close()
+        print("Data upserted successfully!")
+    else:
+        # Messages already in production, e.g. from an earlier full run over the same staging rows, are skipped
+        # instead of failing the copy on their key
+        with stage(report, 'copy', copied_rows) as record:
+            # Insert the cleaned data into the raw_messages_cleaned table
+            inserted = insert_new_from_dataframe(cursor, raw_messages_clean_df, 'raw_messages_cleaned',
+                                                 PRODUCTION_KEY_COLUMNS, binary_copy)
+
+            # Insert the combined data into the raw_messages_cleaned_weather table
+            inserted += insert_new_from_dataframe(cursor, combined_df, 'raw_messages_cleaned_weather',
+                                                  PRODUCTION_KEY_COLUMNS, binary_copy)
+            record['rows_out'] = inserted
+            record['rejected'] = copied_rows - inserted
+
+        # Recompute the rollups and tracks for the hours and days this batch touched and log them for the API
+        refresh_derived_tables(cursor, combined_df, report, track_options)
+        with stage(report, 'commit'):
+            conn.commit()
+        cursor.close()
+
+
+# Without a batch size the whole staging table is processed in memory at once, with a batch size it is streamed
+# through a server-side cursor and every batch is loaded into production before the next one is fetched.
+# An incremental run only processes staging rows past each device's watermark and upserts them.
+# With more than one worker the raw messages are parsed in a pool of that many processes.
+# With a dedup window, deliveries of a message that repeat the same device and raw_message within that many seconds
+# are dropped before parsing, across batches too.
+# With a snapshot_path the production message table is afterwards exported to the columnar snapshot app.py starts
+# from. The export reads the whole table, so it is left to occasional runs instead of every incremental one: app.py
+# reads the changes logged after the file was written from production.
+# The compressed tracks of the touched days keep every message within track_tolerance_m of them and a point at least
+# every track_max_interval_seconds, see compress_tracks in trajectory.py.
+# Every stage is timed in a run report, which is printed and written to run_report_dir unless that is empty.
+def main(batch_size=None, binary_copy=False, incremental=False, lookback_seconds=0, max_weather_distance_km=None,
+         workers=1, snapshot_path=None, run_report_dir=RUN_REPORT_DIR, dedup_window_seconds=None,
+         track_tolerance_m=TRACK_TOLERANCE_M, track_max_interval_seconds=TRACK_MAX_INTERVAL_SECONDS):
+    track_options = {'tolerance_m': track_tolerance_m, 'max_interval_seconds': track_max_interval_seconds}
+    report = RunReport('clean_data_db_insert', options={
+        'batch_size': batch_size, 'binary_copy': binary_copy, 'incremental': incremental,
+        'lookback_seconds': lookback_seconds, 'max_weather_distance_km': max_weather_distance_km, 'workers': workers,
+        'dedup_window_seconds': dedup_window_seconds, 'track_tolerance_m': track_tolerance_m,
+        'track_max_interval_seconds': track_max_interval_seconds
+    })
     try:
-        # Fetch the data from raw_messages table
-        raw_messages_df = fetch_data_from_db(query="SELECT * FROM raw_messages;", environment="STAGING")
-        raw_messages_clean_df = filter_raw_messages_clean_df(raw_messages_df)
+        load_production(report, batch_size, binary_copy, incremental, lookback_seconds, max_weather_distance_km,
+                        workers, dedup_window_seconds, track_options)
+        if snapshot_path:
+            with stage(report, 'snapshot_export'):
+                write_columnar_snapshot(snapshot_path)
+    except Exception as error:
+        report.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        print(report.summary())
+        if run_report_dir:
+            print(f"Run report written to {report.write(run_report_dir)}")
 
-        # Save the combined DataFrame to a temporary CSV file
-        csv_file_path = '/tmp/raw_messages_cleaned.csv'
-        save_df_to_csv(raw_messages_clean_df, csv_file_path)
 
-        # Insert the combined data into the raw_messages_cleaned table
-        create_cursor_and_insert_data(conn, csv_file_path, 'raw_messages_cleaned')
+# Function to run the load of main, see there
+def load_production(report, batch_size, binary_copy, incremental, lookback_seconds, max_weather_distance_km, workers,
+                    dedup_window_seconds, track_options=None):
+    # One filter for the whole run, so duplicates are also found across batches. An incremental run seeds it with
+    # the messages of the last window before the watermarks.
+    duplicate_filter = None if dedup_window_seconds is None else DuplicateFilter(dedup_window_seconds)
 
-        # Load weather data from the JSON file
+    # Borrow a connection to production for the writes, the staging reads use their own pooled connection.
+    # The worker processes are started once and shared by every batch.
+    with connection("PRODUCTION") as conn, (ParallelCleaner(workers) if workers > 1 else nullcontext()) as cleaner:
+        # Load weather data from the JSON file, it is shared by every batch
         weather_json_path = '/workspaces/Xomnia-Assignment/data/weather_data.json'  # Replace with actual path to your JSON file
-        weather_df = load_weather_data(weather_json_path)
-        weather_df = filter_weather_data(weather_df)
-
-        # Combine the two dataframes
-        combined_df = pd.merge_asof(
-            raw_messages_clean_df, 
-            weather_df, 
-            on='datetime', 
-            by=['lat', 'lon'],
-            direction='nearest'
-        )
-
-        # Save the combined DataFrame to a temporary CSV file
-        csv_file_path = '/tmp/raw_messages_cleaned_weather.csv'
-        save_df_to_csv(combined_df, csv_file_path)
-
-        # Insert the combined data into the raw_messages_cleaned table
-        create_cursor_and_insert_data(conn, csv_file_path, 'raw_messages_cleaned_weather')
-        
-    finally:
-        conn.close()
+        with stage(report, 'weather_load') as record:
+            # Parsed by streaming through the stations, or taken from the cache when the file did not change
+            weather_df = load_weather_frame(weather_json_path)
+            weather_index = WeatherIndex(weather_df, max_distance_km=max_weather_distance_km)
+            record['rows_out'] = len(weather_df)
 
+        if incremental:
+            # Only fetch what is newer than the last loaded message of every device
+            cursor = conn.cursor()
+            watermarks_df = fetch_watermarks(cursor)
+            if duplicate_filter is not None:
+                # Start from what the previous runs kept in the last window, a copy through the other collector that
+                # reached staging after them is dropped too
+                with stage(report, 'dedup_seed') as record:
+                    kept_params = fetch_recently_kept(cursor, dedup_window_seconds)
+                    kept_df = fetch_data_from_db(query=KEPT_PAYLOADS_SQL, environment="STAGING", params=kept_params)
+                    duplicate_filter.seed(kept_df)
+                    record.update(rows_in=len(kept_params['device_ids']), rows_out=len(kept_df))
+            cursor.close()
+            query, params = build_incremental_query(watermarks_df, lookback_seconds)
+        else:
+            query, params = "SELECT * FROM raw_messages;", None
+
+        if batch_size:
+            # Stream the raw_messages table in batches of batch_size rows
+            batches = report.timed_batches('fetch', fetch_data_in_batches(query, "STAGING", batch_size, params))
+            for raw_messages_df in batches:
+                process_raw_messages_batch(conn, raw_messages_df, weather_index, binary_copy, incremental, cleaner,
+                                           report, duplicate_filter, track_options)
+        else:
+            # Fetch the data from raw_messages table
+            with stage(report, 'fetch') as record:
+                raw_messages_df = fetch_data_from_db(query=query, environment="STAGING", params=params)
+                record['rows_out'] = len(raw_messages_df)
+            process_raw_messages_batch(conn, raw_messages_df, weather_index, binary_copy, incremental, cleaner, report,
+                                       duplicate_filter, track_options)
+
+        # Let a running API know it can pick up the new data
+        cursor = conn.cursor()
+        notify_changes(cursor)
+        conn.commit()
+        cursor.close()
+
+    if duplicate_filter is not None:
+        stats = duplicate_filter.stats
+        print(f"Dropped {stats['duplicates']} of {stats['messages']} messages as duplicates "
+              f"({duplicate_filter.drop_rate():.1%})")
+
+    tracks = report.stages.get('tracks')
+    if tracks and tracks['rows_out']:
+        print(f"Compressed {tracks['rows_in']} track points to {tracks['rows_out']} "
+              f"({tracks['rows_in'] / tracks['rows_out']:.1f}x), largest error "
+              f"{report.stats['track_max_error_m']:.1f} m")
 
-# Entry point of the script
-if __name__ == "__main__":
-    main()
 
+# Command line of the script, also run by `ships etl clean`
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Clean the staging data and load it into production.")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Stream the staging table in batches of this many rows instead of loading it at once")
+    parser.add_argument("--binary-copy", action="store_true",
+                        help="Load production with PostgreSQL binary COPY instead of CSV")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process staging rows past each device's watermark and upsert them")
+    parser.add_argument("--lookback-seconds", type=int, default=0,
+                        help="With --incremental, also re-read this many seconds before each watermark")
+    parser.add_argument("--max-weather-distance-km", type=float, default=None,
+                        help="Leave the weather empty for messages farther than this from the nearest station")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Parse the raw messages in this many worker processes")
+    parser.add_argument("--snapshot-path", nargs='?', const=SNAPSHOT_PATH, default=None,
+                        help="Afterwards write the columnar snapshot of the production messages for app.py, to this "
+                             "path or the default one")
+    parser.add_argument("--dedup-window-seconds", type=int, default=None,
+                        help="Drop messages repeating the device and raw_message of one kept this many seconds apart")
+    parser.add_argument("--run-report-dir", default=RUN_REPORT_DIR,
+                        help="Directory to write the JSON run report with the time of every stage to, empty to skip it")
+    parser.add_argument("--track-tolerance-m", type=float, default=TRACK_TOLERANCE_M,
+                        help="Metres a message left out of the compressed track may be off from it")
+    parser.add_argument("--track-max-interval-seconds", type=float, default=TRACK_MAX_INTERVAL_SECONDS,
+                        help="Seconds the compressed track may go without a point")
+    args = parser.parse_args(argv)
+
+    main(batch_size=args.batch_size, binary_copy=args.binary_copy,
+         incremental=args.incremental, lookback_seconds=args.lookback_seconds,
+         max_weather_distance_km=args.max_weather_distance_km, workers=args.workers,
+         snapshot_path=args.snapshot_path, run_report_dir=args.run_report_dir,
+         dedup_window_seconds=args.dedup_window_seconds, track_tolerance_m=args.track_tolerance_m,
+         track_max_interval_seconds=args.track_max_interval_seconds)
+    close_pools()
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,11 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
-from clean_data_db_insert import filter_raw_messages_clean_df, load_weather_data, filter_weather_data, save_df_to_csv
+from clean_data_db_insert import filter_raw_messages_clean_df, load_weather_data, filter_weather_data, save_df_to_csv, main
 
 class CleanDataDBInsertTestCase(unittest.TestCase):
 
-    @patch('clean_data_db_insert.psycopg2.connect')
+    @patch('db_connection.psycopg2.connect')
     def test_filter_raw_messages_clean_df(self, mock_connect):
         # Create a sample raw messages DataFrame
         sample_data = {
@@ -47,6 +47,75 @@ class CleanDataDBInsertTestCase(unittest.TestCase):
         # Assert that the result matches the expected DataFrame
         pd.testing.assert_frame_equal(result_df, expected_df)
 
+    @patch('clean_data_db_insert.write_columnar_snapshot')
+    @patch('db_connection.psycopg2.connect')
+    @patch('clean_data_db_insert.load_weather_frame')
+    @patch('clean_data_db_insert.insert_new_from_dataframe')
+    @patch('clean_data_db_insert.fetch_data_in_batches')
+    @patch('clean_data_db_insert.fetch_data_from_db')
+    def test_main_batches_match_single_pass(self, mock_fetch, mock_fetch_batches, mock_insert, mock_load_weather, mock_connect,
+                                          mock_write_snapshot):
+        # Sample staging rows for two ships, as text like in the raw_messages table
+        raw_messages_df = pd.DataFrame({
+            'device_id': ['st-1a2090', '0001', 'st-1a2090', '0001', 'st-1a2090'],
+            'datetime': ['1550066999', '1550067661', '1550067048', '1550069034', '1550070000'],
+            'address_ip': ['172.19.0.17', '172.19.0.16', '172.19.0.17', '172.19.0.16', '172.19.0.17'],
+            'address_port': [4007, 4007, 4007, 4007, 4007],
+            'original_message_id': ['m1', 'm2', 'm3', 'm4', 'm5'],
+            'raw_message': [
+                "A,51.31830816666667,N,4.315722166666666,E,0.0,1.59,150218,0.8,E",
+                "A,51.3183085,N,4.315720833333334,E,0.0,5.25,150218,0.8,E",
+                "A,5$1.90%1005333&3333@3,*N,5.54188533@3333333,E,0.0,42.22,130219,1.4,E",
+                "Invalid message",
+                "A,51.6904161666666,N,4.409101666666666,E,3.1,0.59,130219,1.0,E"
+            ]
+        })
+        weather_df = pd.DataFrame({
+            'lat': [51.3, 51.9],
+            'lon': [4.3, 5.5],
+            'datetime': ['2019-02-13:14', '2019-02-13:15'],
+            'temp': [5.0, 6.0]
+        })
+        mock_load_weather.side_effect = lambda path: filter_weather_data(weather_df.copy())
+
+        # Capture what would be copied into each production table
+        def run(**kwargs):
+            copied = {}
+            mock_insert.reset_mock()
+            def capture(cursor, df, table_name, key_columns, binary=False):
+                copied.setdefault(table_name, []).append(df)
+                return len(df)
+            mock_insert.side_effect = capture
+            main(run_report_dir='', **kwargs)
+            return {
+                table_name: pd.concat(frames).sort_values('original_message_id').reset_index(drop=True)
+                for table_name, frames in copied.items()
+            }
+
+        mock_fetch.side_effect = lambda **kwargs: raw_messages_df.copy()
+        single_pass = run(snapshot_path='messages.arrow')
+
+        mock_fetch_batches.return_value = [raw_messages_df.iloc[i:i + 2].reset_index(drop=True) for i in range(0, 5, 2)]
+        batched = run(batch_size=2)
+
+        # The batched run loads every batch separately but ends up with the same rows
+        self.assertEqual(mock_insert.call_count, 6)
+        self.assertEqual(set(batched), {'raw_messages_cleaned', 'raw_messages_cleaned_weather'})
+        for table_name in single_pass:
+            pd.testing.assert_frame_equal(batched[table_name], single_pass[table_name])
+        # Only the run given a snapshot path exports production to the columnar snapshot afterwards
+        mock_write_snapshot.assert_called_once_with('messages.arrow')
+
+        # A copy of the first message through the other collector, fetched in a later batch after a newer message of
+        # the ship, is dropped before parsing when that newer message is within the window
+        duplicate_row = raw_messages_df.iloc[[0]].assign(datetime='1550067000', address_ip='172.19.0.16',
+                                                         original_message_id='m6')
+        with_duplicate_df = pd.concat([raw_messages_df, duplicate_row], ignore_index=True)
+        mock_fetch_batches.return_value = [with_duplicate_df.iloc[i:i + 2].reset_index(drop=True) for i in range(0, 6, 2)]
+        deduplicated = run(batch_size=2, dedup_window_seconds=60)
+        for table_name in single_pass:
+            pd.testing.assert_frame_equal(deduplicated[table_name], single_pass[table_name])
+
     @patch('clean_data_db_insert.open')
     @patch('clean_data_db_insert.json.load')
     def test_load_weather_data(self, mock_json_load, mock_open):
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+from db_connection import cursor
+from data_changes import fetch_change_marker
+from typed_fetch import FLOAT32_COLUMNS, compact_dtypes
+from copy_writer import TABLE_COLUMNS_SQL
+
+# Arrow IPC file with the rows of raw_messages_cleaned_weather, written by clean_data_db_insert.py after a load when
+# asked to, and memory-mapped by app.py at startup. Both read the location from the same environment variable.
+SNAPSHOT_PATH = os.getenv(
+    'COLUMNAR_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'raw_messages_cleaned_weather.arrow')
+)
+
+# Rows fetched from production and written to the file at once, the export never holds more than this in memory
+EXPORT_BATCH_ROWS = 1000000
+
+# Schema metadata key holding the last etl_changes.change_id included in the file
+VERSION_METADATA_KEY = b'change_id'
+
+# Arrow type of every PostgreSQL column type of the message table
+ARROW_TYPES = {
+    'character varying': pa.string(),
+    'character': pa.string(),
+    'text': pa.string(),
+    'numeric': pa.float64(),
+    'double precision': pa.float64(),
+    'real': pa.float32(),
+    'integer': pa.int64(),
+    'bigint': pa.int64(),
+    'smallint': pa.int64(),
+    'timestamp without time zone': pa.timestamp('us'),
+    'date': pa.date32(),
+    'boolean': pa.bool_()
+}
+
+# Rows in (device, time) order, the order DeviceTimeIndex keeps them in, so app.py can use them without sorting.
+# Rows without a time are never served and are left out.
+EXPORT_SQL = """
+    SELECT * FROM raw_messages_cleaned_weather
+    WHERE datetime IS NOT NULL
+    ORDER BY device_id, datetime, original_message_id;
+"""
+
+
+# Function to build the Arrow schema of the message table from its column types in production,
+# the weather observations are stored as float32 like fetch_typed_data_from_db returns them
+def fetch_arrow_schema(cursor):
+    cursor.execute(TABLE_COLUMNS_SQL, ('raw_messages_cleaned_weather',))
+    return pa.schema([
+        (name, pa.float32() if name in FLOAT32_COLUMNS else ARROW_TYPES[data_type])
+        for name, data_type in cursor.fetchall()
+    ])
+
+
+# Function to convert fetched rows to a record batch. Missing floats are stored as NaN instead of nulls, so the
+# float columns of a memory-mapped file can be used as they are instead of being copied to fill in the NaNs.
+def rows_to_record_batch(rows, schema):
+    df = pd.DataFrame.from_records(rows, columns=schema.names, coerce_float=True)
+    arrays = []
+    for field in schema:
+        if pa.types.is_floating(field.type):
+            arrays.append(pa.array(df[field.name].astype(field.type.to_pandas_dtype()).to_numpy(), type=field.type))
+        else:
+            arrays.append(pa.array(df[field.name], type=field.type, from_pandas=True))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# Function to export the message table to the snapshot file. The change marker is read first, like load_snapshot
+# does, so changes committed during the export are applied again by app.py. The file is written next to the old one,
+# under a name no other export uses, and renamed over it: running app processes keep their mapping of the old file.
+def write_columnar_snapshot(path=SNAPSHOT_PATH, batch_size=EXPORT_BATCH_ROWS):
+    with cursor("PRODUCTION") as cur:
+        version, _ = fetch_change_marker(cur, 0)
+        schema = fetch_arrow_schema(cur)
+    schema = schema.with_metadata({VERSION_METADATA_KEY: str(version).encode('ascii')})
+
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    os.close(descriptor)
+    try:
+        with cursor("PRODUCTION", name="write_columnar_snapshot") as cur:
+            cur.itersize = batch_size
+            cur.execute(EXPORT_SQL)
+            with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.write_batch(rows_to_record_batch(rows, schema))
+        # mkstemp creates the file readable by its owner only, the app may run as another user
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return version
+
+
+# Function to read the snapshot file, returning the version it includes and its rows, or None without a readable
+# file. The file is memory-mapped: processes on one host share its pages through the page cache.
+def read_columnar_snapshot(path=SNAPSHOT_PATH):
+    try:
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    version = int(table.schema.metadata[VERSION_METADATA_KEY])
+    # Separate blocks per column, so the float columns of a file written as one batch stay views of the mapped file.
+    # Text columns with few distinct values become categoricals, Arrow dictionaries cannot change between batches.
+    return version, compact_dtypes(table.to_pandas(split_blocks=True))
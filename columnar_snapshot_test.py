@@ -0,0 +1,86 @@
+import os
+import unittest
+import tempfile
+import datetime
+from decimal import Decimal
+from unittest.mock import patch, MagicMock
+import numpy as np
+import pyarrow as pa
+from columnar_snapshot import rows_to_record_batch, write_columnar_snapshot, read_columnar_snapshot
+
+SCHEMA = pa.schema([
+    ('device_id', pa.string()),
+    ('datetime', pa.timestamp('us')),
+    ('address_port', pa.int64()),
+    ('temp', pa.float64())
+])
+
+ROWS = [
+    ('0001', datetime.datetime(2019, 2, 13, 14, 10), 4007, Decimal('5.5')),
+    ('0001', datetime.datetime(2019, 2, 13, 15, 10), None, None),
+    ('st-1a2090', datetime.datetime(2019, 2, 13, 14, 20), 4007, Decimal('-1.25'))
+]
+
+class ColumnarSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'messages.arrow')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rows_to_record_batch(self):
+        # Test that decimals become floats and a missing float is stored as NaN, not as a null
+        batch = rows_to_record_batch(ROWS, SCHEMA)
+
+        self.assertEqual(batch.schema, SCHEMA)
+        self.assertEqual(batch.column('temp').null_count, 0)
+        self.assertTrue(np.isnan(batch.column('temp').to_numpy()[1]))
+        self.assertEqual(batch.column('address_port').to_pylist(), [4007, None, 4007])
+
+    @patch('columnar_snapshot.fetch_arrow_schema', return_value=SCHEMA)
+    @patch('columnar_snapshot.fetch_change_marker', return_value=(7, None))
+    @patch('columnar_snapshot.cursor')
+    def test_write_and_read_columnar_snapshot(self, mock_cursor, mock_marker, mock_schema):
+        # The export fetches the rows in two batches
+        cur = MagicMock()
+        cur.fetchmany.side_effect = [ROWS[:2], ROWS[2:], []]
+        mock_cursor.return_value.__enter__.return_value = cur
+
+        self.assertEqual(write_columnar_snapshot(self.path, batch_size=2), 7)
+        self.assertEqual(os.listdir(self.directory.name), ['messages.arrow'])
+
+        version, messages_df = read_columnar_snapshot(self.path)
+        self.assertEqual(version, 7)
+        self.assertEqual(list(messages_df.columns), SCHEMA.names)
+        self.assertEqual(list(messages_df['device_id']), ['0001', '0001', 'st-1a2090'])
+        self.assertEqual(messages_df['temp'].tolist()[::2], [5.5, -1.25])
+        self.assertEqual(messages_df['datetime'].iloc[2], datetime.datetime(2019, 2, 13, 14, 20))
+
+    @patch('columnar_snapshot.fetch_arrow_schema', return_value=SCHEMA)
+    @patch('columnar_snapshot.fetch_change_marker', return_value=(8, None))
+    @patch('columnar_snapshot.cursor')
+    def test_failed_export_keeps_the_old_file(self, mock_cursor, mock_marker, mock_schema):
+        # Test that an export failing halfway leaves the previous file in place and no temporary file behind
+        cur = MagicMock()
+        cur.fetchmany.side_effect = [ROWS[:2], RuntimeError("connection lost")]
+        mock_cursor.return_value.__enter__.return_value = cur
+        with open(self.path, 'wb') as file:
+            file.write(b'previous export')
+
+        with self.assertRaises(RuntimeError):
+            write_columnar_snapshot(self.path, batch_size=2)
+        self.assertEqual(os.listdir(self.directory.name), ['messages.arrow'])
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), b'previous export')
+
+    def test_read_columnar_snapshot_without_file(self):
+        # Test that a missing or unreadable file is reported as no snapshot
+        self.assertIsNone(read_columnar_snapshot(self.path))
+        with open(self.path, 'wb') as file:
+            file.write(b'not an arrow file')
+        self.assertIsNone(read_columnar_snapshot(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
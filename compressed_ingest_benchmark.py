@@ -0,0 +1,139 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from db_connection import connection, close_pools
+from fleet_generator import write_fleet
+from raw_data_db_insert import COPY_READ_BYTES, copy_from_csv, open_raw_csv
+
+# Table the dumps are copied into, a temporary copy of staging dropped with the benchmark's connection
+BENCHMARK_TABLE = 'raw_messages_ingest_benchmark'
+
+
+# Function to compress a CSV file the way the collectors ship it, returning the path of the dump
+def compress(csv_path, compression, directory):
+    path = os.path.join(directory, f"raw_messages.csv.{compression}")
+    with open(csv_path, 'rb') as source:
+        if compression == 'gz':
+            with gzip.open(path, 'wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target, COPY_READ_BYTES)
+        else:
+            import zstandard
+            with open(path, 'wb') as target:
+                zstandard.ZstdCompressor(level=3).copy_stream(source, target)
+    return path
+
+
+# Loads a CSV file into the benchmark table, or only reads it through like COPY would with --sink null
+class Sink:
+
+    def __init__(self, kind, cursor=None):
+        self.kind = kind
+        self.cursor = cursor
+
+    def load(self, path):
+        if self.kind == 'null':
+            with open_raw_csv(path) as file:
+                while file.read(COPY_READ_BYTES):
+                    pass
+            return
+        self.cursor.execute(f"TRUNCATE {BENCHMARK_TABLE};")
+        copy_from_csv(self.cursor, path, BENCHMARK_TABLE)
+
+
+# The old path: decompress the dump to scratch disk, then load the plain file. Returns the seconds of both steps and
+# the scratch bytes written.
+def decompress_then_load(dump_path, sink, scratch_directory):
+    scratch_path = os.path.join(scratch_directory, 'raw_messages.csv')
+    start = time.perf_counter()
+    with open_raw_csv(dump_path) as source, open(scratch_path, 'wb') as target:
+        shutil.copyfileobj(source, target, COPY_READ_BYTES)
+        target.flush()
+        os.fsync(target.fileno())
+    decompress_seconds = time.perf_counter() - start
+    scratch_bytes = os.path.getsize(scratch_path)
+
+    start = time.perf_counter()
+    sink.load(scratch_path)
+    load_seconds = time.perf_counter() - start
+    os.remove(scratch_path)
+    return decompress_seconds + load_seconds, scratch_bytes
+
+
+# The new path: COPY straight from the dump, decompressing on the way
+def stream_load(dump_path, sink):
+    start = time.perf_counter()
+    sink.load(dump_path)
+    return time.perf_counter() - start, 0
+
+
+def run_benchmark(csv_path, compressions, sink, repeats, directory):
+    csv_bytes = os.path.getsize(csv_path)
+    results = {'csv_bytes': csv_bytes, 'compressions': {}}
+    for compression in compressions:
+        dump_path = compress(csv_path, compression, directory)
+        paths = {'decompress_then_load': lambda: decompress_then_load(dump_path, sink, directory),
+                 'stream': lambda: stream_load(dump_path, sink)}
+        result = {'dump_bytes': os.path.getsize(dump_path)}
+        for name, run in paths.items():
+            runs = [run() for _ in range(repeats)]
+            seconds = statistics.median(seconds for seconds, _ in runs)
+            result[name] = {'seconds': seconds, 'csv_mb_per_second': csv_bytes / 2 ** 20 / seconds,
+                            'scratch_bytes': max(scratch_bytes for _, scratch_bytes in runs)}
+        results['compressions'][compression] = result
+        os.remove(dump_path)
+    return results
+
+
+def print_results(results):
+    print(f"CSV data: {results['csv_bytes'] / 2 ** 20:.1f} MB")
+    print(f"{'dump':>5} {'dump (MB)':>10} {'path':>21} {'time (s)':>9} {'CSV MB/s':>9} {'scratch disk (MB)':>18}")
+    for compression, result in results['compressions'].items():
+        for name in ('decompress_then_load', 'stream'):
+            run = result[name]
+            print(f"{compression:>5} {result['dump_bytes'] / 2 ** 20:>10.1f} {name:>21} {run['seconds']:>9.2f} "
+                  f"{run['csv_mb_per_second']:>9.1f} {run['scratch_bytes'] / 2 ** 20:>18.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare loading compressed dumps by decompressing them to disk first with streaming them into COPY."
+    )
+    parser.add_argument("--csv-path", help="CSV file of raw messages to compress, by default a generated fleet")
+    parser.add_argument("--ships", type=int, default=100, help="Ships of the generated fleet")
+    parser.add_argument("--days", type=int, default=2, help="Days of the generated fleet")
+    parser.add_argument("--compressions", nargs='+', choices=['gz', 'zst'], default=['gz'],
+                        help="Compressions of the dumps, zst needs zstandard (pip install zstandard)")
+    parser.add_argument("--sink", choices=['postgres', 'null'], default='postgres',
+                        help="COPY into a temporary table in staging, or only read the data through")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = args.csv_path
+        if csv_path is None:
+            write_fleet(directory, args.ships, args.days, n_stations=1)
+            csv_path = os.path.join(directory, 'raw_messages.csv')
+        if args.sink == 'null':
+            results = run_benchmark(csv_path, args.compressions, Sink('null'), args.repeats, directory)
+        else:
+            with connection("STAGING") as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"CREATE TEMP TABLE {BENCHMARK_TABLE} (LIKE raw_messages);")
+                results = run_benchmark(csv_path, args.compressions, Sink('postgres', cursor), args.repeats,
+                                        directory)
+                conn.rollback()
+            close_pools()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import struct
+import decimal
+import numpy as np
+import pandas as pd
+
+# Number of DataFrame rows serialized per chunk handed to COPY
+COPY_BATCH_ROWS = 10000
+
+# Size of the reads copy_expert does on the producer, much larger than psycopg2's 8 KiB default
+COPY_READ_SIZE = 1 << 20
+
+# PostgreSQL binary COPY framing: signature, flags field and header extension length, and the file trailer
+BINARY_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_COPY_TRAILER = struct.pack('>h', -1)
+
+# A NULL field in binary COPY is just a length of -1 without any data
+_NULL_FIELD = struct.pack('>i', -1)
+
+# Binary timestamps are microseconds since 2000-01-01
+_POSTGRES_EPOCH_US = 946684800 * 1000000
+
+# Fixed-width binary encodings per type name, as format_type gives it without modifiers
+_FIXED_WIDTH_TYPES = {
+    'smallint': '>i2',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'real': '>f4',
+    'double precision': '>f8',
+    'timestamp without time zone': '>i8',
+    'timestamp with time zone': '>i8'
+}
+_TEXT_TYPES = {'character varying', 'character', 'text'}
+
+
+# File-like object that hands out the chunks of an iterator to cursor.copy_expert without buffering them all
+class ChunkReader:
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = None
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._buffer is None or self._offset >= len(self._buffer):
+                self._buffer = next(self._chunks, None)
+                self._offset = 0
+                if self._buffer is None:
+                    break
+            # Keep an offset into the current chunk instead of re-slicing what is left of it
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + remaining)
+            parts.append(self._buffer[self._offset:end])
+            remaining -= end - self._offset
+            self._offset = end
+
+        if not parts:
+            return ''
+        return parts[0][:0].join(parts)
+
+
+# Generate CSV text for the DataFrame, batch_rows rows at a time and without a header
+def iter_csv_chunks(df, batch_rows=COPY_BATCH_ROWS):
+    for start in range(0, len(df), batch_rows):
+        yield df.iloc[start:start + batch_rows].to_csv(header=False, index=False)
+
+
+# Name and type of every column of a table, in column order. The table is the one the search path resolves its name
+# to, so a table of the same name in another schema (or another session's temporary table) adds no columns. The type
+# names have no modifiers, 'numeric' for numeric(9,6) like information_schema's data_type.
+TABLE_COLUMNS_SQL = """
+    SELECT attname, format_type(atttypid, NULL)
+    FROM pg_attribute
+    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum;
+"""
+
+
+# Fetch the type of every column of a table, in column order
+def fetch_column_types(cursor, table_name):
+    cursor.execute(TABLE_COLUMNS_SQL, (table_name,))
+    return [row[1] for row in cursor.fetchall()]
+
+
+# Split a number into its sign, integer digits and fraction digits as PostgreSQL's numeric type sees them
+def _numeric_digits(value):
+    text = repr(value) if isinstance(value, float) else str(value)
+    if text.lstrip('-').replace('.', '', 1).isdigit():
+        # Fast path for plain positional notation, which is what nearly every value looks like
+        negative = text.startswith('-')
+        integer_part, _, fraction_part = text.lstrip('-').partition('.')
+        return negative, integer_part, fraction_part
+
+    # Exponent notation, NaN and infinities go through Decimal
+    value = decimal.Decimal(text)
+    if not value.is_finite():
+        return value, None, None
+    sign, digits, exponent = value.as_tuple()
+    digits = ''.join(map(str, digits)) + '0' * max(exponent, 0)
+    dscale = max(-exponent, 0)
+    if dscale >= len(digits):
+        return bool(sign), '', '0' * (dscale - len(digits)) + digits
+    return bool(sign), digits[:len(digits) - dscale], digits[len(digits) - dscale:]
+
+
+# Encode a single value as the payload of a binary NUMERIC field
+def encode_numeric(value):
+    negative, integer_part, fraction_part = _numeric_digits(value)
+    if integer_part is None:
+        # NaN, +Infinity or -Infinity, told apart by the sign word alone
+        special = 0xC000 if negative.is_nan() else 0xF000 if negative.is_signed() else 0xD000
+        return struct.pack('>hhHh', 0, 0, special, 0)
+    dscale = len(fraction_part)
+
+    # Base-10000 groups around the decimal point
+    integer_part = integer_part.zfill((len(integer_part) + 3) // 4 * 4)
+    fraction_part = fraction_part.ljust((len(fraction_part) + 3) // 4 * 4, '0')
+    groups = [int(integer_part[i:i + 4]) for i in range(0, len(integer_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(fraction_part[i:i + 4]) for i in range(0, len(fraction_part), 4)]
+
+    # Leading zero groups only move the weight, trailing zero groups are implied by dscale
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    return struct.pack(f'>hhHh{len(groups)}h', len(groups), weight, 0x4000 if negative else 0, dscale, *groups)
+
+
+# Encode a column of fixed-width values into length-prefixed binary fields in a single NumPy pass
+def _encode_fixed_width_column(series, data_type):
+    value_format = _FIXED_WIDTH_TYPES[data_type]
+    if data_type.startswith('timestamp'):
+        timestamps = pd.to_datetime(series)
+        valid = timestamps.notna().to_numpy()
+        values = timestamps.to_numpy(dtype='datetime64[us]').astype(np.int64) - _POSTGRES_EPOCH_US
+    else:
+        values = pd.to_numeric(series)
+        valid = values.notna().to_numpy()
+        values = values.to_numpy(dtype=np.float64 if 'f' in value_format else np.int64, na_value=0)
+
+    fields = np.zeros(len(series), dtype=[('length', '>i4'), ('value', value_format)])
+    fields['length'] = np.dtype(value_format).itemsize
+    fields['value'][valid] = values[valid]
+
+    encoded = np.empty(len(series), dtype=object)
+    encoded[:] = fields.view(f'V{fields.dtype.itemsize}').tolist()
+    encoded[~valid] = _NULL_FIELD
+    return encoded
+
+
+# Encode a column of variable-width values, every distinct value is only encoded once
+def _encode_variable_width_column(series, data_type):
+    if data_type == 'numeric':
+        encode = encode_numeric
+    elif data_type in _TEXT_TYPES:
+        encode = lambda value: str(value).encode('utf-8')
+    else:
+        raise ValueError(f"Unsupported column type for binary COPY: {data_type}")
+
+    codes, uniques = pd.factorize(series)
+    encoded = []
+    for value in uniques:
+        payload = encode(value.item() if isinstance(value, np.generic) else value)
+        encoded.append(struct.pack('>i', len(payload)) + payload)
+    encoded.append(_NULL_FIELD)  # code -1 marks a missing value
+
+    return np.array(encoded, dtype=object)[codes]
+
+
+# Generate PostgreSQL binary COPY data for the DataFrame, column_types are the target table's data types
+def iter_binary_copy_chunks(df, column_types, batch_rows=COPY_BATCH_ROWS):
+    if len(column_types) != len(df.columns):
+        raise ValueError(f"DataFrame has {len(df.columns)} columns but the table has {len(column_types)}")
+
+    yield BINARY_COPY_HEADER
+    tuple_header = struct.pack('>h', len(df.columns))
+
+    for start in range(0, len(df), batch_rows):
+        batch_df = df.iloc[start:start + batch_rows]
+        columns = []
+        for (_, series), data_type in zip(batch_df.items(), column_types):
+            if data_type in _FIXED_WIDTH_TYPES:
+                columns.append(_encode_fixed_width_column(series, data_type))
+            else:
+                columns.append(_encode_variable_width_column(series, data_type))
+        yield b''.join(tuple_header + b''.join(row) for row in zip(*columns))
+
+    yield BINARY_COPY_TRAILER
+
+
+# Stream a DataFrame straight into a table with COPY, as CSV text or as PostgreSQL binary data
+def copy_from_dataframe(cursor, df, table_name, binary=False, batch_rows=COPY_BATCH_ROWS):
+    if binary:
+        column_types = fetch_column_types(cursor, table_name)
+        reader = ChunkReader(iter_binary_copy_chunks(df, column_types, batch_rows))
+        cursor.copy_expert(f"COPY {table_name} FROM STDIN WITH BINARY", reader, size=COPY_READ_SIZE)
+    else:
+        reader = ChunkReader(iter_csv_chunks(df, batch_rows))
+        cursor.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV", reader, size=COPY_READ_SIZE)
+
+
+# Fetch the column names of a table, in column order
+def fetch_column_names(cursor, table_name):
+    cursor.execute(TABLE_COLUMNS_SQL, (table_name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# COPY a DataFrame into a temporary copy of a table that is dropped at the end of the transaction, returns its name
+def copy_to_load_table(cursor, df, table_name, binary=False, batch_rows=COPY_BATCH_ROWS):
+    load_table = f"{table_name}_upsert"
+    cursor.execute(f"DROP TABLE IF EXISTS {load_table};")
+    cursor.execute(f"CREATE TEMP TABLE {load_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    copy_from_dataframe(cursor, df, load_table, binary=binary, batch_rows=batch_rows)
+    return load_table
+
+
+# Upsert a DataFrame into a table: COPY it into a temporary copy of the table, then merge it on the key columns.
+# Rows whose key already exists are overwritten, so loading the same data twice leaves the table unchanged.
+def upsert_from_dataframe(cursor, df, table_name, key_columns, binary=False, batch_rows=COPY_BATCH_ROWS):
+    load_table = copy_to_load_table(cursor, df, table_name, binary, batch_rows)
+
+    columns = fetch_column_names(cursor, table_name)
+    keys = ', '.join(key_columns)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in key_columns)
+    # DISTINCT ON keeps a key that appears twice in one load from hitting the same row twice
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({', '.join(columns)})
+        SELECT DISTINCT ON ({keys}) {', '.join(columns)} FROM {load_table}
+        ON CONFLICT ({keys}) DO UPDATE SET {updates};
+    """)
+    cursor.execute(f"DROP TABLE {load_table};")
+
+
+# Insert the rows of a DataFrame whose key is not in a table yet: COPY it into a temporary copy of the table, then
+# insert from there skipping the keys that exist. Unlike the upsert, existing rows are kept as they are and a key
+# repeated within the load is kept once. Returns the number of rows inserted.
+def insert_new_from_dataframe(cursor, df, table_name, key_columns, binary=False, batch_rows=COPY_BATCH_ROWS):
+    load_table = copy_to_load_table(cursor, df, table_name, binary, batch_rows)
+    columns = ', '.join(fetch_column_names(cursor, table_name))
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({columns})
+        SELECT {columns} FROM {load_table}
+        ON CONFLICT ({', '.join(key_columns)}) DO NOTHING;
+    """)
+    inserted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {load_table};")
+    return inserted
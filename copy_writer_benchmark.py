@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import psycopg2
+import pandas as pd
+from raw_data_db_insert import copy_from_csv
+from copy_writer import copy_from_dataframe
+from message_parser import vectorized_clean_raw_messages
+
+RAW_MESSAGES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'raw_messages.csv')
+
+# Same layout as raw_messages_cleaned in db_creation.py, with a placeholder for the type of the numeric columns
+BENCHMARK_TABLE_SQL = """
+    CREATE TEMP TABLE copy_benchmark (
+        device_id VARCHAR(255),
+        datetime TIMESTAMP,
+        address_ip VARCHAR(255),
+        address_port INT,
+        original_message_id VARCHAR(255),
+        data_status CHAR(1),
+        latitude {numeric_type},
+        latitude_direction CHAR(1),
+        longitude {numeric_type},
+        longitude_direction CHAR(1),
+        speed_over_ground_d {numeric_type},
+        true_course {numeric_type},
+        ut_date {numeric_type},
+        mag_var_d {numeric_type},
+        mag_var_dir CHAR(1)
+    );
+"""
+
+
+# Stand-in cursor used without a database: it drains what COPY would send, so only the client side is timed
+class DrainCursor:
+
+    def __init__(self, numeric_type):
+        numeric_type = numeric_type.lower()
+        self.column_types = [
+            'character varying', 'timestamp without time zone', 'character varying', 'integer', 'character varying',
+            'character', numeric_type, 'character', numeric_type, 'character', numeric_type, numeric_type,
+            numeric_type, numeric_type, 'character'
+        ]
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return [(data_type,) for data_type in self.column_types]
+
+    def copy_expert(self, sql, file, size=8192):
+        while file.read(size):
+            pass
+
+
+# Build a frame shaped like raw_messages_cleaned from the bundled raw messages
+def load_cleaned_messages(copies):
+    raw_messages_df = pd.read_csv(RAW_MESSAGES_CSV, dtype={'device_id': str})
+    raw_messages_df = pd.concat([raw_messages_df] * copies, ignore_index=True)
+    raw_messages_df['datetime'] = pd.to_datetime(raw_messages_df['datetime'], unit='s')
+    parsed_df = vectorized_clean_raw_messages(raw_messages_df.pop('raw_message'))
+    return pd.concat([raw_messages_df, parsed_df], axis=1)
+
+
+# The current production path: write a temporary CSV file, then COPY it from disk
+def copy_through_temp_file(cursor, df, table_name):
+    csv_file_path = '/tmp/copy_benchmark.csv'
+    df.to_csv(csv_file_path, index=False)
+    copy_from_csv(cursor, csv_file_path, table_name)
+    os.remove(csv_file_path)
+
+
+def main():
+    # Pass a connection URL to COPY into a temporary table, otherwise only the client side is measured
+    database_url = sys.argv[1] if len(sys.argv) > 1 else None
+    conn = psycopg2.connect(database_url) if database_url else None
+    writers = [
+        ('temp CSV file', 'NUMERIC', lambda cursor, df: copy_through_temp_file(cursor, df, 'copy_benchmark')),
+        ('CSV stream', 'NUMERIC', lambda cursor, df: copy_from_dataframe(cursor, df, 'copy_benchmark')),
+        ('binary stream', 'NUMERIC',
+         lambda cursor, df: copy_from_dataframe(cursor, df, 'copy_benchmark', binary=True)),
+        ('temp CSV file', 'DOUBLE PRECISION', lambda cursor, df: copy_through_temp_file(cursor, df, 'copy_benchmark')),
+        ('CSV stream', 'DOUBLE PRECISION', lambda cursor, df: copy_from_dataframe(cursor, df, 'copy_benchmark')),
+        ('binary stream', 'DOUBLE PRECISION',
+         lambda cursor, df: copy_from_dataframe(cursor, df, 'copy_benchmark', binary=True))
+    ]
+
+    print(f"Target: {'PostgreSQL' if conn else 'in-process sink (no database)'}")
+    print(f"{'rows':>10} {'numeric columns':>17} {'writer':>15} {'seconds':>9} {'rows/s':>12}")
+    for copies in [1, 10]:
+        df = load_cleaned_messages(copies)
+        for name, numeric_type, writer in writers:
+            cursor = conn.cursor() if conn else DrainCursor(numeric_type)
+            if conn:
+                cursor.execute(BENCHMARK_TABLE_SQL.format(numeric_type=numeric_type))
+
+            start = time.perf_counter()
+            writer(cursor, df)
+            elapsed = time.perf_counter() - start
+
+            if conn:
+                conn.rollback()
+            print(f"{len(df):>10} {numeric_type:>17} {name:>15} {elapsed:>9.3f} {len(df) / elapsed:>12,.0f}")
+
+    if conn:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
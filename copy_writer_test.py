@@ -0,0 +1,110 @@
+import struct
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+from copy_writer import (ChunkReader, iter_csv_chunks, iter_binary_copy_chunks, encode_numeric, copy_from_dataframe,
+                         upsert_from_dataframe, insert_new_from_dataframe, fetch_column_types, BINARY_COPY_HEADER, BINARY_COPY_TRAILER,
+                         TABLE_COLUMNS_SQL)
+
+class CopyWriterTestCase(unittest.TestCase):
+
+    def test_chunk_reader(self):
+        # Reads of any size return the chunks back to back, and an empty value at the end
+        reader = ChunkReader(['abc', 'de', '', 'fghij'])
+        self.assertEqual(reader.read(4), 'abcd')
+        self.assertEqual(reader.read(2), 'ef')
+        self.assertEqual(reader.read(), 'ghij')
+        self.assertEqual(reader.read(4), '')
+
+    def test_iter_csv_chunks(self):
+        # CSV text is produced in batches and without a header row
+        sample_df = pd.DataFrame({'device_id': ['st-1a2090', '0001', '0001'], 'speed': [0.0, 1.5, None]})
+        chunks = list(iter_csv_chunks(sample_df, batch_rows=2))
+        self.assertEqual(chunks, ['st-1a2090,0.0\n0001,1.5\n', '0001,\n'])
+
+    def test_encode_numeric(self):
+        # 12345.678 is stored as the base-10000 digits 1, 2345 and 6780 with weight 1 and three decimals
+        self.assertEqual(encode_numeric(12345.678), struct.pack('>hhHh3h', 3, 1, 0, 3, 1, 2345, 6780))
+        self.assertEqual(encode_numeric(-0.0001), struct.pack('>hhHh1h', 1, -1, 0x4000, 4, 1))
+        self.assertEqual(encode_numeric(0.0), struct.pack('>hhHh', 0, 0, 0, 1))
+        self.assertEqual(encode_numeric(1e20), struct.pack('>hhHh1h', 1, 5, 0, 0, 1))
+        self.assertEqual(encode_numeric(float('nan')), struct.pack('>hhHh', 0, 0, 0xC000, 0))
+
+    def test_iter_binary_copy_chunks(self):
+        # One row with an integer, a timestamp, a text value and a NULL numeric
+        sample_df = pd.DataFrame({
+            'address_port': [4007],
+            'datetime': [pd.Timestamp('2000-01-01 00:00:01')],
+            'device_id': ['st-1a2090'],
+            'speed_over_ground_d': [None]
+        })
+        data = b''.join(iter_binary_copy_chunks(
+            sample_df, ['integer', 'timestamp without time zone', 'character varying', 'numeric']
+        ))
+
+        expected_row = (
+            struct.pack('>h', 4) +
+            struct.pack('>ii', 4, 4007) +
+            struct.pack('>iq', 8, 1000000) +
+            struct.pack('>i', 9) + b'st-1a2090' +
+            struct.pack('>i', -1)
+        )
+        self.assertEqual(data, BINARY_COPY_HEADER + expected_row + BINARY_COPY_TRAILER)
+
+    def test_iter_binary_copy_chunks_column_mismatch(self):
+        # The table and the DataFrame have to have the same number of columns
+        with self.assertRaises(ValueError):
+            list(iter_binary_copy_chunks(pd.DataFrame({'a': [1]}), ['integer', 'integer']))
+
+    def test_copy_from_dataframe(self):
+        # The DataFrame is streamed to COPY without touching the disk
+        mock_cursor = MagicMock()
+        copied = []
+        mock_cursor.copy_expert.side_effect = lambda sql, f, size: copied.append((sql, f.read()))
+
+        copy_from_dataframe(mock_cursor, pd.DataFrame({'device_id': ['0001'], 'speed': [0.5]}), 'raw_messages_cleaned')
+
+        self.assertEqual(copied, [("COPY raw_messages_cleaned FROM STDIN WITH CSV", '0001,0.5\n')])
+
+    def test_upsert_from_dataframe(self):
+        # The DataFrame goes into a temporary table first and is then merged on the key columns
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('device_id',), ('original_message_id',), ('speed',)]
+
+        sample_df = pd.DataFrame({'device_id': ['0001'], 'original_message_id': ['m1'], 'speed': [0.5]})
+        upsert_from_dataframe(mock_cursor, sample_df, 'raw_messages_cleaned', ['device_id', 'original_message_id'])
+
+        mock_cursor.copy_expert.assert_called_once()
+        self.assertIn('raw_messages_cleaned_upsert', mock_cursor.copy_expert.call_args.args[0])
+        merge_sql = [call.args[0] for call in mock_cursor.execute.call_args_list if 'INSERT INTO' in call.args[0]][0]
+        self.assertIn('ON CONFLICT (device_id, original_message_id) DO UPDATE SET speed = EXCLUDED.speed', merge_sql)
+        self.assertIn('DISTINCT ON (device_id, original_message_id)', merge_sql)
+
+    def test_insert_new_from_dataframe(self):
+        # The DataFrame goes into a temporary table first and only the rows with a new key are inserted
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('device_id',), ('original_message_id',), ('speed',)]
+        mock_cursor.rowcount = 1
+
+        sample_df = pd.DataFrame({'device_id': ['0001', '0001'], 'original_message_id': ['m1', 'm2'], 'speed': [0.5, 1.0]})
+        inserted = insert_new_from_dataframe(mock_cursor, sample_df, 'raw_messages_cleaned',
+                                             ['device_id', 'original_message_id'])
+
+        self.assertEqual(inserted, 1)
+        self.assertIn('raw_messages_cleaned_upsert', mock_cursor.copy_expert.call_args.args[0])
+        insert_sql = [call.args[0] for call in mock_cursor.execute.call_args_list if 'INSERT INTO' in call.args[0]][0]
+        self.assertIn('ON CONFLICT (device_id, original_message_id) DO NOTHING', insert_sql)
+        self.assertNotIn('DISTINCT ON', insert_sql)
+
+    def test_columns_of_the_table_on_the_search_path(self):
+        # The columns are read from the table the name resolves to, not from every schema's table of that name
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('device_id', 'character varying'), ('speed', 'numeric')]
+
+        self.assertEqual(fetch_column_types(mock_cursor, 'raw_messages_cleaned'), ['character varying', 'numeric'])
+        mock_cursor.execute.assert_called_once_with(TABLE_COLUMNS_SQL, ('raw_messages_cleaned',))
+        self.assertIn('%s::regclass', TABLE_COLUMNS_SQL)
+        self.assertNotIn('information_schema', TABLE_COLUMNS_SQL)
+
+if __name__ == "__main__":
+    unittest.main()
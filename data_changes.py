@@ -0,0 +1,67 @@
+import pandas as pd
+from rollups import touched_buckets
+
+# Channel clean_data_db_insert.py notifies after a load, app.py listens on it to refresh its data
+CHANGES_CHANNEL = 'production_data_changed'
+
+# Every load appends the (device, hour) buckets it wrote to etl_changes, see create_change_log_table in
+# db_creation.py. Readers remember the last change_id they applied and only fetch the buckets changed after it.
+# The lock is held until the load commits, so change_ids become visible in the order they were taken: a reader that
+# sees a change_id can never later find a lower one that was still being committed, and skip it.
+RECORD_CHANGES_SQL = """
+    LOCK TABLE etl_changes IN EXCLUSIVE MODE;
+    INSERT INTO etl_changes (device_ids, hours) VALUES (%s::text[], %s::timestamp[]);
+"""
+
+CHANGE_MARKER_SQL = """
+    SELECT coalesce(max(change_id), 0), min(created_at) FILTER (WHERE change_id > %s)
+    FROM etl_changes;
+"""
+
+CHANGED_BUCKETS_SQL = """
+    SELECT DISTINCT b.device_id, b.hour
+    FROM etl_changes c, unnest(c.device_ids, c.hours) AS b(device_id, hour)
+    WHERE c.change_id > %s AND c.change_id <= %s
+    ORDER BY b.device_id, b.hour;
+"""
+
+# Messages of the given (device, hour) buckets, as they are now in production. The bounds of all hours together only
+# repeat what the join already says, they let PostgreSQL skip the daily partitions outside them.
+CHANGED_MESSAGES_SQL = """
+    SELECT m.*
+    FROM unnest(%(device_ids)s::text[], %(hours)s::timestamp[]) AS t(device_id, hour)
+    JOIN raw_messages_cleaned_weather m
+        ON m.device_id = t.device_id AND m.datetime >= t.hour AND m.datetime < t.hour + interval '1 hour'
+    WHERE m.datetime >= (SELECT min(hour) FROM unnest(%(hours)s::timestamp[]) AS hour)
+      AND m.datetime < (SELECT max(hour) FROM unnest(%(hours)s::timestamp[]) AS hour) + interval '1 hour';
+"""
+
+
+# Function to record the hours a batch of messages touched, in the same transaction as the batch itself. Other loads
+# wait to record theirs until this transaction ends, call it right before the commit.
+def record_changes(cursor, messages_df):
+    hours_df = touched_buckets(messages_df, 'h')
+    if hours_df.empty:
+        return
+    cursor.execute(RECORD_CHANGES_SQL, (
+        hours_df['device_id'].tolist(),
+        hours_df['bucket'].dt.to_pydatetime().tolist()
+    ))
+
+
+# Function to tell listeners that production changed, delivered when the transaction commits
+def notify_changes(cursor):
+    cursor.execute(f"NOTIFY {CHANGES_CHANNEL};")
+
+
+# Function to read the latest change_id and when the oldest change after since_change_id was recorded
+def fetch_change_marker(cursor, since_change_id):
+    cursor.execute(CHANGE_MARKER_SQL, (since_change_id,))
+    latest_change_id, pending_since = cursor.fetchone()
+    return latest_change_id, pending_since
+
+
+# Function to fetch the distinct (device, hour) buckets of the changes in (after_change_id, up_to_change_id]
+def fetch_changed_buckets(cursor, after_change_id, up_to_change_id):
+    cursor.execute(CHANGED_BUCKETS_SQL, (after_change_id, up_to_change_id))
+    return pd.DataFrame(cursor.fetchall(), columns=['device_id', 'hour'])
@@ -0,0 +1,49 @@
+import unittest
+import datetime
+from unittest.mock import MagicMock
+import pandas as pd
+from data_changes import record_changes, notify_changes, fetch_change_marker, fetch_changed_buckets, RECORD_CHANGES_SQL, CHANGES_CHANNEL
+
+class DataChangesTestCase(unittest.TestCase):
+
+    def test_record_changes(self):
+        # The touched (device, hour) buckets of a batch are logged as one row of arrays
+        messages_df = pd.DataFrame({
+            'device_id': ['st-1a2090', 'st-1a2090', '0001'],
+            'datetime': pd.to_datetime(['2019-02-13 14:09:59', '2019-02-13 14:54:56', '2019-02-13 15:21:01'])
+        })
+        mock_cursor = MagicMock()
+
+        record_changes(mock_cursor, messages_df)
+
+        mock_cursor.execute.assert_called_once_with(RECORD_CHANGES_SQL, (
+            ['0001', 'st-1a2090'],
+            [datetime.datetime(2019, 2, 13, 15), datetime.datetime(2019, 2, 13, 14)]
+        ))
+
+    def test_record_changes_without_messages(self):
+        # An empty batch changes nothing and logs nothing
+        mock_cursor = MagicMock()
+        record_changes(mock_cursor, pd.DataFrame({'device_id': [], 'datetime': pd.to_datetime([])}))
+        mock_cursor.execute.assert_not_called()
+
+    def test_notify_changes(self):
+        mock_cursor = MagicMock()
+        notify_changes(mock_cursor)
+        mock_cursor.execute.assert_called_once_with(f"NOTIFY {CHANGES_CHANNEL};")
+
+    def test_fetch_change_marker_and_buckets(self):
+        # The marker and the buckets of a range of changes come back as plain values and a DataFrame
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (7, None)
+        mock_cursor.fetchall.return_value = [('0001', datetime.datetime(2019, 2, 13, 15))]
+
+        self.assertEqual(fetch_change_marker(mock_cursor, 7), (7, None))
+        buckets_df = fetch_changed_buckets(mock_cursor, 3, 7)
+
+        self.assertEqual(mock_cursor.execute.call_args.args[1], (3, 7))
+        self.assertEqual(list(buckets_df.columns), ['device_id', 'hour'])
+        self.assertEqual(len(buckets_df), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+# Environment variable holding the connection URL of every environment, see the .env file
+ENVIRONMENT_KEYS = {'STAGING': 'STAGING_KEY', 'PRODUCTION': 'PRODUCTION_KEY'}
+
+# Connections kept open per environment, acquiring more than that waits for one to be released
+POOL_MAX_CONNECTIONS = 5
+
+# A connection that sat idle for longer than this is checked with a round trip before it is handed out again
+HEALTH_CHECK_IDLE_SECONDS = 30
+
+# TCP keepalives, so dead connections are noticed instead of hanging on the next query
+KEEPALIVE_PARAMS = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 5}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Connection parameters of an environment, read from its URL in the .env file
+def connection_params(environment):
+    url = urlparse(os.getenv(ENVIRONMENT_KEYS[environment]))
+    return {
+        'dbname': url.path[1:],    # Extracts the database name after '/'
+        'user': url.username,       # Extracts the username
+        'password': url.password,   # Extracts the password
+        'host': url.hostname,       # Extracts the host
+        'port': url.port,           # Extracts the port
+        **KEEPALIVE_PARAMS
+    }
+
+
+# Connection parameters of an environment as asyncpg takes them, for the async API server
+def async_connection_params(environment):
+    load_dotenv()
+    params = connection_params(environment)
+    return {'database': params['dbname'], 'user': params['user'], 'password': params['password'],
+            'host': params['host'], 'port': params['port']}
+
+
+# Thread-safe pool of connections to one database, with health checks and timing of connects and acquires
+class ConnectionPool:
+
+    def __init__(self, conn_params, max_connections=POOL_MAX_CONNECTIONS):
+        self.conn_params = conn_params
+        self.max_connections = max_connections
+        self._idle = []    # (connection, released at) pairs, the most recently used last
+        self._open = 0
+        self.closed = False
+        self._condition = threading.Condition()
+        self.stats = {
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'connect_seconds': 0.0,
+            'acquires': 0,
+            'acquire_wait_seconds': 0.0,
+            'health_checks': 0
+        }
+
+    def _connect(self):
+        start = time.perf_counter()
+        conn = psycopg2.connect(**self.conn_params)
+        with self._condition:
+            self.stats['connections_opened'] += 1
+            self.stats['connect_seconds'] += time.perf_counter() - start
+        return conn
+
+    def _is_healthy(self, conn):
+        with self._condition:
+            self.stats['health_checks'] += 1
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # Close a connection while keeping its slot, for a caller that opens its replacement in the same slot
+    def _close_only(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self.stats['connections_discarded'] += 1
+
+    def _discard(self, conn):
+        self._close_only(conn)
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    # Take a connection out of the pool, opening one when none is idle and the pool is not full
+    def acquire(self):
+        start = time.perf_counter()
+        with self._condition:
+            while not self._idle and self._open >= self.max_connections:
+                self._condition.wait()
+            self.stats['acquires'] += 1
+            self.stats['acquire_wait_seconds'] += time.perf_counter() - start
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._open += 1
+
+        if conn is not None:
+            stale = time.monotonic() - released_at > HEALTH_CHECK_IDLE_SECONDS
+            if not conn.closed and (not stale or self._is_healthy(conn)):
+                return conn
+            # Replace a broken connection with a fresh one, without freeing its slot for a waiting acquire in between
+            self._close_only(conn)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    # Allow up to max_connections open connections, for a script using more at once than the pool was created with
+    def grow(self, max_connections):
+        with self._condition:
+            self.max_connections = max(self.max_connections, max_connections)
+            self._condition.notify_all()
+
+    # Hand a connection back, an unfinished transaction is rolled back and a broken connection is dropped
+    def release(self, conn):
+        if not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        with self._condition:
+            if not conn.closed and not self.closed:
+                self._idle.append((conn, time.monotonic()))
+                self._condition.notify()
+                return
+        self._discard(conn)
+
+    # Close every idle connection, connections in use are closed when they are released to a closed pool
+    def close(self):
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    # Counters and timings of the pool, plus how many connections are open and idle right now
+    def snapshot(self):
+        with self._condition:
+            return {**self.stats, 'open_connections': self._open, 'idle_connections': len(self._idle)}
+
+
+# The pool of an environment, created on first use
+def get_pool(environment):
+    with _pools_lock:
+        if environment not in _pools:
+            load_dotenv()
+            _pools[environment] = ConnectionPool(connection_params(environment))
+        return _pools[environment]
+
+
+# Borrow a pooled connection of an environment for the duration of a with block
+@contextmanager
+def connection(environment):
+    pool = get_pool(environment)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+# Cursor on a pooled connection: committed when the with block succeeds, rolled back when it raises.
+# A name makes it a server-side cursor.
+@contextmanager
+def cursor(environment, name=None):
+    with connection(environment) as conn:
+        cur = conn.cursor(name=name) if name else conn.cursor()
+        try:
+            yield cur
+        except BaseException:
+            cur.close()
+            conn.rollback()
+            raise
+        # A server-side cursor has to be closed before the transaction it lives in ends
+        cur.close()
+        conn.commit()
+
+
+# Close the pools of every environment, for scripts about to exit and for tests
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# Pool statistics of every environment that has been used
+def pool_stats():
+    with _pools_lock:
+        return {environment: pool.snapshot() for environment, pool in _pools.items()}
@@ -1,50 +1,40 @@
-import psycopg2
-from urllib.parse import urlparse
-from dotenv import load_dotenv
-import os
+import argparse
+from db_connection import connection, close_pools
+from partitions import (partitioning_sql, migrate_to_partitioned, create_future_partitions,
+                        drop_expired_partitions)
+
+# The message tables partitioned by day, per environment
+PARTITIONED_TABLES = {
+    'STAGING': ['raw_messages'],
+    'PRODUCTION': ['raw_messages_cleaned', 'raw_messages_cleaned_weather', 'device_tracks']
+}
 
 # Helper function to handle database connections and execute queries
 def manage_database(db_url_key, create_table_sql, drop_table_sql=None):
-    # Load environment variables from the .env file
-    load_dotenv()
-
-    # Fetch the database URL from the .env file
-    db_url = os.getenv(db_url_key)
-
-    # Parse the URL to extract connection parameters
-    url = urlparse(db_url)
-
-    conn_params = {
-        'dbname': url.path[1:],    # Extracts the database name after '/'
-        'user': url.username,       # Extracts the username
-        'password': url.password,   # Extracts the password
-        'host': url.hostname,       # Extracts the host
-        'port': url.port            # Extracts the port
-    }
-    
-    # Establish a connection to the database
-    conn = psycopg2.connect(**conn_params)
-    print(f"Connection to {db_url_key} established successfully!")
-
-    # Create a cursor object to execute SQL queries
-    cursor = conn.cursor()
-
-    # Execute the SQL statement to create a table
-    cursor.execute(create_table_sql)
-
-    # Commit the transaction to save changes
-    conn.commit()
-    print("Table created successfully!")
-
-    # Optionally, drop the table if necessary
-    if drop_table_sql:
-        cursor.execute(drop_table_sql)
+    # STAGING_KEY and PRODUCTION_KEY name the environments of db_connection
+    environment = db_url_key.removesuffix('_KEY')
+
+    with connection(environment) as conn:
+        print(f"Connection to {db_url_key} established successfully!")
+
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        # Execute the SQL statement to create a table
+        cursor.execute(create_table_sql)
+
+        # Commit the transaction to save changes
         conn.commit()
-        print("Table dropped successfully!")
+        print("Table created successfully!")
+
+        # Optionally, drop the table if necessary
+        if drop_table_sql:
+            cursor.execute(drop_table_sql)
+            conn.commit()
+            print("Table dropped successfully!")
 
-    # Close the cursor and connection
-    cursor.close()
-    conn.close()
+        # Close the cursor, the connection goes back to the pool
+        cursor.close()
 
 # Function to create staging table
 def create_staging_table():
@@ -56,8 +46,8 @@ def create_staging_table():
             address_port INT,
             original_message_id VARCHAR(255),
             raw_message TEXT
-        );
-    """
+        ) PARTITION BY RANGE (datetime);
+    """ + partitioning_sql('raw_messages')
     drop_table_sql = "" # DROP TABLE IF EXISTS raw_messages; Optional table drop logic
     manage_database("STAGING_KEY", create_table_sql, drop_table_sql)
 
@@ -81,8 +71,8 @@ def create_production_table():
             ut_date DECIMAL,
             mag_var_d DECIMAL,
             mag_var_dir CHAR(1)
-        );
-    """
+        ) PARTITION BY RANGE (datetime);
+    """ + partitioning_sql('raw_messages_cleaned')
     drop_table_sql = "" # DROP TABLE IF EXISTS raw_messages_cleaned;  Optional table drop logic
     manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
 
@@ -135,12 +125,206 @@ def create_production_table_2():
             city_name VARCHAR(255),
             station_id VARCHAR(255),
             timezone VARCHAR(255)
+        ) PARTITION BY RANGE (datetime);
+    """ + partitioning_sql('raw_messages_cleaned_weather')
+    drop_table_sql = "" # DROP TABLE IF EXISTS raw_messages_cleaned_weather;   Optional table drop logic
+    manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
+
+# Function to create the table holding the incremental load high-water mark of every device
+def create_watermark_table():
+    create_table_sql = """
+        CREATE TABLE IF NOT EXISTS etl_watermarks (
+            device_id VARCHAR(255) PRIMARY KEY,
+            last_datetime TIMESTAMP NOT NULL,
+            last_original_message_id VARCHAR(255) NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
         );
     """
-    drop_table_sql = "" # DROP TABLE IF EXISTS raw_messages_cleaned_weather;   Optional table drop logic
+    drop_table_sql = "" # DROP TABLE IF EXISTS etl_watermarks;   Optional table drop logic
     manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
 
-if __name__ == "__main__":
+# Function to create the rollup tables that clean_data_db_insert.py keeps up to date for the API
+def create_rollup_tables():
+    create_table_sql = """
+        CREATE TABLE IF NOT EXISTS device_hourly_speed (
+            device_id VARCHAR(255),
+            hour TIMESTAMP,
+            message_count BIGINT NOT NULL,
+            avg_speed DOUBLE PRECISION,
+            min_speed DOUBLE PRECISION,
+            max_speed DOUBLE PRECISION,
+            first_datetime TIMESTAMP NOT NULL,
+            last_datetime TIMESTAMP NOT NULL,
+            PRIMARY KEY (device_id, hour)
+        );
+
+        CREATE TABLE IF NOT EXISTS device_daily_wind (
+            device_id VARCHAR(255),
+            day DATE,
+            observation_count BIGINT NOT NULL,
+            min_wind_spd DOUBLE PRECISION,
+            max_wind_spd DOUBLE PRECISION,
+            PRIMARY KEY (device_id, day)
+        );
+
+        CREATE TABLE IF NOT EXISTS devices (
+            device_id VARCHAR(255) PRIMARY KEY,
+            first_datetime TIMESTAMP NOT NULL,
+            last_datetime TIMESTAMP NOT NULL,
+            message_count BIGINT NOT NULL
+        );
+    """
+    drop_table_sql = "" # DROP TABLE IF EXISTS device_hourly_speed, device_daily_wind, devices;   Optional table drop logic
+    manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
+
+# Function to create the table of the compressed tracks of every ship, see trajectory.py. It holds the messages that
+# are kept of each ship's track with their weather, with signed coordinates.
+def create_track_table():
+    create_table_sql = """
+        CREATE TABLE IF NOT EXISTS device_tracks (
+            device_id VARCHAR(255),
+            datetime TIMESTAMP,
+            original_message_id VARCHAR(255),
+            lat DOUBLE PRECISION,
+            lon DOUBLE PRECISION,
+            speed_over_ground_d DOUBLE PRECISION,
+            true_course DOUBLE PRECISION,
+            temp REAL,
+            wind_spd REAL,
+            rh REAL,
+            weather_description VARCHAR(255),
+            city_name VARCHAR(255),
+            timezone VARCHAR(255)
+        ) PARTITION BY RANGE (datetime);
+    """ + partitioning_sql('device_tracks')
+    drop_table_sql = "" # DROP TABLE IF EXISTS device_tracks;   Optional table drop logic
+    manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
+
+# Function to create the manifest of the CSV files staging_ingest.py loaded into staging. A file is known by the hash
+# of its contents; byte_offset is where the next chunk starts in its CSV data (decompressed, for a compressed file,
+# file_bytes is its size on disk), so an interrupted load resumes there.
+def create_ingest_manifest_table():
+    create_table_sql = """
+        CREATE TABLE IF NOT EXISTS staging_ingest_manifest (
+            file_hash VARCHAR(64) PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            file_bytes BIGINT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            rows_read BIGINT NOT NULL,
+            rows_new BIGINT NOT NULL,
+            rows_rejected BIGINT NOT NULL,
+            completed_at TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """
+    drop_table_sql = "" # DROP TABLE IF EXISTS staging_ingest_manifest;   Optional table drop logic
+    manage_database("STAGING_KEY", create_table_sql, drop_table_sql)
+
+# Function to create the log of the hours every load changed, app.py refreshes its data from it
+def create_change_log_table():
+    create_table_sql = """
+        CREATE TABLE IF NOT EXISTS etl_changes (
+            change_id BIGSERIAL PRIMARY KEY,
+            device_ids TEXT[] NOT NULL,
+            hours TIMESTAMP[] NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """
+    drop_table_sql = "" # DROP TABLE IF EXISTS etl_changes;   Optional table drop logic
+    manage_database("PRODUCTION_KEY", create_table_sql, drop_table_sql)
+
+# Function to migrate the DECIMAL columns of the production message tables to floating point types, so values are
+# read and written without converting every one of them from and to a decimal number. Positions, speeds and
+# timestamps become DOUBLE PRECISION, the weather observations REAL (float32 in app.py, see typed_fetch.py).
+def migrate_float_columns():
+    migrate_sql = """
+        ALTER TABLE raw_messages_cleaned
+            ALTER COLUMN latitude TYPE DOUBLE PRECISION,
+            ALTER COLUMN longitude TYPE DOUBLE PRECISION,
+            ALTER COLUMN speed_over_ground_d TYPE DOUBLE PRECISION,
+            ALTER COLUMN true_course TYPE DOUBLE PRECISION,
+            ALTER COLUMN ut_date TYPE DOUBLE PRECISION,
+            ALTER COLUMN mag_var_d TYPE DOUBLE PRECISION;
+
+        ALTER TABLE raw_messages_cleaned_weather
+            ALTER COLUMN lat TYPE DOUBLE PRECISION,
+            ALTER COLUMN lon TYPE DOUBLE PRECISION,
+            ALTER COLUMN speed_over_ground_d TYPE DOUBLE PRECISION,
+            ALTER COLUMN true_course TYPE DOUBLE PRECISION,
+            ALTER COLUMN ut_date TYPE DOUBLE PRECISION,
+            ALTER COLUMN mag_var_d TYPE DOUBLE PRECISION,
+            ALTER COLUMN ts TYPE DOUBLE PRECISION,
+            ALTER COLUMN rh TYPE REAL,
+            ALTER COLUMN wind_spd TYPE REAL,
+            ALTER COLUMN slp TYPE REAL,
+            ALTER COLUMN vis TYPE REAL,
+            ALTER COLUMN solar_rad TYPE REAL,
+            ALTER COLUMN pres TYPE REAL,
+            ALTER COLUMN h_angle TYPE REAL,
+            ALTER COLUMN dewpt TYPE REAL,
+            ALTER COLUMN snow TYPE REAL,
+            ALTER COLUMN uv TYPE REAL,
+            ALTER COLUMN elev_angle TYPE REAL,
+            ALTER COLUMN wind_dir TYPE REAL,
+            ALTER COLUMN ghi TYPE REAL,
+            ALTER COLUMN dhi TYPE REAL,
+            ALTER COLUMN dni TYPE REAL,
+            ALTER COLUMN azimuth TYPE REAL,
+            ALTER COLUMN temp TYPE REAL,
+            ALTER COLUMN precip TYPE REAL,
+            ALTER COLUMN clouds TYPE REAL;
+    """
+    manage_database("PRODUCTION_KEY", migrate_sql)
+
+# Function to run a function of partitions.py on every partitioned message table in one transaction per database,
+# returning what it returned per table
+def manage_partitions(function, *args):
+    results = {}
+    for environment, table_names in PARTITIONED_TABLES.items():
+        with connection(environment) as conn:
+            cursor = conn.cursor()
+            for table_name in table_names:
+                results[table_name] = function(cursor, table_name, *args)
+            conn.commit()
+            cursor.close()
+    return results
+
+# Function to turn message tables created before they were partitioned into partitioned ones, keeping their rows.
+# Runs before the tables are created, so databases set up by an older version of this script are migrated in place.
+def migrate_partitioned_tables():
+    for table_name, migrated in manage_partitions(migrate_to_partitioned).items():
+        if migrated:
+            print(f"{table_name} migrated to daily partitions")
+
+# Command line of the script, also run by `ships db create`
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the staging and production tables.")
+    parser.add_argument("--migrate-float-columns", action="store_true",
+                        help="Also change the DECIMAL columns of the production message tables to DOUBLE PRECISION/REAL")
+    parser.add_argument("--partition-days-ahead", type=int, default=7,
+                        help="Create the daily partitions of the message tables for today and this many days ahead")
+    parser.add_argument("--retention-days", type=int, default=None,
+                        help="Drop the daily partitions of the message tables older than this many days")
+    args = parser.parse_args(argv)
+
+    migrate_partitioned_tables()
     create_staging_table()
+    create_ingest_manifest_table()
     create_production_table()
     create_production_table_2()
+    create_watermark_table()
+    create_rollup_tables()
+    create_track_table()
+    create_change_log_table()
+    if args.migrate_float_columns:
+        migrate_float_columns()
+    for table_name, created in manage_partitions(create_future_partitions, args.partition_days_ahead).items():
+        print(f"{table_name}: created {len(created)} partitions ahead")
+    if args.retention_days is not None:
+        for table_name, dropped in manage_partitions(drop_expired_partitions, args.retention_days).items():
+            print(f"{table_name}: dropped {len(dropped)} expired partitions")
+    close_pools()
+
+
+if __name__ == "__main__":
+    main()
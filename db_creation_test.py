@@ -1,10 +1,13 @@
+import re
 import unittest
 from unittest.mock import patch, MagicMock
-from db_creation import create_staging_table, create_production_table, create_production_table_2, manage_database
+from typed_fetch import FLOAT32_COLUMNS
+from trajectory import TRACK_COLUMNS
+from db_creation import create_staging_table, create_production_table, create_production_table_2, create_watermark_table, create_rollup_tables, create_track_table, create_change_log_table, create_ingest_manifest_table, migrate_float_columns, manage_database
 
 class DBCreationTestCase(unittest.TestCase):
     
-    @patch('db_creation.psycopg2.connect')
+    @patch('db_connection.psycopg2.connect')
     def test_manage_database_create_table(self, mock_connect):
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -44,12 +47,67 @@ class DBCreationTestCase(unittest.TestCase):
         # Test if the correct SQL statement is passed for production table creation
         create_production_table()
         mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+        # The table is partitioned by day, its key has to include the partition column
+        create_table_sql = mock_manage_db.call_args.args[1]
+        self.assertIn("PARTITION BY RANGE (datetime)", create_table_sql)
+        self.assertIn("(device_id, original_message_id, datetime)", create_table_sql)
 
     @patch('db_creation.manage_database')
     def test_create_production_table_2(self, mock_manage_db):
         # Test if the correct SQL statement is passed for production table 2 creation
         create_production_table_2()
         mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+
+    @patch('db_creation.manage_database')
+    def test_create_watermark_table(self, mock_manage_db):
+        # Test if the watermark table is created in production
+        create_watermark_table()
+        mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+        self.assertIn("etl_watermarks", mock_manage_db.call_args.args[1])
+
+    @patch('db_creation.manage_database')
+    def test_create_rollup_tables(self, mock_manage_db):
+        # Test if the rollup tables are created in production with their primary keys
+        create_rollup_tables()
+        mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+        create_table_sql = mock_manage_db.call_args.args[1]
+        self.assertIn("PRIMARY KEY (device_id, hour)", create_table_sql)
+        self.assertIn("PRIMARY KEY (device_id, day)", create_table_sql)
+        self.assertIn("devices", create_table_sql)
+
+    @patch('db_creation.manage_database')
+    def test_create_track_table(self, mock_manage_db):
+        # Test if the track table is partitioned by day and has the columns trajectory.py copies into it, in order
+        create_track_table()
+        mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+        create_table_sql = mock_manage_db.call_args.args[1]
+        self.assertIn("PARTITION BY RANGE (datetime)", create_table_sql)
+        columns = re.findall(r"^\s+([a-z_]+) [A-Z]", create_table_sql.split("PARTITION BY")[0], re.MULTILINE)
+        self.assertEqual(columns, TRACK_COLUMNS)
+
+    @patch('db_creation.manage_database')
+    def test_create_change_log_table(self, mock_manage_db):
+        # Test if the change log is created in production
+        create_change_log_table()
+        mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY, "")
+        self.assertIn("etl_changes", mock_manage_db.call_args.args[1])
+
+    @patch('db_creation.manage_database')
+    def test_create_ingest_manifest_table(self, mock_manage_db):
+        # Test if the manifest is created in staging, next to the rows it records, keyed by the hash of a file
+        create_ingest_manifest_table()
+        mock_manage_db.assert_called_with("STAGING_KEY", unittest.mock.ANY, "")
+        self.assertIn("file_hash VARCHAR(64) PRIMARY KEY", mock_manage_db.call_args.args[1])
+
+    @patch('db_creation.manage_database')
+    def test_migrate_float_columns(self, mock_manage_db):
+        # Test if exactly the columns app.py keeps as float32 become REAL
+        migrate_float_columns()
+        mock_manage_db.assert_called_with("PRODUCTION_KEY", unittest.mock.ANY)
+        migrate_sql = mock_manage_db.call_args.args[1]
+        real_columns = re.findall(r"ALTER COLUMN (\w+) TYPE REAL", migrate_sql)
+        self.assertEqual(sorted(real_columns), sorted(FLOAT32_COLUMNS))
+        self.assertIn("ALTER COLUMN ts TYPE DOUBLE PRECISION", migrate_sql)
     
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+
+# Rows of a DataFrame grouped per device and sorted by time, built once so that selecting one device over a time
+# range is a dictionary lookup plus a binary search instead of a scan over every row.
+# Rows without a time are left out of the index.
+class DeviceTimeIndex:
+
+    def __init__(self, df, time_column, device_column='device_id'):
+        times = pd.to_datetime(df[time_column])
+        if times.isna().any():
+            df = df[times.notna().to_numpy()]
+            times = times[times.notna()]
+        times = times.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        codes, devices = pd.factorize(df[device_column])
+
+        # One sort makes every device's rows contiguous and in time order, rows that already are (like the
+        # columnar snapshot) are used without copying them
+        order = np.lexsort((times, codes))
+        if (order == np.arange(len(order))).all():
+            self.df = df.reset_index(drop=True)
+        else:
+            self.df = df.iloc[order].reset_index(drop=True)
+        self._times = times[order]
+        starts = np.searchsorted(codes[order], np.arange(len(devices) + 1))
+        self._bounds = {device: (starts[i], starts[i + 1]) for i, device in enumerate(devices)}
+
+    def __contains__(self, device_id):
+        return device_id in self._bounds
+
+    # Devices present in the index
+    def devices(self):
+        return list(self._bounds)
+
+    # Positions [first, last) in df of the rows of one device with start <= time < end,
+    # either bound may be None to leave that side open
+    def positions(self, device_id, start=None, end=None):
+        if device_id not in self._bounds:
+            return 0, 0
+        first, last = self._bounds[device_id]
+        device_times = self._times[first:last]
+        lower = 0 if start is None else np.searchsorted(device_times, pd.Timestamp(start).as_unit('ns').value)
+        upper = len(device_times) if end is None else np.searchsorted(device_times, pd.Timestamp(end).as_unit('ns').value)
+        return first + lower, first + max(lower, upper)
+
+    # Rows of one device with start <= time < end, either bound may be None to leave that side open
+    def rows(self, device_id, start=None, end=None):
+        first, last = self.positions(device_id, start, end)
+        return self.df.iloc[first:last]
@@ -0,0 +1,75 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from device_index import DeviceTimeIndex
+
+# Number of (ship, date) lookups timed per approach and size
+QUERIES = 20
+
+
+# Synthetic raw_messages_cleaned_weather with only the columns the weather_conditions endpoint reads.
+# The text columns are categorical so that 50M rows still fit in memory.
+def make_messages(n_rows, n_ships, n_days, rng):
+    def categorical(values):
+        return pd.Categorical.from_codes(rng.integers(0, len(values), n_rows, dtype=np.int16), values)
+
+    return pd.DataFrame({
+        'device_id': categorical([f"ship-{i}" for i in range(n_ships)]),
+        'datetime': pd.Timestamp('2019-02-01') + pd.to_timedelta(rng.integers(0, n_days * 86400, n_rows), unit='s'),
+        'temp': rng.normal(5, 3, n_rows),
+        'wind_spd': rng.uniform(0, 12, n_rows),
+        'rh': rng.uniform(40, 100, n_rows),
+        'weather_description': categorical(['Overcast clouds', 'Light rain']),
+        'city_name': categorical(['Rotterdam', 'Amsterdam', 'Antwerpen', 'Vlissingen']),
+        'timezone': categorical(['Europe/Amsterdam'])
+    })
+
+
+# The previous endpoint filter: boolean masks over every row, with a date object per row
+def filter_with_masks(df, device_id, date):
+    requested_date = pd.to_datetime(date).date()
+    return df[
+        (df['device_id'] == device_id) &
+        (df['datetime'].dt.date == requested_date) &
+        (~df['datetime'].isnull())
+    ]
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000000, 50000000]
+    rng = np.random.default_rng(42)
+
+    print(f"{'rows':>10} {'index build (s)':>16} {'masks (ms/query)':>17} {'index (ms/query)':>17} {'speedup':>8}")
+    for n_rows in sizes:
+        df = make_messages(n_rows, n_ships=1000, n_days=30, rng=rng)
+        queries = [(f"ship-{rng.integers(1000)}", pd.Timestamp('2019-02-01') + pd.Timedelta(days=int(rng.integers(30))))
+                   for _ in range(QUERIES)]
+
+        start = time.perf_counter()
+        index = DeviceTimeIndex(df, 'datetime')
+        build_time = time.perf_counter() - start
+
+        # The index holds a sorted copy of the rows, the masks run over that copy to keep one frame in memory
+        del df
+        df = index.df
+
+        # The masks are slow enough at scale that a few lookups give a stable number
+        mask_queries = queries[:3] if n_rows > 10000000 else queries
+        start = time.perf_counter()
+        for device_id, date in mask_queries:
+            filter_with_masks(df, device_id, date)
+        mask_ms = (time.perf_counter() - start) / len(mask_queries) * 1000
+
+        start = time.perf_counter()
+        for device_id, date in queries:
+            rows = len(index.rows(device_id, date, date + pd.Timedelta(days=1)))
+        index_ms = (time.perf_counter() - start) / len(queries) * 1000
+        assert rows == len(filter_with_masks(df, *queries[-1]))
+
+        print(f"{n_rows:>10} {build_time:>16.2f} {mask_ms:>17.1f} {index_ms:>17.3f} {mask_ms / index_ms:>7.0f}x")
+        del df, index
+
+
+if __name__ == "__main__":
+    main()
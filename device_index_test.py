@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+import pandas as pd
+from device_index import DeviceTimeIndex
+
+class DeviceTimeIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Messages of two ships out of time order, one without a datetime
+        self.messages_df = pd.DataFrame({
+            'device_id': ['st-1a2090', '0001', 'st-1a2090', 'st-1a2090', '0001', 'st-1a2090'],
+            'datetime': pd.to_datetime([
+                '2019-02-13 15:00', '2019-02-13 14:00', '2019-02-13 14:30', '2019-02-14 01:00', '2019-02-12 23:59', None
+            ]),
+            'temp': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+        })
+        self.index = DeviceTimeIndex(self.messages_df, 'datetime')
+
+    def test_rows_of_device_in_time_order(self):
+        # Test that all rows of a ship come back sorted by time, without the row that has no datetime
+        result_df = self.index.rows('st-1a2090')
+        self.assertEqual(list(result_df['temp']), [3.0, 1.0, 4.0])
+
+    def test_sorted_rows_are_not_copied(self):
+        # Test that rows already in (device, time) order are indexed without copying them
+        sorted_df = self.index.df
+        index = DeviceTimeIndex(sorted_df, 'datetime')
+        self.assertTrue(np.shares_memory(index.df['temp'].to_numpy(), sorted_df['temp'].to_numpy()))
+        self.assertEqual(list(index.rows('st-1a2090')['temp']), [3.0, 1.0, 4.0])
+
+    def test_rows_in_range(self):
+        # Test that the range includes its start and excludes its end
+        result_df = self.index.rows('st-1a2090', pd.Timestamp('2019-02-13 14:30'), pd.Timestamp('2019-02-14'))
+        self.assertEqual(list(result_df['temp']), [3.0, 1.0])
+
+        result_df = self.index.rows('0001', start=pd.Timestamp('2019-02-13'))
+        self.assertEqual(list(result_df['temp']), [2.0])
+
+        result_df = self.index.rows('0001', end=pd.Timestamp('2019-02-13'))
+        self.assertEqual(list(result_df['temp']), [5.0])
+
+    def test_rows_match_masks(self):
+        # Test against filtering the whole frame with boolean masks
+        for device_id in ['st-1a2090', '0001']:
+            for date in pd.to_datetime(['2019-02-12', '2019-02-13', '2019-02-14']):
+                expected_df = self.messages_df[
+                    (self.messages_df['device_id'] == device_id) &
+                    (self.messages_df['datetime'].dt.date == date.date())
+                ].sort_values('datetime')
+                result_df = self.index.rows(device_id, date, date + pd.Timedelta(days=1))
+                self.assertEqual(list(result_df['temp']), list(expected_df['temp']))
+
+    def test_unknown_device_and_empty_range(self):
+        # Test that an unknown ship or an inverted range gives no rows but keeps the columns
+        self.assertNotIn('unknown', self.index)
+        self.assertEqual(len(self.index.rows('unknown')), 0)
+        result_df = self.index.rows('st-1a2090', pd.Timestamp('2019-02-14'), pd.Timestamp('2019-02-13'))
+        self.assertEqual(len(result_df), 0)
+        self.assertEqual(list(result_df.columns), list(self.messages_df.columns))
+
+    def test_date_column(self):
+        # Test with a column of date objects like the daily rollup has
+        daily_df = pd.DataFrame({
+            'device_id': ['0001', '0001'],
+            'day': [pd.Timestamp('2019-02-14').date(), pd.Timestamp('2019-02-13').date()],
+            'max_wind_spd': [4.0, 5.0]
+        })
+        index = DeviceTimeIndex(daily_df, 'day')
+        self.assertEqual(list(index.rows('0001', pd.Timestamp('2019-02-14'))['max_wind_spd']), [4.0])
+        self.assertEqual(index.devices(), ['0001'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,114 +1,69 @@
-import re
-import os
-import psycopg2
 import pandas as pd
-from urllib.parse import urlparse
-from dotenv import load_dotenv
+from db_connection import connection, cursor
+from message_parser import robust_clean_raw_message
 
 
-# Function to connect to the database and fetch data
-def fetch_data_from_db(query, environment):
+# Function to fetch the result of a query into a DataFrame, on a pooled connection
+def fetch_data_from_db(query, environment, params=None):
 
-    load_dotenv()
-    if environment == "STAGING":
-        # Fetch the database URL from the .env file
-        URL = os.getenv("STAGING_KEY")
-    else:
-        URL = os.getenv("PRODUCTION_KEY")
+    with connection(environment) as conn:
+        # Fetch the data into a pandas DataFrame
+        raw_messages_df = pd.read_sql(query, conn, params=params)
+    
+    return raw_messages_df
 
-    # Parse the URL to extract connection parameters
-    url = urlparse(URL)
 
-    conn_params = {
-        'dbname': url.path[1:],    # Extracts the database name after '/'
-        'user': url.username,       # Extracts the username
-        'password': url.password,   # Extracts the password
-        'host': url.hostname,       # Extracts the host
-        'port': url.port            # Extracts the port
-    }
+# Function to stream the result of a query as DataFrames of at most batch_size rows
+def fetch_data_in_batches(query, environment, batch_size, params=None):
 
-    # Establish a connection to the database
-    conn = psycopg2.connect(**conn_params)
-    
-    # Fetch the data into a pandas DataFrame
-    raw_messages_df = pd.read_sql(query, conn)
-    
-    # Close the connection
-    conn.close()
-    
-    return raw_messages_df
+    # A named cursor is a server-side cursor: the result set stays in the database and
+    # only batch_size rows are shipped per round trip. The connection goes back to the pool
+    # when the results run out, also when the consumer stops early.
+    with cursor(environment, name="fetch_data_in_batches") as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
 
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = [column[0] for column in cur.description]
+            yield pd.DataFrame(rows, columns=columns)
 
-# Cleaning function with more robust error handling
-def robust_clean_raw_message(message):
-    # Remove any characters that are not part of a basic valid set (alphanumeric, commas, dots, and basic direction letters)
-    clean_message = re.sub(r'[^A-Za-z0-9.,NSWE]', '', message)
-    
-    # Split the cleaned message by commas
-    parts = clean_message.split(',')
-    
-    # Basic validation: latitude and longitude should be present (at least 7 fields to attempt extraction)
-    if len(parts) >= 7:
-        # Attempt to extract latitude, longitude, and speed fields even if minor noise is present
-        try:
-            data_status = parts[0]  # 'A' or 'V'
-            latitude = float(parts[1])  # Latitude as a float
-            latitude_dir = parts[2]  # 'N' or 'S'
-            longitude = float(parts[3])  # Longitude as a float
-            longitude_dir = parts[4]  # 'E' or 'W'
-            speed_over_ground_d = float(parts[5])  # Speed over ground
-            true_course = float(parts[6])  # Track made good (degrees True)
-            ut_date = float(parts[7])
-            mag_var_d = float(parts[8])
-            mag_var_dir = parts[9]
-
-            # Reconstruct a clean message with the necessary fields
-            return {
-                'data_status': data_status,
-                'latitude': latitude,
-                'latitude_direction': latitude_dir,
-                'longitude': longitude,
-                'longitude_direction': longitude_dir,
-                'speed_over_ground_d': speed_over_ground_d,
-                'true_course': true_course,
-                'ut_date': ut_date,
-                'mag_var_d': mag_var_d,
-                'mag_var_dir': mag_var_dir
-            }
-        except (ValueError, IndexError):
-            # If there's any issue with conversion or missing data, return None (invalid message)
-            return None
-    else:
-        return None
-    
 
-# Fetch the data and store it in a DataFrame
-raw_messages_df = fetch_data_from_db(query="SELECT * FROM raw_messages;", environment="STAGING")
+# Explores the staging table, only when run as a script: the fetch helpers above are imported by the ETL and the API
+def main():
+    # Fetch the data and store it in a DataFrame
+    raw_messages_df = fetch_data_from_db(query="SELECT * FROM raw_messages;", environment="STAGING")
+
+    # Check for overall data information
+    raw_messages_info = raw_messages_df.info()
+    raw_messages_head = raw_messages_df.head()
+
+    print(raw_messages_info, '\n', raw_messages_head)
 
-# Check for overall data information
-raw_messages_info = raw_messages_df.info()
-raw_messages_head = raw_messages_df.head()
+    # Check for missing values in the dataset
+    missing_values = raw_messages_df.isnull().sum()
 
-print(raw_messages_info, '\n', raw_messages_head)
+    # Convert Unix timestamps to a readable datetime format
+    raw_messages_df['datetime'] = pd.to_datetime(pd.to_numeric(raw_messages_df['datetime']), unit='s')
 
-# Check for missing values in the dataset
-missing_values = raw_messages_df.isnull().sum()
+    # Explore the distribution of device IDs
+    device_id_counts = raw_messages_df['device_id'].value_counts()
+    print(missing_values, '\n', raw_messages_df['datetime'].head(), '\n', device_id_counts.head())
 
-# Convert Unix timestamps to a readable datetime format
-raw_messages_df['datetime'] = pd.to_datetime(raw_messages_df['datetime'], unit='s')
+    # Apply the robust cleaning function
+    raw_messages_df['cleaned_message'] = raw_messages_df['raw_message'].apply(robust_clean_raw_message)
 
-# Explore the distribution of device IDs
-device_id_counts = raw_messages_df['device_id'].value_counts()
-print(missing_values, '\n', raw_messages_df['datetime'].head(), '\n', device_id_counts.head())
+    # Check the first few successfully cleaned rows
+    cleaned_sample_robust = raw_messages_df[['raw_message', 'cleaned_message']].head(10)
 
-# Apply the robust cleaning function
-raw_messages_df['cleaned_message'] = raw_messages_df['raw_message'].apply(robust_clean_raw_message)
+    # Count how many messages were successfully cleaned now
+    valid_messages_count_robust = raw_messages_df['cleaned_message'].notnull().sum()
+    invalid_messages_count_robust = raw_messages_df['cleaned_message'].isnull().sum()
 
-# Check the first few successfully cleaned rows
-cleaned_sample_robust = raw_messages_df[['raw_message', 'cleaned_message']].head(10)
+    print(cleaned_sample_robust, valid_messages_count_robust, invalid_messages_count_robust)
 
-# Count how many messages were successfully cleaned now
-valid_messages_count_robust = raw_messages_df['cleaned_message'].notnull().sum()
-invalid_messages_count_robust = raw_messages_df['cleaned_message'].isnull().sum()
 
-print(cleaned_sample_robust, valid_messages_count_robust, invalid_messages_count_robust)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
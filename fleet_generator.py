@@ -0,0 +1,263 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# Area the ships sail in and the stations are spread over, around the bundled data (lat/lon in degrees)
+AREA = {'lat_min': 51.3, 'lat_max': 52.0, 'lon_min': 4.0, 'lon_max': 6.0}
+
+# The first generated ship is the one app.py answers about by default
+DEFAULT_DEVICE_ID = 'st-1a2090'
+DEFAULT_START = '2019-02-13'
+
+# Pairs of collectors, every ship reports to the first one and duplicates arrive through the second one
+COLLECTOR_PAIRS = [('172.19.0.17', '172.19.0.16'), ('172.23.0.1', '172.24.0.1'), ('172.18.0.14', '172.18.0.17')]
+COLLECTOR_PORT = 4007
+
+# Characters the collectors scatter through the messages, robust_clean_raw_message strips all of them
+NOISE_CHARACTERS = list('$%&@*#!')
+
+# The original message ids are millisecond timestamps an hour ahead of the datetime column, like the bundled data
+MESSAGE_ID_OFFSET_MS = 3600 * 1000
+
+# Conditions the stations report, as (icon, code, description)
+WEATHER_CONDITIONS = [
+    ('c01d', 800, 'Clear sky'), ('c02d', 801, 'Few clouds'), ('c03d', 803, 'Broken clouds'),
+    ('c04n', 804, 'Overcast clouds'), ('r01d', 500, 'Light rain'), ('a05n', 741, 'Fog')
+]
+
+KM_PER_DEGREE = 111.2
+KM_PER_NAUTICAL_MILE = 1.852
+
+
+# Function to simulate the tracks of n_ships over the given times: every ship switches between lying moored (speed
+# 0.0 and the same coordinates on every message) and sailing a wandering course, bouncing off the area's edges.
+# Returns arrays of shape (steps, n_ships).
+def simulate_tracks(n_ships, n_steps, interval_seconds, rng, mean_leg_seconds=7200):
+    lat = rng.uniform(AREA['lat_min'], AREA['lat_max'], n_ships)
+    lon = rng.uniform(AREA['lon_min'], AREA['lon_max'], n_ships)
+    course = rng.uniform(0, 360, n_ships)
+    sailing = rng.random(n_ships) < 0.5
+    cruise_speed = rng.uniform(6, 14, n_ships)
+    switch_probability = min(1.0, interval_seconds / mean_leg_seconds)
+
+    lats, lons, speeds, courses = (np.empty((n_steps, n_ships)) for _ in range(4))
+    for step in range(n_steps):
+        sailing ^= rng.random(n_ships) < switch_probability
+        speed = np.where(sailing, np.round(np.maximum(cruise_speed + rng.normal(0, 1, n_ships), 0.1), 1), 0.0)
+        course = np.where(sailing, (course + rng.normal(0, 5, n_ships)) % 360, course)
+
+        distance_km = speed * KM_PER_NAUTICAL_MILE * interval_seconds / 3600
+        lat = lat + distance_km * np.cos(np.radians(course)) / KM_PER_DEGREE
+        lon = lon + distance_km * np.sin(np.radians(course)) / (KM_PER_DEGREE * np.cos(np.radians(lat)))
+        # Turn around at the edges of the area
+        outside_lat = (lat < AREA['lat_min']) | (lat > AREA['lat_max'])
+        outside_lon = (lon < AREA['lon_min']) | (lon > AREA['lon_max'])
+        course = np.where(outside_lat, (180 - course) % 360, course)
+        course = np.where(outside_lon, (360 - course) % 360, course)
+        lat = np.clip(lat, AREA['lat_min'], AREA['lat_max'])
+        lon = np.clip(lon, AREA['lon_min'], AREA['lon_max'])
+
+        lats[step], lons[step], speeds[step], courses[step] = lat, lon, speed, np.round(course, 2)
+    return lats, lons, speeds, courses
+
+
+# Function to damage messages the way robust_clean_raw_message has to reject them: cut short, missing the magnetic
+# variation, or with a letter in a number (which the noise stripping keeps)
+def corrupt_message(message, rng):
+    fields = message.split(',')
+    kind = rng.integers(3)
+    if kind == 0:
+        return ','.join(fields[:5])
+    if kind == 1:
+        return ','.join(fields[:8])
+    fields[1] = fields[1][:3] + 'X' + fields[1][3:]
+    return ','.join(fields)
+
+
+# Function to scatter 1 to 4 noise characters through a message
+def add_noise(message, rng):
+    for _ in range(rng.integers(1, 5)):
+        position = rng.integers(len(message) + 1)
+        message = message[:position] + NOISE_CHARACTERS[rng.integers(len(NOISE_CHARACTERS))] + message[position:]
+    return message
+
+
+# Ids of the generated ships, the first one is the default ship of app.py
+def device_ids(n_ships, rng):
+    ids = [DEFAULT_DEVICE_ID]
+    while len(ids) < n_ships:
+        device_id = f"st-{rng.integers(1 << 24):06x}"
+        if device_id not in ids:
+            ids.append(device_id)
+    return ids[:n_ships]
+
+
+# Function to generate the staging rows of n_ships reporting every interval_seconds (with jitter) for the given
+# number of days, in the columns of data/raw_messages.csv. A duplicate_rate share of the messages also arrives
+# through the second collector a moment later with its own original_message_id, a noise_rate share has noise
+# characters scattered through it and an invalid_rate share cannot be parsed at all.
+# Returns the rows sorted by device and time, and the number of duplicates, noisy and invalid messages.
+def generate_raw_messages(n_ships, days, start=DEFAULT_START, interval_seconds=60, duplicate_rate=0.1,
+                          noise_rate=0.4, invalid_rate=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    n_steps = int(days * 86400 // interval_seconds)
+    lats, lons, speeds, courses = simulate_tracks(n_ships, n_steps, interval_seconds, rng)
+
+    # Receive times in milliseconds, every ship reports at its own jittered moments
+    start_ms = pd.Timestamp(start).value // 10 ** 6
+    offsets = rng.integers(0, interval_seconds * 1000, n_ships)
+    jitter = rng.integers(0, interval_seconds * 500, (n_steps, n_ships))
+    times_ms = start_ms + np.arange(n_steps)[:, None] * interval_seconds * 1000 + offsets + jitter
+
+    ships = np.tile(np.arange(n_ships), n_steps)
+    times_ms = times_ms.ravel()
+    status = np.where(rng.random(len(ships)) < 0.02, 'V', 'A')
+    mag_var = np.round(rng.uniform(0.5, 1.5, n_ships), 1).tolist()
+    ut_dates = pd.to_datetime(times_ms, unit='ms').strftime('%d%m%y')
+    messages = [
+        f"{s},{lat!r},N,{lon!r},E,{speed!r},{course!r},{ut_date},{mag_var[ship]!r},E"
+        for s, lat, lon, speed, course, ut_date, ship in zip(
+            status, lats.ravel().tolist(), lons.ravel().tolist(), speeds.ravel().tolist(),
+            courses.ravel().tolist(), ut_dates, ships.tolist()
+        )
+    ]
+
+    invalid = rng.random(len(messages)) < invalid_rate
+    noisy = rng.random(len(messages)) < noise_rate
+    for i in np.flatnonzero(invalid):
+        messages[i] = corrupt_message(messages[i], rng)
+    for i in np.flatnonzero(noisy):
+        messages[i] = add_noise(messages[i], rng)
+
+    ids = device_ids(n_ships, rng)
+    pairs = [COLLECTOR_PAIRS[ship % len(COLLECTOR_PAIRS)] for ship in range(n_ships)]
+    raw_messages_df = pd.DataFrame({
+        'ship': ships,
+        'time_ms': times_ms,
+        'collector': 0,
+        'raw_message': messages
+    })
+
+    # The same payload delivered again through the other collector of the ship, up to two seconds later
+    duplicates = rng.random(len(raw_messages_df)) < duplicate_rate
+    duplicates_df = raw_messages_df[duplicates].assign(collector=1)
+    duplicates_df['time_ms'] += rng.integers(1, 2000, len(duplicates_df))
+    raw_messages_df = pd.concat([raw_messages_df, duplicates_df], ignore_index=True)
+    raw_messages_df = raw_messages_df.sort_values(['ship', 'time_ms'], kind='stable').reset_index(drop=True)
+
+    ship, collector = raw_messages_df['ship'].to_numpy(), raw_messages_df['collector'].to_numpy()
+    raw_messages_df = pd.DataFrame({
+        'device_id': np.array(ids, dtype=object)[ship],
+        'datetime': (raw_messages_df['time_ms'] // 1000).astype(str),
+        'address_ip': [pairs[s][c] for s, c in zip(ship.tolist(), collector.tolist())],
+        'address_port': str(COLLECTOR_PORT),
+        'original_message_id': (raw_messages_df['time_ms'] + MESSAGE_ID_OFFSET_MS).astype(str) + '-0',
+        'raw_message': raw_messages_df['raw_message']
+    })
+    counts = {'duplicates': int(duplicates.sum()), 'noisy': int(noisy.sum()), 'invalid': int(invalid.sum())}
+    return raw_messages_df, counts
+
+
+# Function to generate hourly observations of n_stations weather stations over the given days (plus the hour after
+# the last one), in the structure of data/weather_data.json
+def generate_weather_stations(n_stations, days, start=DEFAULT_START, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    hours = pd.date_range(pd.Timestamp(start), periods=int(days * 24) + 1, freq='h')
+    hour_of_day = hours.hour.to_numpy()
+    # Sun above the horizon between 8 and 17 in February, highest at noon
+    daylight = np.clip(np.sin((hour_of_day - 7.5) / 10 * np.pi), 0, None)
+
+    stations = []
+    for i in range(n_stations):
+        lat = float(rng.uniform(AREA['lat_min'], AREA['lat_max']))
+        lon = float(rng.uniform(AREA['lon_min'], AREA['lon_max']))
+        temp = 4 + 4 * daylight + rng.normal(0, 0.5, len(hours)) + rng.normal(0, 2)
+        wind_spd = np.abs(rng.normal(5, 2) + np.cumsum(rng.normal(0, 0.5, len(hours))))
+        conditions = rng.integers(len(WEATHER_CONDITIONS), size=len(hours))
+
+        data = []
+        for h, hour in enumerate(hours):
+            icon, code, description = WEATHER_CONDITIONS[conditions[h]]
+            solar = round(float(daylight[h] * 300), 1)
+            data.append({
+                'rh': int(rng.integers(60, 100)),
+                'wind_spd': round(float(wind_spd[h]), 1),
+                'timestamp_utc': hour.strftime('%Y-%m-%dT%H:%M:%S'),
+                'slp': round(float(1025 + rng.normal(0, 3)), 1),
+                'vis': round(float(rng.uniform(1, 10)), 1),
+                'pod': 'd' if daylight[h] > 0 else 'n',
+                'solar_rad': solar,
+                'pres': round(float(1020 + rng.normal(0, 3)), 1),
+                'h_angle': None,
+                'dewpt': round(float(temp[h] - rng.uniform(0, 4)), 1),
+                'snow': 0,
+                'uv': round(float(daylight[h] * 2), 1),
+                'elev_angle': round(float(daylight[h] * 75 - 40), 2),
+                'wind_dir': int(rng.integers(360)),
+                'weather': {'icon': icon, 'code': code, 'description': description},
+                'ghi': solar,
+                'dhi': round(solar * 0.3, 1),
+                'timestamp_local': (hour + pd.Timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S'),
+                'dni': round(solar * 1.5, 1),
+                'azimuth': round(float((hour_of_day[h] * 15 + 180) % 360), 2),
+                'datetime': hour.strftime('%Y-%m-%d:%H'),
+                'temp': round(float(temp[h]), 1),
+                'precip': round(float(rng.exponential(0.2)) if code == 500 else 0.0, 2),
+                'clouds': int(rng.integers(0, 101)),
+                'ts': int(hour.timestamp())
+            })
+        stations.append({
+            'timezone': 'Europe/Amsterdam', 'state_code': '03', 'country_code': 'NL', 'lat': lat, 'lon': lon,
+            'city_name': f"Station {i}", 'station_id': f"{60000 + 10 * i:06d}-99999",
+            'sources': [f"{60000 + 10 * i:06d}-99999"], 'city_id': str(2740000 + i), 'data': data
+        })
+    return stations
+
+
+# Function to write a synthetic fleet to a directory as raw_messages.csv and weather_data.json, returning their
+# paths and what was generated
+def write_fleet(directory, n_ships, days, n_stations, start=DEFAULT_START, interval_seconds=60, duplicate_rate=0.1,
+                noise_rate=0.4, invalid_rate=0.01, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    raw_messages_df, counts = generate_raw_messages(n_ships, days, start, interval_seconds, duplicate_rate,
+                                                    noise_rate, invalid_rate, seed)
+    csv_path = os.path.join(directory, 'raw_messages.csv')
+    raw_messages_df.to_csv(csv_path, index=False)
+
+    stations = generate_weather_stations(n_stations, days, start, seed)
+    json_path = os.path.join(directory, 'weather_data.json')
+    with open(json_path, 'w') as file:
+        json.dump(stations, file)
+
+    return {
+        'raw_messages_path': csv_path,
+        'weather_path': json_path,
+        'ships': n_ships,
+        'days': days,
+        'messages': len(raw_messages_df),
+        **counts,
+        'stations': n_stations,
+        'observations': sum(len(station['data']) for station in stations)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic fleet: raw RMC messages and weather data.")
+    parser.add_argument("directory", help="Directory to write raw_messages.csv and weather_data.json to")
+    parser.add_argument("--ships", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--stations", type=int, default=16)
+    parser.add_argument("--start", default=DEFAULT_START, help="First day of the messages")
+    parser.add_argument("--interval-seconds", type=int, default=60, help="Seconds between two reports of a ship")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1,
+                        help="Share of the messages that arrive a second time through another collector")
+    parser.add_argument("--noise-rate", type=float, default=0.4, help="Share of the messages with noise characters")
+    parser.add_argument("--invalid-rate", type=float, default=0.01, help="Share of the messages that cannot be parsed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = write_fleet(args.directory, args.ships, args.days, args.stations, args.start, args.interval_seconds,
+                          args.duplicate_rate, args.noise_rate, args.invalid_rate, args.seed)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,60 @@
+import os
+import json
+import unittest
+import tempfile
+import pandas as pd
+from fleet_generator import DEFAULT_DEVICE_ID, generate_raw_messages, generate_weather_stations, write_fleet
+from message_parser import robust_clean_raw_message, vectorized_clean_raw_messages
+from weather_loader import parse_weather_json
+
+class FleetGeneratorTestCase(unittest.TestCase):
+
+    def test_generate_raw_messages(self):
+        # Test that the rows look like the staging table and that exactly the corrupted messages are rejected
+        raw_messages_df, counts = generate_raw_messages(3, 0.25, interval_seconds=30, duplicate_rate=0.2,
+                                                        noise_rate=0.5, invalid_rate=0.05, seed=1)
+
+        self.assertEqual(list(raw_messages_df.columns),
+                         ['device_id', 'datetime', 'address_ip', 'address_port', 'original_message_id', 'raw_message'])
+        self.assertEqual(len(raw_messages_df), 3 * 720 + counts['duplicates'])
+        self.assertEqual(raw_messages_df['device_id'].iloc[0], DEFAULT_DEVICE_ID)
+        self.assertEqual(raw_messages_df['device_id'].nunique(), 3)
+        self.assertFalse(raw_messages_df.duplicated(['device_id', 'original_message_id']).any())
+        self.assertTrue(raw_messages_df['raw_message'].str.contains('[$%&@*#!]').any())
+
+        # A duplicate is the same payload of the same ship, received through the other collector
+        duplicated = raw_messages_df.duplicated(['device_id', 'raw_message'], keep=False)
+        self.assertGreater(raw_messages_df[duplicated]['address_ip'].nunique(), 1)
+
+        # Duplicates of invalid messages are rejected too, both parsers agree on every message
+        rejected = raw_messages_df['raw_message'].map(robust_clean_raw_message).isna()
+        self.assertGreaterEqual(rejected.sum(), counts['invalid'])
+        self.assertLess(rejected.sum(), 2 * counts['invalid'] + 1)
+        vectorized_df = vectorized_clean_raw_messages(raw_messages_df['raw_message'])
+        pd.testing.assert_series_equal(vectorized_df['data_status'].isna(), rejected, check_names=False)
+
+    def test_generate_raw_messages_is_reproducible(self):
+        # Test that the same seed gives the same rows
+        first_df, _ = generate_raw_messages(2, 0.1, seed=7)
+        second_df, _ = generate_raw_messages(2, 0.1, seed=7)
+        pd.testing.assert_frame_equal(first_df, second_df)
+
+    def test_write_fleet(self):
+        # Test that the weather file has hourly observations of every station and loads like the bundled one
+        with tempfile.TemporaryDirectory() as directory:
+            summary = write_fleet(directory, 2, 1, 4, seed=3)
+
+            self.assertEqual(summary['observations'], 4 * 25)
+            with open(summary['weather_path'], 'r') as file:
+                stations = json.load(file)
+            self.assertEqual([len(station['data']) for station in stations], [25] * 4)
+            self.assertEqual(stations, generate_weather_stations(4, 1, seed=3))
+
+            weather_df = parse_weather_json(summary['weather_path'])
+            self.assertEqual(len(weather_df), 100)
+            self.assertEqual(weather_df['datetime'].min(), pd.Timestamp('2019-02-13'))
+            self.assertEqual(len(pd.read_csv(summary['raw_messages_path'])), summary['messages'])
+            self.assertTrue(os.path.exists(summary['raw_messages_path']))
+
+if __name__ == '__main__':
+    unittest.main()
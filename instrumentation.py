@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+# Run reports of the ETL scripts are written here as JSON, one file per run
+RUN_REPORT_DIR = os.getenv(
+    'RUN_REPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'run_reports')
+)
+
+# Upper bounds in seconds of the request latency histogram buckets, the last bucket (+Inf) takes everything else
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Highest resident set size of this process so far, in bytes. Worker processes are not included.
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Wall time, row counts and memory of every stage of one ETL run. A stage that runs once per batch is added up over
+# the batches, so the report has one entry per stage however the staging table was read. Stages may be timed from
+# several threads at once, their seconds are then added up over the threads.
+class RunReport:
+
+    def __init__(self, script, options=None):
+        self.script = script
+        self.options = options or {}
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.stages = {}
+        self.stats = {}    # measures of the run's output that are not row counts, like the error of the tracks
+        self.error = None    # set when the run failed
+        self._lock = threading.Lock()
+
+    # Times the block. The block can fill in rows_out and rejected on the record it gets; rows_in may be None when
+    # it is only known afterwards, the block then fills it in too.
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = {'rows_in': rows_in, 'rows_out': None, 'rejected': None}
+        start = time.perf_counter()
+        yield record
+        self._add(name, time.perf_counter() - start, record)
+
+    # Yields the items of an iterator of DataFrames, timing every step as the given stage, for fetches in batches
+    def timed_batches(self, name, batches):
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            batch = next(iterator, None)
+            if batch is None:
+                return
+            self._add(name, time.perf_counter() - start, {'rows_in': None, 'rows_out': len(batch), 'rejected': None})
+            yield batch
+
+    # Keep the largest value of a measure over the batches of the run
+    def record_max(self, name, value):
+        with self._lock:
+            self.stats[name] = max(self.stats.get(name, value), value)
+
+    def _add(self, name, seconds, record):
+        with self._lock:
+            totals = self.stages.setdefault(name, {
+                'calls': 0, 'seconds': 0.0, 'rows_in': None, 'rows_out': None, 'rejected': None, 'peak_rss_bytes': 0
+            })
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            for key in ('rows_in', 'rows_out', 'rejected'):
+                if record[key] is not None:
+                    totals[key] = (totals[key] or 0) + int(record[key])
+            totals['peak_rss_bytes'] = peak_rss_bytes()
+
+    def to_dict(self):
+        return {
+            'script': self.script,
+            'options': self.options,
+            'started_at': self.started_at.isoformat(),
+            'seconds': time.perf_counter() - self._start,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'error': self.error,
+            'stages': self.stages,
+            'stats': self.stats
+        }
+
+    # Function to write the report to a new file in the directory, returning its path
+    def write(self, directory=RUN_REPORT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.script}-{self.started_at:%Y%m%dT%H%M%S}-{os.getpid()}.json")
+        with open(f"{path}.tmp", 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    # One line per stage, for the end of a script's output
+    def summary(self):
+        lines = [f"{'stage':>16} {'calls':>6} {'time (s)':>9} {'rows in':>10} {'rows out':>10} {'rejected':>9} "
+                 f"{'peak RSS (MB)':>14}"]
+        for name, stage in self.stages.items():
+            rows = ['' if stage[key] is None else stage[key] for key in ('rows_in', 'rows_out', 'rejected')]
+            lines.append(f"{name:>16} {stage['calls']:>6} {stage['seconds']:>9.3f} {rows[0]:>10} {rows[1]:>10} "
+                         f"{rows[2]:>9} {stage['peak_rss_bytes'] / 2 ** 20:>14.0f}")
+        lines += [f"{name}: {value:.6g}" for name, value in self.stats.items()]
+        return '\n'.join(lines)
+
+
+# A stage of the report, or an untimed block without a report, for functions that are also called without one
+def stage(report, name, rows_in=None):
+    return nullcontext({}) if report is None else report.stage(name, rows_in)
+
+
+# Thread-safe latency histograms per tuple of label values (like the API's endpoint and status), with cumulative
+# buckets like Prometheus keeps them
+class LatencyHistogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}    # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, seconds)] += 1
+            series[-1] += seconds
+
+    # Per label values: cumulative counts of every bucket bound (+Inf last), the total count and the latency sum
+    def snapshot(self):
+        with self._lock:
+            series = {label: list(values) for label, values in self._series.items()}
+        result = {}
+        for labels, values in series.items():
+            cumulative, count = [], 0
+            for bucket_count in values[:-1]:
+                count += bucket_count
+                cumulative.append(count)
+            result[labels] = {'buckets': cumulative, 'count': count, 'sum': values[-1]}
+        return result
+
+
+# Escapes a Prometheus label value
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Function to render a metric family in the Prometheus text exposition format. samples are (labels, value) pairs,
+# labels a dict of label names and values.
+def render_metric(name, metric_type, help_text, samples):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{_label_value(label)}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return '\n'.join(lines)
+
+
+# Function to render a LatencyHistogram as a Prometheus histogram, label_names name the label values it is kept by
+def render_histogram(name, help_text, histogram, label_names):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    bounds = [repr(bound) for bound in histogram.buckets] + ['+Inf']
+    for labels, series in sorted(histogram.snapshot().items()):
+        label_text = ','.join(f'{key}="{_label_value(label)}"' for key, label in zip(label_names, labels))
+        for bound, count in zip(bounds, series['buckets']):
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {count}')
+        lines.append(f"{name}_sum{{{label_text}}} {series['sum']}")
+        lines.append(f"{name}_count{{{label_text}}} {series['count']}")
+    return '\n'.join(lines)
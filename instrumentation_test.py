@@ -0,0 +1,92 @@
+import os
+import json
+import unittest
+import tempfile
+import pandas as pd
+from instrumentation import LatencyHistogram, RunReport, render_histogram, render_metric, stage
+
+class RunReportTestCase(unittest.TestCase):
+
+    def test_stages_add_up_over_batches(self):
+        # Test that a stage that runs per batch gets one entry with the totals of all batches
+        report = RunReport('test')
+        for rows in (10, 5):
+            with report.stage('parse', rows) as record:
+                record['rows_out'] = rows - 1
+                record['rejected'] = 1
+        with report.stage('commit'):
+            pass
+
+        self.assertEqual(list(report.stages), ['parse', 'commit'])
+        parse = report.stages['parse']
+        self.assertEqual((parse['calls'], parse['rows_in'], parse['rows_out'], parse['rejected']), (2, 15, 13, 2))
+        self.assertGreaterEqual(parse['seconds'], 0)
+        self.assertGreater(parse['peak_rss_bytes'], 0)
+        self.assertIsNone(report.stages['commit']['rows_in'])
+
+    def test_timed_batches(self):
+        # Test that every step through the batches is timed and their rows counted
+        report = RunReport('test')
+        batches = [pd.DataFrame({'a': range(3)}), pd.DataFrame({'a': range(2)})]
+        self.assertEqual(len(list(report.timed_batches('fetch', iter(batches)))), 2)
+        self.assertEqual((report.stages['fetch']['calls'], report.stages['fetch']['rows_out']), (2, 5))
+
+    def test_stage_without_report(self):
+        # Test that functions called without a report still run their blocks
+        with stage(None, 'parse', 3) as record:
+            record['rows_out'] = 3
+
+    def test_write(self):
+        # Test that the report is written as JSON with the options, the error and the stages
+        report = RunReport('clean_data_db_insert', options={'batch_size': 100})
+        with report.stage('fetch') as record:
+            record['rows_out'] = 7
+        report.error = "ValueError: broken"
+        with tempfile.TemporaryDirectory() as directory:
+            path = report.write(directory)
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+            with open(path, 'r') as file:
+                written = json.load(file)
+        self.assertEqual(written['script'], 'clean_data_db_insert')
+        self.assertEqual(written['options'], {'batch_size': 100})
+        self.assertEqual(written['error'], "ValueError: broken")
+        self.assertEqual(written['stages']['fetch']['rows_out'], 7)
+        self.assertIn('fetch', report.summary())
+
+class PrometheusRenderingTestCase(unittest.TestCase):
+
+    def test_latency_histogram(self):
+        # Test that the buckets are cumulative, bounds include their value and slow requests end up in +Inf
+        histogram = LatencyHistogram(buckets=(0.01, 0.1))
+        for seconds in (0.005, 0.01, 0.05, 3.0):
+            histogram.observe(('/metrics/avg_speed', '200'), seconds)
+        histogram.observe(('/status', '200'), 0.001)
+
+        series = histogram.snapshot()[('/metrics/avg_speed', '200')]
+        self.assertEqual(series['buckets'], [2, 3, 4])
+        self.assertEqual(series['count'], 4)
+        self.assertAlmostEqual(series['sum'], 3.065)
+
+        text = render_histogram('request_seconds', 'Latency.', histogram, ('route', 'status'))
+        self.assertEqual(text.splitlines()[:6], [
+            '# HELP request_seconds Latency.',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{route="/metrics/avg_speed",status="200",le="0.01"} 2',
+            'request_seconds_bucket{route="/metrics/avg_speed",status="200",le="0.1"} 3',
+            'request_seconds_bucket{route="/metrics/avg_speed",status="200",le="+Inf"} 4',
+            'request_seconds_sum{route="/metrics/avg_speed",status="200"} 3.065'
+        ])
+        self.assertIn('request_seconds_count{route="/status",status="200"} 1', text)
+
+    def test_render_metric(self):
+        # Test samples with and without labels, label values are escaped
+        text = render_metric('cache_requests_total', 'counter', 'Lookups.', [({'result': 'a"b'}, 3), ({}, 1)])
+        self.assertEqual(text.splitlines(), [
+            '# HELP cache_requests_total Lookups.',
+            '# TYPE cache_requests_total counter',
+            'cache_requests_total{result="a\\"b"} 3',
+            'cache_requests_total 1'
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
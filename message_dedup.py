@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+# Upper bound on the (device, payload) hashes a DuplicateFilter remembers, 16 bytes each
+DEDUP_MAX_ENTRIES = 1000000
+
+# Columns that make two staging rows the same message, whichever collector delivered them
+DEDUP_KEY_COLUMNS = ['device_id', 'raw_message']
+
+# Messages in production from the last window before every device's watermark, the ones earlier runs kept. The bound
+# on all devices together lets PostgreSQL skip the daily partitions before it.
+RECENTLY_KEPT_SQL = """
+    SELECT c.device_id, c.original_message_id, EXTRACT(EPOCH FROM c.datetime)::bigint
+    FROM raw_messages_cleaned c
+    JOIN etl_watermarks w ON w.device_id = c.device_id
+    WHERE c.datetime >= w.last_datetime - make_interval(secs => %(window_seconds)s)
+      AND c.datetime <= w.last_datetime
+      AND c.datetime >= (SELECT min(last_datetime) FROM etl_watermarks) - make_interval(secs => %(window_seconds)s);
+"""
+
+# The staging rows of the given messages, production does not keep their raw_message
+KEPT_PAYLOADS_SQL = """
+    SELECT r.*
+    FROM unnest(%(device_ids)s::text[], %(message_ids)s::text[], %(datetimes)s::text[])
+        AS k(device_id, original_message_id, datetime)
+    JOIN raw_messages r USING (device_id, original_message_id, datetime);
+"""
+
+
+# Drops repeated deliveries of the same message: a staging row is a duplicate when a row with the same device and
+# raw_message was kept at most window_seconds before or after it. A ship that keeps sending the same payload (lying
+# moored) still has one message kept every window, only deliveries closer together than that are dropped.
+#
+# The filter remembers a 64-bit hash and the last kept time of every payload kept within the window of its device's
+# newest message, so it can be fed one batch after another in any order of devices and its memory stays bounded by
+# the number of distinct payloads per device and window (and by max_entries). A row that arrives after a message of
+# its device more than a window newer may miss its earlier copy and is then kept.
+class DuplicateFilter:
+
+    def __init__(self, window_seconds, max_entries=DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        # Last kept time and device per payload hash, sorted by hash
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._times = np.empty(0, dtype=np.int64)
+        self._devices = np.empty(0, dtype=np.uint64)
+        # Newest kept time per device hash
+        self._latest = pd.Series(dtype=np.int64)
+        self.stats = {'messages': 0, 'duplicates': 0}
+
+    # Remember the staging rows an earlier run kept without counting them, so a filter of an incremental run also
+    # drops the copies of messages the previous run loaded
+    def seed(self, kept_df):
+        self.keep_mask(kept_df)
+        self.stats = {'messages': 0, 'duplicates': 0}
+
+    # Boolean mask over the rows of a batch of staging rows, False for the duplicates. Rows without a numeric
+    # datetime are always kept, cleaning rejects them later.
+    def keep_mask(self, raw_messages_df):
+        times = pd.to_numeric(raw_messages_df['datetime'], errors='coerce')
+        timed = times.notna().to_numpy()
+        mask = np.ones(len(raw_messages_df), dtype=bool)
+        if timed.any():
+            mask[timed] = self._keep_mask(raw_messages_df[timed], times[timed].to_numpy(dtype=np.int64))
+        self.stats['messages'] += len(mask)
+        self.stats['duplicates'] += int(len(mask) - mask.sum())
+        return mask
+
+    def _keep_mask(self, raw_messages_df, times):
+        n_rows = len(raw_messages_df)
+        hashes = pd.util.hash_pandas_object(raw_messages_df[DEDUP_KEY_COLUMNS], index=False).to_numpy()
+        devices = pd.util.hash_pandas_object(raw_messages_df['device_id'], index=False).to_numpy()
+
+        # Every payload's deliveries next to each other and in time order
+        order = np.lexsort((times, hashes))
+        sorted_hashes, sorted_times, sorted_devices = hashes[order], times[order], devices[order]
+        first_of_group = np.ones(n_rows, dtype=bool)
+        first_of_group[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+
+        # The remembered kept time of every payload that was seen in an earlier batch
+        state_times = np.full(n_rows, np.iinfo(np.int64).min, dtype=np.int64)
+        if len(self._hashes):
+            positions = np.minimum(np.searchsorted(self._hashes, sorted_hashes), len(self._hashes) - 1)
+            found = self._hashes[positions] == sorted_hashes
+            state_times[found] = self._times[positions[found]]
+        remembered = state_times != np.iinfo(np.int64).min
+
+        # A delivery can only be dropped when it is within the window of the previous one or of the remembered time
+        close = np.zeros(n_rows, dtype=bool)
+        close[1:] = ~first_of_group[1:] & (sorted_times[1:] - sorted_times[:-1] <= self.window_seconds)
+        close |= remembered & (np.abs(sorted_times - state_times) <= self.window_seconds)
+
+        keep = np.ones(n_rows, dtype=bool)
+        group_ids = np.cumsum(first_of_group) - 1
+        group_starts = np.flatnonzero(first_of_group)
+        group_ends = np.append(group_starts[1:], n_rows)
+        # Only payloads with close deliveries need their rows walked in order, every other row is kept
+        for group in np.unique(group_ids[close]):
+            start, end = group_starts[group], group_ends[group]
+            kept_time = state_times[start] if remembered[start] else None
+            for row in range(start, end):
+                if kept_time is not None and abs(sorted_times[row] - kept_time) <= self.window_seconds:
+                    keep[row] = False
+                else:
+                    kept_time = sorted_times[row]
+
+        self._remember(sorted_hashes[keep], sorted_times[keep], sorted_devices[keep])
+
+        mask = np.empty(n_rows, dtype=bool)
+        mask[order] = keep
+        return mask
+
+    # Merge the last kept time of every payload into the remembered ones and forget what fell out of the window
+    def _remember(self, kept_hashes, kept_times, kept_devices):
+        if len(kept_times) == 0:
+            return
+        batch_latest = pd.Series(kept_times).groupby(kept_devices).max()
+        self._latest = pd.concat([self._latest, batch_latest]).groupby(level=0).max()
+
+        hashes = np.concatenate([self._hashes, kept_hashes])
+        times = np.concatenate([self._times, kept_times])
+        devices = np.concatenate([self._devices, kept_devices])
+        # The latest kept time of every hash: sort by hash, then time, and take the last of each hash
+        order = np.lexsort((times, hashes))
+        hashes, times, devices = hashes[order], times[order], devices[order]
+        last_of_hash = np.ones(len(hashes), dtype=bool)
+        last_of_hash[:-1] = hashes[:-1] != hashes[1:]
+        hashes, times, devices = hashes[last_of_hash], times[last_of_hash], devices[last_of_hash]
+
+        recent = times >= self._latest.reindex(devices).to_numpy() - self.window_seconds
+        hashes, times, devices = hashes[recent], times[recent], devices[recent]
+        if len(hashes) > self.max_entries:
+            # Keep the most recent payloads, still sorted by hash
+            newest = np.sort(np.argpartition(times, len(times) - self.max_entries)[-self.max_entries:])
+            hashes, times, devices = hashes[newest], times[newest], devices[newest]
+        self._hashes, self._times, self._devices = hashes, times, devices
+
+    # Share of the messages seen so far that were duplicates
+    def drop_rate(self):
+        return self.stats['duplicates'] / self.stats['messages'] if self.stats['messages'] else 0.0
+
+
+# Function to read from production the messages earlier runs kept in the last window_seconds before every device's
+# watermark, as the parameters of KEPT_PAYLOADS_SQL
+def fetch_recently_kept(cursor, window_seconds):
+    cursor.execute(RECENTLY_KEPT_SQL, {'window_seconds': window_seconds})
+    rows = cursor.fetchall()
+    return {
+        'device_ids': [device_id for device_id, _, _ in rows],
+        'message_ids': [message_id for _, message_id, _ in rows],
+        'datetimes': [str(epoch) for _, _, epoch in rows]
+    }
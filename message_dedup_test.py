@@ -0,0 +1,118 @@
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+import pandas as pd
+from message_dedup import DuplicateFilter, fetch_recently_kept
+from fleet_generator import generate_raw_messages
+
+PAYLOAD = "A,51.31830816666667,N,4.315722166666666,E,0.0,1.59,150218,0.8,E"
+OTHER_PAYLOAD = "A,51.32,N,4.31,E,3.2,87.0,150218,0.8,E"
+
+
+# Staging rows as fetched, with the datetime as text like the staging table stores it
+def staging_rows(rows):
+    return pd.DataFrame({
+        'device_id': [device_id for device_id, _, _ in rows],
+        'datetime': [str(timestamp) for _, timestamp, _ in rows],
+        'address_ip': '172.19.0.16',
+        'address_port': 4007,
+        'original_message_id': [f"{timestamp}000-{i}" for i, (_, timestamp, _) in enumerate(rows)],
+        'raw_message': [payload for _, _, payload in rows]
+    })
+
+class DuplicateFilterTestCase(unittest.TestCase):
+
+    def test_drops_deliveries_within_the_window(self):
+        # Test that the second delivery through the other collector is dropped, in whichever order it was fetched
+        df = staging_rows([
+            ('0001', 1000, PAYLOAD), ('0001', 1090, OTHER_PAYLOAD), ('0001', 1003, PAYLOAD), ('0002', 1003, PAYLOAD)
+        ])
+        duplicate_filter = DuplicateFilter(5)
+
+        np.testing.assert_array_equal(duplicate_filter.keep_mask(df), [True, True, False, True])
+        self.assertEqual(duplicate_filter.stats, {'messages': 4, 'duplicates': 1})
+        self.assertEqual(duplicate_filter.drop_rate(), 0.25)
+
+    def test_keeps_one_message_per_window_of_a_repeated_payload(self):
+        # Test that a moored ship repeating its payload every minute keeps a message every window
+        df = staging_rows([('0001', 1000 + 60 * i, PAYLOAD) for i in range(10)])
+
+        np.testing.assert_array_equal(DuplicateFilter(5).keep_mask(df), [True] * 10)
+        np.testing.assert_array_equal(DuplicateFilter(120).keep_mask(df), [True, False, False] * 3 + [True])
+
+    def test_batches_give_the_same_result(self):
+        # Test that feeding the rows in batches drops the same rows as a single pass, also when the devices follow
+        # each other and the deliveries of a device are a little out of order
+        raw_messages_df, counts = generate_raw_messages(3, 0.1, interval_seconds=30, duplicate_rate=0.2, seed=3)
+        expected = DuplicateFilter(5).keep_mask(raw_messages_df)
+        self.assertEqual((~expected).sum(), counts['duplicates'])
+
+        jitter = np.random.default_rng(0).uniform(0, 60, len(raw_messages_df))
+        delivered = raw_messages_df.assign(
+            delivered=pd.to_numeric(raw_messages_df['datetime']) + jitter
+        ).sort_values(['device_id', 'delivered']).drop(columns='delivered')
+        duplicate_filter = DuplicateFilter(5)
+        masks = [duplicate_filter.keep_mask(delivered.iloc[start:start + 100])
+                 for start in range(0, len(delivered), 100)]
+        batched = pd.Series(np.concatenate(masks), index=delivered.index).sort_index()
+
+        # Which delivery of a message is kept depends on the order, that one of them is kept does not
+        self.assertEqual(duplicate_filter.stats['duplicates'], counts['duplicates'])
+        pd.testing.assert_frame_equal(
+            raw_messages_df[batched.to_numpy()][['device_id', 'raw_message']].sort_values(['device_id', 'raw_message'])
+            .reset_index(drop=True),
+            raw_messages_df[expected][['device_id', 'raw_message']].sort_values(['device_id', 'raw_message'])
+            .reset_index(drop=True)
+        )
+
+    def test_keeps_rows_without_a_numeric_datetime(self):
+        # Test that a row cleaning will reject is not taken for a duplicate
+        df = staging_rows([('0001', 1000, PAYLOAD), ('0001', 1001, PAYLOAD)])
+        df.loc[1, 'datetime'] = 'unknown'
+
+        np.testing.assert_array_equal(DuplicateFilter(5).keep_mask(df), [True, True])
+
+    def test_state_is_bounded(self):
+        # Test that at most max_entries payloads are remembered, the most recent ones
+        duplicate_filter = DuplicateFilter(10, max_entries=3)
+        duplicate_filter.keep_mask(staging_rows([('0001', 1000 + i, f"{PAYLOAD},{i}") for i in range(5)]))
+        np.testing.assert_array_equal(np.sort(duplicate_filter._times), [1002, 1003, 1004])
+
+    def test_forgets_payloads_older_than_the_window_of_their_device(self):
+        # Test that newer messages of another device keep a device's payloads, newer ones of the device do not
+        duplicate_filter = DuplicateFilter(10)
+        duplicate_filter.keep_mask(staging_rows([('0001', 1000, PAYLOAD), ('0001', 1001, OTHER_PAYLOAD)]))
+        duplicate_filter.keep_mask(staging_rows([('0002', 2000, PAYLOAD)]))
+        self.assertEqual(len(duplicate_filter._hashes), 3)
+        np.testing.assert_array_equal(duplicate_filter.keep_mask(staging_rows([('0001', 1003, PAYLOAD)])), [False])
+
+        duplicate_filter.keep_mask(staging_rows([('0001', 2000, PAYLOAD)]))
+        self.assertEqual(len(duplicate_filter._hashes), 2)
+        # A late copy of a forgotten payload is kept
+        np.testing.assert_array_equal(duplicate_filter.keep_mask(staging_rows([('0001', 1005, OTHER_PAYLOAD)])),
+                                      [True])
+
+    def test_seeded_filter_drops_copies_of_an_earlier_run(self):
+        # Test that the next incremental run drops a copy of a message the previous run kept, without counting the
+        # seeded rows
+        duplicate_filter = DuplicateFilter(5)
+        duplicate_filter.seed(staging_rows([('0001', 1000, PAYLOAD), ('0002', 1000, PAYLOAD)]))
+        self.assertEqual(duplicate_filter.stats, {'messages': 0, 'duplicates': 0})
+
+        df = staging_rows([('0001', 1003, PAYLOAD), ('0002', 1010, PAYLOAD), ('0001', 1004, OTHER_PAYLOAD)])
+        np.testing.assert_array_equal(duplicate_filter.keep_mask(df), [False, True, True])
+        self.assertEqual(duplicate_filter.stats, {'messages': 3, 'duplicates': 1})
+
+    def test_fetch_recently_kept(self):
+        # Test that the kept messages are turned into the parameters of the staging lookup, datetimes as epoch text
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('0001', 'm1', 1000), ('st-1a2090', 'm2', 1003)]
+
+        params = fetch_recently_kept(mock_cursor, 5)
+
+        self.assertEqual(mock_cursor.execute.call_args.args[1], {'window_seconds': 5})
+        self.assertEqual(params, {'device_ids': ['0001', 'st-1a2090'], 'message_ids': ['m1', 'm2'],
+                                  'datetimes': ['1000', '1003']})
+
+if __name__ == '__main__':
+    unittest.main()
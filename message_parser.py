@@ -0,0 +1,158 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Names of the ten RMC fields, in the order they appear in a raw message
+RMC_FIELDS = [
+    'data_status',
+    'latitude',
+    'latitude_direction',
+    'longitude',
+    'longitude_direction',
+    'speed_over_ground_d',
+    'true_course',
+    'ut_date',
+    'mag_var_d',
+    'mag_var_dir'
+]
+
+# Fields that are converted with float(), every other field is kept as text
+RMC_NUMERIC_FIELDS = ['latitude', 'longitude', 'speed_over_ground_d', 'true_course', 'ut_date', 'mag_var_d']
+
+# Any character that is not part of a basic valid set (alphanumeric, commas, dots, and basic direction letters)
+NOISE_PATTERN = r'[^A-Za-z0-9.,NSWE]'
+
+# Every string float() accepts once the noise is removed (signs and underscores never survive the cleaning)
+FLOAT_PATTERN = re.compile(r'(?:\d+(?:\.\d*)?|\.\d+)(?:[eE]\d+)?|[nN][aA][nN]|[iI][nN][fF](?:[iI][nN][iI][tT][yY])?')
+
+# Every byte the noise pattern strips, the row separator used when joining a column has to survive the cleaning;
+# non-ASCII characters encode to bytes >= 0x80 only, so deleting those bytes drops exactly those characters
+_NOISE_BYTES = bytes(b for b in range(256) if re.fullmatch(r'[A-Za-z0-9.,\n]', chr(b)) is None)
+
+
+# Cleaning function with more robust error handling
+def robust_clean_raw_message(message):
+    # Remove any characters that are not part of a basic valid set (alphanumeric, commas, dots, and basic direction letters)
+    clean_message = re.sub(NOISE_PATTERN, '', message)
+
+    # Split the cleaned message by commas
+    parts = clean_message.split(',')
+
+    # Basic validation: latitude and longitude should be present (at least 7 fields to attempt extraction)
+    if len(parts) >= 7:
+        # Attempt to extract latitude, longitude, and speed fields even if minor noise is present
+        try:
+            data_status = parts[0]  # 'A' or 'V'
+            latitude = float(parts[1])  # Latitude as a float
+            latitude_dir = parts[2]  # 'N' or 'S'
+            longitude = float(parts[3])  # Longitude as a float
+            longitude_dir = parts[4]  # 'E' or 'W'
+            speed_over_ground_d = float(parts[5])  # Speed over ground
+            true_course = float(parts[6])  # Track made good (degrees True)
+            ut_date = float(parts[7])
+            mag_var_d = float(parts[8])
+            mag_var_dir = parts[9]
+
+            # Reconstruct a clean message with the necessary fields
+            return {
+                'data_status': data_status,
+                'latitude': latitude,
+                'latitude_direction': latitude_dir,
+                'longitude': longitude,
+                'longitude_direction': longitude_dir,
+                'speed_over_ground_d': speed_over_ground_d,
+                'true_course': true_course,
+                'ut_date': ut_date,
+                'mag_var_d': mag_var_d,
+                'mag_var_dir': mag_var_dir
+            }
+        except (ValueError, IndexError):
+            # If there's any issue with conversion or missing data, return None (invalid message)
+            return None
+    else:
+        return None
+
+
+# Convert one column of numeric field strings, returning the float values and which of them float() accepted
+def _to_float_column(tokens):
+    try:
+        # Fast path: float() semantics over the whole column in a single C loop
+        return tokens.astype(np.float64), np.ones(len(tokens), dtype=bool)
+    except ValueError:
+        # Slow path: only reached when the column holds at least one value float() rejects
+        parsable = np.array([FLOAT_PATTERN.fullmatch(token) is not None for token in tokens], dtype=bool)
+        values = np.full(len(tokens), np.nan)
+        values[parsable] = tokens[parsable].astype(np.float64)
+        return values, parsable
+
+
+# Parse a list of raw messages, returning the positions of the valid ones and their fields as one array per field
+def parse_valid_messages(messages):
+    n_rows = len(messages)
+    if n_rows == 0:
+        return np.array([], dtype=np.int64), {
+            field: np.array([], dtype=np.float64 if field in RMC_NUMERIC_FIELDS else object) for field in RMC_FIELDS
+        }
+
+    # Join the column into one blob so the noise is stripped by a single byte-level pass
+    blob = '\n'.join(messages)
+    if blob.count('\n') != n_rows - 1:
+        # Some messages carry newlines themselves, those are noise as well
+        blob = '\n'.join(message.replace('\n', '') for message in messages)
+    blob = blob.encode('utf-8', 'surrogatepass').translate(None, _NOISE_BYTES).decode('ascii')
+
+    # Count the commas of every row from the byte positions of the separators
+    blob_bytes = np.frombuffer(blob.encode('ascii'), dtype=np.uint8)
+    newline_positions = np.flatnonzero(blob_bytes == ord('\n'))
+    comma_positions = np.flatnonzero(blob_bytes == ord(','))
+    row_ends = np.append(newline_positions, len(blob_bytes))
+    comma_counts = np.diff(np.searchsorted(comma_positions, row_ends), prepend=0)
+
+    # Rows with fewer than ten fields can never be valid, extra fields after the tenth are ignored
+    n_fields = len(RMC_FIELDS)
+    has_all_fields = comma_counts >= n_fields - 1
+    if not (comma_counts == n_fields - 1).all():
+        clean_messages = np.array(blob.split('\n'), dtype=object)
+        for i in np.flatnonzero(comma_counts > n_fields - 1):
+            clean_messages[i] = ','.join(clean_messages[i].split(',', n_fields)[:n_fields])
+        blob = '\n'.join(clean_messages[has_all_fields])
+
+    # Every remaining row has exactly ten fields, so one split gives a (rows, fields) token matrix
+    n_candidates = int(has_all_fields.sum())
+    tokens = np.array(blob.replace('\n', ',').split(',') if n_candidates else [], dtype=object)
+    tokens = tokens.reshape(n_candidates, n_fields)
+
+    # Type-convert the numeric fields, a row stays valid only if float() accepts all of them
+    candidate_valid = np.ones(n_candidates, dtype=bool)
+    columns = {}
+    for i, field in enumerate(RMC_FIELDS):
+        if field in RMC_NUMERIC_FIELDS:
+            columns[field], parsable = _to_float_column(tokens[:, i])
+            candidate_valid &= parsable
+        else:
+            columns[field] = tokens[:, i]
+
+    positions = np.flatnonzero(has_all_fields)[candidate_valid]
+    return positions, {field: columns[field][candidate_valid] for field in RMC_FIELDS}
+
+
+# Frame of the RMC fields of every message from the valid positions and their fields, invalid rows are all-NaN
+def scatter_valid_messages(index, positions, columns):
+    parsed_df = pd.DataFrame(index=index)
+    for field in RMC_FIELDS:
+        if field in RMC_NUMERIC_FIELDS:
+            column = np.full(len(index), np.nan)
+        else:
+            column = np.full(len(index), np.nan, dtype=object)
+        column[positions] = columns[field]
+        parsed_df[field] = column
+    return parsed_df
+
+
+# Columnar version of robust_clean_raw_message for a whole raw_message column
+def vectorized_clean_raw_messages(raw_message_series):
+    messages = raw_message_series.fillna('').astype(str).tolist()
+    if not messages:
+        return pd.DataFrame({field: pd.Series(dtype=float if field in RMC_NUMERIC_FIELDS else object) for field in RMC_FIELDS})
+    positions, columns = parse_valid_messages(messages)
+    return scatter_valid_messages(raw_message_series.index, positions, columns)
@@ -0,0 +1,47 @@
+import os
+import time
+import pandas as pd
+from message_parser import robust_clean_raw_message, vectorized_clean_raw_messages
+
+RAW_MESSAGES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'raw_messages.csv')
+
+
+# Parse a raw_message column the way filter_raw_messages_clean_df used to, one message at a time
+def parse_row_by_row(raw_message_series):
+    return pd.json_normalize(raw_message_series.apply(robust_clean_raw_message))
+
+
+# Time a parser over a column, keeping the best of a few runs
+def time_parser(parser, raw_message_series, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = parser(raw_message_series)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    raw_messages_df = pd.read_csv(RAW_MESSAGES_CSV, dtype=str)
+
+    print(f"{'rows':>10} {'row-by-row (s)':>15} {'vectorized (s)':>15} {'speedup':>8} {'invalid':>8}")
+    for copies in [1, 10, 100]:
+        # Synthetic copies of the bundled data, large enough to show how both parsers scale
+        raw_message_series = pd.concat([raw_messages_df['raw_message']] * copies, ignore_index=True)
+        repeats = 3 if copies < 100 else 1
+
+        row_by_row_time, row_by_row_df = time_parser(parse_row_by_row, raw_message_series, repeats)
+        vectorized_time, vectorized_df = time_parser(vectorized_clean_raw_messages, raw_message_series, repeats)
+
+        # Both parsers have to agree on which messages are valid
+        row_by_row_invalid = row_by_row_df['data_status'].isna()
+        vectorized_invalid = vectorized_df['data_status'].isna()
+        assert (row_by_row_invalid == vectorized_invalid).all(), "Parsers disagree on valid/invalid messages"
+
+        print(f"{len(raw_message_series):>10} {row_by_row_time:>15.3f} {vectorized_time:>15.3f} "
+              f"{row_by_row_time / vectorized_time:>7.1f}x {int(vectorized_invalid.sum()):>8}")
+
+
+if __name__ == "__main__":
+    main()
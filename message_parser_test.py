@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+import pandas as pd
+from message_parser import robust_clean_raw_message, vectorized_clean_raw_messages, RMC_FIELDS
+
+class MessageParserTestCase(unittest.TestCase):
+
+    def test_vectorized_clean_raw_messages_valid(self):
+        # Test with a valid message carrying some noise
+        raw_message_series = pd.Series(["A,5$1.31%83085,N&,4.3@15*720833333334@,E,0.0,5.25,150218,0.8,E"])
+        result_df = vectorized_clean_raw_messages(raw_message_series)
+
+        self.assertEqual(list(result_df.columns), RMC_FIELDS)
+        self.assertEqual(result_df.loc[0, 'data_status'], 'A')
+        self.assertEqual(result_df.loc[0, 'latitude'], 51.3183085)
+        self.assertEqual(result_df.loc[0, 'longitude'], 4.315720833333334)
+        self.assertEqual(result_df.loc[0, 'true_course'], 5.25)
+        self.assertEqual(result_df.loc[0, 'mag_var_dir'], 'E')
+        self.assertEqual(result_df['latitude'].dtype, np.float64)
+
+    def test_vectorized_clean_raw_messages_matches_robust_clean_raw_message(self):
+        # Test with valid, invalid and edge case messages against the row-by-row cleaning function
+        messages = [
+            "A,51.31831,N,4.18015,E,0.0,1.59,150218,0.8,W",
+            "Invalid message",
+            "A,51.31831,N",
+            "A,51.3,N,4.1,E,0.0,1.59,150218,0.8",
+            "A,nan,N,inf,E,1e5,.5,5.,0,E,extra,fields",
+            "A,1.2.3,N,4.1,E,0.0,1.59,150218,0.8,W",
+            "V,-1.5,,4_0,,0,1,2,3,",
+            "A,1\n.5,N,4,E,0,1,2,3,E",
+            ""
+        ]
+        raw_message_series = pd.Series(messages, index=range(10, 10 + len(messages)))
+        result_df = vectorized_clean_raw_messages(raw_message_series)
+        expected_df = pd.json_normalize(raw_message_series.apply(robust_clean_raw_message))
+        expected_df.index = raw_message_series.index
+
+        pd.testing.assert_series_equal(result_df['data_status'].isna(), expected_df['data_status'].isna())
+        for field in RMC_FIELDS:
+            pd.testing.assert_series_equal(result_df[field], expected_df[field], check_dtype=False)
+
+    def test_vectorized_clean_raw_messages_missing_message(self):
+        # Test with a missing message, which is treated as invalid
+        result_df = vectorized_clean_raw_messages(pd.Series([None]))
+        self.assertTrue(result_df.loc[0].isna().all())
+
+    def test_vectorized_clean_raw_messages_empty(self):
+        # Test with an empty column
+        result_df = vectorized_clean_raw_messages(pd.Series([], dtype=object))
+        self.assertEqual(list(result_df.columns), RMC_FIELDS)
+        self.assertEqual(len(result_df), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from message_parser import (RMC_FIELDS, RMC_NUMERIC_FIELDS, parse_valid_messages, scatter_valid_messages,
+                            vectorized_clean_raw_messages)
+
+# Largest number of messages sent to a worker at once, smaller batches are split evenly over the workers
+CHUNK_ROWS = 100000
+
+
+# Worker side: parse one chunk and send back only the valid rows as typed arrays. The numeric fields are float64,
+# the text fields hold a handful of distinct values and travel as small integer codes plus their distinct values.
+def _clean_chunk(messages):
+    positions, columns = parse_valid_messages(messages)
+    encoded = {}
+    for field in RMC_FIELDS:
+        if field in RMC_NUMERIC_FIELDS:
+            encoded[field] = columns[field]
+        else:
+            codes, uniques = pd.factorize(columns[field])
+            encoded[field] = (codes.astype(np.min_scalar_type(len(uniques))), uniques)
+    return positions.astype(np.int32), encoded
+
+
+# Parses raw_message columns in a pool of worker processes. The column is cut into row ranges, every range is
+# parsed in a worker and the results are put back in row order, so the output is the same as
+# vectorized_clean_raw_messages gives for the whole column in one process.
+class ParallelCleaner:
+
+    def __init__(self, workers, chunk_rows=CHUNK_ROWS):
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    # Row ranges of a column, at least one per worker as long as there are enough rows
+    def _chunk_bounds(self, n_rows):
+        chunk_rows = max(1, min(self.chunk_rows, math.ceil(n_rows / self.workers)))
+        return [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+
+    def clean(self, raw_message_series):
+        n_rows = len(raw_message_series)
+        if n_rows == 0:
+            return vectorized_clean_raw_messages(raw_message_series)
+
+        messages = raw_message_series.fillna('').astype(str).tolist()
+        bounds = self._chunk_bounds(n_rows)
+        # map hands the results back in the order of the chunks, whichever worker finishes first
+        results = self._executor.map(_clean_chunk, [messages[start:end] for start, end in bounds])
+
+        positions, chunk_columns = [], []
+        for (start, _), (chunk_positions, encoded) in zip(bounds, results):
+            positions.append(chunk_positions.astype(np.int64) + start)
+            chunk_columns.append({
+                field: values if field in RMC_NUMERIC_FIELDS else values[1][values[0]]
+                for field, values in encoded.items()
+            })
+        columns = {field: np.concatenate([chunk[field] for chunk in chunk_columns]) for field in RMC_FIELDS}
+
+        return scatter_valid_messages(raw_message_series.index, np.concatenate(positions), columns)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import pandas as pd
+from message_parser import vectorized_clean_raw_messages
+from parallel_cleaning import ParallelCleaner
+
+RAW_MESSAGES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'raw_messages.csv')
+
+# Copies of the bundled data parsed per run, about 2.9M messages
+COPIES = 100
+
+
+# Time cleaning a column with a given number of workers, keeping the best of a few runs.
+# The pool is started before the clock starts, the ETL starts it once for all batches too.
+def time_workers(workers, raw_message_series, repeats):
+    best = None
+    with ParallelCleaner(workers) as cleaner:
+        cleaner.clean(raw_message_series.head(workers))
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = cleaner.clean(raw_message_series)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    # Worker counts from the command line, by default powers of two up to the number of cores
+    cpu_count = os.cpu_count() or 1
+    worker_counts = [int(workers) for workers in sys.argv[1:]]
+    if not worker_counts:
+        worker_counts = [2 ** i for i in range(cpu_count.bit_length()) if 2 ** i < cpu_count] + [cpu_count]
+
+    raw_messages_df = pd.read_csv(RAW_MESSAGES_CSV, dtype=str)
+    raw_message_series = pd.concat([raw_messages_df['raw_message']] * COPIES, ignore_index=True)
+
+    start = time.perf_counter()
+    expected_df = vectorized_clean_raw_messages(raw_message_series)
+    serial_time = time.perf_counter() - start
+
+    print(f"{len(raw_message_series)} messages on {cpu_count} cores, single process: {serial_time:.3f} s")
+    print(f"{'workers':>8} {'time (s)':>9} {'speedup':>8} {'efficiency':>11}")
+    for workers in worker_counts:
+        elapsed, result_df = time_workers(workers, raw_message_series, repeats=3)
+        # Parallel cleaning has to give exactly the single process result
+        pd.testing.assert_frame_equal(result_df, expected_df)
+        speedup = serial_time / elapsed
+        print(f"{workers:>8} {elapsed:>9.3f} {speedup:>7.2f}x {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+import pandas as pd
+from message_parser import vectorized_clean_raw_messages, RMC_FIELDS
+from parallel_cleaning import ParallelCleaner, _clean_chunk
+
+class ParallelCleaningTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cleaner = ParallelCleaner(workers=2, chunk_rows=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cleaner.close()
+
+    def test_clean_matches_vectorized_clean_raw_messages(self):
+        # Test with more chunks than workers, valid and invalid messages mixed over the chunks
+        messages = [
+            "A,51.31831,N,4.18015,E,0.0,1.59,150218,0.8,W",
+            "Invalid message",
+            "A,5$1.31%83085,N&,4.3@15*720833333334@,E,0.0,5.25,150218,0.8,E",
+            None,
+            "A,nan,N,inf,E,1e5,.5,5.,0,E,extra,fields",
+            "A,1.2.3,N,4.1,E,0.0,1.59,150218,0.8,W",
+            "V,-1.5,,4_0,,0,1,2,3,",
+            "A,1\n.5,N,4,E,0,1,2,3,E",
+            "",
+            "V,52.1,N,3.9,E,12.5,270.0,160218,1.1,W"
+        ]
+        raw_message_series = pd.Series(messages, index=range(100, 100 + len(messages)))
+        result_df = self.cleaner.clean(raw_message_series)
+        expected_df = vectorized_clean_raw_messages(raw_message_series)
+
+        pd.testing.assert_frame_equal(result_df, expected_df)
+
+    def test_clean_keeps_row_order_over_many_chunks(self):
+        # Test that the chunks are recombined in row order
+        raw_message_series = pd.Series([f"A,{i}.5,N,4.1,E,{i},1.59,150218,0.8,W" for i in range(50)])
+        result_df = self.cleaner.clean(raw_message_series)
+
+        np.testing.assert_array_equal(result_df['speed_over_ground_d'].to_numpy(), np.arange(50, dtype=float))
+
+    def test_clean_empty(self):
+        # Test with an empty column
+        result_df = self.cleaner.clean(pd.Series([], dtype=object))
+        self.assertEqual(list(result_df.columns), RMC_FIELDS)
+        self.assertEqual(len(result_df), 0)
+
+    def test_clean_chunk_returns_typed_arrays(self):
+        # Test that a worker only sends back the valid rows, as float arrays and codes of the distinct text values
+        positions, columns = _clean_chunk([
+            "Invalid message", "A,51.3,N,4.1,E,0.0,1.59,150218,0.8,W", "V,51.4,N,4.2,E,0.0,1.59,150218,0.8,W"
+        ])
+
+        np.testing.assert_array_equal(positions, [1, 2])
+        self.assertEqual(columns['latitude'].dtype, np.float64)
+        codes, uniques = columns['data_status']
+        self.assertEqual(codes.dtype, np.uint8)
+        self.assertEqual(list(uniques[codes]), ['A', 'V'])
+
+if __name__ == "__main__":
+    unittest.main()
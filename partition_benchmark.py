@@ -0,0 +1,169 @@
+import json
+import time
+import argparse
+from datetime import date, datetime, timedelta
+import psycopg2
+from db_connection import connection_params
+from data_changes import CHANGED_MESSAGES_SQL
+from partitions import partitioning_sql, migrate_to_partitioned, drop_expired_partitions
+
+# Every layout gets its own scratch schema in the PRODUCTION database, dropped again afterwards. The queries use
+# unqualified table names, so they run unchanged on each layout through the search path.
+LAYOUTS = {
+    # The table as db_creation.py created it before it was partitioned: only the unique key
+    'unpartitioned': 'partition_benchmark_unpartitioned',
+    # The indexes of the partitioned table without the partitions, to tell the index from the pruning apart
+    'unpartitioned_indexed': 'partition_benchmark_indexed',
+    'partitioned': 'partition_benchmark_partitioned'
+}
+
+FIRST_DAY = date(2019, 2, 1)
+
+# Synthetic messages of the fleet, with the columns the queries read filled in
+GENERATE_MESSAGES_SQL = """
+    INSERT INTO raw_messages_cleaned_weather
+        (device_id, datetime, original_message_id, lat, lon, speed_over_ground_d, wind_spd, temp)
+    SELECT 'ship-' || ship, t, ship || '-' || extract(epoch FROM t)::bigint,
+           51.3 + random() * 0.7, 4.0 + random() * 2.0, random() * 20, random() * 12, random() * 10
+    FROM generate_series(1, %(ships)s) AS ship,
+         generate_series(%(first_day)s::timestamp, %(first_day)s::timestamp + %(days)s * interval '1 day'
+                         - interval '1 second', %(interval)s * interval '1 second') AS t;
+"""
+
+# The queries timed on every layout, as the API and the ETL run them
+QUERIES = {
+    # Messages of one ship on one day, the lookup behind every /metrics endpoint
+    'ship_day': """
+        SELECT * FROM raw_messages_cleaned_weather
+        WHERE device_id = %(device_id)s AND datetime >= %(day)s::timestamp
+          AND datetime < %(day)s::timestamp + interval '1 day';
+    """,
+    # The (ship, hour) buckets of a load re-read by the API's snapshot refresher, see data_changes.py
+    'changed_hours': CHANGED_MESSAGES_SQL,
+    # Every ship on one day, like the daily rollups
+    'fleet_day': """
+        SELECT device_id, count(*), avg(speed_over_ground_d), max(wind_spd)
+        FROM raw_messages_cleaned_weather
+        WHERE datetime >= %(day)s::timestamp AND datetime < %(day)s::timestamp + interval '1 day'
+        GROUP BY device_id;
+    """
+}
+
+
+# Function to create the table of a layout in its schema and fill it with the synthetic fleet
+def create_layout(cursor, layout, schema, ships, days, interval_seconds):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}; SET search_path TO {schema};")
+    cursor.execute(
+        "CREATE TABLE raw_messages_cleaned_weather (LIKE public.raw_messages_cleaned_weather INCLUDING DEFAULTS);"
+    )
+    cursor.execute(GENERATE_MESSAGES_SQL, {'ships': ships, 'first_day': FIRST_DAY, 'days': days,
+                                           'interval': interval_seconds})
+    if layout == 'unpartitioned':
+        cursor.execute("CREATE UNIQUE INDEX ON raw_messages_cleaned_weather (device_id, original_message_id);")
+    elif layout == 'unpartitioned_indexed':
+        # The default partition of partitioning_sql only exists on a partitioned table
+        cursor.execute(partitioning_sql('raw_messages_cleaned_weather').split(';', 1)[1])
+    else:
+        migrate_to_partitioned(cursor, 'raw_messages_cleaned_weather')
+    cursor.execute("ANALYZE raw_messages_cleaned_weather;")
+
+
+# Walks a plan of EXPLAIN (FORMAT JSON) and counts the scans of message tables (or partitions) that ran
+def scanned_relations(plan):
+    count = 1 if plan.get('Relation Name', '').startswith('raw_messages_cleaned_weather') and \
+        plan.get('Actual Loops', 0) > 0 else 0
+    return count + sum(scanned_relations(child) for child in plan.get('Plans', []))
+
+
+# Function to run a query under EXPLAIN ANALYZE a few times and return its fastest run
+def explain(cursor, query, params, repeat):
+    runs = []
+    for _ in range(repeat):
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+        result = cursor.fetchone()[0]
+        result = json.loads(result) if isinstance(result, str) else result
+        plan = result[0]
+        runs.append({
+            'planning_ms': plan['Planning Time'],
+            'execution_ms': plan['Execution Time'],
+            'relations_scanned': scanned_relations(plan['Plan']),
+            'buffers': plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0)
+        })
+    return min(runs, key=lambda run: run['planning_ms'] + run['execution_ms'])
+
+
+# Function to time dropping the oldest day, by DELETE on a plain table and by dropping its partition, rolled back
+def time_retention(conn, cursor, layout):
+    second_day = FIRST_DAY + timedelta(days=1)
+    start = time.perf_counter()
+    if layout == 'partitioned':
+        drop_expired_partitions(cursor, 'raw_messages_cleaned_weather', 0, today=second_day)
+    else:
+        cursor.execute("DELETE FROM raw_messages_cleaned_weather WHERE datetime < %s;", (second_day,))
+    seconds = time.perf_counter() - start
+    conn.rollback()
+    return seconds
+
+
+# Function to build every layout, time the queries and the retention on it and return the results per layout
+def run_benchmark(ships=50, days=30, interval_seconds=120, repeat=5):
+    # A ship and a day in the middle of the range, and the hours of that day of a few ships
+    day = FIRST_DAY + timedelta(days=days // 2)
+    hours = [datetime(day.year, day.month, day.day) + timedelta(hours=hour) for hour in range(24)]
+    params = {
+        'ship_day': {'device_id': 'ship-1', 'day': day},
+        'changed_hours': {'device_ids': [f"ship-{1 + n % min(ships, 5)}" for n in range(24)], 'hours': hours},
+        'fleet_day': {'day': day}
+    }
+
+    results = {}
+    conn = psycopg2.connect(**connection_params("PRODUCTION"))
+    cursor = conn.cursor()
+    try:
+        for layout, schema in LAYOUTS.items():
+            start = time.perf_counter()
+            create_layout(cursor, layout, schema, ships, days, interval_seconds)
+            conn.commit()
+            results[layout] = {'build_seconds': time.perf_counter() - start}
+            cursor.execute(f"SET search_path TO {schema};")
+            for name, query in QUERIES.items():
+                results[layout][name] = explain(cursor, query, params[name], repeat)
+            conn.rollback()
+            cursor.execute(f"SET search_path TO {schema};")
+            results[layout]['retention_seconds'] = time_retention(conn, cursor, layout)
+    finally:
+        conn.rollback()
+        for schema in LAYOUTS.values():
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        conn.commit()
+        cursor.close()
+        conn.close()
+    return results
+
+
+def print_results(results):
+    print(f"{'layout':>22} {'query':>14} {'scans':>6} {'buffers':>8} {'planning (ms)':>14} {'execution (ms)':>15}")
+    for layout, result in results.items():
+        for name in QUERIES:
+            run = result[name]
+            print(f"{layout:>22} {name:>14} {run['relations_scanned']:>6} {run['buffers']:>8} "
+                  f"{run['planning_ms']:>14.2f} {run['execution_ms']:>15.2f}")
+    print(f"{'layout':>22} {'build (s)':>10} {'drop oldest day (ms)':>21}")
+    for layout, result in results.items():
+        print(f"{layout:>22} {result['build_seconds']:>10.1f} {result['retention_seconds'] * 1000:>21.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the message table unpartitioned and partitioned by day on the API's queries."
+    )
+    parser.add_argument("--ships", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval-seconds", type=int, default=120, help="Seconds between two messages of a ship")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query, the fastest one is reported")
+    args = parser.parse_args(argv)
+    print_results(run_benchmark(args.ships, args.days, args.interval_seconds, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
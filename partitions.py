@@ -0,0 +1,179 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+# Message tables that are range partitioned by day on their datetime column, see db_creation.py. Staging keeps the
+# datetime as the text it arrives in (Unix seconds), so its bounds are text too: epoch seconds have 10 digits from
+# 2001 until 2286, in that range their text order is their time order.
+PARTITIONED_TABLES = {
+    'raw_messages': 'epoch_text',
+    'raw_messages_cleaned': 'timestamp',
+    'raw_messages_cleaned_weather': 'timestamp',
+    'device_tracks': 'timestamp'
+}
+
+# Daily partitions are named after their table and day, e.g. raw_messages_cleaned_20190213
+_PARTITION_DAY = re.compile(r'_(\d{8})$')
+
+PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass;
+"""
+
+RELKIND_SQL = "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);"
+
+
+# Function to give the DDL that makes a table created with PARTITION BY RANGE (datetime) usable: its default partition,
+# which takes the rows no daily partition exists for yet (and NULL datetimes), and the indexes of every partition.
+# The key includes datetime because a unique index of a partitioned table has to include its partition column.
+def partitioning_sql(table_name):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+
+        -- Key used to skip or upsert messages that were already loaded
+        CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_key ON {table_name} (device_id, original_message_id, datetime);
+        -- Messages of one ship over a time range
+        CREATE INDEX IF NOT EXISTS {table_name}_device_datetime ON {table_name} (device_id, datetime);
+        -- Time ranges over all ships, a few pages per partition since rows arrive roughly in time order
+        CREATE INDEX IF NOT EXISTS {table_name}_datetime_brin ON {table_name} USING brin (datetime);
+    """
+
+
+def partition_name(table_name, day):
+    return f"{table_name}_{day:%Y%m%d}"
+
+
+# The SQL literals of the lower and upper bound of a day's partition
+def _bounds(table_name, day):
+    lower = datetime(day.year, day.month, day.day)
+    upper = lower + timedelta(days=1)
+    if PARTITIONED_TABLES[table_name] == 'epoch_text':
+        return tuple(f"'{int(bound.replace(tzinfo=timezone.utc).timestamp())}'" for bound in (lower, upper))
+    return f"'{lower:%Y-%m-%d}'", f"'{upper:%Y-%m-%d}'"
+
+
+# The SQL expression of the day of a row's datetime, NULL for staging text that is no epoch of 10 digits
+def _day_expression(table_name):
+    if PARTITIONED_TABLES[table_name] == 'epoch_text':
+        return "CASE WHEN datetime ~ '^[0-9]{10}$' THEN to_timestamp(datetime::bigint) AT TIME ZONE 'UTC' END::date"
+    return "datetime::date"
+
+
+def is_partitioned(cursor, table_name):
+    cursor.execute(RELKIND_SQL, (table_name,))
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+# The days of the daily partitions of a table, sorted
+def partition_days(cursor, table_name):
+    cursor.execute(PARTITIONS_SQL, (table_name,))
+    days = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_DAY.search(name)
+        # The default partition has no day
+        if match:
+            days.append(datetime.strptime(match.group(1), '%Y%m%d').date())
+    return sorted(days)
+
+
+# Function to find the distinct days of a column of datetimes, like the datetime column of a batch of messages.
+# pandas is imported here, the staging load and db_creation.py use this module without it.
+def days_of(datetimes):
+    import pandas as pd
+    days = pd.to_datetime(pd.Series(datetimes), errors='coerce').dropna().dt.normalize().unique()
+    return sorted(day.date() for day in pd.DatetimeIndex(days))
+
+
+# Function to find the distinct days of the rows of a table, e.g. of the temporary table a load is copied into
+def days_in_table(cursor, table_name, source_table):
+    cursor.execute(f"SELECT DISTINCT {_day_expression(table_name)} AS day FROM {source_table} ORDER BY day;")
+    return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+
+# Function to create the missing daily partitions for the rows of another table, like the temporary table a load is
+# copied into before it is inserted
+def ensure_partitions_for_table(cursor, table_name, source_table):
+    if not is_partitioned(cursor, table_name):
+        return []
+    return ensure_partitions(cursor, table_name, days_in_table(cursor, table_name, source_table))
+
+
+# Function to create the daily partitions of the given days that do not exist yet, returning the ones it created.
+# A new partition is created on its own and attached afterwards, which locks the parent less than CREATE TABLE ...
+# PARTITION OF would, and rows of its day that were already put in the default partition are moved into it first.
+# Loads running at once take turns creating them: the first to miss a day holds a lock on the table's name until its
+# transaction ends, the others then see its partitions. Tables that are not partitioned (yet, see
+# migrate_to_partitioned) are left alone.
+def ensure_partitions(cursor, table_name, days):
+    if not days or not is_partitioned(cursor, table_name):
+        return []
+    existing = set(partition_days(cursor, table_name))
+    if not set(days) <= existing:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (table_name,))
+        existing = set(partition_days(cursor, table_name))
+    created = []
+    for day in sorted(set(days) - existing):
+        name = partition_name(table_name, day)
+        lower, upper = _bounds(table_name, day)
+        cursor.execute(f"""
+            CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            WITH moved AS (
+                DELETE FROM {table_name}_default WHERE datetime >= {lower} AND datetime < {upper} RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved;
+            ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper});
+        """)
+        created.append(name)
+    return created
+
+
+# Function to create the partitions of today and the days_ahead days after it ahead of the loads of live data
+def create_future_partitions(cursor, table_name, days_ahead, today=None):
+    today = today or datetime.now(timezone.utc).date()
+    return ensure_partitions(cursor, table_name, [today + timedelta(days=n) for n in range(days_ahead + 1)])
+
+
+# Function to drop the daily partitions of the days more than retention_days before today, returning their names.
+# Dropping a partition removes its rows without scanning or deleting them one by one.
+def drop_expired_partitions(cursor, table_name, retention_days, today=None):
+    if not is_partitioned(cursor, table_name):
+        return []
+    cutoff = (today or datetime.now(timezone.utc).date()) - timedelta(days=retention_days)
+    dropped = []
+    for day in partition_days(cursor, table_name):
+        if day < cutoff:
+            name = partition_name(table_name, day)
+            cursor.execute(f"DROP TABLE {name};")
+            dropped.append(name)
+    return dropped
+
+
+# Function to turn an existing unpartitioned table into a partitioned one with the same name, columns and column
+# types, in the cursor's transaction. The rows are copied into a daily partition per day they have. The key exists
+# before the copy, so repeated copies of a message in a table loaded before there was a key are skipped instead of
+# failing the migration. Returns False when there is nothing to migrate.
+def migrate_to_partitioned(cursor, table_name):
+    cursor.execute(RELKIND_SQL, (table_name,))
+    row = cursor.fetchone()
+    if row is None or row[0] != 'r':
+        return False
+
+    old_table = f"{table_name}_unpartitioned"
+    cursor.execute(f"ALTER TABLE {table_name} RENAME TO {old_table};")
+    # The indexes of the old table go first, the partitioned table uses their names
+    cursor.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass;", (old_table,))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"DROP INDEX {index_name};")
+
+    cursor.execute(f"""
+        CREATE TABLE {table_name} (LIKE {old_table} INCLUDING DEFAULTS) PARTITION BY RANGE (datetime);
+        CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT;
+    """)
+    ensure_partitions(cursor, table_name, days_in_table(cursor, table_name, old_table))
+    cursor.execute(partitioning_sql(table_name))
+    cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {old_table} ON CONFLICT DO NOTHING;")
+    cursor.execute(f"DROP TABLE {old_table};")
+    return True
+
@@ -0,0 +1,91 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+from partitions import (partitioning_sql, partition_name, days_of, ensure_partitions, drop_expired_partitions,
+                        migrate_to_partitioned)
+
+# A cursor of a partitioned table with the given daily partitions
+def partitioned_cursor(partition_names, relkind='p'):
+    mock_cursor = MagicMock()
+    mock_cursor.fetchone.return_value = (relkind,)
+    mock_cursor.fetchall.return_value = [(name,) for name in partition_names]
+    return mock_cursor
+
+def executed_sql(mock_cursor):
+    return '\n'.join(call.args[0] for call in mock_cursor.execute.call_args_list)
+
+class PartitionsTestCase(unittest.TestCase):
+
+    def test_partitioning_sql(self):
+        # Test that the key includes the partition column and that both time indexes are created
+        sql = partitioning_sql('raw_messages_cleaned')
+        self.assertIn("raw_messages_cleaned_default PARTITION OF raw_messages_cleaned DEFAULT", sql)
+        self.assertIn("raw_messages_cleaned_key ON raw_messages_cleaned (device_id, original_message_id, datetime)", sql)
+        self.assertIn("ON raw_messages_cleaned (device_id, datetime)", sql)
+        self.assertIn("USING brin (datetime)", sql)
+
+    def test_days_of(self):
+        # Test that every day of a batch is found once, missing datetimes are ignored
+        datetimes = pd.Series(pd.to_datetime(['2019-02-13 23:59', '2019-02-13 01:00', '2019-02-14 00:00', None]))
+        self.assertEqual(days_of(datetimes), [datetime.date(2019, 2, 13), datetime.date(2019, 2, 14)])
+
+    def test_ensure_partitions(self):
+        # Test that only missing days get a partition, attached with the bounds of the day
+        mock_cursor = partitioned_cursor(['raw_messages_cleaned_20190213', 'raw_messages_cleaned_default'])
+        created = ensure_partitions(mock_cursor, 'raw_messages_cleaned',
+                                    [datetime.date(2019, 2, 13), datetime.date(2019, 2, 14)])
+
+        self.assertEqual(created, ['raw_messages_cleaned_20190214'])
+        sql = executed_sql(mock_cursor)
+        self.assertIn("pg_advisory_xact_lock", sql)
+        self.assertIn("DELETE FROM raw_messages_cleaned_default WHERE datetime >= '2019-02-14' AND datetime < '2019-02-15'", sql)
+        self.assertIn("ATTACH PARTITION raw_messages_cleaned_20190214 FOR VALUES FROM ('2019-02-14') TO ('2019-02-15')", sql)
+
+    def test_ensure_partitions_of_staging(self):
+        # Test that staging partitions are bounded by the epoch seconds of the day, as text
+        mock_cursor = partitioned_cursor([])
+        ensure_partitions(mock_cursor, 'raw_messages', [datetime.date(2019, 2, 13)])
+        self.assertIn("FOR VALUES FROM ('1550016000') TO ('1550102400')", executed_sql(mock_cursor))
+
+    def test_ensure_partitions_of_unpartitioned_table(self):
+        # Test that a table that was not migrated yet is left alone
+        mock_cursor = partitioned_cursor([], relkind='r')
+        self.assertEqual(ensure_partitions(mock_cursor, 'raw_messages_cleaned', [datetime.date(2019, 2, 13)]), [])
+        mock_cursor.execute.assert_called_once()
+
+    def test_drop_expired_partitions(self):
+        # Test that the partitions of days before the retention are dropped and the default partition is kept
+        mock_cursor = partitioned_cursor([
+            'raw_messages_cleaned_20190211', 'raw_messages_cleaned_20190212', 'raw_messages_cleaned_20190213',
+            'raw_messages_cleaned_default'
+        ])
+        dropped = drop_expired_partitions(mock_cursor, 'raw_messages_cleaned', 1, today=datetime.date(2019, 2, 13))
+
+        self.assertEqual(dropped, ['raw_messages_cleaned_20190211'])
+        self.assertIn("DROP TABLE raw_messages_cleaned_20190211;", executed_sql(mock_cursor))
+        self.assertNotIn("DROP TABLE raw_messages_cleaned_20190212;", executed_sql(mock_cursor))
+
+    def test_migrate_to_partitioned(self):
+        # Test that only an existing unpartitioned table is migrated
+        self.assertFalse(migrate_to_partitioned(partitioned_cursor([]), 'raw_messages_cleaned'))
+
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.side_effect = [('r',), ('p',)]
+        # The partitions are listed again once the lock for creating them is held
+        mock_cursor.fetchall.side_effect = [[('raw_messages_cleaned_key',)], [(datetime.date(2019, 2, 13),)], [], []]
+        self.assertTrue(migrate_to_partitioned(mock_cursor, 'raw_messages_cleaned'))
+        sql = executed_sql(mock_cursor)
+        self.assertIn("ALTER TABLE raw_messages_cleaned RENAME TO raw_messages_cleaned_unpartitioned;", sql)
+        self.assertIn("DROP INDEX raw_messages_cleaned_key;", sql)
+        self.assertIn("PARTITION BY RANGE (datetime)", sql)
+        self.assertIn(f"ATTACH PARTITION {partition_name('raw_messages_cleaned', datetime.date(2019, 2, 13))}", sql)
+        # The key is created before the rows are copied, repeated copies of a message are skipped
+        insert_sql = ("INSERT INTO raw_messages_cleaned SELECT * FROM raw_messages_cleaned_unpartitioned "
+                      "ON CONFLICT DO NOTHING;")
+        self.assertIn(insert_sql, sql)
+        self.assertLess(sql.index("CREATE UNIQUE INDEX IF NOT EXISTS raw_messages_cleaned_key"), sql.index(insert_sql))
+        self.assertIn("DROP TABLE raw_messages_cleaned_unpartitioned;", sql)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,377 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from contextlib import nullcontext
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import psycopg2
+from db_connection import connection_params
+from raw_data_db_insert import STAGING_KEY_COLUMNS, copy_new_rows_from_csv
+from copy_writer import copy_from_dataframe
+from clean_data_db_insert import filter_raw_messages_clean_df
+from parallel_cleaning import ParallelCleaner
+from weather_loader import parse_weather_json
+from weather_join import WeatherIndex
+from rollups import refresh_rollups
+from trajectory import compress_tracks, message_track_points, refresh_tracks
+from typed_fetch import compact_dtypes
+from snapshot import DataSnapshot, SnapshotRefresher
+from fleet_generator import DEFAULT_START, write_fleet
+from instrumentation import RunReport, peak_rss_bytes
+from message_dedup import DuplicateFilter
+import app
+
+# Endpoints of app.py that are timed, every one is requested once per ship
+ENDPOINTS = ['/metrics/total_ships', '/metrics/avg_speed', '/metrics/wind_speed', '/metrics/weather_conditions',
+             '/metrics/route']
+
+# Tables the Postgres sink copies into its scratch schema, per environment
+STAGING_TABLES = ['raw_messages']
+PRODUCTION_TABLES = [
+    'raw_messages_cleaned', 'raw_messages_cleaned_weather', 'device_hourly_speed', 'device_daily_wind', 'devices',
+    'device_tracks'
+]
+
+# Stages and endpoints faster than this are never reported as regressions, their timings are mostly noise
+MIN_REGRESSION_SECONDS = 0.005
+
+
+# Sink that keeps everything in the benchmark process. The staging COPY reads the file, the fetch parses it like
+# the database would return it, the production COPY renders the COPY stream without sending it anywhere and the
+# rollups are computed with pandas. Measures the client side of the pipeline without a database.
+class MemorySink:
+
+    name = 'memory'
+
+    def __init__(self):
+        self._staging_csv = None
+        self.copied_bytes = {}
+
+    def load_staging(self, csv_path):
+        with open(csv_path, 'r') as file:
+            self._staging_csv = file.read()
+
+    def fetch_staging(self):
+        # Staging stores everything as text except the port
+        raw_messages_df = pd.read_csv(io.StringIO(self._staging_csv), dtype=str, keep_default_na=False)
+        return raw_messages_df.astype({'address_port': 'int64'})
+
+    def load_production(self, table_name, df):
+        copy_from_dataframe(_DrainingCursor(self.copied_bytes, table_name), df, table_name)
+
+    # The rows refresh_rollups leaves in the rollup tables for the given messages
+    def rollups(self, combined_df):
+        messages_df = combined_df.assign(hour=combined_df['datetime'].dt.floor('h'))
+        hourly_speed_df = messages_df.groupby(['device_id', 'hour'], as_index=False, observed=True).agg(
+            message_count=('speed_over_ground_d', 'size'),
+            avg_speed=('speed_over_ground_d', 'mean'),
+            min_speed=('speed_over_ground_d', 'min'),
+            max_speed=('speed_over_ground_d', 'max'),
+            first_datetime=('datetime', 'min'),
+            last_datetime=('datetime', 'max')
+        )
+        wind_df = messages_df[messages_df['wind_spd'].notna()]
+        daily_wind_df = wind_df.assign(day=wind_df['datetime'].dt.floor('D')).groupby(
+            ['device_id', 'day'], as_index=False, observed=True
+        ).agg(
+            observation_count=('wind_spd', 'size'),
+            min_wind_spd=('wind_spd', 'min'),
+            max_wind_spd=('wind_spd', 'max')
+        )
+        devices_df = hourly_speed_df.groupby('device_id', as_index=False, observed=True).agg(
+            first_datetime=('first_datetime', 'min'),
+            last_datetime=('last_datetime', 'max'),
+            message_count=('message_count', 'sum')
+        )
+        return devices_df, hourly_speed_df, daily_wind_df
+
+    # The compressed tracks refresh_tracks leaves in device_tracks for the given messages, with its counts and error
+    def tracks(self, messages_df):
+        return compress_tracks(message_track_points(messages_df))
+
+    def close(self):
+        self._staging_csv = None
+
+
+# Stands in for a cursor in copy_from_dataframe: reads the COPY stream the way psycopg2 does and counts its bytes
+class _DrainingCursor:
+
+    def __init__(self, copied_bytes, table_name):
+        self._copied_bytes = copied_bytes
+        self._table_name = table_name
+
+    def copy_expert(self, sql, file, size=8192):
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            self._copied_bytes[self._table_name] = self._copied_bytes.get(self._table_name, 0) + len(chunk)
+
+
+# Sink that runs the pipeline's statements against the STAGING and PRODUCTION databases of the .env file.
+# Everything is written to empty copies of the tables in a scratch schema, which is dropped again on close, so the
+# benchmark never touches the real tables. The tables have to exist, see db_creation.py.
+class PostgresSink:
+
+    name = 'postgres'
+    schema = 'pipeline_benchmark'
+
+    def __init__(self):
+        self._staging = self._connect("STAGING", STAGING_TABLES)
+        self._production = self._connect("PRODUCTION", PRODUCTION_TABLES)
+
+    # A connection whose search path starts with the scratch schema, unqualified table names resolve to the copies
+    def _connect(self, environment, tables):
+        conn = psycopg2.connect(**connection_params(environment))
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE; CREATE SCHEMA {self.schema};")
+        for table_name in tables:
+            cursor.execute(f"CREATE TABLE {self.schema}.{table_name} (LIKE public.{table_name} INCLUDING ALL);")
+        cursor.execute(f"SET search_path TO {self.schema}, public;")
+        conn.commit()
+        cursor.close()
+        return conn
+
+    def load_staging(self, csv_path):
+        cursor = self._staging.cursor()
+        copy_new_rows_from_csv(cursor, csv_path, 'raw_messages', STAGING_KEY_COLUMNS)
+        self._staging.commit()
+        cursor.close()
+
+    def fetch_staging(self):
+        return pd.read_sql("SELECT * FROM raw_messages;", self._staging)
+
+    def load_production(self, table_name, df):
+        cursor = self._production.cursor()
+        copy_from_dataframe(cursor, df, table_name)
+        self._production.commit()
+        cursor.close()
+
+    def rollups(self, combined_df):
+        cursor = self._production.cursor()
+        refresh_rollups(cursor, combined_df)
+        self._production.commit()
+        cursor.close()
+        return (
+            pd.read_sql("SELECT * FROM devices;", self._production),
+            pd.read_sql("SELECT * FROM device_hourly_speed ORDER BY device_id, hour;", self._production),
+            pd.read_sql("SELECT * FROM device_daily_wind ORDER BY device_id, day;", self._production)
+        )
+
+    def tracks(self, messages_df):
+        cursor = self._production.cursor()
+        stats = refresh_tracks(cursor, messages_df)
+        self._production.commit()
+        cursor.close()
+        return pd.read_sql("SELECT * FROM device_tracks;", self._production), stats
+
+    def close(self):
+        for conn in (self._staging, self._production):
+            cursor = conn.cursor()
+            cursor.execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE;")
+            conn.commit()
+            conn.close()
+
+
+SINKS = {'memory': MemorySink, 'postgres': PostgresSink}
+
+
+# Function to run the ETL stages of clean_data_db_insert.py on a generated fleet through a sink, timing every stage in
+# the report. Cleaning is timed as the parse, normalize and sort stages like in the ETL's own run reports.
+def run_pipeline(sink, fleet, report, workers=1, dedup_window_seconds=None):
+    with report.stage('staging_copy', fleet['messages']) as record:
+        sink.load_staging(fleet['raw_messages_path'])
+        record['rows_out'] = fleet['messages']
+
+    with report.stage('fetch', fleet['messages']) as record:
+        raw_messages_df = sink.fetch_staging()
+        record['rows_out'] = len(raw_messages_df)
+
+    if dedup_window_seconds is not None:
+        with report.stage('dedup', len(raw_messages_df)) as record:
+            raw_messages_df = raw_messages_df[DuplicateFilter(dedup_window_seconds).keep_mask(raw_messages_df)]
+            record['rows_out'] = len(raw_messages_df)
+            record['rejected'] = record['rows_in'] - len(raw_messages_df)
+
+    # The worker processes are started before the clock starts, the ETL starts them once for all batches too
+    with (ParallelCleaner(workers) if workers > 1 else nullcontext()) as cleaner:
+        clean_df = filter_raw_messages_clean_df(raw_messages_df, cleaner, report)
+
+    with report.stage('weather_load', fleet['observations']) as record:
+        weather_df = parse_weather_json(fleet['weather_path'])
+        record['rows_out'] = len(weather_df)
+
+    with report.stage('weather_join', len(clean_df)) as record:
+        combined_df = WeatherIndex(weather_df).join(clean_df)
+        record['rows_out'] = len(combined_df)
+
+    with report.stage('production_copy', 2 * len(clean_df)) as record:
+        sink.load_production('raw_messages_cleaned', clean_df)
+        sink.load_production('raw_messages_cleaned_weather', combined_df)
+        record['rows_out'] = len(clean_df) + len(combined_df)
+
+    with report.stage('rollups', len(combined_df)) as record:
+        rollups = sink.rollups(combined_df)
+        record['rows_out'] = sum(len(df) for df in rollups)
+
+    # The API reads the production columns, which use underscores where the joined weather columns have dots
+    messages_df = combined_df.rename(columns=lambda column: column.replace('.', '_'))
+    with report.stage('tracks') as record:
+        tracks_df, stats = sink.tracks(messages_df)
+        record.update(rows_in=stats['points_in'], rows_out=stats['points_out'],
+                      rejected=stats['points_in'] - stats['points_out'])
+    report.record_max('track_max_error_m', stats['max_error_m'])
+
+    with report.stage('snapshot', len(messages_df)) as record:
+        snapshot = DataSnapshot(1, compact_dtypes(messages_df), *rollups, compact_dtypes(tracks_df))
+        record['rows_out'] = len(snapshot.messages_by_device.df)
+    return snapshot
+
+
+# Latency percentiles in milliseconds
+def latency_summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        'p50': float(np.percentile(milliseconds, 50)),
+        'p95': float(np.percentile(milliseconds, 95)),
+        'max': float(milliseconds.max())
+    }
+
+
+# Function to time every endpoint of app.py on a snapshot, through Flask's test client. Every ship is requested once
+# (different query parameters, so every request renders the response) and then once more, answered from the
+# response cache.
+def time_endpoints(snapshot, date=DEFAULT_START):
+    app.snapshots = SnapshotRefresher(snapshot)
+    client = app.app.test_client()
+    device_ids = snapshot.messages_by_device.devices()
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        timings = {'uncached': [], 'cached': []}
+        for kind in timings:
+            for device_id in device_ids:
+                start = time.perf_counter()
+                response = client.get(endpoint, query_string={'device_id': device_id, 'date': date})
+                timings[kind].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{endpoint} answered {response.status_code} for {device_id}")
+        results[endpoint] = {
+            'requests': len(device_ids),
+            'uncached_ms': latency_summary(timings['uncached']),
+            'cached_ms': latency_summary(timings['cached'])
+        }
+    return results
+
+
+# Function to list the stages and endpoints that got slower than the baseline by more than the tolerance (0.25 is
+# 25% slower). Stages with different row counts than in the baseline are not compared.
+def compare_results(results, baseline, tolerance):
+    if baseline['meta']['sink'] != results['meta']['sink']:
+        raise ValueError(f"The baseline ran on the {baseline['meta']['sink']} sink, not on {results['meta']['sink']}")
+    regressions = []
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old is None or old['rows_in'] != stage['rows_in']:
+            continue
+        if stage['seconds'] > max(old['seconds'] * (1 + tolerance), MIN_REGRESSION_SECONDS):
+            regressions.append(f"stage {name}: {old['seconds']:.3f} s -> {stage['seconds']:.3f} s")
+    for endpoint, timing in results['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(endpoint)
+        if old is None or old['requests'] != timing['requests']:
+            continue
+        old_ms, new_ms = old['uncached_ms']['p50'], timing['uncached_ms']['p50']
+        if new_ms > max(old_ms * (1 + tolerance), MIN_REGRESSION_SECONDS * 1000):
+            regressions.append(f"endpoint {endpoint}: p50 {old_ms:.2f} ms -> {new_ms:.2f} ms")
+    return regressions
+
+
+# Function to generate a fleet, run the pipeline and the endpoints on it and return the results
+def run_benchmark(directory, sink_name='memory', ships=10, days=1, stations=16, workers=1, seed=0,
+                  start=DEFAULT_START, fleet_options=None, dedup_window_seconds=None):
+    fleet = write_fleet(directory, ships, days, stations, start=start, seed=seed, **(fleet_options or {}))
+    report = RunReport('pipeline_benchmark')
+    sink = SINKS[sink_name]()
+    try:
+        snapshot = run_pipeline(sink, fleet, report, workers, dedup_window_seconds)
+    finally:
+        sink.close()
+    endpoints = time_endpoints(snapshot, start)
+
+    return {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'sink': sink_name,
+            'workers': workers,
+            'dedup_window_seconds': dedup_window_seconds,
+            'fleet': {key: value for key, value in fleet.items() if not key.endswith('_path')},
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'peak_rss_bytes': peak_rss_bytes()
+        },
+        'stages': report.stages,
+        'stats': report.stats,
+        'endpoints': endpoints
+    }
+
+
+def print_results(results):
+    print(f"{'stage':>16} {'rows in':>10} {'rows out':>10} {'time (s)':>9} {'rows/s':>11}")
+    for name, stage in results['stages'].items():
+        rate = stage['rows_in'] / stage['seconds'] if stage['seconds'] else float('inf')
+        print(f"{name:>16} {stage['rows_in']:>10} {stage['rows_out']:>10} {stage['seconds']:>9.3f} {rate:>11.0f}")
+    print(f"{'endpoint':>28} {'requests':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'cached p50 (ms)':>16}")
+    for endpoint, timing in results['endpoints'].items():
+        print(f"{endpoint:>28} {timing['requests']:>9} {timing['uncached_ms']['p50']:>9.2f} "
+              f"{timing['uncached_ms']['p95']:>9.2f} {timing['cached_ms']['p50']:>16.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every ETL stage and API endpoint on a synthetic fleet.")
+    parser.add_argument("--sink", choices=sorted(SINKS), default='memory',
+                        help="Run against the databases of the .env file or keep everything in process")
+    parser.add_argument("--ships", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--stations", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="Parse the raw messages in this many processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dedup-window-seconds", type=int, default=None,
+                        help="Drop repeated deliveries of a message within this many seconds before parsing")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Report stages and endpoints slower than the baseline by more than this share")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = run_benchmark(directory, args.sink, args.ships, args.days, args.stations, args.workers, args.seed,
+                                dedup_window_seconds=args.dedup_window_seconds)
+    finally:
+        shutil.rmtree(directory)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import json
+import unittest
+import tempfile
+from unittest.mock import patch, MagicMock
+import pandas as pd
+from pipeline_benchmark import ENDPOINTS, PRODUCTION_TABLES, STAGING_TABLES, PostgresSink, compare_results, run_benchmark
+
+class PipelineBenchmarkTestCase(unittest.TestCase):
+
+    def test_run_benchmark_in_memory(self):
+        # Test that every stage and endpoint is timed and the results are JSON
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_benchmark(directory, 'memory', ships=2, days=0.1, stations=3,
+                                    fleet_options={'invalid_rate': 0.1})
+
+        self.assertEqual(list(results['stages']), [
+            'staging_copy', 'fetch', 'parse', 'normalize', 'sort', 'weather_load', 'weather_join', 'production_copy',
+            'rollups', 'tracks', 'snapshot'
+        ])
+        stages = results['stages']
+        messages = results['meta']['fleet']['messages']
+        self.assertEqual(stages['fetch']['rows_out'], messages)
+        self.assertGreater(stages['parse']['rejected'], 0)
+        self.assertEqual(stages['parse']['rows_out'], messages - stages['parse']['rejected'])
+        self.assertEqual(stages['sort']['rows_out'], stages['parse']['rows_out'])
+        self.assertEqual(stages['production_copy']['rows_out'], 2 * stages['sort']['rows_out'])
+        self.assertLess(stages['tracks']['rows_out'], stages['tracks']['rows_in'])
+        self.assertLessEqual(results['stats']['track_max_error_m'], 25.0)
+        self.assertEqual(list(results['endpoints']), ENDPOINTS)
+        self.assertEqual(results['endpoints']['/metrics/avg_speed']['requests'], 2)
+        json.dumps(results)
+
+    @patch('pipeline_benchmark.connection_params', return_value={})
+    @patch('pipeline_benchmark.psycopg2.connect')
+    def test_postgres_sink_statements(self, mock_connect, mock_params):
+        # Test that the Postgres sink writes into copies of the tables in its scratch schema and drops it on close
+        staging, production = MagicMock(), MagicMock()
+        mock_connect.side_effect = [staging, production]
+        sink = PostgresSink()
+
+        def statements(conn):
+            return [call.args[0] for call in conn.cursor.return_value.execute.call_args_list]
+
+        self.assertEqual(statements(production), [
+            "DROP SCHEMA IF EXISTS pipeline_benchmark CASCADE; CREATE SCHEMA pipeline_benchmark;",
+            *[f"CREATE TABLE pipeline_benchmark.{table_name} (LIKE public.{table_name} INCLUDING ALL);"
+              for table_name in PRODUCTION_TABLES],
+            "SET search_path TO pipeline_benchmark, public;"
+        ])
+        self.assertEqual(len(statements(staging)), len(STAGING_TABLES) + 2)
+        production.commit.assert_called_once()
+
+        # Writes name the tables unqualified, the search path resolves them to the copies
+        sink.load_production('raw_messages_cleaned', pd.DataFrame({'device_id': ['0001'], 'lat': [51.3]}))
+        copy_sql = production.cursor.return_value.copy_expert.call_args.args[0]
+        self.assertEqual(copy_sql, "COPY raw_messages_cleaned FROM STDIN WITH CSV")
+        self.assertEqual(production.commit.call_count, 2)
+
+        sink.close()
+        for conn in (staging, production):
+            self.assertEqual(statements(conn)[-1], "DROP SCHEMA IF EXISTS pipeline_benchmark CASCADE;")
+            conn.close.assert_called_once()
+
+    def test_compare_results(self):
+        # Test that only stages and endpoints slower than the tolerance, and not too fast to measure, are reported
+        def results(clean_seconds, fetch_seconds, p50_ms, rows_in=100):
+            return {
+                'meta': {'sink': 'memory'},
+                'stages': {
+                    'clean': {'rows_in': rows_in, 'seconds': clean_seconds},
+                    'fetch': {'rows_in': rows_in, 'seconds': fetch_seconds}
+                },
+                'endpoints': {'/metrics/avg_speed': {'requests': 2, 'uncached_ms': {'p50': p50_ms}}}
+            }
+
+        baseline = results(1.0, 0.001, 10.0)
+        self.assertEqual(compare_results(results(1.2, 0.004, 12.0), baseline, 0.25), [])
+        self.assertEqual(compare_results(results(1.5, 0.004, 20.0), baseline, 0.25), [
+            "stage clean: 1.000 s -> 1.500 s", "endpoint /metrics/avg_speed: p50 10.00 ms -> 20.00 ms"
+        ])
+        # Another number of rows is not comparable
+        self.assertEqual(compare_results(results(1.5, 0.004, 10.0, rows_in=200), baseline, 0.25), [])
+
+        other_sink = dict(baseline, meta={'sink': 'postgres'})
+        with self.assertRaises(ValueError):
+            compare_results(results(1.0, 0.001, 10.0), other_sink, 0.25)
+
+if __name__ == '__main__':
+    unittest.main()
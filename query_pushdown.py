@@ -0,0 +1,202 @@
+import weakref
+import threading
+from datetime import datetime, timezone
+import pandas as pd
+from db_connection import cursor
+from snapshot import WEATHER_COLUMNS, SnapshotRefresher
+from trajectory import ROUTE_COLUMNS, TRACK_ROW_COLUMNS
+from area_index import AREA_COLUMNS
+from typed_fetch import compact_dtypes
+from data_changes import fetch_change_marker
+
+# The queries of the API in pushdown mode, run as server-side prepared statements: name -> (parameter types, query).
+# Every one reads a single ship over a time range (or the devices registry), so it only touches the ship's rows in the
+# daily partitions of the range through the (device_id, datetime) index, see partitions.py.
+PUSHDOWN_STATEMENTS = {
+    # The registry has one row per ship, counting it does not scan the message history like COUNT(DISTINCT) would
+    'ship_count': ((), "SELECT count(*) FROM devices"),
+    'hourly_speed': (('text', 'timestamp', 'timestamp'), """
+        SELECT date_trunc('hour', datetime) AS hour, avg(speed_over_ground_d)::float8 AS avg_speed
+        FROM raw_messages_cleaned_weather
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3
+        GROUP BY 1
+        ORDER BY 1
+    """),
+    # Like the daily rollup, days without any wind observation get no row
+    'daily_wind': (('text', 'timestamp', 'timestamp'), """
+        SELECT datetime::date AS day, max(wind_spd)::float8 AS max_wind_spd, min(wind_spd)::float8 AS min_wind_spd
+        FROM raw_messages_cleaned_weather
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3 AND wind_spd IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+    """),
+    'weather_rows': (('text', 'timestamp', 'timestamp'), f"""
+        SELECT {', '.join(WEATHER_COLUMNS)}
+        FROM raw_messages_cleaned_weather
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3
+        ORDER BY datetime
+    """),
+    # The message tables keep the coordinates unsigned, the direction fields carry the hemisphere
+    'route_rows': (('text', 'timestamp', 'timestamp'), """
+        SELECT datetime,
+               (CASE WHEN latitude_direction = 'S' THEN -lat ELSE lat END)::float8 AS lat,
+               (CASE WHEN longitude_direction = 'W' THEN -lon ELSE lon END)::float8 AS lon,
+               speed_over_ground_d::float8, true_course::float8
+        FROM raw_messages_cleaned_weather
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3
+        ORDER BY datetime
+    """),
+    'track_rows': (('text', 'timestamp', 'timestamp'), f"""
+        SELECT {', '.join(TRACK_ROW_COLUMNS)}
+        FROM device_tracks
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3
+        ORDER BY datetime
+    """),
+    # The days a ship has messages on, read from the (device_id, datetime) index
+    'message_days': (('text', 'timestamp', 'timestamp'), """
+        SELECT DISTINCT date_trunc('day', datetime) AS day
+        FROM raw_messages_cleaned_weather
+        WHERE device_id = $1 AND datetime >= $2 AND datetime < $3
+        ORDER BY 1
+    """),
+    # The ships in a box (west, south, east, north) over a time range. The range limits the scan to its daily
+    # partitions, the position of every message in them is compared with the box. A box with west > east crosses
+    # the antimeridian.
+    'ships_in_area': (('float8', 'float8', 'float8', 'float8', 'timestamp', 'timestamp'), """
+        SELECT device_id, min(datetime) AS first_seen, max(datetime) AS last_seen, count(*) AS messages
+        FROM (
+            SELECT device_id, datetime,
+                   CASE WHEN latitude_direction = 'S' THEN -lat ELSE lat END AS lat,
+                   CASE WHEN longitude_direction = 'W' THEN -lon ELSE lon END AS lon
+            FROM raw_messages_cleaned_weather
+            WHERE datetime >= $5 AND datetime < $6
+        ) AS positions
+        WHERE lat BETWEEN $2 AND $4 AND (lon BETWEEN $1 AND $3 OR ($1 > $3 AND (lon >= $1 OR lon <= $3)))
+        GROUP BY device_id
+        ORDER BY device_id
+    """)
+}
+
+# Names of the statements prepared in every pooled connection's session, forgotten with the connection
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+# Function to run one of PUSHDOWN_STATEMENTS on a pooled PRODUCTION connection and return its rows. The statement is
+# prepared the first time a connection runs it, after that only its name and parameters are sent and the server
+# reuses the parsed (and, once it settles on one, the planned) query.
+def execute_prepared(name, params=()):
+    types, query = PUSHDOWN_STATEMENTS[name]
+    with cursor("PRODUCTION") as cur:
+        conn = cur.connection
+        with _prepared_lock:
+            prepared = _prepared.setdefault(conn, set())
+        if name not in prepared:
+            type_list = f"({', '.join(types)})" if types else ""
+            cur.execute(f"PREPARE {name}{type_list} AS {query};")
+            prepared.add(name)
+        cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(params))});" if params else f"EXECUTE {name};", params)
+        return cur.fetchall()
+
+
+# Bucket the range of a ship's statement is rounded up to, a rollup only holds whole hours or days
+STATEMENT_BUCKETS = {'hourly_speed': 'h', 'daily_wind': 'D', 'weather_rows': None, 'route_rows': None,
+                     'track_rows': None, 'message_days': None}
+
+
+# The bound of a range for a prepared statement, rounded up to the first whole bucket at or after it when freq is
+# given. An open side is the earliest or latest datetime, which both psycopg2 and asyncpg accept for a timestamp.
+def range_bound(value, open_bound, freq=None):
+    if value is None:
+        return open_bound
+    value = pd.Timestamp(value)
+    return (value.ceil(freq) if freq else value).to_pydatetime()
+
+
+# Function to give the parameters of a ship's statement for start <= datetime < end, either bound may be None to leave
+# that side open
+def statement_params(name, device_id, start=None, end=None):
+    freq = STATEMENT_BUCKETS[name]
+    return device_id, range_bound(start, datetime.min, freq), range_bound(end, datetime.max, freq)
+
+
+# Function to give the parameters of the ships_in_area statement for the box (west, south, east, north) and
+# start <= datetime < end, either bound may be None to leave that side open
+def area_params(bbox, start=None, end=None):
+    return (*(float(value) for value in bbox), range_bound(start, datetime.min), range_bound(end, datetime.max))
+
+
+# Function to turn the rows of a statement into the DataFrame the endpoints format, with the dtypes of the
+# in-memory tables also when there are no rows
+def result_frame(name, rows):
+    if name == 'hourly_speed':
+        return pd.DataFrame(rows, columns=['hour', 'avg_speed']).astype(
+            {'hour': 'datetime64[us]', 'avg_speed': 'float64'}
+        )
+    if name == 'daily_wind':
+        return pd.DataFrame(rows, columns=['day', 'max_wind_spd', 'min_wind_spd']).astype(
+            {'max_wind_spd': 'float64', 'min_wind_spd': 'float64'}
+        )
+    if name == 'message_days':
+        return pd.DataFrame(rows, columns=['day']).astype({'day': 'datetime64[us]'})
+    if name == 'ships_in_area':
+        return pd.DataFrame(rows, columns=AREA_COLUMNS).astype(
+            {'first_seen': 'datetime64[us]', 'last_seen': 'datetime64[us]', 'messages': 'int64'}
+        )
+    columns = {'weather_rows': WEATHER_COLUMNS, 'route_rows': ROUTE_COLUMNS, 'track_rows': TRACK_ROW_COLUMNS}[name]
+    return compact_dtypes(pd.DataFrame(rows, columns=columns).astype({'datetime': 'datetime64[us]'}))
+
+
+# Answers the API's queries from production at request time instead of from a snapshot in memory. It has the
+# interface of DataSnapshot the endpoints use and holds nothing but the version of the data it answers for, so an
+# API process only needs the memory of its responses and the database may hold more history than fits in RAM.
+class DatabaseView:
+
+    def __init__(self, version):
+        self.version = version    # last etl_changes.change_id seen, the response cache key still changes with it
+        self.built_at = datetime.now(timezone.utc)
+        self.memory_bytes = 0
+        # The messages stay in the database
+        self.row_count = None
+
+    def ship_count(self):
+        return execute_prepared('ship_count')[0][0]
+
+    def _query(self, name, device_id, start, end):
+        return result_frame(name, execute_prepared(name, statement_params(name, device_id, start, end)))
+
+    def hourly_speed(self, device_id, start=None, end=None):
+        return self._query('hourly_speed', device_id, start, end)
+
+    def daily_wind(self, device_id, start=None, end=None):
+        return self._query('daily_wind', device_id, start, end)
+
+    def weather_rows(self, device_id, start=None, end=None):
+        return self._query('weather_rows', device_id, start, end)
+
+    def route_rows(self, device_id, start=None, end=None):
+        return self._query('route_rows', device_id, start, end)
+
+    def track_rows(self, device_id, start=None, end=None):
+        return self._query('track_rows', device_id, start, end)
+
+    def message_days(self, device_id, start=None, end=None):
+        return self._query('message_days', device_id, start, end)
+
+    def in_area(self, bbox, start=None, end=None):
+        return result_frame('ships_in_area', execute_prepared('ships_in_area', area_params(bbox, start, end)))
+
+
+# Function to start pushdown mode at the current change marker, nothing is loaded
+def load_database_view():
+    with cursor("PRODUCTION") as cur:
+        version, _ = fetch_change_marker(cur, 0)
+    return DatabaseView(version)
+
+
+# Follows the change marker like SnapshotRefresher, but a change only moves the version forward, which invalidates
+# the cached responses: the data itself is read from production on every request anyway
+class PushdownRefresher(SnapshotRefresher):
+
+    def build(self, snapshot, latest_change_id):
+        return DatabaseView(latest_change_id)
@@ -0,0 +1,110 @@
+import unittest
+import datetime
+from unittest.mock import patch, MagicMock
+import pandas as pd
+from query_pushdown import DatabaseView, PushdownRefresher, execute_prepared
+
+# A pooled cursor on the given connection, returning rows for every statement
+def mock_cursor(mock_cursor_factory, conn, rows):
+    cur = MagicMock()
+    cur.connection = conn
+    cur.fetchall.return_value = rows
+    mock_cursor_factory.return_value.__enter__.return_value = cur
+    return cur
+
+class QueryPushdownTestCase(unittest.TestCase):
+
+    @patch('query_pushdown.cursor')
+    def test_statements_are_prepared_once_per_connection(self, mock_cursor_factory):
+        # Test that a connection prepares a statement on first use and only executes it afterwards
+        conn = MagicMock()
+        cur = mock_cursor(mock_cursor_factory, conn, [(3,)])
+
+        self.assertEqual(execute_prepared('ship_count'), [(3,)])
+        self.assertEqual(execute_prepared('ship_count'), [(3,)])
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        self.assertEqual(sum(statement.startswith('PREPARE ship_count AS') for statement in statements), 1)
+        self.assertEqual(statements.count('EXECUTE ship_count;'), 2)
+
+        # Another connection of the pool has its own session
+        other_cur = mock_cursor(mock_cursor_factory, MagicMock(), [(3,)])
+        execute_prepared('ship_count')
+        self.assertTrue(other_cur.execute.call_args_list[0].args[0].startswith('PREPARE ship_count AS'))
+
+    @patch('query_pushdown.execute_prepared')
+    def test_bucket_queries_read_whole_buckets(self, mock_execute):
+        # Test that the bounds are moved to the next whole hour or day like the rollups answer, open bounds are
+        # the earliest and latest datetimes, and an empty result keeps the column types the endpoints format
+        mock_execute.return_value = []
+        view = DatabaseView(7)
+
+        hourly_df = view.hourly_speed('0001', pd.Timestamp('2019-02-13 08:30'), None)
+        mock_execute.assert_called_with('hourly_speed', ('0001', datetime.datetime(2019, 2, 13, 9),
+                                                         datetime.datetime.max))
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(hourly_df['hour']))
+        self.assertEqual(list(hourly_df['hour'].dt.hour), [])
+
+        view.daily_wind('0001', pd.Timestamp('2019-02-12 12:00'), pd.Timestamp('2019-02-14'))
+        mock_execute.assert_called_with('daily_wind', ('0001', datetime.datetime(2019, 2, 13),
+                                                       datetime.datetime(2019, 2, 14)))
+
+        view.weather_rows('0001')
+        mock_execute.assert_called_with('weather_rows', ('0001', datetime.datetime.min, datetime.datetime.max))
+
+    @patch('query_pushdown.execute_prepared')
+    def test_weather_rows_have_compact_dtypes(self, mock_execute):
+        # Test that rows read at request time have the dtypes of the messages of a snapshot
+        mock_execute.return_value = [
+            (datetime.datetime(2019, 2, 13, 14, 10), 5.0, 2.5, 80.0, 'Overcast clouds', 'Antwerp', 'Europe/Brussels')
+        ]
+        weather_df = DatabaseView(7).weather_rows('0001', pd.Timestamp('2019-02-13'), pd.Timestamp('2019-02-14'))
+
+        self.assertEqual(weather_df['temp'].dtype, 'float32')
+        self.assertEqual(weather_df['city_name'].dtype, 'category')
+        self.assertEqual(weather_df['datetime'].iloc[0], pd.Timestamp('2019-02-13 14:10'))
+
+    @patch('query_pushdown.execute_prepared')
+    def test_track_rows_are_named_by_column(self, mock_execute):
+        # Test that the track points have the columns of a snapshot's track_rows, and an empty track stays empty
+        mock_execute.return_value = [
+            (datetime.datetime(2019, 2, 13, 14, 10), -33.9, 18.4, 10.0, 90.0, 5.0, 2.5, 80.0, 'Overcast clouds',
+             'Cape Town', 'Africa/Johannesburg')
+        ]
+        track_df = DatabaseView(7).track_rows('0001', pd.Timestamp('2019-02-13'), pd.Timestamp('2019-02-14'))
+
+        mock_execute.assert_called_with('track_rows', ('0001', datetime.datetime(2019, 2, 13),
+                                                       datetime.datetime(2019, 2, 14)))
+        self.assertEqual(track_df[['lat', 'lon']].iloc[0].tolist(), [-33.9, 18.4])
+        self.assertEqual(track_df['city_name'].iloc[0], 'Cape Town')
+
+        mock_execute.return_value = []
+        self.assertTrue(DatabaseView(7).track_rows('0001').empty)
+
+    @patch('snapshot.fetch_change_marker')
+    @patch('snapshot.cursor')
+    def test_refresh_only_moves_the_version(self, mock_cursor, mock_marker):
+        # Test that a new load gives a new view of the new version and nothing is loaded
+        refresher = PushdownRefresher(DatabaseView(3))
+        mock_marker.return_value = (5, None)
+
+        self.assertTrue(refresher.refresh())
+        self.assertIsInstance(refresher.current(), DatabaseView)
+        self.assertEqual(refresher.current().version, 5)
+        self.assertIsNone(refresher.status()['snapshot_rows'])
+
+    @patch('query_pushdown.execute_prepared')
+    def test_in_area_passes_the_box_and_range(self, mock_execute):
+        # Test that the box and the open end of the range become the statement's parameters
+        mock_execute.return_value = [('0001', datetime.datetime(2019, 2, 13, 14, 10),
+                                      datetime.datetime(2019, 2, 13, 15, 10), 2)]
+        ships_df = DatabaseView(7).in_area((4, 51, 5, 52), pd.Timestamp('2019-02-13'))
+
+        mock_execute.assert_called_with('ships_in_area', (4.0, 51.0, 5.0, 52.0, datetime.datetime(2019, 2, 13),
+                                                          datetime.datetime.max))
+        self.assertEqual(ships_df.to_dict(orient='records'), [
+            {'device_id': '0001', 'first_seen': pd.Timestamp('2019-02-13 14:10'),
+             'last_seen': pd.Timestamp('2019-02-13 15:10'), 'messages': 2}
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
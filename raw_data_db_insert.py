@@ -1,61 +1,146 @@
-import psycopg2
-from urllib.parse import urlparse
-from dotenv import load_dotenv
-import os
-
+import io
+import sys
+import gzip
+import argparse
+from contextlib import contextmanager, nullcontext
+from db_connection import connection, close_pools
+from instrumentation import RUN_REPORT_DIR, RunReport, stage
+from partitions import ensure_partitions_for_table
+
+# Key of the staging table, datetime is part of it because the table is partitioned on it
+STAGING_KEY_COLUMNS = ['device_id', 'original_message_id', 'datetime']
+
+# CSV export of the raw messages loaded into staging
+RAW_MESSAGES_CSV_PATH = '/workspaces/Xomnia-Assignment/data/raw_messages.csv'
+
+# First bytes of gzip and zstd compressed data
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Bytes of CSV data handed to COPY at once, psycopg2 reads 8 KB at a time by default
+COPY_READ_BYTES = 1 << 20
+
+# Open a raw messages CSV for reading as bytes: a file or named pipe, or stdin for '-'. gzip and zstd compressed data
+# is recognized by its first bytes, whatever the file is called, and decompressed as it is read, never to disk.
+# zstandard (pip install zstandard) is only imported for zstd data.
+@contextmanager
+def open_raw_csv(file_path):
+    with (nullcontext(sys.stdin.buffer) if file_path == '-' else open(file_path, 'rb')) as file:
+        magic = file.peek(len(ZSTD_MAGIC))[:len(ZSTD_MAGIC)]
+        if magic.startswith(GZIP_MAGIC):
+            with gzip.GzipFile(fileobj=file) as decompressed:
+                yield decompressed
+        elif magic == ZSTD_MAGIC:
+            import zstandard
+            reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=False)
+            # Buffered, so reads return as many bytes as asked for and lines can be read
+            with io.BufferedReader(reader, COPY_READ_BYTES) as decompressed:
+                yield decompressed
+        else:
+            yield file
+
+# COPY a CSV file into a table, returning the number of rows copied. The file may be compressed, see open_raw_csv.
 def copy_from_csv(cursor, file_path, table_name):
-    with open(file_path, 'r') as f:
-        next(f)  # Skip the header row
-        cursor.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV HEADER", f)
-
-def create_cursor_and_insert_data(connection, csv_file_path, table_name):
+    with open_raw_csv(file_path) as f:
+        # The HEADER option already skips the header row
+        cursor.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV HEADER", f, size=COPY_READ_BYTES)
+    return cursor.rowcount
+
+# Create the temporary table rows are copied into before they go into a table, dropped when the transaction ends
+def create_load_table(cursor, table_name):
+    load_table = f"{table_name}_load"
+    cursor.execute(f"CREATE TEMP TABLE {load_table} (LIKE {table_name}) ON COMMIT DROP;")
+    return load_table
+
+# Insert the rows of a load table whose key is not in the table yet, returning how many were new. The daily partitions
+# of their days are created first when the table is partitioned. Rows go in in key order, so loads running at once
+# wait for the keys they share in the same order instead of deadlocking on them.
+def insert_new_rows(cursor, load_table, table_name, key_columns):
+    ensure_partitions_for_table(cursor, table_name, load_table)
+    cursor.execute(f"""
+        INSERT INTO {table_name} SELECT * FROM {load_table} ORDER BY {', '.join(key_columns)}
+        ON CONFLICT ({', '.join(key_columns)}) DO NOTHING;
+    """)
+    return cursor.rowcount
+
+# COPY a CSV file through a temporary table and only keep the rows whose key is not in the table yet.
+# Returns the number of rows in the file and the number of them that were new.
+def copy_new_rows_from_csv(cursor, file_path, table_name, key_columns):
+    load_table = create_load_table(cursor, table_name)
+    copied_rows = copy_from_csv(cursor, file_path, load_table)
+    return copied_rows, insert_new_rows(cursor, load_table, table_name, key_columns)
+
+# With a RunReport the COPY and the commit are timed as stages of it, rows already in the table count as rejected
+def create_cursor_and_insert_data(connection, csv_file_path, table_name, key_columns=None, report=None):
     cursor = connection.cursor()
 
     print("Connection established successfully!")
     
-    # Use COPY command to bulk insert from CSV
-    copy_from_csv(cursor, csv_file_path, table_name)
+    # Use COPY command to bulk insert from CSV, skipping rows that are already loaded when the table has a key
+    with stage(report, 'copy') as record:
+        if key_columns:
+            copied_rows, new_rows = copy_new_rows_from_csv(cursor, csv_file_path, table_name, key_columns)
+        else:
+            copied_rows = new_rows = copy_from_csv(cursor, csv_file_path, table_name)
+        record.update(rows_in=copied_rows, rows_out=new_rows, rejected=copied_rows - new_rows)
 
     print("Data inserted successfully!")
 
     # Commit the transaction
-    connection.commit()
+    with stage(report, 'commit'):
+        connection.commit()
     
     # Close the cursor
     cursor.close()
 
+# copy_writer (and with it pandas) is only imported when a DataFrame is loaded, the CSV load above runs without it
+def create_cursor_and_insert_df(connection, df, table_name, binary=False):
+    from copy_writer import copy_from_dataframe
+    cursor = connection.cursor()
 
-def main():
+    print("Connection established successfully!")
 
-    load_dotenv()
+    # Use COPY command to bulk insert straight from the DataFrame, without a temporary CSV file
+    copy_from_dataframe(cursor, df, table_name, binary=binary)
 
-    # Fetch the database URL from the .env file
-    STAGING_URL = os.getenv("STAGING_KEY")
+    print("Data inserted successfully!")
 
-    # Parse the URL to extract connection parameters
-    url = urlparse(STAGING_URL)
+    # Commit the transaction
+    connection.commit()
 
-    conn_params = {
-        'dbname': url.path[1:],    # Extracts the database name after '/'
-        'user': url.username,       # Extracts the username
-        'password': url.password,   # Extracts the password
-        'host': url.hostname,       # Extracts the host
-        'port': url.port            # Extracts the port
-    }
+    # Close the cursor
+    cursor.close()
 
-    # Establish a connection to the database
-    conn = psycopg2.connect(**conn_params)
 
+def main(run_report_dir=RUN_REPORT_DIR, csv_file_path=RAW_MESSAGES_CSV_PATH):
+    report = RunReport('raw_data_db_insert')
     try:
-        # Path to the CSV file
-        csv_file_path = '/workspaces/Xomnia-Assignment/data/raw_messages.csv'
-        
-        # Create the tables and insert the data
-        create_cursor_and_insert_data(conn, csv_file_path, 'raw_messages')
+        # Borrow a connection to the staging database
+        with connection("STAGING") as conn:
+            # Insert the data, messages that are already in the table are skipped so the script can be re-run
+            create_cursor_and_insert_data(conn, csv_file_path, 'raw_messages',
+                                          key_columns=STAGING_KEY_COLUMNS, report=report)
+    except Exception as error:
+        report.error = f"{type(error).__name__}: {error}"
+        raise
     finally:
-        conn.close()
+        close_pools()
+        print(report.summary())
+        if run_report_dir:
+            print(f"Run report written to {report.write(run_report_dir)}")
+
+
+# Command line of the script, also run by `ships etl raw`
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Load the raw messages CSV into the staging table.")
+    parser.add_argument("--csv-path", default=RAW_MESSAGES_CSV_PATH,
+                        help="CSV file of the raw messages, gzip or zstd compressed or not, '-' to read it from stdin")
+    parser.add_argument("--run-report-dir", default=RUN_REPORT_DIR,
+                        help="Directory to write the JSON run report with the time of every stage to, empty to skip it")
+    args = parser.parse_args(argv)
+    main(run_report_dir=args.run_report_dir, csv_file_path=args.csv_path)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
 
@@ -1,11 +1,22 @@
+import io
+import os
+import gzip
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
+import psycopg2.extensions
 import pandas as pd
-from exploratory_data_analysis import fetch_data_from_db, robust_clean_raw_message
+from raw_data_db_insert import open_raw_csv, copy_from_csv, COPY_READ_BYTES
+from db_connection import close_pools, pool_stats
+from exploratory_data_analysis import fetch_data_from_db, fetch_data_in_batches, robust_clean_raw_message
 
 class ExploratoryDataAnalysisTestCase(unittest.TestCase):
 
-    @patch('exploratory_data_analysis.psycopg2.connect')
+    def tearDown(self):
+        # Drop the pooled mock connections
+        close_pools()
+
+    @patch('db_connection.psycopg2.connect')
     def test_fetch_data_from_db(self, mock_connect):
         # Mock the database connection and cursor
         mock_conn = MagicMock()
@@ -34,6 +45,37 @@ class ExploratoryDataAnalysisTestCase(unittest.TestCase):
         # Validate the result DataFrame
         pd.testing.assert_frame_equal(result_df, expected_df)
     
+    @patch('db_connection.psycopg2.connect')
+    def test_fetch_data_in_batches(self, mock_connect):
+        # Mock the database connection and the server-side cursor
+        mock_conn = MagicMock(closed=False)
+        mock_conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        mock_cursor = MagicMock(closed=False)
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+
+        # Mock three rows coming back in batches of two
+        mock_cursor.fetchmany.side_effect = [
+            [('st-1a2090', '1550066999'), ('st-1a2090', '1550067000')],
+            [('0001', '1550067001')],
+            []
+        ]
+        mock_cursor.description = [('device_id',), ('datetime',)]
+
+        # Call fetch_data_in_batches function
+        batches = list(fetch_data_in_batches(query="SELECT * FROM raw_messages;", environment="STAGING", batch_size=2))
+
+        # Validate the batches and that a named (server-side) cursor was used
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(list(batches[1]['device_id']), ['0001'])
+        self.assertIn('name', mock_conn.cursor.call_args.kwargs)
+        mock_cursor.fetchmany.assert_called_with(2)
+
+        # The cursor is closed but the connection goes back to the pool for the next query
+        mock_cursor.close.assert_called_once()
+        mock_conn.close.assert_not_called()
+        self.assertEqual(pool_stats()['STAGING']['idle_connections'], 1)
+    
     def test_robust_clean_raw_message_valid(self):
         # Test with a valid message
         test_message = "A,51.31831,N,4.18015,E,0.0,1.59,150218,0.8,W"
@@ -66,5 +108,59 @@ class ExploratoryDataAnalysisTestCase(unittest.TestCase):
         result = robust_clean_raw_message(test_message)
         self.assertIsNone(result)
 
+CSV_DATA = (b'device_id,datetime,address_ip,address_port,original_message_id,raw_message\n'
+            b'0001,1550066999,172.19.0.17,4007,1550070599576-0,"A,51.3183,N,4.3157,E,0.0,1.59,150218,0.8,E"\n')
+
+class RawDataDBInsertTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, data):
+        # Named .csv whatever the contents, compression is recognized by the first bytes
+        path = os.path.join(self.directory.name, 'raw_messages.csv')
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_open_raw_csv_decompresses_gzip(self):
+        # Test that plain and gzip compressed files read as the same CSV data, several gzip members as one
+        with open_raw_csv(self.write_file(CSV_DATA)) as file:
+            self.assertEqual(file.read(), CSV_DATA)
+        with open_raw_csv(self.write_file(gzip.compress(CSV_DATA[:40]) + gzip.compress(CSV_DATA[40:]))) as file:
+            self.assertEqual(file.readline(), CSV_DATA.splitlines(keepends=True)[0])
+            self.assertEqual(file.read(), CSV_DATA.splitlines(keepends=True)[1])
+
+    def test_open_raw_csv_reads_stdin(self):
+        # Test that '-' reads a compressed dump from stdin, and leaves stdin open
+        stdin = MagicMock(buffer=io.BufferedReader(io.BytesIO(gzip.compress(CSV_DATA))))
+        with patch('raw_data_db_insert.sys.stdin', stdin), open_raw_csv('-') as file:
+            self.assertEqual(file.read(), CSV_DATA)
+        self.assertFalse(stdin.buffer.closed)
+
+    def test_open_raw_csv_decompresses_zstd(self):
+        # Test that zstd data is read through zstandard's stream reader, across its frames
+        mock_zstandard = MagicMock()
+        mock_zstandard.ZstdDecompressor.return_value.stream_reader.side_effect = (
+            lambda file, **kwargs: io.BytesIO(CSV_DATA)
+        )
+        path = self.write_file(b'\x28\xb5\x2f\xfd' + b'frames')
+        with patch.dict('sys.modules', {'zstandard': mock_zstandard}), open_raw_csv(path) as file:
+            self.assertEqual(file.read(), CSV_DATA)
+        self.assertTrue(mock_zstandard.ZstdDecompressor.return_value.stream_reader.call_args.kwargs['read_across_frames'])
+
+    def test_copy_from_csv_streams_large_reads(self):
+        # Test that COPY gets the decompressed bytes in reads of COPY_READ_BYTES
+        mock_cursor = MagicMock(rowcount=1)
+        mock_cursor.copy_expert.side_effect = lambda statement, file, size: self.assertEqual(file.read(), CSV_DATA)
+
+        self.assertEqual(copy_from_csv(mock_cursor, self.write_file(gzip.compress(CSV_DATA)), 'raw_messages'), 1)
+        self.assertEqual(mock_cursor.copy_expert.call_args.args[0],
+                         "COPY raw_messages FROM STDIN WITH CSV HEADER")
+        self.assertEqual(mock_cursor.copy_expert.call_args.kwargs['size'], COPY_READ_BYTES)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,121 @@
+import os
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, make_response
+
+# Upper bound on the size of the cached response bodies
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Part of every ETag, the same for every process and restart of a deployment so that any of them can answer a
+# client's If-None-Match with 304. Change it when the data versions start over, e.g. after production is recreated.
+ETAG_SALT = os.getenv('ETAG_SALT', '')
+
+
+# LRU cache of rendered responses, bounded by the total size of the bodies. Entries belong to one data version:
+# the first lookup or store for a newer version drops everything cached for older ones.
+class ResponseCache:
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()    # key -> (body, headers)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'not_modified': 0}
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.stats['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, version, body, headers):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, headers)
+            self._bytes += len(body)
+            # Evict the least recently used responses until the bodies fit again
+            while self._bytes > self.max_bytes:
+                _, (evicted_body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_body)
+                self.stats['evictions'] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.stats['not_modified'] += 1
+
+    # Counters plus the current size, for sizing the cache
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+# Cache key of a request: its path and query parameters, in any order
+def cache_key(path, query_items):
+    return path, tuple(sorted(query_items))
+
+
+# Strong ETag of a response: the same endpoint, query parameters and data version always render the same body
+def make_etag(key, version, salt=ETAG_SALT):
+    return hashlib.sha1(repr((salt, key, version)).encode('utf-8')).hexdigest()
+
+
+# Function to check an If-None-Match header against an ETag, for servers without werkzeug's parsing. Weak ETags
+# never match, like werkzeug's ETags.contains.
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or f'"{etag}"' in tags
+
+
+# Decorator for GET endpoints whose response only depends on the request and the data version.
+# A matching If-None-Match is answered with 304 before the view runs, other requests are served from the cache
+# when possible. Only 200 responses are cached.
+def cached_response(cache, version_func):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = version_func()
+            key = cache_key(request.path, request.args.items(multi=True))
+            etag = make_etag(key, version)
+
+            if request.if_none_match.contains(etag):
+                cache.count_not_modified()
+                response = make_response('', 304, {'Cache-Control': 'no-cache'})
+                response.set_etag(etag)
+                return response
+
+            entry = cache.get(key, version)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                cache.put(key, version, response.get_data(), dict(response.headers))
+                return response
+
+            body, headers = entry
+            return make_response(body, 200, headers)
+        return wrapper
+    return decorator
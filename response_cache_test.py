@@ -0,0 +1,110 @@
+import unittest
+import os
+import sys
+import subprocess
+from unittest.mock import MagicMock
+from flask import Flask, jsonify
+from response_cache import ResponseCache, cache_key, cached_response, etag_matches, make_etag
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # A small app with one cached endpoint whose data version can be changed by the test
+        self.version = 1
+        self.cache = ResponseCache()
+        self.view = MagicMock(side_effect=lambda: jsonify({"version": self.version}))
+        app = Flask(__name__)
+
+        @app.route('/metric')
+        @cached_response(self.cache, lambda: self.version)
+        def metric():
+            return self.view()
+
+        @app.route('/invalid')
+        @cached_response(self.cache, lambda: self.version)
+        def invalid():
+            return jsonify({"error": "bad parameter"}), 400
+
+        self.client = app.test_client()
+
+    def test_lru_eviction_by_size(self):
+        # Test that the least recently used entry goes first once the bodies no longer fit
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', 1, b'aaaa', {})
+        cache.put('b', 1, b'bbbb', {})
+        cache.get('a', 1)
+        cache.put('c', 1, b'cccc', {})
+
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIsNotNone(cache.get('a', 1))
+        self.assertIsNotNone(cache.get('c', 1))
+        self.assertEqual(cache.snapshot()['evictions'], 1)
+        self.assertEqual(cache.snapshot()['bytes'], 8)
+
+    def test_new_version_invalidates(self):
+        # Test that entries of an older data version are dropped
+        cache = ResponseCache()
+        cache.put('a', 1, b'aaaa', {})
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual(cache.snapshot()['invalidations'], 1)
+        self.assertEqual(cache.snapshot()['entries'], 0)
+
+    def test_cached_response(self):
+        # Test that the second request is served from the cache with the same strong ETag
+        first = self.client.get('/metric?b=2&a=1')
+        second = self.client.get('/metric?a=1&b=2')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertFalse(first.headers['ETag'].startswith('W/'))
+        self.view.assert_called_once()
+        self.assertEqual(self.cache.snapshot()['hits'], 1)
+        self.assertEqual(self.cache.snapshot()['misses'], 1)
+
+    def test_conditional_get(self):
+        # Test that a matching If-None-Match is answered with 304 without running the view
+        etag = self.client.get('/metric').headers['ETag']
+        response = self.client.get('/metric', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.view.assert_called_once()
+        self.assertEqual(self.cache.snapshot()['not_modified'], 1)
+
+        # After the data changes the old ETag no longer matches
+        self.version = 2
+        response = self.client.get('/metric', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.get_json(), {"version": 2})
+
+    def test_etags_are_shared_by_processes(self):
+        # Test that another process, like a restarted server or another worker, gives a request the same ETag
+        key = cache_key('/metric', [('device_id', '0001')])
+        other = subprocess.run(
+            [sys.executable, '-c', "from response_cache import cache_key, make_etag; "
+                                   "print(make_etag(cache_key('/metric', [('device_id', '0001')]), 1))"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        self.assertEqual(other.stdout.strip(), make_etag(key, 1))
+        self.assertNotEqual(make_etag(key, 1, salt='recreated'), make_etag(key, 1))
+
+    def test_errors_are_not_cached(self):
+        # Test that only successful responses are stored
+        self.client.get('/invalid')
+        response = self.client.get('/invalid')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response.headers)
+        self.assertEqual(self.cache.snapshot()['entries'], 0)
+
+    def test_etag_matches(self):
+        # Test that the If-None-Match parsing of servers without werkzeug matches only strong ETags
+        self.assertTrue(etag_matches('"abc"', 'abc'))
+        self.assertTrue(etag_matches('"xyz", "abc"', 'abc'))
+        self.assertTrue(etag_matches('*', 'abc'))
+        self.assertFalse(etag_matches('W/"abc"', 'abc'))
+        self.assertFalse(etag_matches(None, 'abc'))
+
+if __name__ == '__main__':
+    unittest.main()
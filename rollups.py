@@ -0,0 +1,80 @@
+import pandas as pd
+
+# Rollup tables maintained next to raw_messages_cleaned_weather, see create_rollup_tables in db_creation.py.
+# A load recomputes every (device, bucket) it touched from the message table instead of adding to the old values,
+# so re-loading or upserting the same messages never counts them twice.
+
+# Speed statistics per device and hour. The bounds of all buckets together let PostgreSQL skip the daily partitions
+# of the message table outside them, the join alone does not.
+REFRESH_HOURLY_SPEED_SQL = """
+    DELETE FROM device_hourly_speed h
+    USING unnest(%(device_ids)s::text[], %(hours)s::timestamp[]) AS t(device_id, hour)
+    WHERE h.device_id = t.device_id AND h.hour = t.hour;
+
+    INSERT INTO device_hourly_speed
+        (device_id, hour, message_count, avg_speed, min_speed, max_speed, first_datetime, last_datetime)
+    SELECT m.device_id, t.hour, count(*), avg(m.speed_over_ground_d), min(m.speed_over_ground_d),
+           max(m.speed_over_ground_d), min(m.datetime), max(m.datetime)
+    FROM unnest(%(device_ids)s::text[], %(hours)s::timestamp[]) AS t(device_id, hour)
+    JOIN raw_messages_cleaned_weather m
+        ON m.device_id = t.device_id AND m.datetime >= t.hour AND m.datetime < t.hour + interval '1 hour'
+    WHERE m.datetime >= (SELECT min(hour) FROM unnest(%(hours)s::timestamp[]) AS hour)
+      AND m.datetime < (SELECT max(hour) FROM unnest(%(hours)s::timestamp[]) AS hour) + interval '1 hour'
+    GROUP BY m.device_id, t.hour;
+"""
+
+# Wind speed statistics per device and day, days without any wind observation get no row
+REFRESH_DAILY_WIND_SQL = """
+    DELETE FROM device_daily_wind w
+    USING unnest(%(device_ids)s::text[], %(days)s::date[]) AS t(device_id, day)
+    WHERE w.device_id = t.device_id AND w.day = t.day;
+
+    INSERT INTO device_daily_wind (device_id, day, observation_count, min_wind_spd, max_wind_spd)
+    SELECT m.device_id, t.day, count(*), min(m.wind_spd), max(m.wind_spd)
+    FROM unnest(%(device_ids)s::text[], %(days)s::date[]) AS t(device_id, day)
+    JOIN raw_messages_cleaned_weather m
+        ON m.device_id = t.device_id AND m.datetime >= t.day AND m.datetime < t.day + interval '1 day'
+    WHERE m.wind_spd IS NOT NULL
+      AND m.datetime >= (SELECT min(day) FROM unnest(%(days)s::date[]) AS day)
+      AND m.datetime < (SELECT max(day) FROM unnest(%(days)s::date[]) AS day) + interval '1 day'
+    GROUP BY m.device_id, t.day;
+"""
+
+# Registry of every device, rebuilt from the hourly rollup which is much smaller than the message table
+REFRESH_DEVICES_SQL = """
+    INSERT INTO devices (device_id, first_datetime, last_datetime, message_count)
+    SELECT device_id, min(first_datetime), max(last_datetime), sum(message_count)
+    FROM device_hourly_speed
+    WHERE device_id = ANY(%(device_ids)s::text[])
+    GROUP BY device_id
+    ON CONFLICT (device_id) DO UPDATE SET
+        first_datetime = EXCLUDED.first_datetime,
+        last_datetime = EXCLUDED.last_datetime,
+        message_count = EXCLUDED.message_count;
+"""
+
+
+# Function to find the distinct (device, time bucket) pairs of a batch of messages, freq is a pandas offset alias
+def touched_buckets(messages_df, freq):
+    buckets_df = pd.DataFrame({
+        'device_id': messages_df['device_id'],
+        'bucket': pd.to_datetime(messages_df['datetime']).dt.floor(freq)
+    })
+    return buckets_df.dropna().drop_duplicates().sort_values(['device_id', 'bucket']).reset_index(drop=True)
+
+
+# Function to recompute the rollups for every bucket the given messages fall into, run after they are loaded
+def refresh_rollups(cursor, messages_df):
+    hours_df = touched_buckets(messages_df, 'h')
+    days_df = touched_buckets(messages_df, 'D')
+
+    # psycopg2 adapts Python datetimes and dates, not NumPy values
+    cursor.execute(REFRESH_HOURLY_SPEED_SQL, {
+        'device_ids': hours_df['device_id'].tolist(),
+        'hours': hours_df['bucket'].dt.to_pydatetime().tolist()
+    })
+    cursor.execute(REFRESH_DAILY_WIND_SQL, {
+        'device_ids': days_df['device_id'].tolist(),
+        'days': days_df['bucket'].dt.date.tolist()
+    })
+    cursor.execute(REFRESH_DEVICES_SQL, {'device_ids': hours_df['device_id'].unique().tolist()})
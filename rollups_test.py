@@ -0,0 +1,48 @@
+import unittest
+import datetime
+from unittest.mock import MagicMock
+import pandas as pd
+from rollups import touched_buckets, refresh_rollups, REFRESH_HOURLY_SPEED_SQL, REFRESH_DAILY_WIND_SQL, REFRESH_DEVICES_SQL
+
+class RollupsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Messages of two ships spread over two hours of one day and one message of the next day
+        self.messages_df = pd.DataFrame({
+            'device_id': ['st-1a2090', 'st-1a2090', '0001', 'st-1a2090', '0001'],
+            'datetime': pd.to_datetime([
+                '2019-02-13 14:09:59', '2019-02-13 14:54:56', '2019-02-13 14:21:01', '2019-02-13 15:01:00', None
+            ]),
+            'speed_over_ground_d': [0.0, 1.5, 2.0, 3.0, 4.0]
+        })
+
+    def test_touched_buckets(self):
+        # Every (device, hour) pair is listed once, messages without a datetime touch nothing
+        result_df = touched_buckets(self.messages_df, 'h')
+
+        expected_df = pd.DataFrame({
+            'device_id': ['0001', 'st-1a2090', 'st-1a2090'],
+            'bucket': pd.to_datetime(['2019-02-13 14:00', '2019-02-13 14:00', '2019-02-13 15:00'])
+        })
+        pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
+
+    def test_refresh_rollups(self):
+        # The touched buckets are passed as Python values in three statements, the device registry last
+        mock_cursor = MagicMock()
+
+        refresh_rollups(mock_cursor, self.messages_df)
+
+        calls = mock_cursor.execute.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [REFRESH_HOURLY_SPEED_SQL, REFRESH_DAILY_WIND_SQL, REFRESH_DEVICES_SQL])
+        self.assertEqual(calls[0].args[1], {
+            'device_ids': ['0001', 'st-1a2090', 'st-1a2090'],
+            'hours': [datetime.datetime(2019, 2, 13, 14), datetime.datetime(2019, 2, 13, 14), datetime.datetime(2019, 2, 13, 15)]
+        })
+        self.assertEqual(calls[1].args[1], {
+            'device_ids': ['0001', 'st-1a2090'],
+            'days': [datetime.date(2019, 2, 13), datetime.date(2019, 2, 13)]
+        })
+        self.assertEqual(calls[2].args[1], {'device_ids': ['0001', 'st-1a2090']})
+
+if __name__ == '__main__':
+    unittest.main()
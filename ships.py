@@ -0,0 +1,56 @@
+import sys
+import argparse
+import importlib
+
+# Function to serve the API: app.py's development server, or with --asgi the ASGI app of async_app.py.
+# Every other argument is passed on to the server.
+def serve(argv):
+    parser = argparse.ArgumentParser(prog='ships serve', add_help=False)
+    parser.add_argument("--asgi", action="store_true")
+    args, rest = parser.parse_known_args(argv)
+    return run_command('async_app:main' if args.asgi else 'app:main', rest)
+
+
+# Commands of the ships command line, as words: (entry point taking the rest of the arguments, description).
+# Entry points are 'module:function' and the module is only imported when its command runs, so `ships --help` or
+# loading the staging table does not pay for pandas, Flask and the rest of what the other commands use.
+COMMANDS = {
+    ('etl', 'raw'): ('raw_data_db_insert:cli', "Load the raw messages CSV into the staging table"),
+    ('etl', 'ingest'): ('staging_ingest:cli', "Load many CSV files into staging in parallel, resuming where it stopped"),
+    ('etl', 'clean'): ('clean_data_db_insert:cli', "Clean the staging data and load it into production"),
+    ('db', 'create'): ('db_creation:main', "Create the tables and the partitions of the coming days"),
+    ('serve',): (serve, "Serve the metrics API, with --asgi from uvicorn instead of Flask's server")
+}
+
+
+def run_command(entry_point, argv):
+    if callable(entry_point):
+        return entry_point(argv)
+    module_name, function_name = entry_point.split(':')
+    return getattr(importlib.import_module(module_name), function_name)(argv)
+
+
+def usage():
+    lines = ["usage: ships <command> [arguments]", "", "commands:"]
+    for words, (_, description) in COMMANDS.items():
+        lines.append(f"  {' '.join(words):<12} {description}")
+    lines += ["", "Run `ships <command> --help` for the arguments of a command."]
+    return '\n'.join(lines)
+
+
+# Function to run the command the arguments start with, the longest match wins
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    for words in sorted(COMMANDS, key=len, reverse=True):
+        if tuple(argv[:len(words)]) == words:
+            run_command(COMMANDS[words][0], argv[len(words):])
+            return 0
+    print(f"ships: unknown command {' '.join(argv)!r}\n\n{usage()}", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
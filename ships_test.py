@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+import unittest
+import subprocess
+from contextlib import redirect_stderr
+from unittest.mock import patch
+import ships
+
+# Modules of the pipeline and the API, imported by the commands of ships.py
+LIBRARY_MODULES = [
+    'app', 'area_index', 'async_app', 'clean_data_db_insert', 'columnar_snapshot', 'copy_writer', 'data_changes', 'db_connection',
+    'db_creation', 'device_index', 'exploratory_data_analysis', 'instrumentation', 'message_dedup', 'message_parser',
+    'parallel_cleaning', 'partitions', 'query_pushdown', 'raw_data_db_insert', 'response_cache', 'rollups', 'snapshot',
+    'staging_ingest', 'trajectory', 'typed_fetch', 'watermarks', 'weather_join', 'weather_loader'
+]
+
+# Function to run Python code in a fresh interpreter in the repository and return what it printed
+def run_python(code):
+    completed = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    return completed.stdout.strip()
+
+class ShipsTestCase(unittest.TestCase):
+
+    @patch('ships.importlib.import_module')
+    def test_commands_run_their_entry_point(self, mock_import):
+        # Test that a command imports its module and passes it the rest of the arguments
+        self.assertEqual(ships.main(['etl', 'raw', '--csv-path', 'messages.csv']), 0)
+        mock_import.assert_called_with('raw_data_db_insert')
+        mock_import.return_value.cli.assert_called_with(['--csv-path', 'messages.csv'])
+
+        ships.main(['serve', '--port', '9000'])
+        mock_import.assert_called_with('app')
+        mock_import.return_value.main.assert_called_with(['--port', '9000'])
+
+        ships.main(['serve', '--port', '9000', '--asgi'])
+        mock_import.assert_called_with('async_app')
+        mock_import.return_value.main.assert_called_with(['--port', '9000'])
+
+    @patch('ships.run_command')
+    def test_unknown_command(self, mock_run):
+        # Test that an unknown command runs nothing and fails
+        with redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(ships.main(['etl', 'load']), 2)
+        mock_run.assert_not_called()
+        self.assertIn("unknown command 'etl load'", stderr.getvalue())
+
+    def test_light_commands_do_not_import_pandas(self):
+        # Test that the command line and the staging load start without pandas
+        printed = run_python("import sys, ships, raw_data_db_insert, staging_ingest, db_creation; print('pandas' in sys.modules)")
+        self.assertEqual(printed, 'False')
+
+    def test_importing_connects_to_nothing(self):
+        # Test that importing the modules opens no database connection, connecting fails in the interpreter
+        printed = run_python(
+            "import psycopg2, asyncpg\n"
+            "def refuse(*args, **kwargs):\n"
+            "    raise AssertionError('connected on import')\n"
+            "psycopg2.connect = asyncpg.connect = asyncpg.create_pool = refuse\n"
+            f"import {', '.join(LIBRARY_MODULES)}\n"
+            "print('imported')"
+        )
+        self.assertEqual(printed, 'imported')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+import time
+import select
+import threading
+from functools import cached_property
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import psycopg2
+from db_connection import cursor, connection_params
+from device_index import DeviceTimeIndex
+from area_index import AreaTimeIndex, ships_in_area
+from exploratory_data_analysis import fetch_data_from_db
+from columnar_snapshot import SNAPSHOT_PATH, read_columnar_snapshot
+from typed_fetch import fetch_typed_data_from_db, compact_dtypes
+from data_changes import (CHANGES_CHANNEL, CHANGED_MESSAGES_SQL, fetch_change_marker, fetch_changed_buckets)
+from trajectory import (TRACK_WEATHER_COLUMNS, TRACK_ROW_COLUMNS, ROUTE_COLUMNS, CHANGED_TRACKS_SQL,
+                        message_track_points)
+
+# Seconds between checks of the change marker when no notification arrives
+POLL_SECONDS = 30
+
+# Message columns of the weather_conditions endpoint
+WEATHER_COLUMNS = ['datetime'] + TRACK_WEATHER_COLUMNS
+
+
+# Everything the API serves, indexed by ship and time. A snapshot is never modified after it is built: a refresh
+# builds a new one, so a request that picked up a snapshot keeps reading consistent data while the next is built.
+# The endpoints read it through ship_count, hourly_speed, daily_wind, weather_rows, route_rows, track_rows,
+# message_days and in_area, which DatabaseView in query_pushdown.py answers from the database instead.
+# Without the compressed tracks (tracks_df of None) the endpoints answer every request from the messages.
+# The positions of the messages are also indexed by grid cell and hour, see area_index.py.
+class DataSnapshot:
+
+    def __init__(self, version, messages_df, devices_df, hourly_speed_df, daily_wind_df, tracks_df=None):
+        self.version = version    # last etl_changes.change_id included
+        self.built_at = datetime.now(timezone.utc)
+        self.devices_df = devices_df
+        self.messages_by_device = DeviceTimeIndex(messages_df, 'datetime')
+        self.hourly_speed_by_device = DeviceTimeIndex(hourly_speed_df, 'hour')
+        self.daily_wind_by_device = DeviceTimeIndex(daily_wind_df, 'day')
+        self.tracks_by_device = None if tracks_df is None else DeviceTimeIndex(tracks_df, 'datetime')
+        self.messages_by_area = AreaTimeIndex(area_points(messages_df))
+
+    # Bytes held by the tables, counted once per snapshot when first asked for
+    @cached_property
+    def memory_bytes(self):
+        tables = [self.messages_by_device.df, self.devices_df, self.hourly_speed_by_device.df,
+                  self.daily_wind_by_device.df]
+        if self.tracks_by_device is not None:
+            tables.append(self.tracks_by_device.df)
+        tables.append(self.messages_by_area.df)
+        table_bytes = sum(df.memory_usage(index=True, deep=True).sum() for df in tables)
+        return int(table_bytes + self.messages_by_area.index_bytes)
+
+    # Messages held in memory
+    @property
+    def row_count(self):
+        return len(self.messages_by_device.df)
+
+    # Number of ships, the devices rollup has one row per ship
+    def ship_count(self):
+        return len(self.devices_df)
+
+    # Average speed of every hour of a ship with start <= hour < end, either bound may be None
+    def hourly_speed(self, device_id, start=None, end=None):
+        return self.hourly_speed_by_device.rows(device_id, start, end)[['hour', 'avg_speed']]
+
+    # Maximum and minimum wind speed of every day of a ship with start <= day < end that has wind speeds
+    def daily_wind(self, device_id, start=None, end=None):
+        return self.daily_wind_by_device.rows(device_id, start, end)[['day', 'max_wind_spd', 'min_wind_spd']]
+
+    # Weather columns of the messages of a ship with start <= datetime < end, in time order
+    def weather_rows(self, device_id, start=None, end=None):
+        return self.messages_by_device.rows(device_id, start, end)[WEATHER_COLUMNS]
+
+    # Positions of every message of a ship with start <= datetime < end, in time order, with signed coordinates
+    def route_rows(self, device_id, start=None, end=None):
+        return message_track_points(self.messages_by_device.rows(device_id, start, end))[ROUTE_COLUMNS]
+
+    # Points of the compressed track of a ship with start <= datetime < end, in time order. Empty when the snapshot
+    # has no tracks, the endpoints then read the messages.
+    def track_rows(self, device_id, start=None, end=None):
+        if self.tracks_by_device is None:
+            return pd.DataFrame(columns=TRACK_ROW_COLUMNS).astype({'datetime': 'datetime64[us]'})
+        return self.tracks_by_device.rows(device_id, start, end)[TRACK_ROW_COLUMNS]
+
+    # Days with messages of a ship with start <= datetime < end, in time order
+    def message_days(self, device_id, start=None, end=None):
+        days = pd.DatetimeIndex(self.messages_by_device.rows(device_id, start, end)['datetime']).floor('D').unique()
+        return pd.DataFrame({'day': days.sort_values()})
+
+    # Ships with messages inside the box (west, south, east, north) with start <= datetime < end, either bound may be
+    # None, ordered by ship
+    def in_area(self, bbox, start=None, end=None):
+        return ships_in_area(self.messages_by_area.rows(bbox, start, end))
+
+
+# Function to give the ship, time and signed position of every message, what the area index is built on. Messages
+# without positions (or a frame without the position columns) give no rows.
+def area_points(messages_df):
+    if 'lat' not in messages_df.columns:
+        return pd.DataFrame({'device_id': pd.Series(dtype=object), 'datetime': pd.Series(dtype='datetime64[ns]'),
+                             'lat': pd.Series(dtype='float64'), 'lon': pd.Series(dtype='float64')})
+    return message_track_points(messages_df[['device_id', 'datetime', 'lat', 'latitude_direction', 'lon',
+                                             'longitude_direction']])
+
+
+# Function to load the rollup tables, they are small enough to be reloaded whole on every refresh
+def load_rollups():
+    devices_df = fetch_data_from_db(query="SELECT * FROM devices;", environment="PRODUCTION")
+    hourly_speed_df = fetch_data_from_db(
+        query="SELECT * FROM device_hourly_speed ORDER BY device_id, hour;", environment="PRODUCTION"
+    )
+    daily_wind_df = fetch_data_from_db(
+        query="SELECT * FROM device_daily_wind ORDER BY device_id, day;", environment="PRODUCTION"
+    )
+    return devices_df, hourly_speed_df, daily_wind_df
+
+
+# Function to load the compressed tracks of every ship, see trajectory.py
+def load_tracks():
+    return fetch_typed_data_from_db("SELECT * FROM device_tracks;", "PRODUCTION")
+
+
+# Function to load a full snapshot of production.
+# The change marker is read first, so changes committed while the tables are read are applied again later.
+# The messages are taken from the columnar snapshot the ETL writes when there is one: only the changes logged after
+# it was written are fetched from production. Without a file, or with one newer than production, all messages are
+# read from the database.
+def load_snapshot(columnar_path=SNAPSHOT_PATH):
+    with cursor("PRODUCTION") as cur:
+        version, _ = fetch_change_marker(cur, 0)
+
+    columnar = read_columnar_snapshot(columnar_path)
+    if columnar is not None and columnar[0] <= version:
+        file_version, messages_df = columnar
+        snapshot = DataSnapshot(file_version, messages_df, *load_rollups(), load_tracks())
+        return snapshot if file_version == version else apply_changes(snapshot, version)
+
+    messages_df = fetch_typed_data_from_db("SELECT * FROM raw_messages_cleaned_weather;", "PRODUCTION")
+    return DataSnapshot(version, messages_df, *load_rollups(), load_tracks())
+
+
+# Function to replace the rows of the given (device, bucket start) buckets of an index by the changed rows, the rows
+# of the other buckets are taken over
+def replace_buckets(index, buckets_df, width, changed_df):
+    keep = np.ones(len(index.df), dtype=bool)
+    for device_id, bucket in buckets_df.itertuples(index=False):
+        first, last = index.positions(device_id, bucket, bucket + width)
+        keep[first:last] = False
+    rows_df = index.df[keep]
+    if changed_df.empty:
+        return rows_df
+    # Categories of the new rows may be missing from the old ones, they are merged again after concatenating
+    return compact_dtypes(pd.concat([rows_df, changed_df], ignore_index=True))
+
+
+# Function to build the snapshot that includes the changes up to latest_change_id: the messages of every changed
+# (device, hour) bucket are replaced by what production holds now, the rest is taken over from the old snapshot.
+# A track is compressed per day, so the tracks of the days of the changed hours are replaced.
+def apply_changes(snapshot, latest_change_id):
+    with cursor("PRODUCTION") as cur:
+        buckets_df = fetch_changed_buckets(cur, snapshot.version, latest_change_id)
+    changed_df = fetch_typed_data_from_db(CHANGED_MESSAGES_SQL, "PRODUCTION", params={
+        'device_ids': buckets_df['device_id'].tolist(),
+        'hours': buckets_df['hour'].tolist()
+    })
+    messages_df = replace_buckets(snapshot.messages_by_device, buckets_df, pd.Timedelta(hours=1), changed_df)
+
+    tracks_df = None
+    if snapshot.tracks_by_device is not None:
+        days_df = pd.DataFrame({
+            'device_id': buckets_df['device_id'],
+            'day': pd.to_datetime(buckets_df['hour']).dt.floor('D')
+        }).drop_duplicates()
+        changed_tracks_df = fetch_typed_data_from_db(CHANGED_TRACKS_SQL, "PRODUCTION", params={
+            'device_ids': days_df['device_id'].tolist(),
+            'days': days_df['day'].dt.date.tolist()
+        })
+        tracks_df = replace_buckets(snapshot.tracks_by_device, days_df, pd.Timedelta(days=1), changed_tracks_df)
+
+    return DataSnapshot(latest_change_id, messages_df, *load_rollups(), tracks_df)
+
+
+# Keeps the current snapshot up to date in a background thread. It wakes up on a NOTIFY from the loader or every
+# poll_seconds, and swaps in a new snapshot once it is completely built; readers never wait for a refresh.
+class SnapshotRefresher:
+
+    def __init__(self, snapshot, poll_seconds=POLL_SECONDS):
+        self._snapshot = snapshot
+        self.poll_seconds = poll_seconds
+        self._listen_conn = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self._status_lock = threading.Lock()
+        self._latest_change_id = snapshot.version
+        self._pending_since = None
+        self._last_check_at = None
+        self._last_refresh_seconds = None
+        self._last_error = None
+
+    # The snapshot to serve a request from, read it once per request
+    def current(self):
+        return self._snapshot
+
+    def start(self):
+        self._thread.start()
+
+    # Stop refreshing, waiting at most timeout seconds for a refresh in progress or the wait for a notification
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # Check the change marker and swap in a new snapshot when production changed, returns whether it did
+    def refresh(self):
+        snapshot = self._snapshot
+        with cursor("PRODUCTION") as cur:
+            latest_change_id, pending_since = fetch_change_marker(cur, snapshot.version)
+        with self._status_lock:
+            self._latest_change_id, self._pending_since = latest_change_id, pending_since
+            self._last_check_at = datetime.now(timezone.utc)
+        if latest_change_id <= snapshot.version:
+            return False
+
+        start = time.perf_counter()
+        new_snapshot = self.build(snapshot, latest_change_id)
+        # A single reference assignment, requests see either the old or the new snapshot
+        self._snapshot = new_snapshot
+        with self._status_lock:
+            self._last_refresh_seconds = time.perf_counter() - start
+            if self._latest_change_id <= new_snapshot.version:
+                self._pending_since = None
+        return True
+
+    # The snapshot that includes the changes up to latest_change_id
+    def build(self, snapshot, latest_change_id):
+        return apply_changes(snapshot, latest_change_id)
+
+    # Block until a notification arrives or poll_seconds pass, without a LISTEN connection this is a plain sleep
+    def _wait_for_change(self):
+        try:
+            if self._listen_conn is None or self._listen_conn.closed:
+                self._listen_conn = psycopg2.connect(**connection_params("PRODUCTION"))
+                self._listen_conn.autocommit = True
+                self._listen_conn.cursor().execute(f"LISTEN {CHANGES_CHANNEL};")
+            if select.select([self._listen_conn], [], [], self.poll_seconds)[0]:
+                self._listen_conn.poll()
+                self._listen_conn.notifies.clear()
+        except (psycopg2.Error, OSError):
+            self._close_listen_conn()
+            self._stop.wait(self.poll_seconds)
+
+    def _close_listen_conn(self):
+        if self._listen_conn is not None and not self._listen_conn.closed:
+            self._listen_conn.close()
+        self._listen_conn = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wait_for_change()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+                self._last_error = None
+            except Exception as error:
+                # Keep serving the current snapshot, the next wake-up tries again
+                self._last_error = f"{type(error).__name__}: {error}"
+        self._close_listen_conn()
+
+    # Version, age and lag of the served data for the status endpoint
+    def status(self):
+        snapshot = self._snapshot
+        now = datetime.now(timezone.utc)
+        with self._status_lock:
+            pending = self._latest_change_id > snapshot.version and self._pending_since is not None
+            return {
+                "snapshot_version": snapshot.version,
+                "snapshot_built_at": snapshot.built_at.isoformat(),
+                "snapshot_rows": snapshot.row_count,
+                "latest_change_id": self._latest_change_id,
+                "data_lag_seconds": (now - self._pending_since).total_seconds() if pending else 0.0,
+                "last_check_at": self._last_check_at.isoformat() if self._last_check_at else None,
+                "last_refresh_seconds": self._last_refresh_seconds,
+                "listening": self._listen_conn is not None,
+                "last_error": self._last_error
+            }
@@ -0,0 +1,110 @@
+import unittest
+import datetime
+from unittest.mock import patch
+import pandas as pd
+from snapshot import DataSnapshot, SnapshotRefresher, apply_changes, load_snapshot
+
+def make_rollups():
+    devices_df = pd.DataFrame({'device_id': ['0001', 'st-1a2090']})
+    hourly_speed_df = pd.DataFrame({'device_id': ['0001'], 'hour': pd.to_datetime(['2019-02-13 14:00']), 'avg_speed': [1.0]})
+    daily_wind_df = pd.DataFrame({'device_id': ['0001'], 'day': [datetime.date(2019, 2, 13)], 'max_wind_spd': [4.0]})
+    return devices_df, hourly_speed_df, daily_wind_df
+
+def make_messages(device_ids, datetimes, temps):
+    return pd.DataFrame({'device_id': device_ids, 'datetime': pd.to_datetime(datetimes), 'temp': temps})
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        messages_df = make_messages(
+            ['0001', '0001', 'st-1a2090'],
+            ['2019-02-13 14:10', '2019-02-13 15:10', '2019-02-13 14:20'],
+            [1.0, 2.0, 3.0]
+        )
+        self.snapshot = DataSnapshot(3, messages_df, *make_rollups())
+
+    @patch('snapshot.load_rollups', side_effect=lambda: make_rollups())
+    @patch('snapshot.fetch_typed_data_from_db')
+    @patch('snapshot.fetch_changed_buckets')
+    @patch('snapshot.cursor')
+    def test_apply_changes_replaces_changed_buckets(self, mock_cursor, mock_buckets, mock_fetch, mock_rollups):
+        # Hour 14 of 0001 was reloaded with two messages, the rest of the snapshot is kept
+        mock_buckets.return_value = pd.DataFrame({'device_id': ['0001'], 'hour': pd.to_datetime(['2019-02-13 14:00'])})
+        mock_fetch.return_value = make_messages(['0001', '0001'], ['2019-02-13 14:10', '2019-02-13 14:50'], [10.0, 11.0])
+
+        new_snapshot = apply_changes(self.snapshot, 5)
+
+        self.assertEqual(new_snapshot.version, 5)
+        mock_buckets.assert_called_once_with(unittest.mock.ANY, 3, 5)
+        self.assertEqual(list(new_snapshot.messages_by_device.rows('0001')['temp']), [10.0, 11.0, 2.0])
+        self.assertEqual(list(new_snapshot.messages_by_device.rows('st-1a2090')['temp']), [3.0])
+        # The old snapshot is left untouched for requests still reading it
+        self.assertEqual(list(self.snapshot.messages_by_device.rows('0001')['temp']), [1.0, 2.0])
+
+    @patch('snapshot.apply_changes')
+    @patch('snapshot.fetch_change_marker')
+    @patch('snapshot.cursor')
+    def test_refresh_swaps_snapshot_only_on_change(self, mock_cursor, mock_marker, mock_apply):
+        refresher = SnapshotRefresher(self.snapshot)
+        pending_since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=60)
+
+        # Nothing new in production
+        mock_marker.return_value = (3, None)
+        self.assertFalse(refresher.refresh())
+        self.assertIs(refresher.current(), self.snapshot)
+        self.assertEqual(refresher.status()['data_lag_seconds'], 0.0)
+
+        # A failed refresh keeps serving the old snapshot and reports the lag
+        mock_marker.return_value = (4, pending_since)
+        mock_apply.side_effect = RuntimeError("database went away")
+        with self.assertRaises(RuntimeError):
+            refresher.refresh()
+        self.assertIs(refresher.current(), self.snapshot)
+        self.assertGreaterEqual(refresher.status()['data_lag_seconds'], 60)
+
+        # A successful refresh swaps in the new snapshot
+        new_snapshot = DataSnapshot(4, self.snapshot.messages_by_device.df, *make_rollups())
+        mock_apply.side_effect = None
+        mock_apply.return_value = new_snapshot
+        self.assertTrue(refresher.refresh())
+        self.assertIs(refresher.current(), new_snapshot)
+        status = refresher.status()
+        self.assertEqual(status['snapshot_version'], 4)
+        self.assertEqual(status['data_lag_seconds'], 0.0)
+
+    @patch('snapshot.apply_changes')
+    @patch('snapshot.load_tracks', return_value=None)
+    @patch('snapshot.load_rollups', side_effect=lambda: make_rollups())
+    @patch('snapshot.fetch_typed_data_from_db')
+    @patch('snapshot.read_columnar_snapshot')
+    @patch('snapshot.fetch_change_marker')
+    @patch('snapshot.cursor')
+    def test_load_snapshot_sources(self, mock_cursor, mock_marker, mock_read, mock_fetch, mock_rollups, mock_tracks,
+                                   mock_apply):
+        messages_df = self.snapshot.messages_by_device.df
+        mock_marker.return_value = (5, None)
+
+        # An up to date columnar snapshot is used as it is
+        mock_read.return_value = (5, messages_df)
+        snapshot = load_snapshot()
+        self.assertEqual(snapshot.version, 5)
+        mock_fetch.assert_not_called()
+        mock_apply.assert_not_called()
+
+        # A stale one is brought up to date with the changes logged after it
+        mock_read.return_value = (3, messages_df)
+        load_snapshot()
+        mock_fetch.assert_not_called()
+        self.assertEqual(mock_apply.call_args.args[0].version, 3)
+        self.assertEqual(mock_apply.call_args.args[1], 5)
+
+        # Without a file, or with one newer than production, every message is read from the database
+        mock_fetch.return_value = messages_df
+        for columnar in [None, (9, messages_df)]:
+            mock_fetch.reset_mock()
+            mock_read.return_value = columnar
+            self.assertEqual(load_snapshot().version, 5)
+            mock_fetch.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
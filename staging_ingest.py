@@ -0,0 +1,294 @@
+import io
+import os
+import csv
+import sys
+import glob
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
+from db_connection import connection, close_pools, get_pool
+from instrumentation import RUN_REPORT_DIR, RunReport, stage
+from raw_data_db_insert import STAGING_KEY_COLUMNS, COPY_READ_BYTES, create_load_table, insert_new_rows, open_raw_csv
+
+# Staging table the collector dumps are loaded into
+STAGING_TABLE = 'raw_messages'
+
+# Files of a directory that are loaded, compressed dumps are recognized by their contents (see open_raw_csv)
+CSV_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+# Megabytes of a file copied and committed at once. A chunk ends at the end of a line, so it may be a little longer.
+CHUNK_MB = 64
+
+# Files loaded at once, each over a connection of its own
+INGEST_WORKERS = 4
+
+# Times a chunk is tried when PostgreSQL aborted its transaction for a deadlock with another load
+CHUNK_ATTEMPTS = 3
+
+# Rejected rows of a file listed with their byte offset in the file. The rest are only counted.
+REJECTS_PRINTED = 5
+
+MANIFEST_SQL = """
+    SELECT byte_offset, rows_read, rows_new, rows_rejected, completed_at IS NOT NULL
+    FROM staging_ingest_manifest
+    WHERE file_hash = %s;
+"""
+
+UPDATE_MANIFEST_SQL = """
+    INSERT INTO staging_ingest_manifest
+        (file_hash, file_path, file_bytes, byte_offset, rows_read, rows_new, rows_rejected, completed_at)
+    VALUES (%(file_hash)s, %(file_path)s, %(file_bytes)s, %(byte_offset)s, %(rows_read)s, %(rows_new)s,
+            %(rows_rejected)s, CASE WHEN %(completed)s THEN now() END)
+    ON CONFLICT (file_hash) DO UPDATE SET
+        file_path = EXCLUDED.file_path,
+        byte_offset = EXCLUDED.byte_offset,
+        rows_read = EXCLUDED.rows_read,
+        rows_new = EXCLUDED.rows_new,
+        rows_rejected = EXCLUDED.rows_rejected,
+        completed_at = EXCLUDED.completed_at,
+        updated_at = now();
+"""
+
+
+# Function to list the CSV files to load: every file of a directory ending in one of CSV_SUFFIXES, the matches of a
+# glob, or a file as it is. Each file is listed once, in the order of the arguments.
+def find_input_files(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += sorted(path for path in glob.glob(os.path.join(pattern, '*')) if path.endswith(CSV_SUFFIXES))
+        elif glob.has_magic(pattern):
+            paths += sorted(glob.glob(pattern))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        else:
+            raise FileNotFoundError(f"No such file or directory: {pattern}")
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+# Function to hash the contents of a file without reading it into memory at once
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to read about chunk_bytes of a CSV file up to the end of a line. A line ending inside a quoted field is
+# not the end of a row: CSV doubles the quotes within a field, so a row ends where the number of quotes read is even.
+# A stray quote would make the rest of the file one field, so after twice chunk_bytes any end of a line will do.
+def read_chunk(file, chunk_bytes):
+    parts = [file.read(chunk_bytes)]
+    quotes, size = parts[0].count(b'"'), len(parts[0])
+    while parts[-1] and (not parts[-1].endswith(b'\n') or (quotes % 2 and size < 2 * chunk_bytes)):
+        line = file.readline()
+        if not line:
+            break
+        parts.append(line)
+        quotes, size = quotes + line.count(b'"'), size + len(line)
+    return b''.join(parts)
+
+
+# Function to move a file forward by count bytes. A decompressing stream that cannot seek is read through instead.
+def skip_bytes(file, count):
+    if file.seekable():
+        file.seek(count, os.SEEK_CUR)
+        return
+    while count > 0:
+        block = file.read(min(count, COPY_READ_BYTES))
+        if not block:
+            return
+        count -= len(block)
+
+
+# Function to split CSV data into its rows, as (byte offset, row) pairs, for the data starting at byte offset. With
+# by_line every line is a row, for data where a stray quote runs on over the lines after it.
+def split_rows(data, offset, by_line=False):
+    rows, row = [], b''
+    for line in data.splitlines(keepends=True):
+        row += line
+        if by_line or row.count(b'"') % 2 == 0:
+            rows.append((offset, row))
+            offset += len(row)
+            row = b''
+    if row:
+        rows.append((offset, row))
+    return rows
+
+
+# Function to COPY (byte offset, CSV data) parts, returning the number of rows copied and the offsets of the rows
+# PostgreSQL rejected. A part that fails is rolled back to a savepoint and copied again in halves, down to single
+# rows and then single lines, so a bad line costs about two COPYs per halving instead of the whole load.
+def copy_parts(cursor, copy_statement, parts):
+    cursor.execute("SAVEPOINT ingest_copy;")
+    try:
+        cursor.copy_expert(copy_statement, io.BytesIO(b''.join(data for _, data in parts)))
+    except psycopg2.DataError:
+        cursor.execute("ROLLBACK TO SAVEPOINT ingest_copy; RELEASE SAVEPOINT ingest_copy;")
+        if len(parts) == 1:
+            parts = split_rows(parts[0][1], parts[0][0])
+            if len(parts) == 1:
+                parts = split_rows(parts[0][1], parts[0][0], by_line=True)
+            if len(parts) == 1:
+                return 0, [parts[0][0]]
+        middle = len(parts) // 2
+        copied, rejected = copy_parts(cursor, copy_statement, parts[:middle])
+        more_copied, more_rejected = copy_parts(cursor, copy_statement, parts[middle:])
+        return copied + more_copied, rejected + more_rejected
+    copied = cursor.rowcount
+    cursor.execute("RELEASE SAVEPOINT ingest_copy;")
+    return copied, []
+
+
+# Function to load a chunk of a CSV file with the given header columns into staging, in the cursor's transaction.
+# Returns the rows read, the rows new to staging and the byte offsets of the rejected rows.
+def load_chunk(cursor, columns, data, offset):
+    load_table = create_load_table(cursor, STAGING_TABLE)
+    copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH CSV").format(
+        sql.Identifier(load_table), sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    )
+    copied, rejected = copy_parts(cursor, copy_statement, [(offset, data)]) if data else (0, [])
+    return copied + len(rejected), insert_new_rows(cursor, load_table, STAGING_TABLE, STAGING_KEY_COLUMNS), rejected
+
+
+# Function to load one CSV file into staging chunk by chunk, committing every chunk together with the file's entry in
+# staging_ingest_manifest. A file whose entry is complete is skipped, one that was interrupted resumes after its last
+# committed chunk. Offsets count the bytes of the CSV data, after decompressing a compressed file. When claim is
+# given, it is called with the hash of the file and says whether to load it, so a file also found under another name
+# in the same run is loaded once. Returns the file's entry, with the byte offsets of the first rows rejected in this
+# run.
+def ingest_file(path, chunk_bytes=CHUNK_MB * 2 ** 20, report=None, claim=None):
+    with stage(report, 'hash'):
+        file_hash = file_digest(path)
+    entry = {'file_hash': file_hash, 'file_path': path, 'file_bytes': os.path.getsize(path), 'byte_offset': 0,
+             'rows_read': 0, 'rows_new': 0, 'rows_rejected': 0, 'completed': False, 'status': 'loaded',
+             'rejected_offsets': []}
+    if claim is not None and not claim(file_hash):
+        return {**entry, 'status': 'duplicate'}
+
+    with connection("STAGING") as conn, open_raw_csv(path) as file:
+        cursor = conn.cursor()
+        cursor.execute(MANIFEST_SQL, (file_hash,))
+        row = cursor.fetchone()
+        conn.commit()
+        if row is not None:
+            entry.update(zip(['byte_offset', 'rows_read', 'rows_new', 'rows_rejected', 'completed'], row))
+            if entry['completed']:
+                return {**entry, 'status': 'skipped'}
+            entry['status'] = 'resumed'
+
+        header = file.readline()
+        columns = next(csv.reader([header.decode('utf-8')]))
+        offset = max(entry['byte_offset'], len(header))
+        skip_bytes(file, offset - len(header))
+        data = read_chunk(file, chunk_bytes)
+        while not entry['completed']:
+            # The next chunk is read first: the last one completes the file, whose size is only known decompressed
+            following = read_chunk(file, chunk_bytes) if data else b''
+            for attempt in range(CHUNK_ATTEMPTS):
+                try:
+                    with stage(report, 'copy') as record:
+                        rows_read, rows_new, rejected = load_chunk(cursor, columns, data, offset)
+                        loaded = {**entry, 'byte_offset': offset + len(data),
+                                  'rows_read': entry['rows_read'] + rows_read,
+                                  'rows_new': entry['rows_new'] + rows_new,
+                                  'rows_rejected': entry['rows_rejected'] + len(rejected),
+                                  'completed': not following}
+                        cursor.execute(UPDATE_MANIFEST_SQL, loaded)
+                        conn.commit()
+                        record.update(rows_in=rows_read, rows_out=rows_new, rejected=rows_read - rows_new)
+                    break
+                except psycopg2.errors.TransactionRollbackError:
+                    conn.rollback()
+                    if attempt == CHUNK_ATTEMPTS - 1:
+                        raise
+            entry = {**loaded, 'rejected_offsets': (entry['rejected_offsets'] + rejected)[:REJECTS_PRINTED]}
+            offset, data = offset + len(data), following
+        cursor.close()
+    return entry
+
+
+# Function to load CSV files into staging with workers connections at once. A file that fails does not stop the
+# others, its entry has status 'failed' and the error; run again to resume it. Returns the entries of the files.
+def ingest_files(paths, workers=INGEST_WORKERS, chunk_bytes=CHUNK_MB * 2 ** 20, report=None):
+    get_pool("STAGING").grow(workers)
+    claimed, claimed_lock = set(), threading.Lock()
+
+    def claim(file_hash):
+        with claimed_lock:
+            first = file_hash not in claimed
+            claimed.add(file_hash)
+            return first
+
+    def ingest(path):
+        try:
+            return ingest_file(path, chunk_bytes, report, claim)
+        except Exception as error:
+            return {'file_path': path, 'status': 'failed', 'error': f"{type(error).__name__}: {error}"}
+
+    # The largest files first, so the run does not end waiting for one large file
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    entries = []
+    with ThreadPoolExecutor(workers) as executor:
+        for future in as_completed([executor.submit(ingest, path) for path in paths]):
+            entries.append(future.result())
+            print(ingest_line(entries[-1]))
+    return entries
+
+
+def ingest_line(entry):
+    if entry['status'] == 'failed':
+        return f"{entry['file_path']}: failed, {entry['error']}"
+    if entry['status'] == 'duplicate':
+        return f"{entry['file_path']}: skipped, same contents as another file of this run"
+    line = (f"{entry['file_path']}: {entry['status']}, {entry['rows_new']} new of {entry['rows_read']} rows, "
+            f"{entry['rows_rejected']} rejected")
+    if entry['rejected_offsets']:
+        line += f", the first at bytes {', '.join(str(offset) for offset in entry['rejected_offsets'])}"
+    return line
+
+
+def main(patterns, workers=INGEST_WORKERS, chunk_mb=CHUNK_MB, run_report_dir=RUN_REPORT_DIR):
+    report = RunReport('staging_ingest', options={'workers': workers, 'chunk_mb': chunk_mb})
+    try:
+        entries = ingest_files(find_input_files(patterns), workers, int(chunk_mb * 2 ** 20), report)
+        failed = [entry for entry in entries if entry['status'] == 'failed']
+        if failed:
+            report.error = f"{len(failed)} of {len(entries)} files failed"
+        return entries
+    except Exception as error:
+        report.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        close_pools()
+        print(report.summary())
+        if run_report_dir:
+            print(f"Run report written to {report.write(run_report_dir)}")
+
+
+# Command line of the script, also run by `ships etl ingest`. Exits with an error when a file failed.
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load the CSV dumps of the collectors into the staging table in parallel. Every chunk is committed "
+                    "with a checkpoint, so an interrupted run resumes where it stopped."
+    )
+    parser.add_argument("paths", nargs='+',
+                        help="CSV files, gzip or zstd compressed or not, directories of them or glob patterns")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Files loaded at once")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_MB, help="Megabytes of a file committed at once")
+    parser.add_argument("--run-report-dir", default=RUN_REPORT_DIR,
+                        help="Directory to write the JSON run report with the time of every stage to, empty to skip it")
+    args = parser.parse_args(argv)
+    entries = main(args.paths, args.workers, args.chunk_mb, args.run_report_dir)
+    failed = [entry for entry in entries if entry['status'] == 'failed']
+    if failed:
+        sys.exit(f"{len(failed)} of {len(entries)} files were not loaded completely, run again to resume them")
+
+
+if __name__ == "__main__":
+    cli()
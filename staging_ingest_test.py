@@ -0,0 +1,162 @@
+import io
+import os
+import gzip
+import tempfile
+import unittest
+from contextlib import contextmanager, redirect_stdout
+from unittest.mock import patch, MagicMock
+import psycopg2
+from staging_ingest import (find_input_files, read_chunk, split_rows, copy_parts, ingest_file, ingest_files,
+                            UPDATE_MANIFEST_SQL)
+
+HEADER = b'device_id,datetime,address_ip,address_port,original_message_id,raw_message\n'
+ROWS = [
+    b'0001,1550066999,172.19.0.17,4007,1550070599576-0,"A,51.3183,N,4.3157,E,0.0,1.59,150218,0.8,E"\n',
+    b'0001,1550067661,172.19.0.16,4007,1550071261429-0,"A,51.3183,N,4.3157,E,0.0,1.59,150218,0.8,E"\n',
+    b'0001,1550067700,172.19.0.16,bad,1550071300000-0,"A,51.3183,N,4.3157,E,0.0,1.59,150218,0.8,E"\n',
+    b'0001,1550067800,172.19.0.16,4007,1550071400000-0,"A,51.3183,N,4.3157,E,0.0,1.59,150218,0.8,E"\n'
+]
+
+# A cursor whose COPY fails on data holding 'bad', like PostgreSQL failing on a port that is no number
+def copying_cursor():
+    mock_cursor = MagicMock()
+
+    def copy_expert(statement, file):
+        data = file.read()
+        if b'bad' in data:
+            raise psycopg2.DataError('invalid input syntax for type integer: "bad"')
+        mock_cursor.rowcount = len(split_rows(data, 0))
+    mock_cursor.copy_expert.side_effect = copy_expert
+    return mock_cursor
+
+# A pooled connection of the given cursor for staging_ingest.connection
+def mock_connection(mock_conn):
+    @contextmanager
+    def connection(environment):
+        yield mock_conn
+    return connection
+
+class StagingIngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as file:
+            file.write(HEADER + b''.join(rows))
+        return path
+
+    def test_find_input_files(self):
+        # Test that directories give their CSV files, globs their matches, and every file is listed once
+        first, second = self.write_file('a.csv', ROWS), self.write_file('b.csv', ROWS)
+        self.write_file('notes.txt', [])
+
+        self.assertEqual(find_input_files([self.directory.name]), [first, second])
+        self.assertEqual(find_input_files([os.path.join(self.directory.name, 'b*'), first, second]), [second, first])
+        with self.assertRaises(FileNotFoundError):
+            find_input_files([os.path.join(self.directory.name, 'missing.csv')])
+
+    def test_read_chunk_ends_with_a_row(self):
+        # Test that a chunk ends at the end of a line, and not within a quoted field spanning lines
+        file = io.BytesIO(b'a,"one\ntwo",b\nc,d\n')
+        self.assertEqual(read_chunk(file, 5), b'a,"one\ntwo",b\n')
+        self.assertEqual(read_chunk(file, 5), b'c,d\n')
+        self.assertEqual(read_chunk(file, 5), b'')
+
+    def test_copy_parts_rejects_only_bad_rows(self):
+        # Test that a failing COPY is retried in halves and only the row PostgreSQL rejects is left out
+        mock_cursor = copying_cursor()
+
+        copied, rejected = copy_parts(mock_cursor, 'COPY', [(100, b''.join(ROWS))])
+
+        self.assertEqual(copied, 3)
+        self.assertEqual(rejected, [100 + len(ROWS[0]) + len(ROWS[1])])
+        statements = [call.args[0] for call in mock_cursor.execute.call_args_list]
+        self.assertEqual(statements.count("SAVEPOINT ingest_copy;"), statements.count("RELEASE SAVEPOINT ingest_copy;")
+                         + statements.count("ROLLBACK TO SAVEPOINT ingest_copy; RELEASE SAVEPOINT ingest_copy;"))
+
+    @patch('staging_ingest.insert_new_rows', return_value=2)
+    def test_ingest_file_commits_every_chunk_with_its_checkpoint(self, mock_insert):
+        # Test that every chunk is committed together with the offset after it, the last one completing the file
+        path = self.write_file('dump.csv', ROWS)
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value = copying_cursor()
+        mock_conn.cursor.return_value.fetchone.return_value = None
+
+        with patch('staging_ingest.connection', mock_connection(mock_conn)):
+            entry = ingest_file(path, chunk_bytes=2 * len(ROWS[0]))
+
+        updates = [call.args[1] for call in mock_conn.cursor.return_value.execute.call_args_list
+                   if call.args[0] == UPDATE_MANIFEST_SQL]
+        self.assertEqual([update['byte_offset'] for update in updates],
+                         [len(HEADER) + len(ROWS[0]) + len(ROWS[1]), os.path.getsize(path)])
+        self.assertEqual([update['completed'] for update in updates], [False, True])
+        self.assertEqual((entry['rows_read'], entry['rows_new'], entry['rows_rejected']), (4, 4, 1))
+        self.assertEqual(entry['rejected_offsets'], [len(HEADER) + len(ROWS[0]) + len(ROWS[1])])
+        # The manifest is read and committed once, then once per chunk
+        self.assertEqual(mock_conn.commit.call_count, 3)
+
+    @patch('staging_ingest.load_chunk', return_value=(2, 2, []))
+    def test_ingest_file_resumes_and_skips(self, mock_load):
+        # Test that an interrupted file resumes at its checkpoint and a completed file is not read again
+        path = self.write_file('dump.csv', ROWS[:2] + ROWS[3:])
+        checkpoint = len(HEADER) + len(ROWS[0])
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.fetchone.return_value = (checkpoint, 1, 1, 0, False)
+
+        with patch('staging_ingest.connection', mock_connection(mock_conn)):
+            entry = ingest_file(path)
+
+        self.assertEqual(mock_load.call_args.args[2:], (ROWS[1] + ROWS[3], checkpoint))
+        self.assertEqual((entry['status'], entry['rows_read'], entry['completed']), ('resumed', 3, True))
+
+        mock_load.reset_mock()
+        mock_conn.cursor.return_value.fetchone.return_value = (os.path.getsize(path), 3, 3, 0, True)
+        with patch('staging_ingest.connection', mock_connection(mock_conn)):
+            self.assertEqual(ingest_file(path)['status'], 'skipped')
+        mock_load.assert_not_called()
+
+    @patch('staging_ingest.load_chunk', return_value=(2, 2, []))
+    def test_ingest_file_resumes_a_compressed_file(self, mock_load):
+        # Test that a gzip compressed dump resumes at its checkpoint in the decompressed CSV data
+        path = os.path.join(self.directory.name, 'dump.csv.gz')
+        with open(path, 'wb') as file:
+            file.write(gzip.compress(HEADER + b''.join(ROWS)))
+        checkpoint = len(HEADER) + len(ROWS[0]) + len(ROWS[1])
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.fetchone.return_value = (checkpoint, 2, 2, 0, False)
+
+        with patch('staging_ingest.connection', mock_connection(mock_conn)):
+            entry = ingest_file(path)
+
+        self.assertEqual(mock_load.call_args.args[1:], (HEADER.decode().strip().split(','), ROWS[2] + ROWS[3],
+                                                        checkpoint))
+        self.assertEqual((entry['byte_offset'], entry['file_bytes']), (len(HEADER) + len(b''.join(ROWS)),
+                                                                       os.path.getsize(path)))
+
+    @patch('staging_ingest.get_pool')
+    @patch('staging_ingest.ingest_file')
+    def test_ingest_files_keeps_going_after_a_failure(self, mock_ingest, mock_get_pool):
+        # Test that a failing file is reported and the others are still loaded, over as many connections as workers
+        paths = [self.write_file(name, ROWS) for name in ['a.csv', 'b.csv']]
+
+        def ingest(path, chunk_bytes, report, claim):
+            if path.endswith('a.csv'):
+                raise psycopg2.OperationalError('server closed the connection unexpectedly')
+            return {'file_path': path, 'status': 'loaded', 'rows_read': 4, 'rows_new': 4, 'rows_rejected': 0,
+                    'rejected_offsets': []}
+        mock_ingest.side_effect = ingest
+
+        with redirect_stdout(io.StringIO()):
+            entries = ingest_files(paths, workers=2)
+
+        mock_get_pool.return_value.grow.assert_called_once_with(2)
+        statuses = {os.path.basename(entry['file_path']): entry['status'] for entry in entries}
+        self.assertEqual(statuses, {'a.csv': 'failed', 'b.csv': 'loaded'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from api_load_benchmark import start_server, stop_server
+
+# Commands timed from a fresh interpreter, as arguments of ships.py. --help parses the arguments after every import
+# of the command and exits before any work, so the time is the cold start of the command.
+COMMANDS = {
+    'ships --help': ['--help'],
+    'etl raw': ['etl', 'raw', '--help'],
+    'etl ingest': ['etl', 'ingest', '--help'],
+    'db create': ['db', 'create', '--help'],
+    'etl clean': ['etl', 'clean', '--help'],
+    'serve': ['serve', '--help'],
+    'serve --asgi': ['serve', '--asgi', '--help']
+}
+
+# Seconds the median cold start of a command may take before the check fails, about twice what they take now.
+# The staging load and the table creation do not import pandas, the commands working with DataFrames do.
+BUDGETS = {
+    'ships --help': 0.1,
+    'etl raw': 0.3,
+    'etl ingest': 0.3,
+    'db create': 0.3,
+    'etl clean': 2.0,
+    'serve': 2.0,
+    'serve --asgi': 2.5
+}
+
+
+# Function to run a command in a fresh interpreter repeats times and give the wall times in seconds
+def time_command(arguments, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'ships.py'] + arguments, check=True, stdout=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+# Function to find the slowest top-level imports of a command with python -X importtime, as (module, seconds)
+def slowest_imports(arguments, count=5):
+    completed = subprocess.run([sys.executable, '-X', 'importtime', 'ships.py'] + arguments, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module importing them
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+
+# Function to time how long a server takes from its start until it answers /status
+def time_servers(servers, port):
+    results = {}
+    for name in servers:
+        process, startup_seconds = start_server(name, port, pushdown=False)
+        stop_server(process)
+        results[name] = startup_seconds
+    return results
+
+
+def run_benchmark(commands, repeats):
+    results = {}
+    for name in commands:
+        seconds = time_command(COMMANDS[name], repeats)
+        results[name] = {
+            'median_seconds': statistics.median(seconds),
+            'min_seconds': min(seconds),
+            'budget_seconds': BUDGETS[name],
+            'slowest_imports': slowest_imports(COMMANDS[name])
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{'command':>14} {'median (s)':>11} {'min (s)':>9} {'budget (s)':>11}  slowest imports")
+    for name, result in results.items():
+        imports = ', '.join(f"{module} {seconds:.2f}" for module, seconds in result['slowest_imports'][:3])
+        flag = '' if result['median_seconds'] <= result['budget_seconds'] else '  OVER BUDGET'
+        print(f"{name:>14} {result['median_seconds']:>11.3f} {result['min_seconds']:>9.3f} "
+              f"{result['budget_seconds']:>11.2f}  {imports}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the cold start of the ships commands and check them against their budgets."
+    )
+    parser.add_argument("--commands", nargs='+', choices=list(COMMANDS), default=list(COMMANDS))
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per command")
+    parser.add_argument("--servers", nargs='*', choices=['flask', 'async'], default=[],
+                        help="Also time these servers until they answer /status, they load the production data")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.commands, args.repeats)
+    print_results(results)
+    server_results = time_servers(args.servers, args.port)
+    for name, seconds in server_results.items():
+        print(f"{name}: answered /status {seconds:.1f} s after it was started")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'commands': results, 'servers': server_results}, file, indent=2)
+
+    # A non-zero exit code fails a CI step when a command got slower than its budget
+    over_budget = [name for name, result in results.items() if result['median_seconds'] > result['budget_seconds']]
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+from rollups import touched_buckets
+from copy_writer import copy_from_dataframe
+from weather_join import EARTH_RADIUS_KM
+
+# Metres a dropped message may lie from the compressed track, measured from where the track puts the ship at the
+# moment of the message (not from the nearest point of the line), so stops and changes of speed are kept too.
+# Message times are whole seconds of receipt, and a second collector delivers the same position up to seconds later:
+# at 10 knots every second of that is 5 m, a tighter tolerance mostly keeps timing noise.
+TRACK_TOLERANCE_M = 25.0
+
+# Seconds the compressed track may go without a point when the messages have one, so a ship lying still for hours
+# still shows up on a route of a shorter range
+TRACK_MAX_INTERVAL_SECONDS = 900
+
+# Weather columns of a track point. A point is always kept where they change, so the weather along the route has
+# every observation the messages had.
+TRACK_WEATHER_COLUMNS = ['temp', 'wind_spd', 'rh', 'weather_description', 'city_name', 'timezone']
+
+# Columns of the device_tracks table, see create_track_table in db_creation.py. Unlike the message tables, lat and
+# lon are signed: negative in the southern and western hemispheres.
+TRACK_COLUMNS = (['device_id', 'datetime', 'original_message_id', 'lat', 'lon', 'speed_over_ground_d', 'true_course']
+                 + TRACK_WEATHER_COLUMNS)
+
+# Columns of the positions of a ship on the route endpoint
+ROUTE_COLUMNS = ['datetime', 'lat', 'lon', 'speed_over_ground_d', 'true_course']
+
+# Columns of the track points of one ship the route and weather_conditions endpoints read
+TRACK_ROW_COLUMNS = ROUTE_COLUMNS + TRACK_WEATHER_COLUMNS
+
+# Messages of the given (device, day) buckets as track points, including the rows of the batch being loaded.
+# The bounds of all days together let PostgreSQL skip the daily partitions outside them, like the rollups.
+TRACK_MESSAGES_SQL = """
+    SELECT m.device_id, m.datetime, m.original_message_id,
+           (CASE WHEN m.latitude_direction = 'S' THEN -m.lat ELSE m.lat END)::float8 AS lat,
+           (CASE WHEN m.longitude_direction = 'W' THEN -m.lon ELSE m.lon END)::float8 AS lon,
+           m.speed_over_ground_d::float8, m.true_course::float8, m.temp::float8, m.wind_spd::float8, m.rh::float8,
+           m.weather_description, m.city_name, m.timezone
+    FROM unnest(%(device_ids)s::text[], %(days)s::date[]) AS t(device_id, day)
+    JOIN raw_messages_cleaned_weather m
+        ON m.device_id = t.device_id AND m.datetime >= t.day AND m.datetime < t.day + interval '1 day'
+    WHERE m.datetime >= (SELECT min(day) FROM unnest(%(days)s::date[]) AS day)
+      AND m.datetime < (SELECT max(day) FROM unnest(%(days)s::date[]) AS day) + interval '1 day';
+"""
+
+# Points of the tracks of the given (device, day) buckets, for the API to replace the tracks of changed days
+CHANGED_TRACKS_SQL = """
+    SELECT k.*
+    FROM unnest(%(device_ids)s::text[], %(days)s::date[]) AS t(device_id, day)
+    JOIN device_tracks k
+        ON k.device_id = t.device_id AND k.datetime >= t.day AND k.datetime < t.day + interval '1 day'
+    WHERE k.datetime >= (SELECT min(day) FROM unnest(%(days)s::date[]) AS day)
+      AND k.datetime < (SELECT max(day) FROM unnest(%(days)s::date[]) AS day) + interval '1 day';
+"""
+
+DELETE_TRACKS_SQL = """
+    DELETE FROM device_tracks k
+    USING unnest(%(device_ids)s::text[], %(days)s::date[]) AS t(device_id, day)
+    WHERE k.device_id = t.device_id AND k.datetime >= t.day AND k.datetime < t.day + interval '1 day'
+      AND k.datetime >= (SELECT min(day) FROM unnest(%(days)s::date[]) AS day)
+      AND k.datetime < (SELECT max(day) FROM unnest(%(days)s::date[]) AS day) + interval '1 day';
+"""
+
+
+# Function to give messages as track points: their TRACK_COLUMNS with signed coordinates. The message tables keep the
+# coordinates unsigned, their direction fields carry the hemisphere.
+def message_track_points(messages_df):
+    points_df = messages_df[[column for column in TRACK_COLUMNS if column in messages_df.columns]].copy()
+    points_df['lat'] = np.where(messages_df['latitude_direction'].isin(['S']), -1, 1) * messages_df['lat']
+    points_df['lon'] = np.where(messages_df['longitude_direction'].isin(['W']), -1, 1) * messages_df['lon']
+    return points_df
+
+
+# Distance in metres between points and the positions interpolated for them, in degrees. Over the few kilometres
+# of a segment the equirectangular approximation is well within the tolerance.
+def _offset_m(lats, lons, interpolated_lats, interpolated_lons):
+    dlat = np.radians(lats - interpolated_lats)
+    dlon = np.radians((lons - interpolated_lons + 180) % 360 - 180)
+    return EARTH_RADIUS_KM * 1000 * np.hypot(dlat, dlon * np.cos(np.radians(lats)))
+
+
+# Rows where a column differs from the row before it, missing values equal to each other
+def _changes(df):
+    changed = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        values = df[column]
+        changed[1:] |= ~((values.iloc[1:].to_numpy() == values.iloc[:-1].to_numpy())
+                         | (values.iloc[1:].isna().to_numpy() & values.iloc[:-1].isna().to_numpy()))
+    return changed
+
+
+# Function to compress the tracks of many ships at once, with a Douglas-Peucker simplification that measures the
+# error of a message from the position the simplified track interpolates for its time (the synchronized distance).
+# The first and last message of every ship and every change of the weather are kept. Then every segment between two
+# kept messages whose farthest message is off by more than tolerance_m is split there, and every segment longer than
+# max_interval_seconds at the message nearest its middle, until none is left to split. All segments of all ships are
+# split in the same pass, so the loop runs as often as the simplification is deep, not once per segment.
+# Messages without a time or a position are left out. Returns the kept messages, sorted by ship and time, and the
+# number of messages, the number kept and the largest distance of a dropped message from the track in metres.
+def compress_tracks(points_df, tolerance_m=TRACK_TOLERANCE_M, max_interval_seconds=TRACK_MAX_INTERVAL_SECONDS):
+    points_df = points_df[points_df[['datetime', 'lat', 'lon']].notna().all(axis=1).to_numpy()]
+    codes, _ = pd.factorize(points_df['device_id'])
+    times = pd.to_datetime(points_df['datetime']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    order = np.lexsort((times, codes))
+    points_df, codes = points_df.iloc[order].reset_index(drop=True), codes[order]
+    seconds = (times[order] - (times.min() if len(times) else 0)) / 1e9
+    lats, lons = points_df['lat'].to_numpy(dtype=float), points_df['lon'].to_numpy(dtype=float)
+
+    keep = np.zeros(len(points_df), dtype=bool)
+    if len(points_df):
+        ship_edges = np.flatnonzero(np.diff(codes)) + 1
+        keep[np.r_[0, ship_edges, ship_edges - 1, len(points_df) - 1]] = True
+        weather_columns = [column for column in TRACK_WEATHER_COLUMNS if column in points_df.columns]
+        keep |= _changes(points_df[weather_columns])
+
+    open_points = ~keep
+    max_error_m = 0.0
+    while open_points.any():
+        kept = np.flatnonzero(keep)
+        points = np.flatnonzero(open_points)
+        # Every open message lies between two kept ones of its ship, the ships' first and last are kept
+        right = np.searchsorted(kept, points)
+        first, last = kept[right - 1], kept[right]
+
+        duration = seconds[last] - seconds[first]
+        fraction = np.divide(seconds[points] - seconds[first], duration, out=np.zeros(len(points)),
+                             where=duration > 0)
+        dlon = (lons[last] - lons[first] + 180) % 360 - 180
+        errors = _offset_m(lats[points], lons[points], lats[first] + (lats[last] - lats[first]) * fraction,
+                           lons[first] + dlon * fraction)
+
+        # The open messages of a segment are contiguous
+        segment_starts = np.flatnonzero(np.r_[True, right[1:] != right[:-1]])
+        segments = np.repeat(np.arange(len(segment_starts)), np.diff(np.r_[segment_starts, len(points)]))
+        segment_errors = np.maximum.reduceat(errors, segment_starts)
+        split_on_error = segment_errors > tolerance_m
+        split_on_time = np.zeros(len(segment_starts), dtype=bool)
+        if max_interval_seconds is not None:
+            split_on_time = ~split_on_error & (duration[segment_starts] > max_interval_seconds)
+        done = ~(split_on_error | split_on_time)
+        if done.any():
+            max_error_m = max(max_error_m, float(segment_errors[done].max()))
+
+        # The message to split a segment at has the highest score in it: its error, or its closeness to the middle
+        middle = (seconds[first] + seconds[last]) / 2
+        scores = np.where(split_on_error[segments], errors, -np.abs(seconds[points] - middle))
+        best = np.flatnonzero(scores == np.maximum.reduceat(scores, segment_starts)[segments])
+        _, firsts = np.unique(segments[best], return_index=True)
+        splits = best[firsts]
+        splits = points[splits[~done[segments[splits]]]]
+
+        keep[splits] = True
+        open_points[splits] = False
+        open_points[points[done[segments]]] = False
+
+    return points_df[keep].reset_index(drop=True), {
+        'points_in': len(points_df), 'points_out': int(keep.sum()), 'max_error_m': max_error_m
+    }
+
+
+# Function to rebuild the compressed tracks of every (device, day) a batch of messages touched, after the batch was
+# loaded into raw_messages_cleaned_weather in the cursor's transaction. Like the rollups, the days are recomputed from
+# all their messages in the table, so a track never depends on how the messages were split into batches or loads.
+# The price is that every batch reads and compresses the whole of the days it touches again: a ship-day loaded in k
+# batches (hourly --incremental runs, or a small --batch-size) reads about k / 2 times its messages, so for a fixed
+# batch size the work grows with the square of a day's messages. Batches of a day or more keep it to a single pass.
+# Returns the counts and error of compress_tracks.
+def refresh_tracks(cursor, messages_df, tolerance_m=TRACK_TOLERANCE_M,
+                   max_interval_seconds=TRACK_MAX_INTERVAL_SECONDS):
+    days_df = touched_buckets(messages_df, 'D')
+    params = {'device_ids': days_df['device_id'].tolist(), 'days': days_df['bucket'].dt.date.tolist()}
+    if days_df.empty:
+        return {'points_in': 0, 'points_out': 0, 'max_error_m': 0.0}
+
+    cursor.execute(TRACK_MESSAGES_SQL, params)
+    points_df = pd.DataFrame(cursor.fetchall(), columns=TRACK_COLUMNS)
+    track_df, stats = compress_tracks(points_df, tolerance_m, max_interval_seconds)
+
+    cursor.execute(DELETE_TRACKS_SQL, params)
+    copy_from_dataframe(cursor, track_df[TRACK_COLUMNS], 'device_tracks')
+    return stats
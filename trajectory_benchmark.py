@@ -0,0 +1,83 @@
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from fleet_generator import DEFAULT_START, simulate_tracks
+from trajectory import compress_tracks, TRACK_MAX_INTERVAL_SECONDS
+from app import route_records
+
+
+# Function to simulate the track points of a fleet, one message per ship every interval_seconds. Like the received
+# messages, every time is off by up to two seconds from when the position was taken.
+def make_points(n_ships, days, interval_seconds, rng):
+    n_steps = days * 86400 // interval_seconds
+    lats, lons, speeds, courses = simulate_tracks(n_ships, n_steps, interval_seconds, rng)
+    times = pd.Timestamp(DEFAULT_START) + pd.to_timedelta(np.arange(n_steps) * interval_seconds, unit='s')
+    jitter = pd.to_timedelta(rng.integers(0, 3, (n_steps, n_ships)).ravel(), unit='s')
+    return pd.DataFrame({
+        'device_id': np.tile([f"ship-{i}" for i in range(n_ships)], n_steps),
+        'datetime': np.repeat(times, n_ships) + jitter,
+        'lat': lats.ravel(), 'lon': lons.ravel(), 'speed_over_ground_d': speeds.ravel(), 'true_course': courses.ravel()
+    })
+
+
+# Bytes of the JSON the route endpoint answers with for every ship-day, on average
+def route_bytes_per_ship_day(points_df):
+    days = points_df['datetime'].dt.floor('D')
+    sizes = [len(json.dumps(route_records(day_df))) for _, day_df in points_df.groupby(['device_id', days])]
+    return float(np.mean(sizes))
+
+
+def run_benchmark(n_ships, days, interval_seconds, tolerances, max_interval_seconds, seed=0):
+    points_df = make_points(n_ships, days, interval_seconds, np.random.default_rng(seed))
+    results = {
+        'points': len(points_df),
+        'full': {'route_bytes': route_bytes_per_ship_day(points_df)},
+        'tolerances': {}
+    }
+    for tolerance_m in tolerances:
+        start = time.perf_counter()
+        track_df, stats = compress_tracks(points_df, tolerance_m, max_interval_seconds)
+        seconds = time.perf_counter() - start
+        results['tolerances'][tolerance_m] = {
+            **stats,
+            'ratio': stats['points_in'] / stats['points_out'],
+            'seconds': seconds,
+            'route_bytes': route_bytes_per_ship_day(track_df)
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{results['points']} messages, route of a ship-day at full resolution: "
+          f"{results['full']['route_bytes'] / 1024:.0f} KiB")
+    print(f"{'tolerance (m)':>13} {'points':>9} {'ratio':>7} {'max error (m)':>14} {'time (s)':>9} {'route (KiB)':>12}")
+    for tolerance_m, result in results['tolerances'].items():
+        print(f"{tolerance_m:>13g} {result['points_out']:>9} {result['ratio']:>6.1f}x {result['max_error_m']:>14.1f} "
+              f"{result['seconds']:>9.2f} {result['route_bytes'] / 1024:>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compress the tracks of a simulated fleet at several tolerances and compare the routes."
+    )
+    parser.add_argument("--ships", type=int, default=20)
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--interval-seconds", type=int, default=10, help="Seconds between the messages of a ship")
+    parser.add_argument("--tolerances", type=float, nargs='+', default=[5, 10, 25, 50, 100],
+                        help="Tolerances in metres, one compression per value")
+    parser.add_argument("--max-interval-seconds", type=int, default=TRACK_MAX_INTERVAL_SECONDS)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.ships, args.days, args.interval_seconds, args.tolerances,
+                            args.max_interval_seconds)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
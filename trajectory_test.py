@@ -0,0 +1,109 @@
+import unittest
+import datetime
+from unittest.mock import patch, MagicMock
+import numpy as np
+import pandas as pd
+from trajectory import (compress_tracks, message_track_points, refresh_tracks, TRACK_COLUMNS, TRACK_MESSAGES_SQL,
+                        DELETE_TRACKS_SQL)
+
+# Track points of a ship at one message a minute: sailing north at about 5.6 m/s for 30 minutes, lying still for
+# 30 minutes and sailing east for 30 minutes, in the same weather throughout
+def make_points(device_id='0001'):
+    times = pd.date_range('2019-02-13 10:00', periods=90, freq='min')
+    lats = np.r_[51.0 + np.arange(30) * 0.003, np.full(30, 51.09), np.full(30, 51.09)]
+    lons = np.r_[np.full(30, 4.0), np.full(30, 4.0), 4.0 + np.arange(30) * 0.005]
+    return pd.DataFrame({
+        'device_id': device_id, 'datetime': times, 'original_message_id': [f"{device_id}-{i}" for i in range(90)],
+        'lat': lats, 'lon': lons, 'speed_over_ground_d': 10.0, 'true_course': 0.0, 'temp': 1.0, 'wind_spd': 3.0,
+        'rh': 80.0, 'weather_description': 'Overcast clouds', 'city_name': 'Antwerp', 'timezone': 'Europe/Brussels'
+    })
+
+class TrajectoryTestCase(unittest.TestCase):
+
+    def test_compress_tracks_keeps_the_corners(self):
+        # Test that straight legs and the stop between them shrink to their ends, and every ship keeps its own
+        points_df = pd.concat([make_points('0001'), make_points('st-1a2090')]).sample(frac=1, random_state=0)
+
+        track_df, stats = compress_tracks(points_df, tolerance_m=25.0, max_interval_seconds=None)
+
+        self.assertEqual(stats['points_in'], 180)
+        self.assertEqual(stats['points_out'], len(track_df))
+        self.assertLess(len(track_df), 20)
+        self.assertLessEqual(stats['max_error_m'], 25.0)
+        for device_id in ['0001', 'st-1a2090']:
+            times = track_df.loc[track_df['device_id'] == device_id, 'datetime']
+            self.assertTrue(times.is_monotonic_increasing)
+            # The first and last message, and where the ship stopped and started again
+            for moment in ['10:00', '10:30', '11:00', '11:29']:
+                self.assertIn(pd.Timestamp(f'2019-02-13 {moment}'), times.tolist())
+
+    def test_compress_tracks_keeps_weather_changes_and_gaps(self):
+        # Test that a change of the weather is kept, and that the track has a point at least every interval
+        points_df = make_points()
+        points_df.loc[45:, 'temp'] = 2.0
+
+        track_df, _ = compress_tracks(points_df, tolerance_m=25.0, max_interval_seconds=600)
+
+        self.assertIn(points_df.loc[45, 'datetime'], track_df['datetime'].tolist())
+        self.assertLessEqual(track_df['datetime'].diff().max(), pd.Timedelta(seconds=600))
+
+    def test_compress_tracks_bounds_the_error(self):
+        # Test that no message of a noisy track lies farther than the tolerance from where the track puts the ship
+        rng = np.random.default_rng(0)
+        points_df = make_points()
+        points_df['lat'] += rng.normal(0, 0.0002, len(points_df))
+        points_df['lon'] += rng.normal(0, 0.0003, len(points_df))
+
+        track_df, stats = compress_tracks(points_df, tolerance_m=25.0, max_interval_seconds=None)
+
+        seconds = (points_df['datetime'] - points_df['datetime'].min()).dt.total_seconds()
+        track_seconds = (track_df['datetime'] - points_df['datetime'].min()).dt.total_seconds()
+        lats = np.interp(seconds, track_seconds, track_df['lat'])
+        lons = np.interp(seconds, track_seconds, track_df['lon'])
+        errors_m = 6371000 * np.hypot(np.radians(points_df['lat'] - lats),
+                                      np.radians(points_df['lon'] - lons) * np.cos(np.radians(points_df['lat'])))
+        self.assertLessEqual(errors_m.max(), 25.0 + 1e-6)
+        self.assertAlmostEqual(stats['max_error_m'], errors_m.max(), places=3)
+
+    def test_message_track_points(self):
+        # Test that southern latitudes and western longitudes become negative
+        messages_df = pd.DataFrame({
+            'device_id': ['0001', '0001'], 'datetime': pd.to_datetime(['2019-02-13 10:00', '2019-02-13 10:01']),
+            'lat': [51.0, 33.9], 'latitude_direction': ['N', 'S'], 'lon': [4.0, 18.4],
+            'longitude_direction': ['W', 'E'], 'speed_over_ground_d': [1.0, 2.0]
+        })
+
+        points_df = message_track_points(messages_df)
+
+        self.assertEqual(points_df['lat'].tolist(), [51.0, -33.9])
+        self.assertEqual(points_df['lon'].tolist(), [-4.0, 18.4])
+        self.assertNotIn('latitude_direction', points_df.columns)
+
+    @patch('trajectory.copy_from_dataframe')
+    def test_refresh_tracks(self, mock_copy):
+        # Test that the touched days are read back, deleted and written again compressed
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = list(make_points()[TRACK_COLUMNS].itertuples(index=False))
+        messages_df = make_points().iloc[:2]
+
+        stats = refresh_tracks(mock_cursor, messages_df)
+
+        calls = mock_cursor.execute.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [TRACK_MESSAGES_SQL, DELETE_TRACKS_SQL])
+        self.assertEqual(calls[0].args[1], {'device_ids': ['0001'], 'days': [datetime.date(2019, 2, 13)]})
+        track_df, table = mock_copy.call_args.args[1:]
+        self.assertEqual(table, 'device_tracks')
+        self.assertEqual(list(track_df.columns), TRACK_COLUMNS)
+        self.assertEqual((stats['points_in'], stats['points_out']), (90, len(track_df)))
+
+    def test_refresh_tracks_without_messages(self):
+        # Test that an empty batch touches no table
+        mock_cursor = MagicMock()
+
+        stats = refresh_tracks(mock_cursor, make_points().iloc[:0])
+
+        mock_cursor.execute.assert_not_called()
+        self.assertEqual(stats['points_out'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
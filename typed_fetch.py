@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from db_connection import cursor, close_pools
+from exploratory_data_analysis import fetch_data_from_db
+
+# Text columns with a handful of distinct values repeated on every row, stored as categoricals
+CATEGORICAL_COLUMNS = [
+    'device_id', 'data_status', 'latitude_direction', 'longitude_direction', 'mag_var_dir', 'pod',
+    'weather_icon', 'weather_code', 'weather_description', 'city_name', 'station_id', 'timezone'
+]
+
+# Weather observations, their precision fits in float32 (and in REAL, see migrate_float_columns in db_creation.py).
+# Positions, speeds and timestamps like ts stay float64.
+FLOAT32_COLUMNS = [
+    'rh', 'wind_spd', 'slp', 'vis', 'solar_rad', 'pres', 'h_angle', 'dewpt', 'snow', 'uv', 'elev_angle', 'wind_dir',
+    'ghi', 'dhi', 'dni', 'azimuth', 'temp', 'precip', 'clouds'
+]
+
+# PostgreSQL type oids of the columns a query returns, see pg_type
+_FLOAT_OIDS = {700, 701, 1700}    # real, double precision, numeric
+_TEMPORAL_OIDS = {1082, 1114, 1184}    # date, timestamp, timestamptz
+_TEXT_OIDS = {18, 25, 1042, 1043}    # char, text, character, character varying
+
+# Bytes of COPY output gathered before they are written to the pipe the parser reads
+COPY_BUFFER_BYTES = 1024 * 1024
+
+# Written by COPY for NULL, so NULL and empty strings stay apart
+_COPY_NULL = '\\N'
+
+
+# Function to give the message columns of a DataFrame their compact dtypes, also after concatenating frames whose
+# categoricals have different categories
+def compact_dtypes(df):
+    dtypes = {column: 'category' for column in CATEGORICAL_COLUMNS if column in df.columns}
+    dtypes.update({column: 'float32' for column in FLOAT32_COLUMNS if column in df.columns})
+    return df.astype(dtypes)
+
+
+# Function to stream the output of a COPY ... TO STDOUT statement, the context gives a file to read it from while
+# the statement runs. COPY writes into a pipe from a thread, so nothing is held on disk or in memory beyond the
+# pipe's buffer, and an error of the COPY is raised when the output is read to its end or cut short by it.
+@contextmanager
+def copy_output(cur, copy_sql):
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy_out():
+        try:
+            # COPY writes every row on its own, the buffer turns them into few large writes to the pipe
+            with open(write_fd, 'wb', buffering=COPY_BUFFER_BYTES) as writer:
+                cur.copy_expert(copy_sql, writer)
+        except BaseException as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=copy_out, name='copy_output', daemon=True)
+    thread.start()
+    try:
+        # Closing the read end makes a COPY still writing fail instead of waiting for a reader forever
+        with open(read_fd, 'rb') as reader:
+            yield reader
+    except Exception:
+        thread.join()
+        # Output cut short by a failed COPY is reported as that failure, not as the parse error it causes
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+        raise
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+# Function to fetch the result of a query into a DataFrame with compact dtypes. Instead of building a Python object
+# (a Decimal for every NUMERIC) per value, the result is streamed out with COPY and parsed into typed columns by the
+# CSV reader as it arrives, which also keeps memory flat while fetching.
+def fetch_typed_data_from_db(query, environment, params=None):
+    query = query.strip().rstrip(';')
+    with cursor(environment) as cur:
+        # The column types of the result, without fetching any rows
+        cur.execute(f"SELECT * FROM ({query}) AS result LIMIT 0;", params)
+        description = cur.description
+
+        dtypes, parse_dates, na_values = {}, [], {}
+        for column in description:
+            na_values[column.name] = [_COPY_NULL]
+            if column.type_code in _FLOAT_OIDS:
+                dtypes[column.name] = 'float32' if column.name in FLOAT32_COLUMNS else 'float64'
+                na_values[column.name].append('NaN')
+            elif column.type_code in _TEMPORAL_OIDS:
+                parse_dates.append(column.name)
+            elif column.type_code in _TEXT_OIDS:
+                dtypes[column.name] = 'category' if column.name in CATEGORICAL_COLUMNS else 'str'
+
+        copy_sql = cur.mogrify(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '{_COPY_NULL}')", params)
+        with copy_output(cur, copy_sql.decode('utf-8')) as file:
+            # round_trip parses every float to the same value float() gives for the text
+            return pd.read_csv(file, dtype=dtypes, parse_dates=parse_dates, na_values=na_values,
+                               keep_default_na=False, float_precision='round_trip')
+
+
+# Function to compare the memory of every column of two DataFrames with the same columns, in bytes
+def memory_report(before_df, after_df):
+    report_df = pd.DataFrame({
+        'before_dtype': before_df.dtypes.astype(str),
+        'before_bytes': before_df.memory_usage(index=False, deep=True),
+        'after_dtype': after_df.dtypes.astype(str),
+        'after_bytes': after_df.memory_usage(index=False, deep=True)
+    })
+    report_df.loc['total'] = ['', report_df['before_bytes'].sum(), '', report_df['after_bytes'].sum()]
+    report_df['ratio'] = report_df['before_bytes'] / report_df['after_bytes']
+    return report_df
+
+
+# Prints the time and per-column memory of loading a production table through pd.read_sql and the typed path
+def main(table_name='raw_messages_cleaned_weather'):
+    query = f"SELECT * FROM {table_name};"
+
+    start = time.perf_counter()
+    read_sql_df = fetch_data_from_db(query=query, environment="PRODUCTION")
+    read_sql_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    typed_df = fetch_typed_data_from_db(query, "PRODUCTION")
+    typed_seconds = time.perf_counter() - start
+
+    print(f"{table_name}: {len(typed_df)} rows, pd.read_sql {read_sql_seconds:.2f} s, typed {typed_seconds:.2f} s")
+    print(memory_report(read_sql_df, typed_df).to_string())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
+    close_pools()
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from collections import namedtuple
+import numpy as np
+import psycopg2.errors
+import pandas as pd
+from typed_fetch import compact_dtypes, fetch_typed_data_from_db, memory_report
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+# What COPY writes for two messages, NULL is written as \N
+COPY_CSV = (
+    b"device_id,datetime,address_port,original_message_id,lat,temp,latitude_direction,weather_description\n"
+    b"st-1a2090,2019-02-13 14:09:59,4007,m1,51.31830816666667,4.7,N,Overcast clouds\n"
+    b"0001,2019-02-13 14:21:01,4007,m2,NaN,\\N,\"\",\\N\n"
+)
+
+class TypedFetchTestCase(unittest.TestCase):
+
+    @patch('typed_fetch.cursor')
+    def test_fetch_typed_data_from_db(self, mock_cursor):
+        cur = MagicMock()
+        cur.description = [
+            Column('device_id', 1043), Column('datetime', 1114), Column('address_port', 23),
+            Column('original_message_id', 1043), Column('lat', 1700), Column('temp', 1700),
+            Column('latitude_direction', 1042), Column('weather_description', 1043)
+        ]
+        cur.mogrify.side_effect = lambda sql, params: sql.encode('utf-8')
+        cur.copy_expert.side_effect = lambda sql, file: file.write(COPY_CSV)
+        mock_cursor.return_value.__enter__.return_value = cur
+
+        result_df = fetch_typed_data_from_db("SELECT * FROM raw_messages_cleaned_weather;", "PRODUCTION")
+
+        # The result is copied out without the trailing semicolon
+        self.assertIn("COPY (SELECT * FROM raw_messages_cleaned_weather) TO STDOUT", cur.copy_expert.call_args.args[0])
+        self.assertEqual(result_df['device_id'].dtype, 'category')
+        self.assertEqual(result_df['weather_description'].dtype, 'category')
+        self.assertEqual(result_df['lat'].dtype, np.float64)
+        self.assertEqual(result_df['temp'].dtype, np.float32)
+        self.assertEqual(result_df['address_port'].dtype, np.int64)
+        self.assertEqual(result_df['datetime'].iloc[0], pd.Timestamp('2019-02-13 14:09:59'))
+        # Floats are parsed exactly, NULL and NaN become NaN while an empty string stays a string
+        self.assertEqual(result_df['lat'].iloc[0], 51.31830816666667)
+        self.assertTrue(np.isnan(result_df['lat'].iloc[1]))
+        self.assertTrue(np.isnan(result_df['temp'].iloc[1]))
+        self.assertEqual(result_df['latitude_direction'].iloc[1], '')
+        self.assertTrue(pd.isna(result_df['weather_description'].iloc[1]))
+
+    @patch('typed_fetch.cursor')
+    def test_fetch_typed_data_from_db_copy_error(self, mock_cursor):
+        # Test that a COPY failing halfway raises its own error instead of returning the rows read so far
+        def copy_expert(sql, file):
+            file.write(COPY_CSV[:120])
+            raise psycopg2.errors.DivisionByZero("division by zero")
+        cur = MagicMock()
+        cur.description = [Column('device_id', 1043), Column('datetime', 1114)]
+        cur.mogrify.side_effect = lambda sql, params: sql.encode('utf-8')
+        cur.copy_expert.side_effect = copy_expert
+        mock_cursor.return_value.__enter__.return_value = cur
+
+        with self.assertRaises(psycopg2.errors.DivisionByZero):
+            fetch_typed_data_from_db("SELECT * FROM raw_messages_cleaned_weather;", "PRODUCTION")
+
+    def test_compact_dtypes_merges_categories(self):
+        # Concatenating categoricals with different categories gives object columns, compacting makes them categorical
+        first_df = compact_dtypes(pd.DataFrame({'device_id': ['0001'], 'temp': [1.5]}))
+        second_df = compact_dtypes(pd.DataFrame({'device_id': ['st-1a2090'], 'temp': [2.5]}))
+        result_df = compact_dtypes(pd.concat([first_df, second_df], ignore_index=True))
+
+        self.assertEqual(list(result_df['device_id'].cat.categories), ['0001', 'st-1a2090'])
+        self.assertEqual(result_df['temp'].dtype, np.float32)
+
+    def test_memory_report(self):
+        # Test that the report has the bytes of every column before and after, plus a total
+        before_df = pd.DataFrame({'device_id': ['st-1a2090'] * 100, 'temp': np.ones(100)})
+        report_df = memory_report(before_df, compact_dtypes(before_df))
+
+        self.assertEqual(list(report_df.index), ['device_id', 'temp', 'total'])
+        self.assertEqual(report_df.loc['temp', 'before_bytes'], 800)
+        self.assertEqual(report_df.loc['temp', 'after_bytes'], 400)
+        self.assertEqual(report_df.loc['total', 'before_bytes'], report_df['before_bytes'].iloc[:2].sum())
+        self.assertGreater(report_df.loc['device_id', 'ratio'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import pandas as pd
+
+# Staging rows past the high-water mark of their device, in watermark order so that an interrupted
+# batched run never moves a watermark past rows it has not loaded yet
+INCREMENTAL_STAGING_QUERY = """
+    SELECT r.*
+    FROM raw_messages r
+    LEFT JOIN unnest(%(device_ids)s::text[], %(last_epochs)s::bigint[], %(last_message_ids)s::text[])
+        AS w(device_id, last_epoch, last_original_message_id)
+        ON w.device_id = r.device_id
+    WHERE w.device_id IS NULL
+       OR (r.datetime::bigint, r.original_message_id) > (w.last_epoch - %(lookback_seconds)s, w.last_original_message_id)
+    ORDER BY r.datetime::bigint, r.original_message_id;
+"""
+
+
+# Function to read the high-water mark of every device from production
+def fetch_watermarks(cursor):
+    cursor.execute("""
+        SELECT device_id, EXTRACT(EPOCH FROM last_datetime)::bigint, last_original_message_id
+        FROM etl_watermarks;
+    """)
+    return pd.DataFrame(cursor.fetchall(), columns=['device_id', 'last_epoch', 'last_original_message_id'])
+
+
+# Function to build the staging query and its parameters for everything past the given watermarks.
+# A lookback re-reads that many seconds before each watermark to pick up late messages, the upserts make that safe.
+def build_incremental_query(watermarks_df, lookback_seconds=0):
+    params = {
+        'device_ids': watermarks_df['device_id'].tolist(),
+        'last_epochs': [int(epoch) for epoch in watermarks_df['last_epoch']],
+        'last_message_ids': watermarks_df['last_original_message_id'].tolist(),
+        'lookback_seconds': int(lookback_seconds)
+    }
+    return INCREMENTAL_STAGING_QUERY, params
+
+
+# Function to find the latest (datetime, original_message_id) of every device in a batch of staging rows
+def compute_watermarks(raw_messages_df):
+    watermarks_df = pd.DataFrame({
+        'device_id': raw_messages_df['device_id'],
+        'last_epoch': pd.to_numeric(raw_messages_df['datetime']).astype('int64'),
+        'last_original_message_id': raw_messages_df['original_message_id']
+    })
+    watermarks_df = watermarks_df.sort_values(['last_epoch', 'last_original_message_id'])
+    return watermarks_df.groupby('device_id', sort=True).tail(1).sort_values('device_id').reset_index(drop=True)
+
+
+# Function to move the watermarks forward, a watermark is never moved back
+def update_watermarks(cursor, watermarks_df):
+    cursor.execute("""
+        INSERT INTO etl_watermarks (device_id, last_datetime, last_original_message_id)
+        SELECT device_id, to_timestamp(last_epoch) AT TIME ZONE 'UTC', last_original_message_id
+        FROM unnest(%s::text[], %s::bigint[], %s::text[]) AS w(device_id, last_epoch, last_original_message_id)
+        ON CONFLICT (device_id) DO UPDATE SET
+            last_datetime = EXCLUDED.last_datetime,
+            last_original_message_id = EXCLUDED.last_original_message_id,
+            updated_at = now()
+        WHERE (etl_watermarks.last_datetime, etl_watermarks.last_original_message_id)
+            < (EXCLUDED.last_datetime, EXCLUDED.last_original_message_id);
+    """, (
+        watermarks_df['device_id'].tolist(),
+        [int(epoch) for epoch in watermarks_df['last_epoch']],
+        watermarks_df['last_original_message_id'].tolist()
+    ))
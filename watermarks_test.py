@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+from watermarks import fetch_watermarks, build_incremental_query, compute_watermarks, update_watermarks
+
+class WatermarksTestCase(unittest.TestCase):
+
+    def test_compute_watermarks(self):
+        # Staging rows as text, the latest (datetime, original_message_id) of every device wins
+        sample_df = pd.DataFrame({
+            'device_id': ['st-1a2090', '0001', 'st-1a2090', 'st-1a2090', '0001'],
+            'datetime': ['1550067048', '1550066999', '1550069034', '1550069034', '1550067661'],
+            'original_message_id': ['m1', 'm2', 'm3', 'm4', 'm5']
+        })
+
+        result_df = compute_watermarks(sample_df)
+
+        expected_df = pd.DataFrame({
+            'device_id': ['0001', 'st-1a2090'],
+            'last_epoch': [1550067661, 1550069034],
+            'last_original_message_id': ['m5', 'm4']
+        })
+        pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
+
+    def test_build_incremental_query(self):
+        # The watermarks are passed as array parameters next to the lookback
+        watermarks_df = pd.DataFrame({
+            'device_id': ['0001'],
+            'last_epoch': [1550067661],
+            'last_original_message_id': ['m5']
+        })
+
+        query, params = build_incremental_query(watermarks_df, lookback_seconds=60)
+
+        self.assertIn('ORDER BY', query)
+        self.assertEqual(params, {
+            'device_ids': ['0001'],
+            'last_epochs': [1550067661],
+            'last_message_ids': ['m5'],
+            'lookback_seconds': 60
+        })
+
+    def test_build_incremental_query_without_watermarks(self):
+        # A first run has no watermarks, which selects every staging row
+        query, params = build_incremental_query(fetch_watermarks(MagicMock(**{'fetchall.return_value': []})))
+        self.assertEqual(params['device_ids'], [])
+
+    def test_update_watermarks(self):
+        # The watermarks are upserted in a single statement and only ever move forward
+        mock_cursor = MagicMock()
+        watermarks_df = pd.DataFrame({
+            'device_id': ['0001', 'st-1a2090'],
+            'last_epoch': [1550067661, 1550069034],
+            'last_original_message_id': ['m5', 'm4']
+        })
+
+        update_watermarks(mock_cursor, watermarks_df)
+
+        sql, params = mock_cursor.execute.call_args.args
+        self.assertIn('ON CONFLICT (device_id)', sql)
+        self.assertIn('WHERE (etl_watermarks.last_datetime', sql)
+        self.assertEqual(params, (['0001', 'st-1a2090'], [1550067661, 1550069034], ['m5', 'm4']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+# Mean Earth radius used for the haversine distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Columns of the weather DataFrame that are used for the lookup and not copied onto the messages
+WEATHER_KEY_COLUMNS = ['datetime', 'lat', 'lon']
+
+# Upper bound on (grid cells x stations) distances computed when building the lookup grid of a query
+_GRID_DISTANCE_BUDGET = 1 << 24
+_MAX_GRID_CELLS = 1 << 16
+_POINTS_PER_GRID_CELL = 16
+
+
+# Great-circle distance in kilometres between two sets of points given in degrees
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=np.float64)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Points on the unit sphere: the straight-line distance between them grows with the great-circle distance,
+# so the nearest point in 3D is also the nearest point on the globe
+def _unit_vectors(lats, lons):
+    lats, lons = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+# Nearest-station lookup over the station coordinates.
+# The queried area is cut into a grid of small lat/lon cells and every cell keeps the few stations that can be
+# nearest to some point inside it, so most messages are resolved by an array lookup and the rest by a few dot products.
+class StationIndex:
+
+    def __init__(self, station_lats, station_lons):
+        self.station_lats = np.asarray(station_lats, dtype=np.float64)
+        self.station_lons = np.asarray(station_lons, dtype=np.float64)
+        self._vectors = _unit_vectors(self.station_lats, self.station_lons)
+
+    # Candidate stations of every cell of a grid over the given bounds, padded with -1
+    def _cell_candidates(self, lat_min, lon_min, step, n_rows, n_cols):
+        cell_lats = lat_min + (np.repeat(np.arange(n_rows), n_cols) + 0.5) * step
+        cell_lons = lon_min + (np.tile(np.arange(n_cols), n_rows) + 0.5) * step
+        centers = _unit_vectors(cell_lats, cell_lons)
+
+        # The farthest point of a lat/lon cell from its center is one of its corners
+        radius = np.zeros(len(centers))
+        for lat_offset in (-step / 2, step / 2):
+            for lon_offset in (-step / 2, step / 2):
+                corners = _unit_vectors(np.clip(cell_lats + lat_offset, -90, 90), cell_lons + lon_offset)
+                radius = np.maximum(radius, np.linalg.norm(centers - corners, axis=1))
+        radius = radius * (1 + 1e-6) + 1e-12
+
+        # A station can only be nearest to a point of the cell if it is within twice the radius of the nearest one
+        distances = np.sqrt(np.maximum(2 - 2 * centers @ self._vectors.T, 0))
+        keep = distances <= distances.min(axis=1, keepdims=True) + 2 * radius[:, None]
+        cells, stations = np.nonzero(keep)
+        slots = keep.cumsum(axis=1)[cells, stations] - 1
+        candidates = np.full((len(centers), slots.max() + 1), -1, dtype=np.int64)
+        candidates[cells, slots] = stations
+        return candidates
+
+    # Index of the nearest station for every point, with its haversine distance in kilometres when asked for.
+    # Points with a nan or infinite coordinate, which the message parser lets through, get station -1 and no distance.
+    def nearest(self, lats, lons, with_distance=True):
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        finite = np.isfinite(lats) & np.isfinite(lons)
+        if not finite.all():
+            station_idx = np.full(len(lats), -1, dtype=np.int64)
+            distance_km = np.full(len(lats), np.nan) if with_distance else None
+            station_idx[finite], finite_distance_km = self.nearest(lats[finite], lons[finite], with_distance)
+            if with_distance:
+                distance_km[finite] = finite_distance_km
+            return station_idx, distance_km
+        if len(lats) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0) if with_distance else None
+
+        # Square cells over the bounds of the points, as many as the budget allows
+        lat_min, lon_min = lats.min(), lons.min()
+        lat_span, lon_span = lats.max() - lat_min, lons.max() - lon_min
+        max_cells = min(_MAX_GRID_CELLS, len(lats) // _POINTS_PER_GRID_CELL, _GRID_DISTANCE_BUDGET // len(self._vectors))
+        max_cells = max(max_cells, 1)
+        step = max(np.sqrt(lat_span * lon_span / max_cells), max(lat_span, lon_span) / max_cells, 1e-9)
+        n_rows, n_cols = int(lat_span / step) + 1, int(lon_span / step) + 1
+        candidates = self._cell_candidates(lat_min, lon_min, step, n_rows, n_cols)
+
+        cells = (np.minimum(((lats - lat_min) / step).astype(np.int64), n_rows - 1) * n_cols
+                 + np.minimum(((lons - lon_min) / step).astype(np.int64), n_cols - 1))
+        station_idx = candidates[cells, 0]
+
+        # Points in cells with more than one candidate pick the closest candidate
+        if candidates.shape[1] > 1:
+            undecided = np.flatnonzero(candidates[cells, 1] >= 0)
+            undecided_candidates = candidates[cells[undecided]]
+            similarity = np.einsum(
+                'nd,nkd->nk', _unit_vectors(lats[undecided], lons[undecided]),
+                self._vectors[np.maximum(undecided_candidates, 0)]
+            )
+            similarity[undecided_candidates < 0] = -np.inf
+            station_idx[undecided] = undecided_candidates[np.arange(len(undecided)), similarity.argmax(axis=1)]
+
+        if not with_distance:
+            return station_idx, None
+        distance_km = haversine_km(lats, lons, self.station_lats[station_idx], self.station_lons[station_idx])
+        return station_idx, distance_km
+
+
+# Weather observations grouped per station and sorted by time, ready to be joined onto messages.
+# Every distinct (lat, lon) in the weather data is a station.
+class WeatherIndex:
+
+    def __init__(self, weather_df, max_distance_km=None):
+        weather_df = weather_df[weather_df['datetime'].notna()]
+        station_codes = weather_df.groupby(['lat', 'lon'], sort=False).ngroup().to_numpy()
+        stations = weather_df[['lat', 'lon']].drop_duplicates()
+        self.stations = StationIndex(stations['lat'], stations['lon'])
+        self.max_distance_km = max_distance_km
+
+        # Sort the observations by (station, time) and remember where every station starts
+        times = weather_df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        order = np.lexsort((times, station_codes))
+        self._times = times[order]
+        self._station_starts = np.searchsorted(station_codes[order], np.arange(len(stations) + 1))
+        self._weather_df = weather_df.drop(columns=WEATHER_KEY_COLUMNS).iloc[order].reset_index(drop=True)
+
+    # Row of the observation nearest in time at the given station for every message, -1 where there is none
+    def _nearest_observations(self, station_idx, times):
+        rows = np.full(len(times), -1, dtype=np.int64)
+        message_order = np.argsort(station_idx, kind='stable')
+        message_starts = np.searchsorted(station_idx[message_order], np.arange(len(self._station_starts)))
+
+        for station in np.flatnonzero(np.diff(message_starts)):
+            messages = message_order[message_starts[station]:message_starts[station + 1]]
+            start, end = self._station_starts[station], self._station_starts[station + 1]
+            station_times = self._times[start:end]
+
+            # The candidates are the observations right before and right after each message, ties go to the earlier
+            message_times = times[messages]
+            after = np.searchsorted(station_times, message_times, side='left')
+            before = np.clip(after - 1, 0, len(station_times) - 1)
+            after = np.clip(after, 0, len(station_times) - 1)
+            take_after = np.abs(station_times[after] - message_times) < np.abs(message_times - station_times[before])
+            rows[messages] = start + np.where(take_after, after, before)
+
+        return rows
+
+    # Attach the nearest station's weather, nearest in time, to every message
+    def join(self, raw_messages_clean_df):
+        if len(self._times) == 0 or len(raw_messages_clean_df) == 0:
+            # Nothing to match: every message keeps empty weather columns
+            weather_columns_df = self._weather_df.reindex(np.full(len(raw_messages_clean_df), len(self._weather_df)))
+            weather_columns_df.index = raw_messages_clean_df.index
+            return pd.concat([raw_messages_clean_df, weather_columns_df], axis=1)
+
+        # The cleaned coordinates are unsigned, the direction fields carry the hemisphere
+        lats = np.where(raw_messages_clean_df['latitude_direction'].isin(['S']), -1, 1) * raw_messages_clean_df['lat']
+        lons = np.where(raw_messages_clean_df['longitude_direction'].isin(['W']), -1, 1) * raw_messages_clean_df['lon']
+        station_idx, distance_km = self.stations.nearest(
+            lats.to_numpy(dtype=float), lons.to_numpy(dtype=float), with_distance=self.max_distance_km is not None
+        )
+        times = raw_messages_clean_df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+        rows = self._nearest_observations(station_idx, times)
+        rows[raw_messages_clean_df['datetime'].isna().to_numpy() | (station_idx < 0)] = -1
+        if self.max_distance_km is not None:
+            rows[distance_km > self.max_distance_km] = -1
+
+        # Row -1 has no weather: reindex turns it into a row of missing values
+        weather_columns_df = self._weather_df.reindex(np.where(rows >= 0, rows, len(self._weather_df)))
+        weather_columns_df.index = raw_messages_clean_df.index
+        return pd.concat([raw_messages_clean_df, weather_columns_df], axis=1)
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pandas as pd
+from weather_join import WeatherIndex
+
+
+# Synthetic fleet: every ship reports every few seconds over one day somewhere around the Dutch waterways
+def make_fleet(n_ships, messages_per_ship, rng):
+    n_rows = n_ships * messages_per_ship
+    start_lats = rng.uniform(50.5, 53.5, n_ships)
+    start_lons = rng.uniform(3.5, 7.0, n_ships)
+    drift = rng.normal(0, 0.002, (n_ships, messages_per_ship)).cumsum(axis=1)
+    offsets = np.sort(rng.integers(0, 24 * 3600, (n_ships, messages_per_ship)), axis=1)
+    return pd.DataFrame({
+        'device_id': np.repeat([f"ship-{i}" for i in range(n_ships)], messages_per_ship),
+        'datetime': pd.Timestamp('2019-02-13') + pd.to_timedelta(offsets.ravel(), unit='s'),
+        'lat': (start_lats[:, None] + drift).ravel(),
+        'latitude_direction': np.full(n_rows, 'N'),
+        'lon': (start_lons[:, None] + drift[:, ::-1]).ravel(),
+        'longitude_direction': np.full(n_rows, 'E'),
+        'speed_over_ground_d': rng.uniform(0, 15, n_rows)
+    })
+
+
+# Synthetic stations with hourly observations for the same day, shaped like filter_weather_data's output
+def make_weather(n_stations, rng):
+    hours = pd.date_range('2019-02-13', periods=24, freq='h')
+    return pd.DataFrame({
+        'lat': np.repeat(rng.uniform(50.5, 53.5, n_stations), len(hours)),
+        'lon': np.repeat(rng.uniform(3.5, 7.0, n_stations), len(hours)),
+        'datetime': np.tile(hours, n_stations),
+        'temp': rng.normal(5, 3, n_stations * len(hours)),
+        'wind_spd': rng.uniform(0, 12, n_stations * len(hours)),
+        'city_name': np.repeat([f"station-{i}" for i in range(n_stations)], len(hours))
+    })
+
+
+# The previous join: coordinates truncated to whole degrees, then merge_asof per degree cell
+def merge_by_degree_cell(fleet_df, weather_df):
+    fleet_df = fleet_df.assign(lat=fleet_df['lat'].astype(int), lon=fleet_df['lon'].astype(int)).sort_values('datetime')
+    weather_df = weather_df.assign(lat=weather_df['lat'].astype(int), lon=weather_df['lon'].astype(int))
+    weather_df = weather_df.sort_values('datetime')
+    return pd.merge_asof(fleet_df, weather_df, on='datetime', by=['lat', 'lon'], direction='nearest')
+
+
+def main():
+    rng = np.random.default_rng(42)
+    weather_df = make_weather(200, rng)
+
+    print(f"{'ships':>6} {'rows':>10} {'merge_asof (s)':>15} {'matched':>10} {'nearest station (s)':>20} {'matched':>10}")
+    for n_ships in [1000, 5000, 20000]:
+        fleet_df = make_fleet(n_ships, 200, rng)
+
+        start = time.perf_counter()
+        merged_df = merge_by_degree_cell(fleet_df, weather_df)
+        merge_asof_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        weather_index = WeatherIndex(weather_df)
+        joined_df = weather_index.join(fleet_df)
+        nearest_time = time.perf_counter() - start
+
+        print(f"{n_ships:>6} {len(fleet_df):>10} {merge_asof_time:>15.3f} {int(merged_df['temp'].notna().sum()):>10} "
+              f"{nearest_time:>20.3f} {int(joined_df['temp'].notna().sum()):>10}")
+
+
+if __name__ == "__main__":
+    main()
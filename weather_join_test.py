@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+import pandas as pd
+from weather_join import haversine_km, StationIndex, WeatherIndex, _unit_vectors
+
+class WeatherJoinTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Two stations, Rotterdam and Amsterdam, with hourly observations
+        hours = pd.to_datetime(['2019-02-13 10:00', '2019-02-13 11:00', '2019-02-13 12:00'])
+        self.weather_df = pd.DataFrame({
+            'lat': [51.92] * 3 + [52.37] * 3,
+            'lon': [4.48] * 3 + [4.89] * 3,
+            'datetime': list(hours) * 2,
+            'temp': [1.0, 2.0, 3.0, 11.0, 12.0, 13.0],
+            'city_name': ['Rotterdam'] * 3 + ['Amsterdam'] * 3
+        })
+
+    def make_messages(self, lats, lons, datetimes, latitude_direction='N', longitude_direction='E'):
+        return pd.DataFrame({
+            'device_id': [f"st-{i}" for i in range(len(lats))],
+            'datetime': pd.to_datetime(datetimes).astype('datetime64[ns]'),
+            'lat': lats,
+            'latitude_direction': latitude_direction,
+            'lon': lons,
+            'longitude_direction': longitude_direction
+        }, index=range(5, 5 + len(lats)))
+
+    def test_haversine_km(self):
+        # Rotterdam to Amsterdam is about 57 km, a point to itself is 0
+        self.assertAlmostEqual(float(haversine_km(51.92, 4.48, 52.37, 4.89)), 57.5, delta=1.0)
+        self.assertEqual(float(haversine_km(51.92, 4.48, 51.92, 4.48)), 0.0)
+
+    def test_station_index_matches_brute_force(self):
+        # Test the grid lookup against comparing every point with every station
+        rng = np.random.default_rng(0)
+        station_lats, station_lons = rng.uniform(-80, 80, 50), rng.uniform(-180, 180, 50)
+        lats, lons = rng.uniform(-90, 90, 5000), rng.uniform(-180, 180, 5000)
+
+        station_idx, distance_km = StationIndex(station_lats, station_lons).nearest(lats, lons)
+        similarity = _unit_vectors(lats, lons) @ _unit_vectors(station_lats, station_lons).T
+        np.testing.assert_allclose(similarity[np.arange(len(lats)), station_idx], similarity.max(axis=1))
+        np.testing.assert_allclose(distance_km, haversine_km(lats, lons, station_lats[station_idx], station_lons[station_idx]))
+
+    def test_join_nearest_station_and_time(self):
+        # Test that every message gets the closest station's observation closest in time
+        messages_df = self.make_messages(
+            [51.95, 52.30, 51.0],
+            [4.40, 4.95, 4.0],
+            ['2019-02-13 10:20', '2019-02-13 11:45', '2019-02-13 23:00']
+        )
+        result_df = WeatherIndex(self.weather_df).join(messages_df)
+
+        self.assertEqual(list(result_df.index), list(messages_df.index))
+        self.assertEqual(list(result_df['city_name']), ['Rotterdam', 'Amsterdam', 'Rotterdam'])
+        self.assertEqual(list(result_df['temp']), [1.0, 13.0, 3.0])
+
+    def test_join_tie_goes_to_earlier_observation(self):
+        # Test that a message exactly between two observations gets the earlier one
+        messages_df = self.make_messages([51.92], [4.48], ['2019-02-13 10:30'])
+        result_df = WeatherIndex(self.weather_df).join(messages_df)
+        self.assertEqual(result_df['temp'].iloc[0], 1.0)
+
+    def test_join_uses_hemisphere(self):
+        # Test that southern and western coordinates are not matched to stations in the north east
+        weather_df = pd.concat([self.weather_df, self.weather_df.assign(lat=-51.92, city_name='South')])
+        messages_df = self.make_messages([51.92], [4.48], ['2019-02-13 10:00'], latitude_direction='S')
+        result_df = WeatherIndex(weather_df).join(messages_df)
+        self.assertEqual(result_df['city_name'].iloc[0], 'South')
+
+    def test_join_max_distance(self):
+        # Test that messages farther than the cutoff keep empty weather columns
+        messages_df = self.make_messages([51.93, 55.0], [4.48, 4.48], ['2019-02-13 10:00'] * 2)
+        result_df = WeatherIndex(self.weather_df, max_distance_km=50).join(messages_df)
+
+        self.assertEqual(result_df['city_name'].iloc[0], 'Rotterdam')
+        self.assertTrue(pd.isna(result_df['city_name'].iloc[1]))
+        self.assertTrue(pd.isna(result_df['temp'].iloc[1]))
+
+    def test_join_missing_datetime(self):
+        # Test that a message without a datetime gets no weather
+        messages_df = self.make_messages([51.92, 51.92], [4.48, 4.48], ['2019-02-13 10:00', None])
+        result_df = WeatherIndex(self.weather_df).join(messages_df)
+        self.assertEqual(result_df['temp'].iloc[0], 1.0)
+        self.assertTrue(pd.isna(result_df['temp'].iloc[1]))
+
+    def test_join_non_finite_coordinates(self):
+        # Test that a message with a nan or infinite coordinate gets no weather and the others are still matched
+        messages_df = self.make_messages([51.95, np.nan, 52.30, np.inf], [4.40, 4.40, 4.95, 4.95],
+                                         ['2019-02-13 10:20', '2019-02-13 10:20', '2019-02-13 11:45', '2019-02-13 11:45'])
+        result_df = WeatherIndex(self.weather_df, max_distance_km=50).join(messages_df)
+        self.assertEqual(result_df['city_name'].tolist()[::2], ['Rotterdam', 'Amsterdam'])
+        self.assertTrue(result_df['temp'].iloc[[1, 3]].isna().all())
+
+        station_idx, distance_km = StationIndex([51.92], [4.48]).nearest([np.nan, -np.inf], [4.48, 4.48])
+        self.assertEqual(station_idx.tolist(), [-1, -1])
+        self.assertTrue(np.isnan(distance_km).all())
+
+    def test_join_empty_inputs(self):
+        # Test with no messages and with no weather, the columns are the same as for a regular join
+        messages_df = self.make_messages([51.92], [4.48], ['2019-02-13 10:00'])
+        expected_columns = list(WeatherIndex(self.weather_df).join(messages_df).columns)
+
+        result_df = WeatherIndex(self.weather_df).join(messages_df.iloc[:0])
+        self.assertEqual(list(result_df.columns), expected_columns)
+        self.assertEqual(len(result_df), 0)
+
+        result_df = WeatherIndex(self.weather_df.iloc[:0]).join(messages_df)
+        self.assertEqual(list(result_df.columns), expected_columns)
+        self.assertTrue(result_df['temp'].isna().all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+# Fields of the hourly observations in the order of raw_messages_cleaned_weather, named like pd.json_normalize
+# names them. The nested weather object becomes the weather.* columns.
+WEATHER_NUMERIC_FIELDS = [
+    'rh', 'wind_spd', 'slp', 'vis', 'solar_rad', 'pres', 'h_angle', 'dewpt', 'snow', 'uv', 'elev_angle', 'wind_dir',
+    'ghi', 'dhi', 'dni', 'azimuth', 'temp', 'precip', 'clouds', 'ts'
+]
+WEATHER_COLUMNS = [
+    'rh', 'wind_spd', 'timestamp_utc', 'slp', 'vis', 'pod', 'solar_rad', 'pres', 'h_angle', 'dewpt', 'snow', 'uv',
+    'elev_angle', 'wind_dir', 'ghi', 'dhi', 'timestamp_local', 'dni', 'azimuth', 'datetime', 'temp', 'precip', 'clouds',
+    'ts', 'weather.icon', 'weather.code', 'weather.description'
+]
+
+# Fields of the station objects repeated on every observation of the station
+STATION_NUMERIC_FIELDS = ['lat', 'lon']
+STATION_COLUMNS = ['lat', 'lon', 'city_name', 'station_id', 'timezone']
+
+# Parsed weather files are cached here as Arrow files named after the hash of the JSON file
+WEATHER_CACHE_DIR = os.getenv(
+    'WEATHER_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'weather_cache')
+)
+
+# Part of every cache key, bump it when the parsed frame changes so old cache files are no longer used
+WEATHER_CACHE_VERSION = 1
+
+# Characters read from the JSON file at once, a station object larger than that makes the buffer grow
+READ_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# Yield the station objects of a weather JSON file one at a time. The file is a JSON array of stations, only the
+# station being decoded and the unread part of the current block are in memory.
+def iter_stations(json_path, read_size=READ_SIZE):
+    decoder = json.JSONDecoder()
+    with open(json_path, 'r', encoding='utf-8') as file:
+        buffer, position, in_array = '', 0, False
+        while True:
+            decode_error = None
+            position = _WHITESPACE.match(buffer, position).end()
+            if position < len(buffer):
+                char = buffer[position]
+                if not in_array:
+                    if char != '[':
+                        raise ValueError(f"{json_path} does not hold a JSON array of stations")
+                    in_array = True
+                    position += 1
+                    continue
+                if char == ']':
+                    return
+                if char == ',':
+                    position += 1
+                    continue
+                try:
+                    station, position = decoder.raw_decode(buffer, position)
+                    yield station
+                    continue
+                except json.JSONDecodeError as error:
+                    # The station continues after the buffer, or the file is malformed
+                    decode_error = error
+
+            # Read at least as much as the buffer holds, so a large station is decoded after a few attempts
+            block = file.read(max(read_size, len(buffer) - position))
+            if not block:
+                raise ValueError(f"{json_path} is not a complete JSON array of stations") from decode_error
+            buffer = buffer[position:] + block
+            position = 0
+
+
+# Preallocated columns that grow by doubling, filled with one station's observations at a time
+class _ColumnBuffer:
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.columns = {
+            column: np.empty(capacity, dtype=np.float64 if column in WEATHER_NUMERIC_FIELDS + STATION_NUMERIC_FIELDS
+                             else object)
+            for column in WEATHER_COLUMNS + STATION_COLUMNS
+        }
+
+    def _reserve(self, n_rows):
+        capacity = len(self.columns['ts'])
+        if self.size + n_rows <= capacity:
+            return
+        while capacity < self.size + n_rows:
+            capacity *= 2
+        for column, values in self.columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[column] = grown
+
+    def append_station(self, station):
+        observations = station.get('data') or []
+        n_rows = len(observations)
+        self._reserve(n_rows)
+        rows = slice(self.size, self.size + n_rows)
+
+        for field in WEATHER_COLUMNS:
+            if not field.startswith('weather.'):
+                # A list with None in it fills a float column with NaN
+                self.columns[field][rows] = [observation.get(field) for observation in observations]
+        weathers = [observation.get('weather') or {} for observation in observations]
+        self.columns['weather.icon'][rows] = [weather.get('icon') for weather in weathers]
+        # The code is stored in a text column of production
+        self.columns['weather.code'][rows] = [
+            None if weather.get('code') is None else str(weather['code']) for weather in weathers
+        ]
+        self.columns['weather.description'][rows] = [weather.get('description') for weather in weathers]
+        for field in STATION_COLUMNS:
+            self.columns[field][rows] = station.get(field)
+        self.size += n_rows
+
+    def to_frame(self):
+        df = pd.DataFrame({column: values[:self.size] for column, values in self.columns.items()})
+        # Numeric fields that only hold whole numbers stay integers, like pd.json_normalize leaves them
+        for field in WEATHER_NUMERIC_FIELDS:
+            values = df[field].to_numpy()
+            if len(values) and np.isfinite(values).all() and (values == np.round(values)).all():
+                df[field] = values.astype(np.int64)
+        return df
+
+
+# Function to parse a weather JSON file into the frame filter_weather_data(load_weather_data(...)) gives:
+# one row per observation with its station's fields, datetime parsed and sorted by it
+def parse_weather_json(json_path, read_size=READ_SIZE):
+    column_buffer = _ColumnBuffer()
+    for station in iter_stations(json_path, read_size):
+        column_buffer.append_station(station)
+    weather_df = column_buffer.to_frame()
+
+    # The observation hours are written as YYYY-MM-DD:HH, parsed in one pass with the exact format
+    weather_df['datetime'] = pd.to_datetime(
+        weather_df['datetime'], format='%Y-%m-%d:%H', errors='coerce'
+    ).astype('datetime64[ns]')
+    return weather_df.sort_values('datetime', kind='stable').reset_index(drop=True)
+
+
+# Function to hash the contents of a file without reading it into memory at once
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(WEATHER_CACHE_VERSION).encode('ascii'))
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to write a file through write(path) under a temporary name in the same directory and rename it into place,
+# a concurrent run never reads a partial file and two runs writing the same file never share a temporary one
+def replace_file(path, write):
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    os.close(descriptor)
+    try:
+        write(temporary_path)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+# Function to write the cache stamp of a weather file as JSON
+def write_stamp(path, stamp):
+    with open(path, 'w') as file:
+        json.dump(stamp, file)
+
+
+# Function to load a weather JSON file through the cache. The parsed frame is cached under the hash of the file, the
+# hash itself is remembered together with the file's size and mtime: an unchanged file is neither hashed nor parsed
+# again, a touched file with the same contents is hashed but not parsed.
+def load_weather_frame(json_path, cache_dir=WEATHER_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(json_path)
+    path_key = hashlib.blake2b(os.path.abspath(json_path).encode('utf-8'), digest_size=8).hexdigest()
+    stamp_path = os.path.join(cache_dir, f"{path_key}.json")
+
+    stamp = {}
+    if os.path.exists(stamp_path):
+        with open(stamp_path, 'r') as file:
+            stamp = json.load(file)
+    if (stamp.get('size'), stamp.get('mtime_ns'), stamp.get('version')) == (stat.st_size, stat.st_mtime_ns,
+                                                                          WEATHER_CACHE_VERSION):
+        digest = stamp['digest']
+    else:
+        digest = file_digest(json_path)
+
+    cache_path = os.path.join(cache_dir, f"{digest}.arrow")
+    if os.path.exists(cache_path):
+        weather_df = feather.read_feather(cache_path)
+    else:
+        weather_df = parse_weather_json(json_path)
+        replace_file(cache_path, lambda path: feather.write_feather(weather_df, path))
+
+    stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': WEATHER_CACHE_VERSION, 'digest': digest}
+    replace_file(stamp_path, lambda path: write_stamp(path, stamp))
+    return weather_df
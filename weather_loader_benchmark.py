@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import pandas as pd
+from weather_loader import parse_weather_json, load_weather_frame
+
+WEATHER_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'weather_data.json')
+
+
+# The previous loader: the whole file through json.load and pd.json_normalize, then the datetime repaired as text
+def load_with_json_normalize(json_path):
+    with open(json_path, 'r') as file:
+        weather_data = json.load(file)
+    weather_df = pd.json_normalize(weather_data, 'data', ['lat', 'lon', 'city_name', 'station_id', 'timezone'])
+    weather_df['datetime'] = weather_df['datetime'].str.replace(':', ' ', regex=False) + ':00'
+    weather_df['datetime'] = pd.to_datetime(weather_df['datetime'], errors='coerce').astype('datetime64[ns]')
+    return weather_df.sort_values('datetime')
+
+
+# Synthetic weather file with copies of the bundled stations, every copy moved a little so it is a station of its own
+def write_weather_json(path, copies):
+    with open(WEATHER_JSON, 'r') as file:
+        stations = json.load(file)
+    with open(path, 'w') as file:
+        file.write('[')
+        for copy in range(copies):
+            for i, station in enumerate(stations):
+                moved = dict(station, lat=station['lat'] + copy * 0.01, station_id=f"{station['station_id']}-{copy}")
+                file.write((',' if copy or i else '') + json.dumps(moved))
+        file.write(']')
+
+
+# Seconds and peak traced memory of one call
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main():
+    sizes = [int(copies) for copies in sys.argv[1:]] or [10, 100]
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'rows':>9} {'file (MB)':>10} {'json_normalize (s)':>19} {'peak (MB)':>10} "
+              f"{'streaming (s)':>14} {'peak (MB)':>10} {'cached (s)':>11}")
+        for copies in sizes:
+            json_path = os.path.join(directory, f"weather_{copies}.json")
+            write_weather_json(json_path, copies)
+            cache_dir = os.path.join(directory, f"cache_{copies}")
+
+            old_seconds, old_peak, old_df = measure(load_with_json_normalize, json_path)
+            new_seconds, new_peak, new_df = measure(parse_weather_json, json_path)
+            assert len(old_df) == len(new_df)
+
+            # The first load fills the cache, the timed one reads it
+            load_weather_frame(json_path, cache_dir)
+            start = time.perf_counter()
+            load_weather_frame(json_path, cache_dir)
+            cached_seconds = time.perf_counter() - start
+
+            print(f"{len(new_df):>9} {os.path.getsize(json_path) / 1e6:>10.1f} {old_seconds:>19.2f} "
+                  f"{old_peak / 1e6:>10.0f} {new_seconds:>14.2f} {new_peak / 1e6:>10.0f} {cached_seconds:>11.3f}")
+            os.remove(json_path)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
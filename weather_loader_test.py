@@ -0,0 +1,97 @@
+import os
+import json
+import unittest
+import tempfile
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+import weather_loader
+from weather_loader import iter_stations, parse_weather_json, load_weather_frame
+
+def make_station(station_id, lat, lon, hours):
+    return {
+        'timezone': 'Europe/Amsterdam', 'lat': lat, 'lon': lon, 'city_name': f"City {station_id}",
+        'station_id': station_id, 'sources': ['a'],
+        'data': [
+            {
+                'rh': 90 + hour, 'wind_spd': 4.5, 'timestamp_utc': f"2019-02-13T{hour:02d}:00:00", 'h_angle': None,
+                'weather': {'icon': 'c04n', 'code': 804, 'description': 'Overcast clouds'},
+                'datetime': f"2019-02-13:{hour:02d}", 'temp': 4.5 - hour, 'ts': 1550016000 + 3600 * hour
+            }
+            for hour in hours
+        ]
+    }
+
+class WeatherLoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, 'weather_data.json')
+        self.cache_dir = os.path.join(self.directory.name, 'cache')
+        self.stations = [make_station('ST-1', 51.9, 5.8, [2, 0, 1]), make_station('ST-2', 51.7, 4.4, [1, 3])]
+        self.write_json(self.stations)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_json(self, stations):
+        with open(self.json_path, 'w') as file:
+            json.dump(stations, file, indent=1)
+
+    def test_iter_stations_across_small_reads(self):
+        # Test that stations are decoded one by one, also when every read returns only a few characters
+        stations = list(iter_stations(self.json_path, read_size=7))
+        self.assertEqual(stations, self.stations)
+
+    def test_iter_stations_rejects_incomplete_files(self):
+        # Test that a truncated file or a file without an array of stations is an error
+        with open(self.json_path, 'r') as file:
+            text = file.read()
+        for broken in [text[:len(text) // 2], '{"data": []}']:
+            with open(self.json_path, 'w') as file:
+                file.write(broken)
+            with self.assertRaises(ValueError):
+                list(iter_stations(self.json_path, read_size=16))
+
+    def test_parse_weather_json(self):
+        # Test that every observation gets its station's fields, typed columns and a parsed datetime, sorted by it
+        weather_df = parse_weather_json(self.json_path, read_size=16)
+
+        self.assertEqual(len(weather_df), 5)
+        self.assertEqual(list(weather_df['datetime']), list(pd.to_datetime([
+            '2019-02-13 00:00', '2019-02-13 01:00', '2019-02-13 01:00', '2019-02-13 02:00', '2019-02-13 03:00'
+        ])))
+        self.assertEqual(list(weather_df['station_id']), ['ST-1', 'ST-1', 'ST-2', 'ST-1', 'ST-2'])
+        self.assertEqual(list(weather_df['lat']), [51.9, 51.9, 51.7, 51.9, 51.7])
+        self.assertEqual(weather_df['rh'].dtype, np.int64)
+        self.assertEqual(weather_df['wind_spd'].dtype, np.float64)
+        self.assertTrue(weather_df['h_angle'].isna().all())
+        self.assertEqual(weather_df['weather.code'].iloc[0], '804')
+        self.assertEqual(weather_df['weather.description'].iloc[0], 'Overcast clouds')
+
+    @patch('weather_loader.parse_weather_json', side_effect=parse_weather_json)
+    def test_load_weather_frame_cache(self, mock_parse):
+        first_df = load_weather_frame(self.json_path, self.cache_dir)
+
+        # An unchanged file comes from the cache
+        pd.testing.assert_frame_equal(load_weather_frame(self.json_path, self.cache_dir), first_df)
+        self.assertEqual(mock_parse.call_count, 1)
+
+        # A newer mtime with the same contents is hashed again, but not parsed
+        stat = os.stat(self.json_path)
+        os.utime(self.json_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with patch('weather_loader.file_digest', wraps=weather_loader.file_digest) as mock_digest:
+            load_weather_frame(self.json_path, self.cache_dir)
+            self.assertEqual(mock_digest.call_count, 1)
+        self.assertEqual(mock_parse.call_count, 1)
+
+        # Changed contents are parsed again
+        self.write_json(self.stations[:1])
+        self.assertEqual(len(load_weather_frame(self.json_path, self.cache_dir)), 3)
+        self.assertEqual(mock_parse.call_count, 2)
+
+        # Cache files are renamed into place, no temporary file is left behind
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith('.tmp')], [])
+
+if __name__ == '__main__':
+    unittest.main()